@@ -17,6 +17,8 @@ import pytest
 import os
 import hashlib
 import json
+import threading
+import time
 from datetime import datetime, timezone, timedelta, date
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import Session, sessionmaker
@@ -205,7 +207,9 @@ class TestDeduplication:
             old_ts = datetime.now(timezone.utc) - timedelta(seconds=11)
             db.execute(text("""
                 UPDATE device_heartbeats
-                SET ts = :old_ts
+                SET ts = :old_ts,
+                    bucket_ts = date_trunc('minute', CAST(:old_ts AS timestamp))
+                        + floor(extract(second FROM CAST(:old_ts AS timestamp)) / 10) * interval '10 seconds'
                 WHERE device_id = :device_id
             """), {"old_ts": old_ts, "device_id": device_id})
             db.commit()
@@ -218,6 +222,65 @@ class TestDeduplication:
             
         finally:
             db.close()
+    
+    def test_concurrent_heartbeats_same_bucket_insert_once(self):
+        """Concurrent heartbeats in one bucket should produce exactly one row"""
+        device_id = "test-dedup-race"
+        writers = 8
+        
+        db = SessionLocal()
+        try:
+            device = Device(id=device_id, alias="dedup-race", token_hash="t", token_id="t")
+            db.merge(device)
+            db.execute(text("DELETE FROM device_heartbeats WHERE device_id = :device_id"), {"device_id": device_id})
+            db.commit()
+        finally:
+            db.close()
+        
+        # Keep all writers inside one 10s bucket
+        while datetime.now(timezone.utc).second % 10 >= 7:
+            time.sleep(0.2)
+        
+        barrier = threading.Barrier(writers)
+        results = []
+        errors = []
+        
+        def write():
+            session = SessionLocal()
+            try:
+                barrier.wait()
+                result = record_heartbeat_with_bucketing(
+                    session, device_id, {'ip': '192.168.1.100', 'status': 'ok'}, bucket_seconds=10
+                )
+                session.commit()
+                results.append(result)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                session.close()
+        
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        assert not errors, f"Concurrent writers raised: {errors}"
+        assert sum(1 for r in results if r['created']) == 1, "Exactly one writer should insert"
+        assert all(r['reason'] == 'duplicate' for r in results if not r['created'])
+        
+        db = SessionLocal()
+        try:
+            rows = db.execute(text("""
+                SELECT count(*), count(DISTINCT bucket_ts) FROM device_heartbeats
+                WHERE device_id = :device_id
+            """), {"device_id": device_id}).one()
+            assert rows[0] == 1 and rows[1] == 1, f"Expected one row in one bucket, got {rows}"
+            
+            print(f"✓ Concurrent dedup working: {writers} writers, 1 row")
+            
+        finally:
+            db.close()
 
 
 class TestReconciliation:
@@ -0,0 +1,39 @@
+"""add indexes for keyset-paginated device listing
+
+Revision ID: add_device_list_indexes
+Revises: a7fb5ea2f81b
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_device_list_indexes'
+down_revision: Union[str, None] = 'a7fb5ea2f81b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # (sort key, id) for each /v1/devices sort; btree scans serve both directions
+    op.execute("CREATE INDEX IF NOT EXISTS idx_device_list_last_seen ON devices (last_seen, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS idx_device_list_alias ON devices (alias, id)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_device_list_version "
+        "ON devices ((coalesce(installed_apk_version_code, -1)), id)"
+    )
+    # Case-insensitive alias prefix filter: lower(alias) LIKE 'abc%'
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_device_alias_prefix "
+        "ON devices (lower(alias) text_pattern_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_device_alias_prefix")
+    op.execute("DROP INDEX IF EXISTS idx_device_list_version")
+    op.execute("DROP INDEX IF EXISTS idx_device_list_alias")
+    op.execute("DROP INDEX IF EXISTS idx_device_list_last_seen")
@@ -0,0 +1,145 @@
+"""add bucket_ts dedup key to device_heartbeats
+
+Revision ID: add_heartbeat_bucket_ts
+Revises: last_status_jsonb
+Create Date: 2026-10-16 14:00:00.000000
+
+Heartbeat dedup moves from a NOT EXISTS range probe to a unique
+(device_id, bucket_ts) index on every daily partition, so writers can use
+INSERT ... ON CONFLICT DO NOTHING. The index cannot live on the parent:
+unique indexes on a partitioned table must include the partition key (ts).
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_heartbeat_bucket_ts'
+down_revision: Union[str, None] = 'last_status_jsonb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Start of the 10-second bucket containing ts (db_utils.compute_heartbeat_bucket)
+BUCKET_EXPR = "date_trunc('minute', ts) + floor(extract(second FROM ts) / 10) * interval '10 seconds'"
+
+
+def _partitions(conn):
+    return [row[0] for row in conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'device_heartbeats'
+        ORDER BY c.relname
+    """))]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    op.execute("ALTER TABLE device_heartbeats ADD COLUMN IF NOT EXISTS bucket_ts TIMESTAMP")
+
+    for partition in _partitions(conn):
+        op.execute(f"UPDATE {partition} SET bucket_ts = {BUCKET_EXPR} WHERE bucket_ts IS NULL")
+        # Rows that raced past the old range check: keep the first per bucket
+        op.execute(f"""
+            DELETE FROM {partition} h
+            USING {partition} keep
+            WHERE keep.device_id = h.device_id
+            AND keep.bucket_ts = h.bucket_ts
+            AND keep.hb_id < h.hb_id
+        """)
+        # Replaced by the bucket_ts index
+        op.execute(f"DROP INDEX IF EXISTS idx_{partition}_dedupe")
+        op.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{partition}_bucket ON {partition} (device_id, bucket_ts)")
+        op.execute(f"CREATE INDEX IF NOT EXISTS idx_{partition}_device_ts ON {partition} (device_id, ts DESC)")
+
+    # Partitions created by the SQL helper get the new key as well
+    op.execute("""
+        CREATE OR REPLACE FUNCTION create_heartbeat_partition(partition_date DATE)
+        RETURNS void AS $$
+        DECLARE
+            partition_name TEXT;
+            start_date TIMESTAMP;
+            end_date TIMESTAMP;
+        BEGIN
+            partition_name := 'device_heartbeats_' || to_char(partition_date, 'YYYYMMDD');
+            start_date := partition_date;
+            end_date := partition_date + INTERVAL '1 day';
+
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_class WHERE relname = partition_name
+            ) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF device_heartbeats FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, start_date, end_date
+                );
+
+                EXECUTE format(
+                    'CREATE INDEX idx_%s_device_ts ON %I (device_id, ts DESC)',
+                    partition_name, partition_name
+                );
+
+                EXECUTE format(
+                    'CREATE UNIQUE INDEX idx_%s_bucket ON %I (device_id, bucket_ts)',
+                    partition_name, partition_name
+                );
+
+                RAISE NOTICE 'Created partition %', partition_name;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    for partition in _partitions(conn):
+        op.execute(f"DROP INDEX IF EXISTS idx_{partition}_bucket")
+        # Same buckets as bucket_ts, so the deduped rows satisfy the old key
+        op.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{partition}_dedupe
+            ON {partition} (
+                device_id,
+                date_trunc('minute', ts),
+                ((EXTRACT(EPOCH FROM ts)::bigint / 10) % 6)
+            )
+        """)
+    op.execute("ALTER TABLE device_heartbeats DROP COLUMN IF EXISTS bucket_ts")
+
+    # Restore the SQL helper from 66374c55aaf6
+    op.execute("""
+        CREATE OR REPLACE FUNCTION create_heartbeat_partition(partition_date DATE)
+        RETURNS void AS $$
+        DECLARE
+            partition_name TEXT;
+            start_date TIMESTAMP;
+            end_date TIMESTAMP;
+        BEGIN
+            partition_name := 'device_heartbeats_' || to_char(partition_date, 'YYYYMMDD');
+            start_date := partition_date;
+            end_date := partition_date + INTERVAL '1 day';
+
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_class WHERE relname = partition_name
+            ) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF device_heartbeats FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, start_date, end_date
+                );
+
+                EXECUTE format(
+                    'CREATE INDEX idx_%I_device_ts ON %I (device_id, ts DESC)',
+                    partition_name, partition_name
+                );
+
+                EXECUTE format(
+                    'CREATE UNIQUE INDEX idx_%I_dedupe ON %I (device_id, date_trunc(%L, ts), ((EXTRACT(EPOCH FROM ts)::bigint / 10) %% 6))',
+                    partition_name, partition_name, 'minute'
+                );
+
+                RAISE NOTICE 'Created partition %', partition_name;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
@@ -0,0 +1,59 @@
+"""add 1m/1h/1d heartbeat rollup tables
+
+Revision ID: add_heartbeat_rollups
+Revises: add_heartbeat_bucket_ts
+Create Date: 2026-10-16 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_heartbeat_rollups'
+down_revision: Union[str, None] = 'add_heartbeat_bucket_ts'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+RESOLUTIONS = ("1m", "1h", "1d")
+
+
+def upgrade() -> None:
+    for resolution in RESOLUTIONS:
+        table = f"device_heartbeat_rollups_{resolution}"
+        op.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id VARCHAR NOT NULL REFERENCES devices (id) ON DELETE CASCADE,
+                bucket_ts TIMESTAMP NOT NULL,
+                samples INTEGER NOT NULL,
+                battery_min INTEGER,
+                battery_max INTEGER,
+                battery_sum BIGINT,
+                battery_samples INTEGER NOT NULL DEFAULT 0,
+                unity_running_samples INTEGER NOT NULL DEFAULT 0,
+                unity_known_samples INTEGER NOT NULL DEFAULT 0,
+                net_wifi INTEGER NOT NULL DEFAULT 0,
+                net_cell INTEGER NOT NULL DEFAULT 0,
+                net_none INTEGER NOT NULL DEFAULT 0,
+                net_changes INTEGER NOT NULL DEFAULT 0,
+                last_network_type VARCHAR,
+                PRIMARY KEY (device_id, bucket_ts)
+            )
+        """)
+        # Rollup range scans and retention deletes
+        op.execute(f"CREATE INDEX IF NOT EXISTS idx_hb_rollup_{resolution}_bucket ON {table} (bucket_ts)")
+
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS heartbeat_rollup_state (
+            resolution VARCHAR PRIMARY KEY,
+            rolled_through TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS heartbeat_rollup_state")
+    for resolution in reversed(RESOLUTIONS):
+        op.execute(f"DROP TABLE IF EXISTS device_heartbeat_rollups_{resolution}")
@@ -0,0 +1,27 @@
+"""add parquet archive columns to hb_partitions
+
+Revision ID: add_partition_parquet_columns
+Revises: add_heartbeat_rollups
+Create Date: 2026-10-16 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'add_partition_parquet_columns'
+down_revision: Union[str, None] = 'add_heartbeat_rollups'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE hb_partitions ADD COLUMN IF NOT EXISTS parquet_url TEXT")
+    op.execute("ALTER TABLE hb_partitions ADD COLUMN IF NOT EXISTS parquet_checksum_sha256 VARCHAR")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE hb_partitions DROP COLUMN IF EXISTS parquet_checksum_sha256")
+    op.execute("ALTER TABLE hb_partitions DROP COLUMN IF EXISTS parquet_url")
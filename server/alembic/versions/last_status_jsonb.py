@@ -0,0 +1,62 @@
+"""store devices.last_status as JSONB with generated filter columns
+
+Revision ID: last_status_jsonb
+Revises: add_device_list_indexes
+Create Date: 2026-10-16 12:00:00.000000
+
+Idempotent: a database created by init_db() on PostgreSQL already has the JSONB
+column and generated columns, so each step only runs when it is still missing.
+The app picks JSONB mode from the resulting schema at startup (models.init_db).
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from models import LAST_STATUS_GENERATED_COLUMNS, last_status_generated_ddl
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'last_status_jsonb'
+down_revision: Union[str, None] = 'add_device_list_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _last_status_is_jsonb() -> bool:
+    columns = sa.inspect(op.get_bind()).get_columns('devices')
+    return any(c['name'] == 'last_status' and 'JSON' in str(c['type']).upper() for c in columns)
+
+
+def upgrade() -> None:
+    if not _last_status_is_jsonb():
+        _convert_to_jsonb()
+
+    for statement in last_status_generated_ddl():
+        op.execute(statement)
+
+
+def _convert_to_jsonb() -> None:
+    # Rows whose text is not valid JSON become NULL instead of failing the cast
+    op.execute("""
+        CREATE OR REPLACE FUNCTION pg_temp.try_jsonb(value TEXT) RETURNS JSONB AS $$
+        BEGIN
+            RETURN value::jsonb;
+        EXCEPTION WHEN others THEN
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql IMMUTABLE
+    """)
+    op.execute("""
+        ALTER TABLE devices
+        ALTER COLUMN last_status TYPE JSONB USING pg_temp.try_jsonb(last_status)
+    """)
+
+
+def downgrade() -> None:
+    if not _last_status_is_jsonb():
+        return
+    for name, _, _ in reversed(LAST_STATUS_GENERATED_COLUMNS):
+        # Indexes on the column are dropped with it
+        op.execute(f"ALTER TABLE devices DROP COLUMN IF EXISTS {name}")
+    op.execute("ALTER TABLE devices ALTER COLUMN last_status TYPE TEXT USING last_status::text")
@@ -22,6 +22,12 @@ class AlertConfig:
         self.ALERT_ROLLUP_THRESHOLD = int(os.getenv("ALERT_ROLLUP_THRESHOLD", "10"))
         self.ALERTS_ENABLE_AUTOREMEDIATION = os.getenv("ALERTS_ENABLE_AUTOREMEDIATION", "false").lower() == "true"
         self.UNITY_DOWN_REQUIRE_CONSECUTIVE = os.getenv("UNITY_DOWN_REQUIRE_CONSECUTIVE", "false").lower() == "true"
+        
+        # Incremental evaluation: only devices whose device_last_status changed (or whose
+        # offline deadline passed) are evaluated each tick, with a periodic full sweep
+        self.ALERT_INCREMENTAL_EVAL = os.getenv("ALERT_INCREMENTAL_EVAL", "true").lower() == "true"
+        self.ALERT_FULL_RESYNC_MINUTES = int(os.getenv("ALERT_FULL_RESYNC_MINUTES", "60"))
+        self.ALERT_CHANGE_FEED_OVERLAP_S = int(os.getenv("ALERT_CHANGE_FEED_OVERLAP_S", "120"))
         self.DISCORD_WEBHOOK_URL: Optional[str] = os.getenv("DISCORD_WEBHOOK_URL")
         self.DASHBOARD_BASE_URL = config.server_url
 
@@ -1,11 +1,13 @@
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Set
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
 from collections import defaultdict
 
 from models import Device, DeviceHeartbeat, AlertState, SessionLocal, DeviceLastStatus
+from db_utils import chunked, iter_bulk_lookup
 from alert_config import alert_config
+from offline_detector import offline_detector
 from observability import structured_logger, metrics
 
 class AlertCondition:
@@ -14,34 +16,58 @@ class AlertCondition:
     UNITY_DOWN = "unity_down"
     SERVICE_DOWN = "service_down"
 
+ALL_CONDITIONS = [AlertCondition.OFFLINE, AlertCondition.LOW_BATTERY, AlertCondition.UNITY_DOWN, AlertCondition.SERVICE_DOWN]
+
+
+class _IncrementalState:
+    """
+    What the incremental evaluator remembers between ticks.
+
+    inputs holds the alert-relevant verdicts last seen in device_last_status
+    per device: (low_battery, unity_running, service_up). A device is only
+    re-evaluated when those change, when offline_detector reports an
+    online/offline transition for it, or when its previous evaluation produced
+    an alert that has not been recorded yet.
+    """
+
+    def __init__(self):
+        self.inputs: Dict[str, Tuple[bool, Optional[bool], Optional[bool]]] = {}
+        self.last_ts: Dict[str, datetime] = {}
+        self.transitioned: Set[str] = set()
+        self.pending: Set[str] = set()
+        self.watermark: Optional[datetime] = None
+        self.last_full_sweep: Optional[datetime] = None
+
+
 class AlertEvaluator:
     def __init__(self):
         self.config = alert_config
+        self._incremental = _IncrementalState()
+        offline_detector.add_listener(self._on_status_transition)
+    
+    def _on_status_transition(self, device_id: str, status: str, last_seen: Optional[datetime]):
+        self._incremental.transitioned.add(device_id)
     
     def _batch_load_alert_states(self, db: Session, device_ids: List[str]) -> Dict[Tuple[str, str], AlertState]:
         """
         Batch load all alert states for given devices.
         Returns dict indexed by (device_id, condition) -> AlertState
         """
-        alert_states = db.query(AlertState).filter(
-            AlertState.device_id.in_(device_ids)
-        ).all()
-        
         result = {}
-        for alert_state in alert_states:
-            result[(alert_state.device_id, alert_state.condition)] = alert_state
+        for chunk in chunked(device_ids):
+            for alert_state in db.query(AlertState).filter(AlertState.device_id.in_(chunk)):
+                result[(alert_state.device_id, alert_state.condition)] = alert_state
         
         return result
     
     def _batch_load_latest_heartbeats(self, db: Session, device_ids: List[str]) -> Dict[str, DeviceHeartbeat]:
         """
         Batch load latest heartbeat for each device.
-        Returns dict indexed by device_id -> DeviceHeartbeat
+        Returns dict indexed by device_id -> heartbeat row (attribute access
+        like DeviceHeartbeat, without ORM hydration)
         
         Optimized: Uses time window and DISTINCT ON for faster queries.
         """
-        from sqlalchemy import text
-        
         if not device_ids:
             return {}
         
@@ -50,34 +76,17 @@ class AlertEvaluator:
         
         try:
             # Use PostgreSQL DISTINCT ON for efficient "latest per group" query
-            device_id_list = ",".join(f"'{did}'" for did in device_ids)
-            
-            query = text(f"""
+            rows = iter_bulk_lookup(db, """
                 SELECT DISTINCT ON (device_id)
                     hb_id, device_id, ts, battery_pct, plugged, network_type,
                     unity_running, unity_pkg_version
                 FROM device_heartbeats
-                WHERE device_id IN ({device_id_list})
+                WHERE device_id = ANY(:ids)
                 AND ts > :time_window
                 ORDER BY device_id, ts DESC
-            """)
+            """, device_ids, {"time_window": time_window})
             
-            rows = db.execute(query, {"time_window": time_window}).fetchall()
-            
-            result = {}
-            for row in rows:
-                hb = DeviceHeartbeat()
-                hb.hb_id = row[0]
-                hb.device_id = row[1]
-                hb.ts = row[2]
-                hb.battery_pct = row[3]
-                hb.plugged = row[4]
-                hb.network_type = row[5]
-                hb.unity_running = row[6]
-                hb.unity_pkg_version = row[7]
-                result[row[1]] = hb
-            
-            return result
+            return {row.device_id: row for row in rows}
             
         except Exception as e:
             # Rollback the failed transaction before attempting fallback
@@ -130,25 +139,20 @@ class AlertEvaluator:
         Batch load all DeviceLastStatus records for given devices.
         Returns dict indexed by device_id -> DeviceLastStatus
         """
-        last_statuses = db.query(DeviceLastStatus).filter(
-            DeviceLastStatus.device_id.in_(device_ids)
-        ).all()
-        
         result = {}
-        for status in last_statuses:
-            result[status.device_id] = status
+        for chunk in chunked(device_ids):
+            for status in db.query(DeviceLastStatus).filter(DeviceLastStatus.device_id.in_(chunk)):
+                result[status.device_id] = status
         
         return result
     
     def _batch_load_recent_heartbeats(self, db: Session, device_ids: List[str], limit: int = 2) -> Dict[str, List[DeviceHeartbeat]]:
         """
         Batch load last N heartbeats per device for consecutive checks.
-        Returns dict indexed by device_id -> List[DeviceHeartbeat] (ordered by ts desc)
+        Returns dict indexed by device_id -> List of heartbeat rows (ordered by ts desc)
         
         Optimized: Uses time window filter to avoid loading ancient heartbeats.
         """
-        from sqlalchemy import text
-        
         if not device_ids:
             return {}
         
@@ -159,40 +163,26 @@ class AlertEvaluator:
         # Use window function to efficiently get top N per device
         # This is much faster than loading all heartbeats and filtering in Python
         try:
-            # Build the query using raw SQL with window function for efficiency
-            device_id_list = ",".join(f"'{did}'" for did in device_ids)
-            
-            query = text(f"""
+            rows = iter_bulk_lookup(db, """
                 WITH ranked AS (
                     SELECT 
                         hb_id, device_id, ts, battery_pct, plugged, network_type,
                         unity_running, unity_pkg_version,
                         ROW_NUMBER() OVER (PARTITION BY device_id ORDER BY ts DESC) as rn
                     FROM device_heartbeats
-                    WHERE device_id IN ({device_id_list})
+                    WHERE device_id = ANY(:ids)
                     AND ts > :time_window
                 )
                 SELECT hb_id, device_id, ts, battery_pct, plugged, network_type,
                        unity_running, unity_pkg_version, rn
                 FROM ranked WHERE rn <= :limit
                 ORDER BY device_id, ts DESC
-            """)
+            """, device_ids, {"time_window": time_window, "limit": limit})
             
-            rows = db.execute(query, {"time_window": time_window, "limit": limit}).fetchall()
-            
-            # Convert to DeviceHeartbeat objects grouped by device_id
+            # Group rows by device_id; rows keep DeviceHeartbeat's attribute names
             result = defaultdict(list)
             for row in rows:
-                hb = DeviceHeartbeat()
-                hb.hb_id = row[0]
-                hb.device_id = row[1]
-                hb.ts = row[2]
-                hb.battery_pct = row[3]
-                hb.plugged = row[4]
-                hb.network_type = row[5]
-                hb.unity_running = row[6]
-                hb.unity_pkg_version = row[7]
-                result[row[1]].append(hb)
+                result[row.device_id].append(row)
             
             return dict(result)
             
@@ -296,26 +286,24 @@ class AlertEvaluator:
         # Get last 2 heartbeats from pre-loaded data
         heartbeats = recent_heartbeats.get(device.id, [])
         
-        if not heartbeats:
+        if heartbeats:
+            last_seen = heartbeats[0].ts
+        else:
+            # Devices past the threshold have no heartbeat inside the preload window
+            last_seen = offline_detector.last_seen(device.id)
+        
+        if last_seen is None:
             # No heartbeats at all - can't determine offline status
             return False, None, None
         
-        latest_heartbeat = heartbeats[0]
-        last_seen = latest_heartbeat.ts
-        
         if last_seen.tzinfo is None:
             last_seen = last_seen.replace(tzinfo=timezone.utc)
         
         # Calculate time since last heartbeat
         time_since_last_seen = now - last_seen
         
-        # Alert threshold: require 3 consecutive missed heartbeats
-        # If time since last heartbeat > heartbeat_interval * 3, we've missed 3 consecutive expected heartbeats
-        alert_threshold_seconds = heartbeat_interval_seconds * 3
-        alert_threshold = timedelta(seconds=alert_threshold_seconds)
-        
-        # Check if we've missed 3 consecutive heartbeats
-        is_offline = time_since_last_seen > alert_threshold
+        # Offline once 3 consecutive heartbeats were missed (tracked by offline_detector)
+        is_offline = offline_detector.is_offline(device.id, last_seen)
         
         alert_state = alert_states.get((device.id, AlertCondition.OFFLINE))
         
@@ -537,12 +525,26 @@ class AlertEvaluator:
         return False, None, None
     
     def evaluate_all_devices(self, db: Session) -> List[Dict[str, Any]]:
-        start_time = datetime.now(timezone.utc)
-        
         structured_logger.log_event("alert.evaluate.start", level="INFO")
         
         # Load all devices
         devices = db.query(Device).all()
+        
+        return self._evaluate_devices(db, devices, mode="full")
+    
+    def _evaluate_devices(self, db: Session, devices: List[Device], mode: str) -> List[Dict[str, Any]]:
+        """
+        Evaluate every alert condition for the given devices.
+        
+        Args:
+            db: Database session
+            devices: Devices to evaluate
+            mode: "full" or "incremental", for logs and metrics
+            
+        Returns:
+            List of alert/recovery dicts for AlertManager
+        """
+        start_time = datetime.now(timezone.utc)
         device_ids = [device.id for device in devices]
         
         if not device_ids:
@@ -574,7 +576,7 @@ class AlertEvaluator:
         alerts_to_raise = []
         
         for device in devices:
-            for condition in [AlertCondition.OFFLINE, AlertCondition.LOW_BATTERY, AlertCondition.UNITY_DOWN, AlertCondition.SERVICE_DOWN]:
+            for condition in ALL_CONDITIONS:
                 try:
                     should_alert = False
                     value = None
@@ -624,14 +626,137 @@ class AlertEvaluator:
         structured_logger.log_event(
             "alert.evaluate.end",
             level="INFO",
+            mode=mode,
             devices_checked=len(devices),
             alerts_found=len(alerts_to_raise),
             latency_ms=latency_ms
         )
         
-        metrics.observe_histogram("alert_evaluation_latency_ms", latency_ms)
+        metrics.observe_histogram("alert_evaluation_latency_ms", latency_ms, {"mode": mode})
         metrics.inc_counter("alert_evaluations_total", {"alerts_found": str(len(alerts_to_raise))})
         
         return alerts_to_raise
+    
+    def _verdicts(self, battery_pct: Optional[int], unity_running: Optional[bool],
+                  service_up: Optional[bool]) -> Tuple[bool, Optional[bool], Optional[bool]]:
+        low_battery = battery_pct is not None and battery_pct < self.config.ALERT_LOW_BATTERY_PCT
+        return (low_battery, unity_running, service_up)
+    
+    def _load_status_changes(self, db: Session, since: Optional[datetime]) -> List[Tuple]:
+        """
+        device_last_status rows written since `since` (all rows when None).
+        This is the heartbeat path's change feed: every heartbeat, from any
+        worker, bumps last_ts on its device's row.
+        """
+        query = db.query(
+            DeviceLastStatus.device_id,
+            DeviceLastStatus.last_ts,
+            DeviceLastStatus.battery_pct,
+            DeviceLastStatus.unity_running,
+            DeviceLastStatus.service_up
+        )
+        if since is not None:
+            query = query.filter(DeviceLastStatus.last_ts > since)
+        return query.all()
+    
+    def _load_devices(self, db: Session, device_ids: List[str]) -> List[Device]:
+        devices = []
+        for chunk in chunked(device_ids):
+            devices.extend(db.query(Device).filter(Device.id.in_(chunk)))
+        return devices
+    
+    def _observe(self, device_id: str, last_ts: datetime, verdicts: Tuple) -> bool:
+        """
+        Record one device_last_status row. Returns True if the device needs
+        re-evaluating.
+        """
+        state = self._incremental
+        
+        if last_ts.tzinfo is None:
+            last_ts = last_ts.replace(tzinfo=timezone.utc)
+        
+        previous = state.inputs.get(device_id)
+        state.inputs[device_id] = verdicts
+        dirty = previous != verdicts
+        
+        if last_ts != state.last_ts.get(device_id):
+            state.last_ts[device_id] = last_ts
+            
+            # Consecutive unity checks need a look at every new "down" heartbeat
+            if verdicts[1] is False and self.config.UNITY_DOWN_REQUIRE_CONSECUTIVE:
+                dirty = True
+        
+        return dirty
+    
+    def _resync(self, db: Session, now: datetime):
+        """Rebuild the incremental state from device_last_status."""
+        self._incremental = _IncrementalState()
+        state = self._incremental
+        
+        watermark = None
+        for device_id, last_ts, battery_pct, unity_running, service_up in self._load_status_changes(db, None):
+            self._observe(device_id, last_ts, self._verdicts(battery_pct, unity_running, service_up))
+            if watermark is None or state.last_ts[device_id] > watermark:
+                watermark = state.last_ts[device_id]
+        
+        state.watermark = watermark
+        state.last_full_sweep = now
+    
+    def evaluate_changed_devices(self, db: Session) -> List[Dict[str, Any]]:
+        """
+        Incremental counterpart of evaluate_all_devices.
+        
+        Reads only device_last_status rows written since the last tick plus the
+        online/offline transitions offline_detector fired since then, and
+        evaluates just those devices.
+        A full sweep still runs on the first tick and every
+        ALERT_FULL_RESYNC_MINUTES to pick up anything the change feed cannot
+        see (deleted devices, settings changes, clock skew).
+        
+        Returns:
+            List of alert/recovery dicts for AlertManager
+        """
+        now = datetime.now(timezone.utc)
+        state = self._incremental
+        resync_interval = timedelta(minutes=self.config.ALERT_FULL_RESYNC_MINUTES)
+        
+        if state.last_full_sweep is None or now - state.last_full_sweep >= resync_interval:
+            self._resync(db, now)
+            alerts = self.evaluate_all_devices(db)
+            self._incremental.pending = {alert["device_id"] for alert in alerts}
+            return alerts
+        
+        # Re-read a window before the watermark: rows can commit after later ones
+        since = None
+        if state.watermark is not None:
+            since = state.watermark - timedelta(seconds=self.config.ALERT_CHANGE_FEED_OVERLAP_S)
+        
+        # Devices with alerts the manager has not recorded yet (cooldown, rate limit) stay dirty
+        dirty = set(state.pending)
+        changes = self._load_status_changes(db, since)
+        for device_id, last_ts, battery_pct, unity_running, service_up in changes:
+            if self._observe(device_id, last_ts, self._verdicts(battery_pct, unity_running, service_up)):
+                dirty.add(device_id)
+            if state.watermark is None or state.last_ts[device_id] > state.watermark:
+                state.watermark = state.last_ts[device_id]
+        dirty |= state.transitioned
+        state.transitioned = set()
+        
+        metrics.inc_counter("alert_incremental_changes_total", value=len(changes))
+        metrics.set_gauge("alert_incremental_dirty_devices", len(dirty))
+        
+        if not dirty:
+            state.pending = set()
+            return []
+        
+        try:
+            devices = self._load_devices(db, list(dirty))
+            alerts = self._evaluate_devices(db, devices, mode="incremental")
+        except Exception:
+            state.pending = dirty
+            raise
+        
+        state.pending = {alert["device_id"] for alert in alerts}
+        return alerts
 
 alert_evaluator = AlertEvaluator()
@@ -1,10 +1,11 @@
 import asyncio
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from collections import defaultdict
 from sqlalchemy.orm import Session
 
 from models import AlertState, SessionLocal
+from db_utils import chunked
 from alert_config import alert_config
 from alert_evaluator import alert_evaluator, AlertCondition
 from discord_webhook import discord_client
@@ -29,11 +30,6 @@ class AlertManager:
         
         return now < cooldown_until
     
-    def _set_cooldown(self, db: Session, alert_state: AlertState):
-        cooldown_duration = timedelta(minutes=self.config.ALERT_DEVICE_COOLDOWN_MIN)
-        alert_state.cooldown_until = datetime.now(timezone.utc) + cooldown_duration
-        db.commit()
-    
     def _check_global_rate_limit(self) -> bool:
         now = datetime.now(timezone.utc)
         one_minute_ago = now - timedelta(minutes=1)
@@ -73,19 +69,51 @@ class AlertManager:
             'timestamp': datetime.now(timezone.utc)
         })
     
-    async def _raise_alert(
+    def _load_alert_states(self, db: Session, alerts: List[Dict[str, Any]]) -> Dict[Tuple[str, str], AlertState]:
+        """All alert states for the devices in this tick, keyed by (device_id, condition)"""
+        device_ids = list({alert_data['device_id'] for alert_data in alerts})
+        states = {}
+        for chunk in chunked(device_ids):
+            for alert_state in db.query(AlertState).filter(AlertState.device_id.in_(chunk)):
+                states[(alert_state.device_id, alert_state.condition)] = alert_state
+        return states
+    
+    def _mark_raised(self, db: Session, states: Dict[Tuple[str, str], AlertState], alert_data: Dict[str, Any]):
+        key = (alert_data['device_id'], alert_data['condition'])
+        now = datetime.now(timezone.utc)
+        
+        alert_state = states.get(key)
+        if not alert_state:
+            alert_state = AlertState(
+                device_id=alert_data['device_id'],
+                condition=alert_data['condition'],
+                state='raised'
+            )
+            db.add(alert_state)
+            states[key] = alert_state
+        
+        alert_state.state = 'raised'
+        alert_state.last_raised_at = now
+        alert_state.last_value = alert_data.get('value')
+        alert_state.cooldown_until = now + timedelta(minutes=self.config.ALERT_DEVICE_COOLDOWN_MIN)
+    
+    def _apply_raise(
         self,
         db: Session,
+        states: Dict[Tuple[str, str], AlertState],
         alert_data: Dict[str, Any]
-    ):
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Apply cooldown, global rate limit and rollup to one alert and update its state.
+        
+        Returns:
+            Notification to send after commit ({"type": "alert"|"rollup", ...}), or None if suppressed
+        """
         condition = alert_data['condition']
         device_id = alert_data['device_id']
         alias = alert_data['alias']
         
-        alert_state = db.query(AlertState).filter(
-            AlertState.device_id == device_id,
-            AlertState.condition == condition
-        ).first()
+        alert_state = states.get((device_id, condition))
         
         if self._is_in_cooldown(alert_state):
             structured_logger.log_event(
@@ -95,7 +123,7 @@ class AlertManager:
                 condition=condition
             )
             metrics.inc_counter("alerts_suppressed_total", {"reason": "cooldown", "condition": condition})
-            return
+            return None
         
         if self._check_global_rate_limit():
             structured_logger.log_event(
@@ -105,108 +133,39 @@ class AlertManager:
                 condition=condition
             )
             metrics.inc_counter("alerts_suppressed_total", {"reason": "rate_limit", "condition": condition})
-            return
+            return None
         
         self._track_for_rollup(condition, device_id, alias)
         
         needs_rollup, total_count, device_list = self._check_rollup_needed(condition)
         
+        self._mark_raised(db, states, alert_data)
+        severity = alert_data.get('severity', 'WARN')
+        
         if needs_rollup:
-            severity = alert_data.get('severity', 'WARN')
-            success = await discord_client.send_rollup_alert(
-                condition=condition,
-                severity=severity,
-                total_devices=total_count,
-                device_list=device_list
-            )
-            
-            if success:
-                structured_logger.log_event(
-                    "alert.rollup.sent",
-                    level="INFO",
-                    condition=condition,
-                    total_devices=total_count
-                )
-            
             self.rollup_tracker[condition] = []
-            
-            return
-        
-        severity = alert_data.get('severity', 'WARN')
+            return {
+                "type": "rollup",
+                "condition": condition,
+                "severity": severity,
+                "total_devices": total_count,
+                "device_list": device_list
+            }
         
-        success = await discord_client.send_alert(
-            condition=condition,
-            device_id=device_id,
-            alias=alias,
-            severity=severity,
-            last_seen=alert_data.get('last_seen'),
-            battery_pct=alert_data.get('battery_pct'),
-            network_type=alert_data.get('network_type'),
-            unity_running=alert_data.get('unity_running'),
-            unity_version=alert_data.get('unity_version'),
-            details=alert_data.get('details'),
-            monitored_app_name=alert_data.get('monitored_app_name'),
-            monitored_package=alert_data.get('monitored_package'),
-            foreground_recent_s=alert_data.get('foreground_recent_s'),
-            threshold_min=alert_data.get('threshold_min')
-        )
-        
-        if success:
-            if not alert_state:
-                alert_state = AlertState(
-                    device_id=device_id,
-                    condition=condition,
-                    state='raised',
-                    last_raised_at=datetime.now(timezone.utc),
-                    last_value=alert_data.get('value')
-                )
-                db.add(alert_state)
-            else:
-                alert_state.state = 'raised'
-                alert_state.last_raised_at = datetime.now(timezone.utc)
-                alert_state.last_value = alert_data.get('value')
-            
-            self._set_cooldown(db, alert_state)
-            db.commit()
-            
-            structured_logger.log_event(
-                f"alert.raise.{condition}",
-                level="INFO",
-                device_id=device_id,
-                alias=alias,
-                severity=severity
-            )
-            metrics.inc_counter("alerts_sent_total", {"condition": condition, "severity": severity})
-            
-            if alert_data.get('requires_remediation'):
-                from models import Device
-                device = db.query(Device).filter(Device.id == device_id).first()
-                if device:
-                    if condition == AlertCondition.UNITY_DOWN:
-                        await remediation_engine.remediate_unity_down(db, device, device.monitored_package)
-                    elif condition == AlertCondition.OFFLINE:
-                        await remediation_engine.remediate_offline(db, device)
+        return {"type": "alert", **alert_data, "severity": severity}
     
-    async def _handle_recovery(
-        self,
-        db: Session,
-        alert_data: Dict[str, Any]
-    ):
+    def _apply_recovery(self, states: Dict[Tuple[str, str], AlertState], alert_data: Dict[str, Any]) -> bool:
+        """Mark a raised alert as recovered. Returns True if a recovery notification is due."""
         condition = alert_data['condition']
         device_id = alert_data['device_id']
-        alias = alert_data['alias']
         
-        alert_state = db.query(AlertState).filter(
-            AlertState.device_id == device_id,
-            AlertState.condition == condition
-        ).first()
+        alert_state = states.get((device_id, condition))
         
         if not alert_state or alert_state.state != 'raised':
-            return
+            return False
         
         alert_state.state = 'ok'
         alert_state.last_recovered_at = datetime.now(timezone.utc)
-        db.commit()
         
         if alert_data.get('self_healed'):
             structured_logger.log_event(
@@ -217,55 +176,131 @@ class AlertManager:
             )
             metrics.inc_counter("remediations_success_total", {"action": "launch_app"})
         
-        success = await discord_client.send_recovery(
-            condition=condition,
-            device_id=device_id,
-            alias=alias
-        )
+        return True
+    
+    def _notify(self, raised: List[Dict[str, Any]], recovered: List[Dict[str, Any]]):
+        """Hand committed alerts to the Discord delivery queue."""
+        for notification in raised:
+            condition = notification['condition']
+            severity = notification['severity']
+            
+            if notification['type'] == "rollup":
+                discord_client.queue_rollup(
+                    condition=condition,
+                    severity=severity,
+                    total_devices=notification['total_devices'],
+                    device_list=notification['device_list']
+                )
+                structured_logger.log_event(
+                    "alert.rollup.sent",
+                    level="INFO",
+                    condition=condition,
+                    total_devices=notification['total_devices']
+                )
+                continue
+            
+            discord_client.queue_alert(
+                condition=condition,
+                device_id=notification['device_id'],
+                alias=notification['alias'],
+                severity=severity,
+                last_seen=notification.get('last_seen'),
+                battery_pct=notification.get('battery_pct'),
+                network_type=notification.get('network_type'),
+                unity_running=notification.get('unity_running'),
+                unity_version=notification.get('unity_version'),
+                details=notification.get('details'),
+                monitored_app_name=notification.get('monitored_app_name'),
+                monitored_package=notification.get('monitored_package'),
+                foreground_recent_s=notification.get('foreground_recent_s'),
+                threshold_min=notification.get('threshold_min')
+            )
+            structured_logger.log_event(
+                f"alert.raise.{condition}",
+                level="INFO",
+                device_id=notification['device_id'],
+                alias=notification['alias'],
+                severity=severity
+            )
+            metrics.inc_counter("alerts_sent_total", {"condition": condition, "severity": severity})
         
-        if success:
+        for alert_data in recovered:
+            discord_client.queue_recovery(
+                condition=alert_data['condition'],
+                device_id=alert_data['device_id'],
+                alias=alert_data['alias']
+            )
             structured_logger.log_event(
                 "alert.recover",
                 level="INFO",
-                device_id=device_id,
-                alias=alias,
-                condition=condition
+                device_id=alert_data['device_id'],
+                alias=alert_data['alias'],
+                condition=alert_data['condition']
             )
-            metrics.inc_counter("alerts_recovered_total", {"condition": condition})
+            metrics.inc_counter("alerts_recovered_total", {"condition": alert_data['condition']})
+    
+    async def _remediate(self, db: Session, raised: List[Dict[str, Any]]):
+        from models import Device
+        
+        targets = [n for n in raised if n['type'] == "alert" and n.get('requires_remediation')]
+        if not targets:
+            return
+        
+        devices = {}
+        for chunk in chunked([n['device_id'] for n in targets]):
+            for device in db.query(Device).filter(Device.id.in_(chunk)):
+                devices[device.id] = device
+        
+        for notification in targets:
+            device = devices.get(notification['device_id'])
+            if not device:
+                continue
+            try:
+                if notification['condition'] == AlertCondition.UNITY_DOWN:
+                    await remediation_engine.remediate_unity_down(db, device, device.monitored_package)
+                elif notification['condition'] == AlertCondition.OFFLINE:
+                    await remediation_engine.remediate_offline(db, device)
+            except Exception as e:
+                structured_logger.log_event(
+                    "alert.remediation.error",
+                    level="ERROR",
+                    device_id=device.id,
+                    condition=notification['condition'],
+                    error=str(e)
+                )
     
     async def process_alerts(self):
+        """
+        Evaluate, update alert states in one commit, then queue notifications.
+        Discord delivery happens in the background (discord_delivery), so a
+        mass outage does not hold the session open across webhook calls.
+        """
         db = SessionLocal()
         
         try:
-            alerts = alert_evaluator.evaluate_all_devices(db)
+            if self.config.ALERT_INCREMENTAL_EVAL:
+                alerts = alert_evaluator.evaluate_changed_devices(db)
+            else:
+                alerts = alert_evaluator.evaluate_all_devices(db)
+            
+            if not alerts:
+                return
+            
+            states = self._load_alert_states(db, alerts)
+            raised = []
+            recovered = []
             
             for alert_data in alerts:
-                # Use a savepoint for each alert to allow rollback without affecting others
                 try:
-                    # Create a savepoint for this alert
-                    db.begin_nested()
-                    
                     if alert_data.get('recovery'):
-                        await self._handle_recovery(db, alert_data)
+                        if self._apply_recovery(states, alert_data):
+                            recovered.append(alert_data)
                     else:
-                        await self._raise_alert(db, alert_data)
-                    
-                    # Commit this alert's changes
-                    db.commit()
+                        notification = self._apply_raise(db, states, alert_data)
+                        if notification:
+                            raised.append(notification)
                 
                 except Exception as e:
-                    # Rollback this alert's transaction (savepoint)
-                    try:
-                        db.rollback()
-                    except Exception as rollback_error:
-                        structured_logger.log_event(
-                            "alert.process.rollback_error",
-                            level="ERROR",
-                            device_id=alert_data.get('device_id', 'unknown'),
-                            condition=alert_data.get('condition', 'unknown'),
-                            rollback_error=str(rollback_error)
-                        )
-                    
                     structured_logger.log_event(
                         "alert.process.error",
                         level="ERROR",
@@ -275,6 +310,11 @@ class AlertManager:
                         error_type=type(e).__name__
                     )
                     # Continue processing other alerts
+            
+            db.commit()
+            
+            self._notify(raised, recovered)
+            await self._remediate(db, raised)
         
         except Exception as e:
             # Critical error - rollback entire batch
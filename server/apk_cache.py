@@ -1,13 +1,31 @@
 """
-In-memory APK cache for frequently accessed builds.
+APK caches for frequently accessed builds.
 Reduces object storage roundtrips and speeds up concurrent downloads.
+
+Two tiers:
+- DiskApkCache: content-addressed (SHA-256) files on local disk, shared by all
+  workers on the host and kept across restarts. Size-bounded LRU, atomic
+  writes, cross-process single-flight fills, mmap reads. Downloads are served
+  from here.
+- ApkCache: per-process in-memory bytes, only used when a build has no SHA-256
+  or the disk tier is unavailable.
 """
 
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
 import time
-from typing import Optional, Tuple
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
 from dataclasses import dataclass
 from threading import Lock
 
+from observability import structured_logger, metrics
+
 
 @dataclass
 class CacheEntry:
@@ -40,7 +58,8 @@ class ApkCache:
         """
         self.max_size_bytes = max_size_mb * 1024 * 1024
         self.ttl_seconds = ttl_seconds
-        self.cache: dict[str, CacheEntry] = {}
+        # Ordered oldest -> most recently used
+        self.cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
         self.current_size = 0
         self.lock = Lock()
         
@@ -55,22 +74,9 @@ class ApkCache:
     
     def _evict_lru(self, required_space: int):
         """Evict least recently used entries until we have required space"""
-        if not self.cache:
-            return
-        
-        # Sort by last accessed time (oldest first)
-        sorted_keys = sorted(
-            self.cache.keys(),
-            key=lambda k: self.cache[k].last_accessed
-        )
-        
-        for key in sorted_keys:
-            if self.current_size + required_space <= self.max_size_bytes:
-                break
-            
-            entry = self.cache[key]
+        while self.cache and self.current_size + required_space > self.max_size_bytes:
+            _, entry = self.cache.popitem(last=False)
             self.current_size -= entry.file_size
-            del self.cache[key]
             self.evictions += 1
     
     def get(self, cache_key: str) -> Optional[Tuple[bytes, str, int]]:
@@ -100,6 +106,7 @@ class ApkCache:
             # Update access tracking
             entry.access_count += 1
             entry.last_accessed = time.time()
+            self.cache.move_to_end(cache_key)
             self.hits += 1
             
             return (entry.file_data, entry.content_type, entry.file_size)
@@ -139,6 +146,7 @@ class ApkCache:
             )
             
             self.cache[cache_key] = entry
+            self.cache.move_to_end(cache_key)
             self.current_size += file_size
     
     def invalidate(self, cache_key: str):
@@ -175,14 +183,227 @@ class ApkCache:
             }
 
 
-# Global cache instance
+class DiskApkCache:
+    """
+    Content-addressed on-disk APK cache shared by every worker on the host.
+    
+    Files live at {directory}/{sha256[:2]}/{sha256}.apk. A file's mtime is its
+    LRU timestamp (touched on every hit), so recency is shared across workers
+    without any coordination beyond the filesystem. Fills write to a temp file,
+    verify the SHA-256 and rename into place, under an flock per digest so a
+    build is fetched from object storage once per host even when several
+    workers miss at the same time.
+    """
+    
+    def __init__(self, directory: str, max_size_mb: int = 2048):
+        """
+        Initialize cache.
+        
+        Args:
+            directory: Cache root; created on first fill
+            max_size_mb: Maximum total size of cached files in MB (default 2GB)
+        """
+        self.directory = directory
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self._lock_dir = os.path.join(directory, ".locks")
+        
+        # Per-process metrics
+        self.hits = 0
+        self.misses = 0
+        self.fills = 0
+        self.evictions = 0
+    
+    def path_for(self, sha256: str) -> str:
+        """Location of a build in the cache (whether or not it is cached)"""
+        return os.path.join(self.directory, sha256[:2], f"{sha256}.apk")
+    
+    @contextmanager
+    def _flock(self, name: str):
+        os.makedirs(self._lock_dir, exist_ok=True)
+        with open(os.path.join(self._lock_dir, f"{name}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def get_path(self, sha256: str) -> Optional[str]:
+        """
+        Look up a cached build and mark it recently used.
+        
+        Returns:
+            Path to the cached file, or None if not cached
+        """
+        path = self.path_for(sha256)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            metrics.inc_counter("apk_disk_cache_misses_total")
+            return None
+        self.hits += 1
+        metrics.inc_counter("apk_disk_cache_hits_total")
+        return path
+    
+    def open_mmap(self, sha256: str) -> Optional[mmap.mmap]:
+        """
+        Map a cached build read-only. Slices read straight from the page cache,
+        which all workers share, instead of copying the APK into each process.
+        
+        Returns:
+            Read-only mmap (caller closes it), or None if not cached
+        """
+        path = self.get_path(sha256)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    @staticmethod
+    def _sha256_of(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return digest.hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        return digest.hexdigest()
+    
+    def fill(self, sha256: str, fetch: Callable[[str], object]) -> Tuple[str, bool]:
+        """
+        Return the cached build, fetching it first if needed.
+        
+        Args:
+            sha256: Expected SHA-256 of the file
+            fetch: Writes the build to the path it is given (e.g. an object storage download)
+            
+        Returns:
+            Tuple of (path, cache_hit)
+            
+        Raises:
+            ValueError: If the fetched file does not match sha256
+        """
+        path = self.get_path(sha256)
+        if path is not None:
+            return path, True
+        
+        with self._flock(sha256):
+            # Another worker may have filled it while we waited for the lock
+            path = self.path_for(sha256)
+            if os.path.exists(path):
+                os.utime(path)
+                return path, True
+            
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                fetch(tmp_path)
+                actual = self._sha256_of(tmp_path)
+                if actual != sha256:
+                    raise ValueError(f"SHA-256 mismatch: expected {sha256}, got {actual}")
+                with open(tmp_path, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        
+        self.fills += 1
+        metrics.inc_counter("apk_disk_cache_fills_total")
+        self.evict(keep=path)
+        return path, False
+    
+    def _entries(self) -> list:
+        """(mtime, size, path) for every cached file"""
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if d != ".locks"]
+            for name in files:
+                if not name.endswith(".apk"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+    
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used files until the cache fits max_size_mb."""
+        with self._flock("evict"):
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_size_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+                metrics.inc_counter("apk_disk_cache_evictions_total")
+                structured_logger.log_event(
+                    "apk.disk_cache.evicted",
+                    path=path,
+                    file_size=size
+                )
+    
+    def invalidate(self, sha256: str):
+        """Remove a build from the cache"""
+        try:
+            os.remove(self.path_for(sha256))
+        except FileNotFoundError:
+            pass
+    
+    def get_stats(self) -> dict:
+        """Get cache statistics"""
+        entries = self._entries() if os.path.isdir(self.directory) else []
+        size_bytes = sum(size for _, size, _ in entries)
+        total_requests = self.hits + self.misses
+        hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+        return {
+            "directory": self.directory,
+            "size_bytes": size_bytes,
+            "size_mb": round(size_bytes / (1024 * 1024), 2),
+            "max_size_mb": self.max_size_bytes / (1024 * 1024),
+            "entries": len(entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate_percent": round(hit_rate, 2),
+            "fills": self.fills,
+            "evictions": self.evictions
+        }
+
+
+# Global cache instances
 _apk_cache: Optional[ApkCache] = None
+_disk_apk_cache: Optional[DiskApkCache] = None
 
 
 def get_apk_cache() -> ApkCache:
-    """Get or create the singleton APK cache instance"""
+    """Get or create the singleton in-memory APK cache instance"""
     global _apk_cache
     if _apk_cache is None:
         # Default: 200MB cache, 1 hour TTL
-        _apk_cache = ApkCache(max_size_mb=200, ttl_seconds=3600)
+        _apk_cache = ApkCache(
+            max_size_mb=int(os.getenv("APK_MEMORY_CACHE_MB", "200")),
+            ttl_seconds=3600
+        )
     return _apk_cache
+
+
+def get_disk_apk_cache() -> DiskApkCache:
+    """Get or create the singleton on-disk APK cache instance"""
+    global _disk_apk_cache
+    if _disk_apk_cache is None:
+        _disk_apk_cache = DiskApkCache(
+            directory=os.getenv("APK_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nexmdm-apk-cache")),
+            max_size_mb=int(os.getenv("APK_DISK_CACHE_MAX_MB", "2048"))
+        )
+    return _disk_apk_cache
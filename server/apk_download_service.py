@@ -2,22 +2,245 @@
 Optimized APK download service for high-performance fleet deployments.
 
 Features:
-- In-memory caching (200MB, 1hr TTL)
+- Streaming downloads from the shared, content-addressed disk cache
+  (FileResponse), so a worker never holds a whole APK in memory
+- HTTP Range (single range, resume) and If-Range support
+- ETag / If-None-Match keyed on ApkVersion.sha256
+- In-memory caching (200MB, 1hr TTL) as a fallback for builds without a SHA-256
+  or when the disk cache is unavailable
 - Download telemetry tracking
 - Rate limit bypass for deployments
 - Concurrent download support
 """
 
-from fastapi import Response, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import Request, Response, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
-from models import ApkVersion, ApkInstallation
+from models import ApkVersion, ApkInstallation, SessionLocal
 from object_storage import get_storage_service, ObjectNotFoundError
-from apk_cache import get_apk_cache
+from apk_cache import get_apk_cache, get_disk_apk_cache
 from observability import structured_logger, metrics
 from datetime import datetime, timezone
-from typing import Optional
-import io
+from typing import Optional, Tuple, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import asyncio
+import mmap
+import os
+
+APK_CONTENT_TYPE = "application/vnd.android.package-archive"
+
+# Serve builds from the shared on-disk cache (apk_cache.DiskApkCache) with FileResponse
+APK_DISK_CACHE_ENABLED = os.getenv("APK_DISK_CACHE_ENABLED", "true").lower() == "true"
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+_prewarm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="apk-prewarm")
+
+metrics.register_histogram(
+    "apk_download_speed_kbps",
+    buckets=[100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000]
+)
+
+
+def apk_etag(apk: ApkVersion) -> Optional[str]:
+    """Strong ETag for an APK build (its SHA-256), or None if the hash is unknown"""
+    return f'"{apk.sha256}"' if apk.sha256 else None
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Check an If-None-Match header against an ETag (weak comparison)"""
+    if not if_none_match or not etag:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+def parse_range_header(range_header: Optional[str], file_size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header.
+    
+    Args:
+        range_header: Value of the Range header (e.g. "bytes=1000-", "bytes=-500")
+        file_size: Size of the full file in bytes
+        
+    Returns:
+        (start, end) with end inclusive, or None to serve the full file
+        (no header, malformed header, or multiple ranges)
+        
+    Raises:
+        HTTPException: 416 if the range lies outside the file
+    """
+    if not range_header:
+        return None
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    start_str, sep, end_str = ranges.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_str == "":
+            # Suffix range: the last N bytes
+            length = int(end_str)
+            if length <= 0:
+                raise ValueError
+            start, end = max(file_size - length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+            end = min(end, file_size - 1)
+    except ValueError:
+        return None
+
+    if start < 0 or start >= file_size or end < start:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, end
+
+
+def _close_if_mapped(data) -> None:
+    """Close an mmap from DiskApkCache.open_mmap(); plain bytes are left alone"""
+    if isinstance(data, mmap.mmap):
+        data.close()
+
+
+def _iter_bytes(data: bytes, start: int, end: int) -> Iterator[bytes]:
+    """
+    Yield data[start:end + 1] in STREAM_CHUNK_SIZE pieces without copying the whole slice.
+    An mmap'd source is closed when the response finishes or the client goes away.
+    """
+    view = memoryview(data)
+    try:
+        for offset in range(start, end + 1, STREAM_CHUNK_SIZE):
+            yield bytes(view[offset:min(offset + STREAM_CHUNK_SIZE, end + 1)])
+    finally:
+        view.release()
+        _close_if_mapped(data)
+
+
+def _ensure_local_file(apk: ApkVersion) -> Tuple[str, bool]:
+    """
+    Make sure the build is in the disk cache (runs in a worker thread).
+    
+    Returns:
+        Tuple of (path, cache_hit)
+        
+    Raises:
+        ObjectNotFoundError: If the APK is missing from object storage
+        ValueError: If the build has no SHA-256 or the download does not match it
+    """
+    if not apk.sha256:
+        raise ValueError(f"APK {apk.id} has no SHA-256; cannot be content-addressed")
+    storage = get_storage_service()
+    return get_disk_apk_cache().fill(
+        apk.sha256,
+        lambda dest_path: storage.download_to_path(apk.file_path, dest_path)
+    )
+
+
+def prewarm_apk(apk: ApkVersion) -> bool:
+    """
+    Pull a build into the disk cache ahead of a rollout so device downloads
+    never wait on object storage. Safe to call repeatedly; runs blocking I/O.
+    
+    Returns:
+        True if the build is cached (already or now), False on failure
+    """
+    if not APK_DISK_CACHE_ENABLED or not apk.sha256:
+        return False
+    try:
+        _, cache_hit = _ensure_local_file(apk)
+    except Exception as e:
+        structured_logger.log_event(
+            "apk.prewarm.failed",
+            level="WARN",
+            apk_id=apk.id,
+            error=str(e),
+            error_type=type(e).__name__
+        )
+        return False
+    structured_logger.log_event(
+        "apk.prewarm.done",
+        apk_id=apk.id,
+        version_code=apk.version_code,
+        already_cached=cache_hit
+    )
+    return True
+
+
+def _prewarm_snapshot(apk: ApkVersion) -> SimpleNamespace:
+    """The fields prewarm_apk needs, detached from the session for use in another thread"""
+    return SimpleNamespace(id=apk.id, sha256=apk.sha256, file_path=apk.file_path, version_code=apk.version_code)
+
+
+def prewarm_current_builds() -> int:
+    """
+    Prewarm every promoted (is_current) build; used at startup.
+    
+    Returns:
+        Number of builds now in the disk cache
+    """
+    db = SessionLocal()
+    try:
+        builds = [
+            _prewarm_snapshot(apk)
+            for apk in db.query(ApkVersion).filter(
+                ApkVersion.is_current == True,
+                ApkVersion.is_active == True
+            ).all()
+        ]
+    except Exception as e:
+        structured_logger.log_event(
+            "apk.prewarm.query_failed",
+            level="WARN",
+            error=str(e),
+            error_type=type(e).__name__
+        )
+        return 0
+    finally:
+        db.close()
+    return sum(1 for build in builds if prewarm_apk(build))
+
+
+@event.listens_for(ApkVersion, "after_insert")
+@event.listens_for(ApkVersion, "after_update")
+def _prewarm_on_promote(mapper, connection, target: ApkVersion):
+    """Promoting a build (is_current -> True) starts pulling it into the disk cache."""
+    if not APK_DISK_CACHE_ENABLED or not target.is_current or not target.sha256:
+        return
+    if inspect(target).attrs.is_current.history.has_changes():
+        _prewarm_executor.submit(prewarm_apk, _prewarm_snapshot(target))
+
+
+def _load_apk_bytes(apk: ApkVersion, use_cache: bool) -> Tuple[bytes, str, int, bool]:
+    """In-memory fallback: (file_data, content_type, file_size, cache_hit)"""
+    if use_cache and apk.sha256:
+        # Another worker may have cached it on disk: map it instead of copying
+        mapped = get_disk_apk_cache().open_mmap(apk.sha256)
+        if mapped is not None:
+            return mapped, APK_CONTENT_TYPE, len(mapped), True
+
+    if use_cache:
+        cached_result = get_apk_cache().get(f"apk:{apk.id}")
+        if cached_result:
+            file_data, content_type, file_size = cached_result
+            return file_data, content_type, file_size, True
+
+    storage = get_storage_service()
+    file_data, content_type, file_size = storage.download_file(
+        apk.file_path,
+        use_cache=use_cache  # Use object storage layer cache too
+    )
+    if use_cache:
+        get_apk_cache().put(f"apk:{apk.id}", file_data, content_type, file_size)
+    return file_data, content_type, file_size, False
 
 
 async def download_apk_optimized(
@@ -25,23 +248,25 @@ async def download_apk_optimized(
     db: Session,
     device_id: Optional[str] = None,
     installation_id: Optional[int] = None,
-    use_cache: bool = True
+    use_cache: bool = True,
+    request: Optional[Request] = None
 ) -> Response:
     """
-    Optimized APK download with caching and telemetry.
+    Optimized APK download with caching, Range support and telemetry.
     
     Args:
         apk_id: APK version ID
         db: Database session
         device_id: Optional device ID for telemetry
         installation_id: Optional installation ID for tracking
-        use_cache: Enable in-memory caching (default: True)
+        use_cache: Enable disk and in-memory caching (default: True)
+        request: Incoming request, for Range / If-Range / If-None-Match headers
         
     Returns:
-        Response with APK file data
+        Streaming response with the APK (200, 206 for a range, 304 if unchanged)
         
     Raises:
-        HTTPException: If APK not found or download fails
+        HTTPException: If APK not found, range not satisfiable or download fails
     """
     # Get APK metadata
     apk = db.query(ApkVersion).filter(ApkVersion.id == apk_id).first()
@@ -53,40 +278,58 @@ async def download_apk_optimized(
         )
         raise HTTPException(status_code=404, detail="APK not found")
     
+    etag = apk_etag(apk)
+    request_headers = request.headers if request is not None else {}
+    
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        metrics.inc_counter("apk_download_not_modified_total")
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and if_range and if_range != etag:
+        # The client's partial copy is of a different build: send the whole file
+        range_header = None
+    
     cache_hit = False
     download_start = datetime.now(timezone.utc)
     file_data: bytes = b""
-    content_type: str = "application/vnd.android.package-archive"
+    local_path: Optional[str] = None
+    content_type: str = APK_CONTENT_TYPE
     file_size: int = 0
     
     try:
-        # Try in-memory cache first
-        cached_result = None
-        if use_cache:
-            cache = get_apk_cache()
-            cached_result = cache.get(f"apk:{apk_id}")
+        if use_cache and APK_DISK_CACHE_ENABLED and apk.sha256:
+            try:
+                local_path, cache_hit = await asyncio.to_thread(_ensure_local_file, apk)
+                file_size = os.path.getsize(local_path)
+            except ObjectNotFoundError:
+                raise
+            except Exception as e:
+                # Disk full / not writable / hash mismatch: serve from memory instead
+                local_path = None
+                metrics.inc_counter("apk_disk_cache_errors_total")
+                structured_logger.log_event(
+                    "apk.download.disk_cache_error",
+                    level="WARN",
+                    apk_id=apk_id,
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
         
-        if cached_result:
-            file_data, content_type, file_size = cached_result
-            cache_hit = True
+        if local_path is None:
+            file_data, content_type, file_size, cache_hit = await asyncio.to_thread(_load_apk_bytes, apk, use_cache)
+        
+        if cache_hit:
             structured_logger.log_event(
                 "apk.download.cache_hit",
                 apk_id=apk_id,
                 device_id=device_id,
                 file_size=file_size
             )
-        else:
-            # Cache miss - fetch from object storage
-            storage = get_storage_service()
-            file_data, content_type, file_size = storage.download_file(
-                apk.file_path,
-                use_cache=use_cache  # Use object storage layer cache too
-            )
-            
-            # Store in cache for next time
-            if use_cache:
-                cache = get_apk_cache()
-                cache.put(f"apk:{apk_id}", file_data, content_type, file_size)
+        
+        byte_range = parse_range_header(range_header, file_size)
+        bytes_sent = byte_range[1] - byte_range[0] + 1 if byte_range else file_size
         
         download_end = datetime.now(timezone.utc)
         download_duration_ms = (download_end - download_start).total_seconds() * 1000
@@ -105,7 +348,7 @@ async def download_apk_optimized(
             if installation:
                 installation.download_start_time = download_start
                 installation.download_end_time = download_end
-                installation.bytes_downloaded = file_size
+                installation.bytes_downloaded = bytes_sent
                 installation.avg_speed_kbps = speed_kbps
                 installation.cache_hit = cache_hit
                 db.commit()
@@ -116,34 +359,65 @@ async def download_apk_optimized(
             apk_id=apk_id,
             device_id=device_id,
             file_size=file_size,
+            bytes_sent=bytes_sent,
+            range_start=byte_range[0] if byte_range else None,
             duration_ms=download_duration_ms,
             speed_kbps=speed_kbps,
-            cache_hit=cache_hit
+            cache_hit=cache_hit,
+            source="disk" if local_path else "memory"
         )
         
         # Increment metrics
         metrics.inc_counter("apk_download_total", {
             "package": apk.package_name,
-            "cache_hit": str(cache_hit)
+            "cache_hit": str(cache_hit),
+            "partial": str(byte_range is not None)
         })
         
         if speed_kbps > 0:
             metrics.observe_histogram("apk_download_speed_kbps", speed_kbps)
         
-        # Return response
-        return Response(
-            content=file_data,
+        headers = {
+            "X-APK-SHA256": apk.sha256 or "",
+            "X-Cache-Hit": str(cache_hit),
+            "X-Download-Speed-Kbps": str(speed_kbps),
+            "Accept-Ranges": "bytes"
+        }
+        if etag:
+            headers["ETag"] = etag
+        filename = f"{apk.package_name}_{apk.version_code}.apk"
+        
+        if local_path:
+            # FileResponse streams from disk and answers Range / If-Range itself
+            return FileResponse(
+                local_path,
+                media_type=content_type,
+                filename=filename,
+                headers=headers
+            )
+        
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            headers["Content-Length"] = str(bytes_sent)
+            return StreamingResponse(
+                _iter_bytes(file_data, start, end),
+                status_code=206,
+                media_type=content_type,
+                headers=headers
+            )
+        
+        headers["Content-Length"] = str(file_size)
+        return StreamingResponse(
+            _iter_bytes(file_data, 0, file_size - 1),
             media_type=content_type,
-            headers={
-                "Content-Disposition": f'attachment; filename="{apk.package_name}_{apk.version_code}.apk"',
-                "Content-Length": str(file_size),
-                "X-APK-SHA256": apk.sha256 or "",
-                "X-Cache-Hit": str(cache_hit),
-                "X-Download-Speed-Kbps": str(speed_kbps),
-                "Accept-Ranges": "bytes"  # Indicate range request support for future
-            }
+            headers=headers
         )
         
+    except HTTPException:
+        _close_if_mapped(file_data)
+        raise
     except ObjectNotFoundError:
         structured_logger.log_event(
             "apk.download.storage_error",
@@ -153,6 +427,7 @@ async def download_apk_optimized(
         )
         raise HTTPException(status_code=404, detail="APK file not found in storage")
     except Exception as e:
+        _close_if_mapped(file_data)
         structured_logger.log_event(
             "apk.download.error",
             apk_id=apk_id,
@@ -167,6 +442,8 @@ def get_cache_statistics() -> dict:
     """Get APK cache statistics for monitoring"""
     try:
         cache = get_apk_cache()
-        return cache.get_stats()
+        stats = cache.get_stats()
+        stats["disk"] = get_disk_apk_cache().get_stats()
+        return stats
     except Exception as e:
         return {"error": str(e)}
@@ -0,0 +1,329 @@
+"""
+Resumable chunked APK uploads.
+
+/v1/apk/upload-init -> /v1/apk/upload-chunk (any order, retries allowed) ->
+/v1/apk/complete. Each chunk is written straight to its final offset in one
+preallocated file, so completing an upload needs no assembly pass:
+
+- every chunk except the last has the same size, so chunk i lands at
+  i * len(chunk) and the last chunk at file_size - len(chunk)
+- a marker file per received chunk records its size; clients resume by asking
+  which chunks are still missing (get_status)
+- the SHA-256 is computed incrementally over the contiguous received prefix
+  while chunks arrive, so finalize only hashes whatever tail is left (nothing,
+  for in-order uploads)
+- the finished file is streamed to object storage from disk
+
+State lives in the upload directory, so chunks may be handled by any worker.
+Hash state is per process; a worker that missed some chunks catches up by
+reading them from the shared file (page cache), not from the client. Re-sending
+a chunk that already has a marker bumps a shared rewrite count, and every
+process restarts its hash from byte 0 when it sees the count change.
+All functions here do blocking file I/O; call them via asyncio.to_thread.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from observability import structured_logger, metrics
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """Raised when a chunk or finalize request is inconsistent with the upload"""
+    pass
+
+
+class _HashState:
+    """Per-process SHA-256 over the contiguous received prefix of one upload"""
+
+    def __init__(self):
+        self.hasher = hashlib.sha256()
+        self.next_index = 0
+        self.hashed_bytes = 0
+        self.rewrites = 0
+        self.lock = threading.Lock()
+
+    def reset(self, rewrites: int):
+        self.hasher = hashlib.sha256()
+        self.next_index = 0
+        self.hashed_bytes = 0
+        self.rewrites = rewrites
+
+
+class ChunkedUploadStore:
+    """
+    On-disk store for in-progress chunked uploads, one directory per apk_id.
+    """
+
+    def __init__(self, base_dir: str = "/tmp/apk_chunks"):
+        self.base_dir = base_dir
+        self._hash_states: Dict[int, _HashState] = {}
+        self._hash_states_lock = threading.Lock()
+
+    def _dir(self, apk_id: int) -> str:
+        return os.path.join(self.base_dir, str(apk_id))
+
+    def _data_path(self, apk_id: int) -> str:
+        return os.path.join(self._dir(apk_id), "upload.apk")
+
+    def _marker_path(self, apk_id: int, chunk_index: int) -> str:
+        return os.path.join(self._dir(apk_id), f"chunk_{chunk_index:05d}.done")
+
+    def _rewrites_path(self, apk_id: int) -> str:
+        return os.path.join(self._dir(apk_id), "rewrites")
+
+    def _rewrites(self, apk_id: int) -> int:
+        """How many times an already-received chunk was overwritten (append-only file size)"""
+        try:
+            return os.stat(self._rewrites_path(apk_id)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _load_state(self, apk_id: int) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self._dir(apk_id), "upload.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError(f"No upload in progress for apk_id={apk_id}")
+
+    def _hash_state(self, apk_id: int) -> _HashState:
+        with self._hash_states_lock:
+            return self._hash_states.setdefault(apk_id, _HashState())
+
+    def _chunk_size(self, apk_id: int, chunk_index: int) -> Optional[int]:
+        try:
+            with open(self._marker_path(apk_id, chunk_index)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return None
+
+    def init_upload(self, apk_id: int, file_size: int, total_chunks: int):
+        """
+        Create the upload directory and preallocate the destination file.
+
+        Args:
+            apk_id: ApkVersion id the upload belongs to
+            file_size: Final size of the APK in bytes
+            total_chunks: Number of chunks the client will send
+        """
+        upload_dir = self._dir(apk_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        with open(self._data_path(apk_id), "wb") as f:
+            f.truncate(file_size)
+        tmp_state = os.path.join(upload_dir, "upload.json.tmp")
+        with open(tmp_state, "w") as f:
+            json.dump({"file_size": file_size, "total_chunks": total_chunks}, f)
+        os.replace(tmp_state, os.path.join(upload_dir, "upload.json"))
+
+    def write_chunk(self, apk_id: int, chunk_index: int, total_chunks: int, source: BinaryIO) -> Dict[str, Any]:
+        """
+        Stream one chunk from `source` (a seekable file, e.g. UploadFile.file)
+        to its offset in the upload file. Re-sending a chunk overwrites it.
+
+        Returns:
+            dict with chunk_size and bytes_hashed (contiguous prefix hashed so far)
+
+        Raises:
+            UploadError: If the chunk does not fit the upload's layout
+        """
+        state = self._load_state(apk_id)
+        if total_chunks != state["total_chunks"] or not (0 <= chunk_index < total_chunks):
+            raise UploadError("Invalid chunk index or total chunks")
+
+        # The chunk's size decides its offset
+        source.seek(0, os.SEEK_END)
+        chunk_size = source.tell()
+        source.seek(0)
+
+        is_last = chunk_index == total_chunks - 1
+        offset = state["file_size"] - chunk_size if is_last else chunk_index * chunk_size
+        if chunk_size == 0 or offset < 0 or offset + chunk_size > state["file_size"]:
+            raise UploadError(f"Chunk {chunk_index} ({chunk_size} bytes) does not fit a {state['file_size']} byte upload")
+        if not is_last:
+            expected = self._claim_chunk_size(apk_id, chunk_size)
+            if chunk_size != expected:
+                raise UploadError(f"Chunk {chunk_index} is {chunk_size} bytes; other chunks are {expected}")
+
+        rewrite = self._chunk_size(apk_id, chunk_index) is not None
+
+        fd = os.open(self._data_path(apk_id), os.O_WRONLY)
+        try:
+            position = offset
+            for block in iter(lambda: source.read(COPY_BUFFER_SIZE), b""):
+                os.pwrite(fd, block, position)
+                position += len(block)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        marker_tmp = self._marker_path(apk_id, chunk_index) + ".tmp"
+        with open(marker_tmp, "w") as f:
+            f.write(str(chunk_size))
+        os.replace(marker_tmp, self._marker_path(apk_id, chunk_index))
+
+        if rewrite:
+            # The bytes may differ from what any process already hashed
+            with open(self._rewrites_path(apk_id), "ab") as f:
+                f.write(b".")
+            metrics.inc_counter("apk_upload_chunk_rewrites_total")
+
+        return {"chunk_size": chunk_size, "bytes_hashed": self._advance_hash(apk_id, state)}
+
+    def _claim_chunk_size(self, apk_id: int, chunk_size: int) -> int:
+        """The size every non-last chunk must have: set by the first one to arrive."""
+        path = os.path.join(self._dir(apk_id), "chunk_size")
+        tmp_path = f"{path}.{threading.get_ident()}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(str(chunk_size))
+        try:
+            # link() fails if the file exists, so exactly one chunk sets the size
+            os.link(tmp_path, path)
+            return chunk_size
+        except FileExistsError:
+            with open(path) as f:
+                return int(f.read())
+        finally:
+            os.remove(tmp_path)
+
+    def _advance_hash(self, apk_id: int, state: Dict[str, Any]) -> int:
+        """Feed newly contiguous chunks into this process's hash. Returns bytes hashed."""
+        hash_state = self._hash_state(apk_id)
+        with hash_state.lock:
+            rewrites = self._rewrites(apk_id)
+            if rewrites != hash_state.rewrites:
+                hash_state.reset(rewrites)
+
+            end = hash_state.hashed_bytes
+            index = hash_state.next_index
+            while index < state["total_chunks"]:
+                size = self._chunk_size(apk_id, index)
+                if size is None:
+                    break
+                end += size
+                index += 1
+
+            if end > hash_state.hashed_bytes:
+                with open(self._data_path(apk_id), "rb") as f:
+                    f.seek(hash_state.hashed_bytes)
+                    remaining = end - hash_state.hashed_bytes
+                    while remaining > 0:
+                        block = f.read(min(COPY_BUFFER_SIZE, remaining))
+                        if not block:
+                            break
+                        hash_state.hasher.update(block)
+                        remaining -= len(block)
+                if remaining:
+                    # File shorter than its markers say: the hash no longer
+                    # matches a byte count, start over next time
+                    hash_state.reset(-1)
+                    return 0
+                metrics.inc_counter("apk_upload_hashed_bytes_total", value=end - hash_state.hashed_bytes)
+                hash_state.hashed_bytes = end
+                hash_state.next_index = index
+
+            if self._rewrites(apk_id) != rewrites:
+                # A chunk was overwritten while we read; start over next time
+                hash_state.reset(-1)
+                return 0
+            return hash_state.hashed_bytes
+
+    def get_status(self, apk_id: int) -> Dict[str, Any]:
+        """
+        Which chunks have arrived, for resuming an interrupted upload.
+
+        Returns:
+            dict with total_chunks, file_size, received, missing and bytes_received
+        """
+        state = self._load_state(apk_id)
+        received: List[int] = []
+        missing: List[int] = []
+        bytes_received = 0
+        for index in range(state["total_chunks"]):
+            size = self._chunk_size(apk_id, index)
+            if size is None:
+                missing.append(index)
+            else:
+                received.append(index)
+                bytes_received += size
+        return {
+            "total_chunks": state["total_chunks"],
+            "file_size": state["file_size"],
+            "received": received,
+            "missing": missing,
+            "bytes_received": bytes_received
+        }
+
+    def finalize(self, apk_id: int) -> Dict[str, Any]:
+        """
+        Check that every chunk arrived and return the file path and SHA-256.
+
+        Returns:
+            dict with path, sha256 and file_size
+
+        Raises:
+            UploadError: If chunks are missing or sizes do not add up
+        """
+        status = self.get_status(apk_id)
+        if status["missing"]:
+            raise UploadError(f"Missing chunks: {status['missing'][:20]}")
+        if status["bytes_received"] != status["file_size"]:
+            raise UploadError(
+                f"Received {status['bytes_received']} bytes, expected {status['file_size']}"
+            )
+
+        state = {"file_size": status["file_size"], "total_chunks": status["total_chunks"]}
+        hash_state = self._hash_state(apk_id)
+        caught_up = status["file_size"] - hash_state.hashed_bytes
+        self._advance_hash(apk_id, state)
+        if caught_up:
+            structured_logger.log_event(
+                "apk.upload.hash_catch_up",
+                apk_id=apk_id,
+                bytes=caught_up
+            )
+
+        with hash_state.lock:
+            if hash_state.hashed_bytes == status["file_size"] and hash_state.rewrites == self._rewrites(apk_id):
+                sha256 = hash_state.hasher.hexdigest()
+            else:
+                # A rewrite raced the catch-up (or the file came up short):
+                # never hand out the digest of a partial stream
+                sha256 = self._sha256_of_file(apk_id)
+                metrics.inc_counter("apk_upload_full_rehash_total")
+                structured_logger.log_event(
+                    "apk.upload.full_rehash",
+                    level="WARN",
+                    apk_id=apk_id,
+                    hashed_bytes=hash_state.hashed_bytes,
+                    file_size=status["file_size"]
+                )
+
+        return {
+            "path": self._data_path(apk_id),
+            "sha256": sha256,
+            "file_size": status["file_size"]
+        }
+
+    def _sha256_of_file(self, apk_id: int) -> str:
+        digest = hashlib.sha256()
+        with open(self._data_path(apk_id), "rb") as f:
+            for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def cleanup(self, apk_id: int):
+        """Remove the upload directory and this process's hash state."""
+        with self._hash_states_lock:
+            self._hash_states.pop(apk_id, None)
+        shutil.rmtree(self._dir(apk_id), ignore_errors=True)
+
+
+# Global instance
+chunked_upload_store = ChunkedUploadStore(
+    base_dir=os.getenv("APK_UPLOAD_DIR", "/tmp/apk_chunks")
+)
@@ -1,8 +1,10 @@
+import asyncio
 import bcrypt
 import secrets
 import jwt
 import os
 import hashlib
+import threading
 import time
 from datetime import datetime, timezone, timedelta
 from fastapi import HTTPException, Security, Depends, Cookie, Header, Request
@@ -10,10 +12,12 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Request as FastAPIRequest
 from fastapi import Request
 from sqlalchemy.orm import Session
-from models import Device, User, Session as SessionModel, get_db
-from typing import Optional
+from models import Device, User, Session as SessionModel, get_db, get_async_db, run_in_session, commit_session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Dict, Tuple
 from observability import structured_logger, metrics
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from config import config
 
 security = HTTPBearer(auto_error=False)
@@ -120,6 +124,95 @@ ip_rate_limiter = IPRateLimiter(
     whitelist_ips=_get_whitelist_ips()
 )
 
+class DeviceTokenCache:
+    """
+    TTL + LRU cache of device tokens that already passed bcrypt verification.
+
+    Keyed by compute_token_id(token) (SHA-256 of the token), so a hit proves the
+    caller presented the exact token that was verified. Each entry remembers the
+    device id, the bcrypt hash it was verified against and the device's
+    revocation generation at verification time. invalidate_device() bumps the
+    generation, which turns every cached entry for that device into a miss
+    without scanning the cache, and also discards verifications that were in
+    flight when the device was revoked.
+    """
+
+    def __init__(self, max_size: int = 50000, ttl_seconds: int = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, str, int, float]]" = OrderedDict()
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def generation(self, device_id: str) -> int:
+        """Current revocation generation for a device (read before verifying)"""
+        with self._lock:
+            return self._generations.get(device_id, 0)
+
+    def get(self, token_id: str) -> Optional[Tuple[str, str]]:
+        """
+        Look up a verified token.
+
+        Returns:
+            (device_id, token_hash) on a fresh hit, None on miss/expiry/revocation
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token_id)
+            if entry is None:
+                return None
+
+            device_id, token_hash, generation, expires_at = entry
+            if expires_at <= now or generation != self._generations.get(device_id, 0):
+                del self._entries[token_id]
+                return None
+
+            self._entries.move_to_end(token_id)
+            return device_id, token_hash
+
+    def put(self, token_id: str, device_id: str, token_hash: str, generation: int):
+        """Cache a successful verification made at the given revocation generation"""
+        with self._lock:
+            if generation != self._generations.get(device_id, 0):
+                # Device was revoked while bcrypt was running
+                return
+
+            self._entries[token_id] = (device_id, token_hash, generation, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(token_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                metrics.inc_counter("device_token_cache_evictions_total")
+
+    def invalidate_device(self, device_id: str):
+        """Drop every cached verification for a device (token revoked or device deleted)"""
+        with self._lock:
+            self._generations[device_id] = self._generations.get(device_id, 0) + 1
+
+    def clear(self):
+        """Drop all entries (useful for testing)"""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+device_token_cache = DeviceTokenCache(
+    max_size=int(os.getenv("DEVICE_TOKEN_CACHE_SIZE", "50000")),
+    ttl_seconds=int(os.getenv("DEVICE_TOKEN_CACHE_TTL_SECONDS", "300"))
+)
+
+# Dedicated pool so bcrypt never runs on the event loop and cannot starve the default executor
+_bcrypt_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BCRYPT_WORKERS", "4")),
+    thread_name_prefix="bcrypt"
+)
+
 SESSION_DURATION_DAYS = 7
 JWT_SECRET = os.getenv("SESSION_SECRET", "default-secret-change-in-production")
 JWT_ALGORITHM = "HS256"
@@ -142,11 +235,34 @@ def compute_token_id(token: str) -> str:
 def generate_device_token() -> str:
     return secrets.token_urlsafe(32)
 
+async def verify_token_async(token: str, hashed: str) -> bool:
+    """verify_token on the bcrypt thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_executor, verify_token, token, hashed)
+
+def _match_legacy_token(token: str, candidates: list) -> Optional[str]:
+    """Return the id of the first (device_id, token_hash) candidate the token verifies against"""
+    for device_id, token_hash in candidates:
+        if verify_token(token, token_hash):
+            return device_id
+    return None
+
 async def verify_device_token(
     request: Request,
     credentials: HTTPAuthorizationCredentials | None = Security(security),
     db: Session = Depends(get_db)
 ) -> Device:
+    return await _verify_device_token(request, credentials, db)
+
+async def verify_device_token_async(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials | None = Security(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> Device:
+    """verify_device_token on the request's AsyncSession (routes ported to get_async_db)"""
+    return await _verify_device_token(request, credentials, db)
+
+async def _verify_device_token(request: Request, credentials: HTTPAuthorizationCredentials | None, db) -> Device:
     auth_start_time = time.time()
     
     # Extract client IP address
@@ -188,14 +304,39 @@ async def verify_device_token(
     token_id = compute_token_id(token)
     token_id_prefix = token_id[:8] if len(token_id) >= 8 else token_id
     
+    # Verified-token cache: skips bcrypt for tokens seen recently.
+    # The device row is still loaded so a rotated hash or a revocation made
+    # by another worker is picked up immediately.
+    cached = device_token_cache.get(token_id)
+    if cached:
+        cached_device_id, cached_token_hash = cached
+        device = await run_in_session(db, lambda s: s.query(Device).filter(Device.id == cached_device_id).first())
+        if device and device.token_id == token_id and device.token_hash == cached_token_hash:
+            metrics.inc_counter("device_token_cache_hits_total")
+            auth_latency_ms = (time.time() - auth_start_time) * 1000
+            metrics.observe_histogram("device_auth_latency_ms", auth_latency_ms, {})
+            structured_logger.log_event(
+                "auth.device_token.success",
+                level="INFO",
+                device_id=device.id,
+                token_id_prefix=token_id_prefix,
+                lookup_method="cache",
+                latency_ms=auth_latency_ms
+            )
+            return device
+        device_token_cache.invalidate_device(cached_device_id)
+    metrics.inc_counter("device_token_cache_misses_total")
+    
     # First try fast lookup by token_id (for new devices)
-    device = db.query(Device).filter(Device.token_id == token_id).first()
+    device = await run_in_session(db, lambda s: s.query(Device).filter(Device.token_id == token_id).first())
     device_found_by_token_id = device is not None
     
     if device:
-        # Device found by token_id, verify the token hash
-        token_verified = verify_token(token, device.token_hash)
+        # Device found by token_id, verify the token hash off the event loop
+        generation = device_token_cache.generation(device.id)
+        token_verified = await verify_token_async(token, device.token_hash)
         if token_verified:
+            device_token_cache.put(token_id, device.id, device.token_hash, generation)
             auth_latency_ms = (time.time() - auth_start_time) * 1000
             metrics.observe_histogram("device_auth_latency_ms", auth_latency_ms, {})
             structured_logger.log_event(
@@ -224,14 +365,24 @@ async def verify_device_token(
             raise HTTPException(status_code=401, detail="Invalid device token")
     
     # Device not found by token_id, try legacy lookup
-    legacy_devices = db.query(Device).filter(Device.token_id.is_(None)).all()
+    legacy_devices = await run_in_session(db, lambda s: s.query(Device).filter(Device.token_id.is_(None)).all())
     legacy_count = len(legacy_devices)
     
+    legacy_match_id = None
+    if legacy_devices:
+        loop = asyncio.get_running_loop()
+        legacy_match_id = await loop.run_in_executor(
+            _bcrypt_executor,
+            _match_legacy_token,
+            token,
+            [(d.id, d.token_hash) for d in legacy_devices]
+        )
+    
     for legacy_device in legacy_devices:
-        if verify_token(token, legacy_device.token_hash):
+        if legacy_device.id == legacy_match_id:
             # Migrate legacy device by setting token_id
             legacy_device.token_id = token_id
-            db.commit()
+            await commit_session(db)
             auth_latency_ms = (time.time() - auth_start_time) * 1000
             metrics.observe_histogram("device_auth_latency_ms", auth_latency_ms, {})
             structured_logger.log_event(
@@ -252,12 +403,12 @@ async def verify_device_token(
     
     if client_ip and client_ip != "unknown":
         from models import DeviceHeartbeat
-        recent_hb = db.query(DeviceHeartbeat).filter(
+        recent_hb = await run_in_session(db, lambda s: s.query(DeviceHeartbeat).filter(
             DeviceHeartbeat.ip == client_ip
-        ).order_by(DeviceHeartbeat.ts.desc()).first()
+        ).order_by(DeviceHeartbeat.ts.desc()).first())
         
         if recent_hb:
-            device_by_ip = db.query(Device).filter(Device.id == recent_hb.device_id).first()
+            device_by_ip = await run_in_session(db, lambda s: s.query(Device).filter(Device.id == recent_hb.device_id).first())
             if device_by_ip:
                 matched_device_id = device_by_ip.id
                 matched_device_alias = device_by_ip.alias
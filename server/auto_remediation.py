@@ -1,4 +1,3 @@
-import httpx
 import uuid
 from datetime import datetime, timezone
 from typing import Optional
@@ -6,7 +5,9 @@ from sqlalchemy.orm import Session
 
 from alert_config import alert_config
 from observability import structured_logger, metrics
-from fcm_v1 import get_access_token, get_firebase_project_id, build_fcm_v1_url
+from fcm_v1 import build_fcm_v1_url
+from fcm_client import fcm_client
+from fcm_scheduler import fcm_scheduler, LANE_BULK
 from hmac_utils import compute_hmac_signature
 from models import Device, FcmDispatch
 from db_utils import record_fcm_dispatch
@@ -54,8 +55,8 @@ class AutoRemediationEngine:
         start_time = datetime.now(timezone.utc)
         
         try:
-            access_token = get_access_token()
-            project_id = get_firebase_project_id()
+            access_token = await fcm_client.get_access_token()
+            project_id = fcm_client.get_project_id()
             fcm_url = build_fcm_v1_url(project_id)
             
             message = {
@@ -77,8 +78,8 @@ class AutoRemediationEngine:
                 "Content-Type": "application/json"
             }
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(fcm_url, json=message, headers=headers)
+            async with fcm_client.session() as client:
+                response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_BULK, request_id=request_id)
                 latency_ms = (datetime.now(timezone.utc) - start_time).total_seconds() * 1000
                 
                 fcm_status = "success" if response.status_code == 200 else "failed"
@@ -171,8 +172,8 @@ class AutoRemediationEngine:
         start_time = datetime.now(timezone.utc)
         
         try:
-            access_token = get_access_token()
-            project_id = get_firebase_project_id()
+            access_token = await fcm_client.get_access_token()
+            project_id = fcm_client.get_project_id()
             fcm_url = build_fcm_v1_url(project_id)
             
             message = {
@@ -193,8 +194,8 @@ class AutoRemediationEngine:
                 "Content-Type": "application/json"
             }
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(fcm_url, json=message, headers=headers)
+            async with fcm_client.session() as client:
+                response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_BULK, request_id=request_id)
                 latency_ms = (datetime.now(timezone.utc) - start_time).total_seconds() * 1000
                 
                 fcm_status = "success" if response.status_code == 200 else "failed"
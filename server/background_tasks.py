@@ -71,6 +71,7 @@ class BackgroundTaskManager:
         self._cleanup_task = None
         self._event_logger_task = None
         self._installation_timeout_task = None
+        self._rollup_task = None
         self.event_queue = AsyncEventQueue()
     
     async def start(self):
@@ -92,6 +93,9 @@ class BackgroundTaskManager:
         
         # Start installation timeout checker
         self._installation_timeout_task = asyncio.create_task(self._run_installation_timeout_worker())
+        
+        # Start heartbeat rollup worker
+        self._rollup_task = asyncio.create_task(self._run_rollup_worker())
     
     async def stop(self):
         """Stop all background tasks."""
@@ -109,6 +113,8 @@ class BackgroundTaskManager:
             self._event_logger_task.cancel()
         if self._installation_timeout_task:
             self._installation_timeout_task.cancel()
+        if self._rollup_task:
+            self._rollup_task.cancel()
         
         structured_logger.log_event("background_tasks.stopped")
     
@@ -306,6 +312,33 @@ class BackgroundTaskManager:
                     error=str(e)
                 )
                 await asyncio.sleep(60)
+    
+    async def _run_rollup_worker(self):
+        """
+        Background worker that rolls closed heartbeat buckets up into the
+        1m/1h/1d history tables every HB_ROLLUP_INTERVAL_S seconds.
+        Runs in a thread; the advisory lock keeps it to one worker process.
+        """
+        from heartbeat_rollups import run_heartbeat_rollups, ROLLUP_INTERVAL_S
+        
+        if ROLLUP_INTERVAL_S <= 0:
+            return
+        
+        loop = asyncio.get_running_loop()
+        while self._running:
+            try:
+                await loop.run_in_executor(None, run_heartbeat_rollups)
+                await asyncio.sleep(ROLLUP_INTERVAL_S)
+                
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                structured_logger.log_event(
+                    "rollup_worker.error",
+                    level="ERROR",
+                    error=str(e)
+                )
+                await asyncio.sleep(ROLLUP_INTERVAL_S)
 
 
 # Global instance
@@ -9,9 +9,11 @@ import json
 import uuid
 from fastapi import HTTPException
 from observability import structured_logger, metrics
-from models import Device, DeviceEvent, DeviceSelection, DeviceLastStatus, AlertState, ApkInstallation, Command, FcmDispatch
+from models import Device, DeviceEvent, DeviceSelection, DeviceLastStatus, AlertState, ApkInstallation, Command, FcmDispatch, uses_jsonb_status, DEVICE_STATUS_COLUMNS
 from purge_jobs import purge_manager
 from alert_config import alert_config
+from auth import device_token_cache
+from device_deltas import device_deltas
 
 # Constants
 SELECTION_TTL_MINUTES = 15
@@ -58,17 +60,17 @@ def create_device_selection(
         elif status_filter == "offline":
             query = query.filter(Device.last_seen < offline_threshold)
     
-    # Network filter (requires parsing last_status JSON)
+    # Network and Unity filters read last_status, which is only queryable in JSONB mode
     network_filter = filter_criteria.get("network", "")
-    if network_filter:
-        # This would require JSONB query or parsing - simplified for now
-        pass
+    if network_filter and uses_jsonb_status(db.get_bind().dialect.name):
+        query = query.filter(
+            func.jsonb_extract_path_text(Device.last_status, "network", "transport") == network_filter
+        )
     
-    # Unity status filter
+    # Unity status filter (running / down / not_installed)
     unity_filter = filter_criteria.get("unity", "")
-    if unity_filter:
-        # Would need to check DeviceLastStatus table
-        pass
+    if unity_filter and uses_jsonb_status(db.get_bind().dialect.name):
+        query = query.filter(DEVICE_STATUS_COLUMNS["unity_status"] == unity_filter)
     
     # Execute query and get device IDs
     devices = query.all()
@@ -217,6 +219,8 @@ def bulk_delete_devices(
             # Revoke device token immediately
             device.token_revoked_at = datetime.now(timezone.utc)
             db.flush()
+            device_token_cache.invalidate_device(device_id)
+            device_deltas.forget(device_id)
             
             structured_logger.log_event(
                 "device.delete.cascade.start",
@@ -0,0 +1,335 @@
+"""
+Columnar (Parquet) copies of archived heartbeat partitions, and reads from them.
+
+Next to the compressed CSV archive (partition_archiver), the nightly archiver
+writes one Parquet file per day:
+- rows sorted by (device_id, ts), read through a server-side cursor
+  PARQUET_ROW_GROUP_ROWS at a time, one row group per batch
+- zstd-compressed columns with min/max statistics per row group
+
+Because of the sort, one device's rows sit in few row groups. read_device_history()
+checks each row group's device_id/ts statistics and reads only the groups
+that can match ("history for device X between dates"), so archived history
+stays queryable after the partition is dropped from Postgres.
+
+Files in App Storage are fetched once into ARCHIVE_CACHE_DIR (the SDK has no
+ranged reads) and checked against the recorded checksum.
+
+Needs pyarrow (listed in requirements.txt); if it is missing, export and reads
+are disabled (available() is False), archiving writes CSV only and nightly
+maintenance keeps partitions instead of dropping them without a Parquet copy.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from observability import structured_logger, metrics
+from partition_archiver import (
+    ARCHIVE_COLUMNS, ARCHIVE_PREFIX, READ_CHUNK_BYTES, ArchiveError, ArchiveResult,
+    get_archive_store, store_for_url
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+ARCHIVE_PARQUET = os.getenv("ARCHIVE_PARQUET", "true").lower() == "true"
+PARQUET_ROW_GROUP_ROWS = int(os.getenv("PARQUET_ROW_GROUP_ROWS", "50000"))
+ARCHIVE_CACHE_DIR = os.getenv("ARCHIVE_CACHE_DIR", "./data/archive_cache")
+ARCHIVE_CACHE_MAX_FILES = int(os.getenv("ARCHIVE_CACHE_MAX_FILES", "32"))
+MAX_ARCHIVE_ROWS = int(os.getenv("ARCHIVE_QUERY_MAX_ROWS", "5000"))
+
+# Columns returned by read_device_history
+READ_COLUMNS = (
+    "ts", "status", "battery_pct", "plugged", "temp_c", "network_type", "signal_dbm",
+    "unity_running", "agent_version"
+)
+
+
+class ColumnarUnavailableError(Exception):
+    """pyarrow is not installed"""
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def _schema():
+    types = {
+        "hb_id": pa.int64(),
+        "ts": pa.timestamp("us"),
+        "bucket_ts": pa.timestamp("us"),
+        "battery_pct": pa.int32(),
+        "temp_c": pa.int32(),
+        "signal_dbm": pa.int32(),
+        "uptime_s": pa.int32(),
+        "ram_used_mb": pa.int32(),
+        "plugged": pa.bool_(),
+        "unity_running": pa.bool_(),
+    }
+    return pa.schema([(name, types.get(name, pa.string())) for name in ARCHIVE_COLUMNS])
+
+
+def _require():
+    if pa is None:
+        raise ColumnarUnavailableError("Columnar archives require the pyarrow package")
+
+
+def write_parquet(rows_batches, path: str) -> int:
+    """
+    Write row batches (lists of tuples in ARCHIVE_COLUMNS order, already sorted)
+    to a Parquet file, one row group per batch.
+
+    Returns:
+        Number of rows written
+    """
+    _require()
+    schema = _schema()
+    row_count = 0
+    with pq.ParquetWriter(path, schema, compression="zstd", write_statistics=True) as writer:
+        for rows in rows_batches:
+            if not rows:
+                continue
+            columns = list(zip(*rows))
+            batch = pa.record_batch(
+                [pa.array(columns[i], type=field.type) for i, field in enumerate(schema)],
+                schema=schema
+            )
+            writer.write_batch(batch, row_group_size=len(rows))
+            row_count += len(rows)
+    return row_count
+
+
+def _fetch_sorted(db, partition_name: str):
+    """Yield PARQUET_ROW_GROUP_ROWS-sized batches from a server-side cursor."""
+    cursor = db.connection().connection.cursor(name=f"parquet_{partition_name}")
+    try:
+        cursor.itersize = PARQUET_ROW_GROUP_ROWS
+        cursor.execute(
+            f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {partition_name} ORDER BY device_id, ts"
+        )
+        while True:
+            rows = cursor.fetchmany(PARQUET_ROW_GROUP_ROWS)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def upload_file(store, path: str, key: str, row_count: int) -> ArchiveResult:
+    """Stream a finished local file into a store, hashing it on the way."""
+    upload = store.open(key)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                upload.write(chunk)
+        url = upload.commit()
+    except Exception as e:
+        upload.abort()
+        raise ArchiveError(f"Failed to upload {key}: {e}") from e
+    return ArchiveResult(
+        url=url,
+        checksum_sha256=digest.hexdigest(),
+        row_count=row_count,
+        raw_bytes=size,
+        compressed_bytes=size
+    )
+
+
+def export_partition_parquet(db, partition_name: str, store=None) -> ArchiveResult:
+    """
+    Write a partition as a Parquet file sorted by (device_id, ts) and upload it.
+
+    Args:
+        db: Database session (psycopg2)
+        partition_name: e.g. device_heartbeats_20260101
+        store: Destination; defaults to get_archive_store()
+
+    Raises:
+        ColumnarUnavailableError: If pyarrow is not installed
+        ArchiveError: If the export or upload fails
+    """
+    _require()
+    store = store or get_archive_store()
+    start = time.time()
+
+    fd, tmp_path = tempfile.mkstemp(prefix="archive-", suffix=".parquet")
+    os.close(fd)
+    try:
+        row_count = write_parquet(_fetch_sorted(db, partition_name), tmp_path)
+        result = upload_file(store, tmp_path, ARCHIVE_PREFIX + partition_name + ".parquet", row_count)
+    finally:
+        os.remove(tmp_path)
+
+    metrics.observe_histogram("archive_parquet_duration_ms", (time.time() - start) * 1000, {})
+    metrics.inc_counter("archive_bytes_total", {"kind": "parquet"}, value=result.compressed_bytes)
+    return result
+
+
+def _local_path(url: str, checksum_sha256: Optional[str]) -> str:
+    """Local file for an archive URL; object-store archives are fetched into the cache once."""
+    if url.startswith("file://"):
+        return url[len("file://"):]
+
+    os.makedirs(ARCHIVE_CACHE_DIR, exist_ok=True)
+    name = (checksum_sha256 or hashlib.sha256(url.encode()).hexdigest()) + ".parquet"
+    path = os.path.join(ARCHIVE_CACHE_DIR, name)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    tmp_path = f"{path}.{os.getpid()}.part"
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in store_for_url(url).iter_chunks(url):
+                digest.update(chunk)
+                f.write(chunk)
+        if checksum_sha256 and digest.hexdigest() != checksum_sha256:
+            raise ArchiveError(f"Checksum mismatch for {url}")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    _evict_cache()
+    return path
+
+
+def _evict_cache():
+    files = [
+        os.path.join(ARCHIVE_CACHE_DIR, name)
+        for name in os.listdir(ARCHIVE_CACHE_DIR)
+        if name.endswith(".parquet")
+    ]
+    files.sort(key=os.path.getmtime)
+    for path in files[:max(0, len(files) - ARCHIVE_CACHE_MAX_FILES)]:
+        os.remove(path)
+
+
+def _row_group_matches(stats: Dict[str, Any], device_id: str, start: datetime, end: datetime) -> bool:
+    """Row group can contain device_id rows in [start, end) according to its min/max statistics."""
+    device = stats.get("device_id")
+    if device is not None and not (device.min <= device_id <= device.max):
+        return False
+    ts = stats.get("ts")
+    if ts is not None and (ts.max < start or ts.min >= end):
+        return False
+    return True
+
+
+def read_parquet_history(
+    path: str,
+    device_id: str,
+    start: datetime,
+    end: datetime,
+    limit: int = MAX_ARCHIVE_ROWS
+) -> List[Dict[str, Any]]:
+    """
+    Rows for one device in [start, end) from a Parquet archive, reading only
+    row groups whose statistics can match.
+
+    Args:
+        path: Local Parquet file
+        device_id: Device identifier
+        start: Range start (naive UTC)
+        end: Range end (naive UTC)
+        limit: Maximum rows returned
+    """
+    _require()
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    column_index = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+
+    rows: List[Dict[str, Any]] = []
+    scanned = skipped = 0
+    for group in range(metadata.num_row_groups):
+        row_group = metadata.row_group(group)
+        stats = {}
+        for name in ("device_id", "ts"):
+            column_stats = row_group.column(column_index[name]).statistics
+            if column_stats is not None and column_stats.has_min_max:
+                stats[name] = column_stats
+        if not _row_group_matches(stats, device_id, start, end):
+            skipped += 1
+            continue
+
+        scanned += 1
+        table = parquet_file.read_row_group(group, columns=["device_id", *READ_COLUMNS])
+        mask = pc.and_(
+            pc.equal(table["device_id"], device_id),
+            pc.and_(
+                pc.greater_equal(table["ts"], pa.scalar(start, type=pa.timestamp("us"))),
+                pc.less(table["ts"], pa.scalar(end, type=pa.timestamp("us")))
+            )
+        )
+        rows.extend(table.filter(mask).select(list(READ_COLUMNS)).to_pylist())
+        if len(rows) >= limit:
+            break
+
+    metrics.inc_counter("archive_row_groups_scanned_total", value=scanned)
+    metrics.inc_counter("archive_row_groups_skipped_total", value=skipped)
+    return rows[:limit]
+
+
+def read_device_history(
+    db,
+    device_id: str,
+    start: datetime,
+    end: datetime,
+    limit: int = MAX_ARCHIVE_ROWS
+) -> List[Dict[str, Any]]:
+    """
+    Archived heartbeats for one device in [start, end), oldest first, from the
+    Parquet files of every archived partition overlapping the range.
+
+    Args:
+        db: Database session
+        device_id: Device identifier
+        start: Range start (naive UTC)
+        end: Range end (naive UTC)
+        limit: Maximum rows returned
+
+    Raises:
+        ColumnarUnavailableError: If pyarrow is not installed
+        ArchiveError: If an archive cannot be fetched or fails its checksum
+    """
+    from models import HeartbeatPartition
+
+    _require()
+    query_start = time.time()
+    partitions = db.query(HeartbeatPartition).filter(
+        HeartbeatPartition.parquet_url.isnot(None),
+        HeartbeatPartition.range_end > start,
+        HeartbeatPartition.range_start < end
+    ).order_by(HeartbeatPartition.range_start).all()
+
+    rows: List[Dict[str, Any]] = []
+    for partition in partitions:
+        path = _local_path(partition.parquet_url, partition.parquet_checksum_sha256)
+        rows.extend(read_parquet_history(path, device_id, start, end, limit - len(rows)))
+        if len(rows) >= limit:
+            break
+
+    metrics.observe_histogram("archive_query_ms", (time.time() - query_start) * 1000, {})
+    structured_logger.log_event(
+        "archive.query",
+        device_id=device_id,
+        partitions=len(partitions),
+        rows=len(rows)
+    )
+    return rows
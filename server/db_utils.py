@@ -4,11 +4,54 @@ Database utility functions for idempotency, retention, and maintenance.
 from datetime import datetime, timedelta, timezone, date
 from sqlalchemy.orm import Session
 from sqlalchemy import text, func
-from typing import Optional
+from typing import Optional, Iterator, Sequence, List
+import io
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+BULK_LOOKUP_CHUNK_SIZE = int(os.getenv("BULK_LOOKUP_CHUNK_SIZE", "5000"))
+# Load batched heartbeats with COPY (psycopg2 only) instead of a bound VALUES list
+HB_COPY_WRITES = os.getenv("HB_COPY_WRITES", "true").lower() == "true"
+
+
+def chunked(ids: Sequence, chunk_size: Optional[int] = None) -> Iterator[List]:
+    """Split ids into lists of at most chunk_size (default BULK_LOOKUP_CHUNK_SIZE)."""
+    chunk_size = chunk_size or BULK_LOOKUP_CHUNK_SIZE
+    ids = list(ids)
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start:start + chunk_size]
+
+
+def iter_bulk_lookup(
+    db: Session,
+    sql: str,
+    ids: Sequence,
+    params: Optional[dict] = None,
+    chunk_size: Optional[int] = None
+) -> Iterator:
+    """
+    Run a query filtered by `= ANY(:ids)` once per chunk of ids.
+    
+    The statement text is the same for every chunk and every call, so
+    PostgreSQL can reuse its plan, and the ids travel as a single array
+    parameter instead of being spliced into the SQL.
+    
+    Args:
+        db: Database session
+        sql: Query containing an `= ANY(:ids)` filter
+        ids: Values to bind to :ids
+        params: Other bind parameters
+        chunk_size: Maximum ids per statement (default BULK_LOOKUP_CHUNK_SIZE)
+        
+    Returns:
+        Iterator over result rows (lightweight Row tuples with attribute access)
+    """
+    statement = text(sql)
+    for chunk in chunked(ids, chunk_size):
+        yield from db.execute(statement, {**(params or {}), "ids": chunk})
+
 
 def log_db_operation(event: str, entity: str, keys: dict, latency_ms: float):
     """
@@ -84,6 +127,21 @@ def record_fcm_dispatch(
     return {'created': True, 'dispatch': dispatch}
 
 
+def compute_heartbeat_bucket(ts: datetime, bucket_seconds: int = 10) -> datetime:
+    """
+    Round a heartbeat timestamp down to the start of its dedup bucket.
+    
+    Args:
+        ts: Heartbeat timestamp
+        bucket_seconds: Time bucket size in seconds (must divide 60)
+        
+    Returns:
+        Start of the bucket containing ts
+    """
+    return ts.replace(second=(ts.second // bucket_seconds) * bucket_seconds,
+                      microsecond=0)
+
+
 def record_heartbeat_with_bucketing(
     db: Session,
     device_id: str,
@@ -95,7 +153,9 @@ def record_heartbeat_with_bucketing(
     Dual-writes to both device_heartbeats (partitioned) and device_last_status (fast read).
     Multiple heartbeats within the same bucket window are deduplicated.
     
-    PERFORMANCE OPTIMIZED: Uses INSERT...ON CONFLICT for dedup check + insert in one query.
+    PERFORMANCE OPTIMIZED: Dedup is the partition's unique (device_id, bucket_ts)
+    index; a heartbeat for a bucket already stored (including one inserted
+    concurrently) is dropped by ON CONFLICT DO NOTHING.
     
     Args:
         db: Database session
@@ -104,7 +164,8 @@ def record_heartbeat_with_bucketing(
         bucket_seconds: Time bucket size in seconds (default: 10)
         
     Returns:
-        dict with 'created' (bool) and 'last_status_updated' (bool) keys
+        dict with 'created' (bool) and 'last_status_updated' (bool) keys, plus
+        'reason': 'duplicate' when the heartbeat was deduplicated
     """
     from models import DeviceHeartbeat, DeviceLastStatus
     from sqlalchemy.dialects.postgresql import insert as pg_insert
@@ -114,23 +175,15 @@ def record_heartbeat_with_bucketing(
     ts = datetime.now(timezone.utc)
     
     # Calculate bucket timestamp (round down to nearest bucket)
-    bucket_ts = ts.replace(second=(ts.second // bucket_seconds) * bucket_seconds, 
-                           microsecond=0)
-    
-    # OPTIMIZATION: Use raw SQL with INSERT...ON CONFLICT for atomic dedup + insert
-    # This is much faster than checking first then inserting
-    heartbeat_insert_sql = text("""
-        INSERT INTO device_heartbeats 
-        (device_id, ts, ip, status, battery_pct, plugged, temp_c, network_type, 
-         signal_dbm, uptime_s, ram_used_mb, unity_pkg_version, unity_running, agent_version)
-        SELECT :device_id, :ts, :ip, :status, :battery_pct, :plugged, :temp_c, :network_type,
-               :signal_dbm, :uptime_s, :ram_used_mb, :unity_pkg_version, :unity_running, :agent_version
-        WHERE NOT EXISTS (
-            SELECT 1 FROM device_heartbeats 
-            WHERE device_id = :device_id 
-            AND ts >= :bucket_start 
-            AND ts < :bucket_end
-        )
+    bucket_ts = compute_heartbeat_bucket(ts, bucket_seconds)
+    
+    # OPTIMIZATION: INSERT...ON CONFLICT against the unique bucket index for atomic dedup + insert
+    heartbeat_insert_sql = text(f"""
+        INSERT INTO device_heartbeats ({HEARTBEAT_COLUMN_LIST}, bucket_ts)
+        VALUES (:device_id, :ts, :ip, :status, :battery_pct, :plugged, :temp_c, :network_type,
+                :signal_dbm, :uptime_s, :ram_used_mb, :unity_pkg_version, :unity_running, :agent_version,
+                :bucket_ts)
+        ON CONFLICT DO NOTHING
         RETURNING hb_id
     """)
     
@@ -149,8 +202,7 @@ def record_heartbeat_with_bucketing(
         'unity_pkg_version': heartbeat_data.get('unity_pkg_version'),
         'unity_running': heartbeat_data.get('unity_running'),
         'agent_version': heartbeat_data.get('agent_version'),
-        'bucket_start': bucket_ts,
-        'bucket_end': bucket_ts + timedelta(seconds=bucket_seconds)
+        'bucket_ts': bucket_ts
     })
     
     # Check if a row was inserted (RETURNING clause returns hb_id if inserted)
@@ -196,7 +248,366 @@ def record_heartbeat_with_bucketing(
                          {'device_id': device_id, 'bucket': str(bucket_ts)}, 
                          latency_ms)
     
-    return {'created': created, 'last_status_updated': True}
+    if not created:
+        return {'created': False, 'reason': 'duplicate', 'last_status_updated': True}
+    return {'created': True, 'last_status_updated': True}
+
+
+# Column layouts for the VALUES lists used by write_heartbeat_batch.
+# Every placeholder is CAST explicitly so Postgres can type all-NULL columns.
+HEARTBEAT_BATCH_COLUMNS = [
+    ('device_id', 'VARCHAR'), ('ts', 'TIMESTAMP'), ('ip', 'VARCHAR'), ('status', 'VARCHAR'),
+    ('battery_pct', 'INTEGER'), ('plugged', 'BOOLEAN'), ('temp_c', 'INTEGER'),
+    ('network_type', 'VARCHAR'), ('signal_dbm', 'INTEGER'), ('uptime_s', 'INTEGER'),
+    ('ram_used_mb', 'INTEGER'), ('unity_pkg_version', 'VARCHAR'), ('unity_running', 'BOOLEAN'),
+    ('agent_version', 'VARCHAR'), ('bucket_ts', 'TIMESTAMP'),
+]
+
+LAST_STATUS_BATCH_COLUMNS = [
+    ('device_id', 'VARCHAR'), ('last_ts', 'TIMESTAMP'), ('battery_pct', 'INTEGER'),
+    ('network_type', 'VARCHAR'), ('unity_running', 'BOOLEAN'), ('signal_dbm', 'INTEGER'),
+    ('agent_version', 'VARCHAR'), ('ip', 'VARCHAR'), ('status', 'VARCHAR'),
+    ('service_up', 'BOOLEAN'), ('monitored_foreground_recent_s', 'INTEGER'),
+    ('monitored_package', 'VARCHAR'), ('monitored_threshold_min', 'INTEGER'),
+]
+
+# last_status arrives as JSON text; its SQL type follows the column's storage
+# (see _device_batch_columns)
+DEVICE_BATCH_COLUMNS = [
+    ('id', 'VARCHAR'), ('last_seen', 'TIMESTAMP'), ('last_status', 'TEXT'),
+    ('app_version', 'VARCHAR'), ('installed_apk_version_code', 'INTEGER'),
+    ('installed_apk_version_name', 'VARCHAR'), ('fcm_token', 'VARCHAR'),
+    ('model', 'VARCHAR'), ('manufacturer', 'VARCHAR'), ('android_version', 'VARCHAR'),
+    ('sdk_int', 'INTEGER'), ('build_id', 'VARCHAR'), ('is_device_owner', 'BOOLEAN'),
+    ('ping_request_id', 'VARCHAR'),
+]
+
+
+def _device_batch_columns() -> list:
+    """DEVICE_BATCH_COLUMNS with last_status typed to match the column's storage mode"""
+    from models import LAST_STATUS_JSONB
+    if not LAST_STATUS_JSONB:
+        return DEVICE_BATCH_COLUMNS
+    return [(name, 'JSONB' if name == 'last_status' else sql_type) for name, sql_type in DEVICE_BATCH_COLUMNS]
+
+
+def _naive_utc(value: datetime) -> datetime:
+    """TIMESTAMP columns hold naive UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _build_values_clause(rows: list, columns: list, prefix: str) -> tuple:
+    """
+    Build a parameterized multi-row VALUES clause.
+    
+    Args:
+        rows: List of dicts keyed by column name
+        columns: List of (column_name, sql_type) tuples
+        prefix: Bind parameter prefix (keeps names unique per statement)
+        
+    Returns:
+        Tuple of (values_sql, column_list_sql, params)
+    """
+    params = {}
+    tuples = []
+    for i, row in enumerate(rows):
+        placeholders = []
+        for name, sql_type in columns:
+            key = f"{prefix}_{name}_{i}"
+            value = row.get(name)
+            # CAST(... AS TIMESTAMP) would apply the session TimeZone to aware values
+            params[key] = _naive_utc(value) if isinstance(value, datetime) else value
+            placeholders.append(f"CAST(:{key} AS {sql_type})")
+        tuples.append(f"({', '.join(placeholders)})")
+    column_list = ", ".join(name for name, _ in columns)
+    return ",\n".join(tuples), column_list, params
+
+
+HEARTBEAT_COLUMN_LIST = (
+    "device_id, ts, ip, status, battery_pct, plugged, temp_c, network_type, "
+    "signal_dbm, uptime_s, ram_used_mb, unity_pkg_version, unity_running, agent_version"
+)
+
+# Per-connection staging table for COPY; temp tables are not WAL-logged
+HEARTBEAT_STAGE_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS hb_copy_stage (
+        device_id VARCHAR, ts TIMESTAMP, ip VARCHAR, status VARCHAR,
+        battery_pct INTEGER, plugged BOOLEAN, temp_c INTEGER, network_type VARCHAR,
+        signal_dbm INTEGER, uptime_s INTEGER, ram_used_mb INTEGER,
+        unity_pkg_version VARCHAR, unity_running BOOLEAN, agent_version VARCHAR,
+        bucket_ts TIMESTAMP
+    ) ON COMMIT DELETE ROWS
+"""
+
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_value(value) -> str:
+    """Encode one value in COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return _naive_utc(value).isoformat()
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def build_copy_buffer(rows: list, columns: list) -> io.StringIO:
+    """
+    Render rows as a COPY ... FROM STDIN text-format stream.
+    
+    Args:
+        rows: List of dicts keyed by column name
+        columns: List of (column_name, sql_type) tuples, in COPY column order
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row.get(name)) for name, _ in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _utc_date(ts: datetime) -> date:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return ts.date()
+
+
+def heartbeat_partition_name(day: date) -> str:
+    """Daily device_heartbeats partition for a UTC date."""
+    return f"device_heartbeats_{day.strftime('%Y%m%d')}"
+
+
+def _insert_heartbeats_values(db: Session, heartbeat_rows: list) -> int:
+    """Multi-row heartbeat insert from a bound VALUES list; returns rows created."""
+    values_sql, column_list, params = _build_values_clause(
+        heartbeat_rows, HEARTBEAT_BATCH_COLUMNS, 'hb'
+    )
+    result = db.execute(text(f"""
+        INSERT INTO device_heartbeats ({column_list})
+        SELECT v.* FROM (VALUES {values_sql}) AS v({column_list})
+        WHERE EXISTS (SELECT 1 FROM devices d WHERE d.id = v.device_id)
+        ON CONFLICT DO NOTHING
+        RETURNING hb_id
+    """), params)
+    return len(result.fetchall())
+
+
+def _insert_heartbeats_copy(db: Session, heartbeat_rows: list) -> int:
+    """
+    COPY heartbeats into a temp staging table, then move them into their
+    daily partitions with one INSERT ... SELECT per day; returns rows created.
+    
+    Inserting into the partition directly skips tuple routing; a day whose
+    partition does not exist yet goes through the parent table.
+    """
+    db.execute(text(HEARTBEAT_STAGE_DDL))
+    column_names = ", ".join(name for name, _ in HEARTBEAT_BATCH_COLUMNS)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY hb_copy_stage ({column_names}) FROM STDIN",
+            build_copy_buffer(heartbeat_rows, HEARTBEAT_BATCH_COLUMNS)
+        )
+    finally:
+        cursor.close()
+    
+    created = 0
+    for day in sorted({_utc_date(row['ts']) for row in heartbeat_rows}):
+        partition = heartbeat_partition_name(day)
+        exists = db.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": partition}).scalar()
+        target = partition if exists else "device_heartbeats"
+        result = db.execute(text(f"""
+            INSERT INTO {target} ({column_names})
+            SELECT s.* FROM hb_copy_stage s
+            WHERE s.ts >= :day_start AND s.ts < :day_end
+            AND EXISTS (SELECT 1 FROM devices d WHERE d.id = s.device_id)
+            ON CONFLICT DO NOTHING
+            RETURNING hb_id
+        """), {
+            "day_start": datetime.combine(day, datetime.min.time()),
+            "day_end": datetime.combine(day + timedelta(days=1), datetime.min.time()),
+        })
+        created += len(result.fetchall())
+    return created
+
+
+def write_heartbeat_batch(db: Session, records: list, bucket_seconds: int = 10) -> dict:
+    """
+    Persist a batch of queued heartbeats with three set-based statements.
+    Used by the async ingest pipeline (heartbeat_ingest.py) instead of
+    calling record_heartbeat_with_bucketing once per device.
+    
+    1. Heartbeats deduplicated in memory by (device_id, bucket) are COPY'd
+       into a staging table and inserted into their daily partition, skipping
+       buckets already in the table (HB_COPY_WRITES; otherwise one
+       multi-row INSERT from a VALUES list)
+    2. One batched upsert into device_last_status (latest record per device)
+    3. One batched UPDATE devices (fields merged per device)
+    
+    Rows for devices deleted since the heartbeat was queued are skipped.
+    The caller owns the transaction (commit/rollback).
+    
+    Args:
+        db: Database session
+        records: Queued heartbeat records (see heartbeat_ingest.HeartbeatIngestQueue)
+        bucket_seconds: Time bucket size in seconds (default: 10)
+        
+    Returns:
+        dict with 'created', 'deduped' (duplicates of a stored or batched
+        bucket), 'skipped_deleted', 'last_status_upserts', 'devices_updated'
+        and 'prev_service_up' (device_id -> service_up before this batch)
+    """
+    from sqlalchemy import bindparam
+    
+    start = datetime.now(timezone.utc)
+    
+    # Dedupe in memory: first heartbeat per (device_id, bucket) wins, matching
+    # ON CONFLICT DO NOTHING against the unique bucket index
+    heartbeat_rows = []
+    seen_buckets = set()
+    for record in records:
+        bucket_start = compute_heartbeat_bucket(record['ts'], bucket_seconds)
+        bucket_key = (record['device_id'], bucket_start)
+        if bucket_key in seen_buckets:
+            continue
+        seen_buckets.add(bucket_key)
+        row = dict(record['heartbeat'])
+        row.update({
+            'device_id': record['device_id'],
+            'ts': record['ts'],
+            'status': row.get('status') or 'ok',
+            'bucket_ts': bucket_start,
+        })
+        heartbeat_rows.append(row)
+    
+    # Latest record per device wins for last_status; device fields are merged
+    # so an earlier fcm_token/app_version is not lost behind a later heartbeat
+    last_status_rows = {}
+    device_rows = {}
+    for record in records:
+        device_id = record['device_id']
+        heartbeat = record['heartbeat']
+        service = record.get('service') or {}
+        last_status_rows[device_id] = {
+            'device_id': device_id,
+            'last_ts': record['ts'],
+            'battery_pct': heartbeat.get('battery_pct'),
+            'network_type': heartbeat.get('network_type'),
+            'unity_running': heartbeat.get('unity_running'),
+            'signal_dbm': heartbeat.get('signal_dbm'),
+            'agent_version': heartbeat.get('agent_version'),
+            'ip': heartbeat.get('ip'),
+            'status': heartbeat.get('status') or 'ok',
+            'service_up': service.get('service_up'),
+            'monitored_foreground_recent_s': service.get('monitored_foreground_recent_s'),
+            'monitored_package': service.get('monitored_package'),
+            'monitored_threshold_min': service.get('monitored_threshold_min'),
+        }
+        merged = device_rows.setdefault(device_id, {'id': device_id})
+        merged.update({k: v for k, v in record['device'].items() if v is not None})
+        if record.get('ping_request_id'):
+            merged['ping_request_id'] = record['ping_request_id']
+    
+    device_ids = list(last_status_rows.keys())
+    
+    # Capture service_up before the upsert so callers can log transitions, and
+    # which devices still exist (rows for deleted devices are not dedup hits)
+    prev_rows = db.execute(
+        text("""
+            SELECT d.id, dls.device_id, dls.service_up
+            FROM devices d
+            LEFT JOIN device_last_status dls ON dls.device_id = d.id
+            WHERE d.id IN :device_ids
+        """).bindparams(bindparam('device_ids', expanding=True)),
+        {'device_ids': device_ids}
+    ).fetchall()
+    existing_devices = {row[0] for row in prev_rows}
+    prev_service_up = {row[0]: row[2] for row in prev_rows if row[1] is not None}
+    
+    # 1. Heartbeat insert with bucket dedup against the table
+    if HB_COPY_WRITES and db.get_bind().dialect.driver == "psycopg2":
+        created = _insert_heartbeats_copy(db, heartbeat_rows)
+    else:
+        created = _insert_heartbeats_values(db, heartbeat_rows)
+    
+    # 2. Batched device_last_status upsert
+    values_sql, column_list, params = _build_values_clause(
+        list(last_status_rows.values()), LAST_STATUS_BATCH_COLUMNS, 'ls'
+    )
+    result = db.execute(text(f"""
+        INSERT INTO device_last_status ({column_list})
+        SELECT v.* FROM (VALUES {values_sql}) AS v({column_list})
+        JOIN devices d ON d.id = v.device_id
+        ON CONFLICT (device_id) DO UPDATE SET
+            last_ts = EXCLUDED.last_ts,
+            battery_pct = EXCLUDED.battery_pct,
+            network_type = EXCLUDED.network_type,
+            unity_running = EXCLUDED.unity_running,
+            signal_dbm = EXCLUDED.signal_dbm,
+            agent_version = EXCLUDED.agent_version,
+            ip = EXCLUDED.ip,
+            status = EXCLUDED.status,
+            service_up = EXCLUDED.service_up,
+            monitored_foreground_recent_s = EXCLUDED.monitored_foreground_recent_s,
+            monitored_package = EXCLUDED.monitored_package,
+            monitored_threshold_min = EXCLUDED.monitored_threshold_min
+    """), params)
+    last_status_upserts = result.rowcount
+    
+    # 3. Batched devices update. Optional fields keep their current value when
+    # the heartbeat did not carry them; a ping is only acknowledged if the
+    # request id still matches (a newer ping may have been sent meanwhile).
+    values_sql, column_list, params = _build_values_clause(
+        list(device_rows.values()), _device_batch_columns(), 'dev'
+    )
+    result = db.execute(text(f"""
+        UPDATE devices AS d SET
+            last_seen = v.last_seen,
+            last_status = COALESCE(v.last_status, d.last_status),
+            app_version = COALESCE(v.app_version, d.app_version),
+            installed_apk_version_code = COALESCE(v.installed_apk_version_code, d.installed_apk_version_code),
+            installed_apk_version_name = COALESCE(v.installed_apk_version_name, d.installed_apk_version_name),
+            fcm_token = COALESCE(v.fcm_token, d.fcm_token),
+            model = COALESCE(v.model, d.model),
+            manufacturer = COALESCE(v.manufacturer, d.manufacturer),
+            android_version = COALESCE(v.android_version, d.android_version),
+            sdk_int = COALESCE(v.sdk_int, d.sdk_int),
+            build_id = COALESCE(v.build_id, d.build_id),
+            is_device_owner = COALESCE(v.is_device_owner, d.is_device_owner),
+            last_ping_response = CASE
+                WHEN v.ping_request_id IS NOT NULL AND d.ping_request_id = v.ping_request_id
+                THEN v.last_seen ELSE d.last_ping_response END,
+            ping_request_id = CASE
+                WHEN v.ping_request_id IS NOT NULL AND d.ping_request_id = v.ping_request_id
+                THEN NULL ELSE d.ping_request_id END
+        FROM (VALUES {values_sql}) AS v({column_list})
+        WHERE d.id = v.id
+    """), params)
+    devices_updated = result.rowcount
+    
+    # In-memory and ON CONFLICT duplicates; rows for deleted devices are skipped
+    live_records = sum(1 for record in records if record['device_id'] in existing_devices)
+    deduped = max(live_records - created, 0)
+    skipped = len(records) - live_records
+    latency_ms = (datetime.now(timezone.utc) - start).total_seconds() * 1000
+    log_db_operation('batch_create', 'device_heartbeats',
+                     {'records': len(records), 'created': created, 'deduped': deduped,
+                      'skipped_deleted': skipped},
+                     latency_ms)
+    
+    return {
+        'created': created,
+        'deduped': deduped,
+        'skipped_deleted': skipped,
+        'last_status_upserts': last_status_upserts,
+        'devices_updated': devices_updated,
+        'prev_service_up': prev_service_up
+    }
 
 
 def record_apk_download(
@@ -339,7 +750,7 @@ def create_heartbeat_partition(target_date: date) -> None:
     """
     from models import SessionLocal
     
-    partition_name = f"device_heartbeats_{target_date.strftime('%Y%m%d')}"
+    partition_name = heartbeat_partition_name(target_date)
     start_ts = datetime.combine(target_date, datetime.min.time(), tzinfo=timezone.utc)
     end_ts = datetime.combine(target_date + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
     
@@ -369,6 +780,9 @@ def create_heartbeat_partition(target_date: date) -> None:
         """)
         
         db.execute(create_query, {"start_ts": start_ts, "end_ts": end_ts})
+        db.execute(text(f"CREATE INDEX idx_{partition_name}_device_ts ON {partition_name} (device_id, ts DESC)"))
+        # Dedup key for ON CONFLICT DO NOTHING
+        db.execute(text(f"CREATE UNIQUE INDEX idx_{partition_name}_bucket ON {partition_name} (device_id, bucket_ts)"))
         db.commit()
         
         logger.info(f"Created partition {partition_name} for range [{start_ts}, {end_ts})")
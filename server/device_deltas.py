@@ -0,0 +1,134 @@
+"""
+Coalesced per-device deltas for dashboard WebSocket clients.
+
+The heartbeat route records the few fields the device list shows live
+(status, battery_pct, unity_running, service_up, last_seen). Once per window
+(WS_DELTA_WINDOW_MS) everything recorded since the last flush goes out as one
+message:
+
+    {"type": "device_deltas", "devices": [{"id": ..., "last_seen": ..., "battery_pct": 41}, ...]}
+
+Each entry carries last_seen plus only the fields that changed since the
+previous delta for that device, so dashboards can patch rows in place instead
+of refetching /v1/devices. A device that heartbeats ten times in one window
+produces one entry. The heartbeat route still publishes the per-device
+device_update message for clients that do not handle device_deltas yet.
+"""
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from observability import structured_logger, metrics
+from ws_broadcast import broadcast_hub
+
+DELTA_FIELDS = ("status", "battery_pct", "unity_running", "service_up")
+
+
+def _iso(ts: Optional[datetime]) -> Optional[str]:
+    return ts.isoformat() if ts else None
+
+
+class DeviceDeltaCoalescer:
+    """
+    Collects device field updates and publishes them as one diff per window.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[Dict[str, Any]], None],
+        window_s: float = 1.0,
+        max_devices_per_message: int = 500
+    ):
+        self.publish = publish
+        self.window_s = window_s
+        self.max_devices_per_message = max_devices_per_message
+
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        # Field values last sent per device; diffs are taken against these
+        self._sent: Dict[str, Dict[str, Any]] = {}
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, device_id: str, last_seen: Optional[datetime] = None, **fields):
+        """
+        Record the latest values for a device; merged with anything already pending.
+
+        Args:
+            device_id: Device the values belong to
+            last_seen: Heartbeat timestamp
+            **fields: Any of DELTA_FIELDS
+        """
+        pending = self._pending.setdefault(device_id, {})
+        if last_seen is not None:
+            pending["last_seen"] = _iso(last_seen)
+        for name, value in fields.items():
+            if name in DELTA_FIELDS:
+                pending[name] = value
+
+    def forget(self, device_id: str):
+        self._pending.pop(device_id, None)
+        self._sent.pop(device_id, None)
+
+    def build_deltas(self) -> List[Dict[str, Any]]:
+        """Take everything pending and return the per-device diffs."""
+        pending, self._pending = self._pending, {}
+        deltas = []
+        for device_id, values in pending.items():
+            sent = self._sent.setdefault(device_id, {})
+            delta = {"id": device_id}
+            for name, value in values.items():
+                if name == "last_seen" or sent.get(name, object()) != value:
+                    delta[name] = value
+                    sent[name] = value
+            if len(delta) > 1:
+                deltas.append(delta)
+        return deltas
+
+    def flush(self) -> int:
+        """Publish pending deltas; returns the number of devices sent."""
+        deltas = self.build_deltas()
+        for i in range(0, len(deltas), self.max_devices_per_message):
+            self.publish({
+                "type": "device_deltas",
+                "devices": deltas[i:i + self.max_devices_per_message]
+            })
+        if deltas:
+            metrics.inc_counter("ws_device_deltas_total", value=len(deltas))
+        return len(deltas)
+
+    async def _run(self):
+        while self._running:
+            await asyncio.sleep(self.window_s)
+            try:
+                self.flush()
+            except Exception as e:
+                structured_logger.log_event(
+                    "device_deltas.error",
+                    level="ERROR",
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global instance
+device_deltas = DeviceDeltaCoalescer(
+    broadcast_hub.publish,
+    window_s=float(os.getenv("WS_DELTA_WINDOW_MS", "1000")) / 1000
+)
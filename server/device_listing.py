@@ -0,0 +1,199 @@
+"""
+Query building for the /v1/devices listing.
+
+- Keyset (cursor) pagination: each page continues from the (sort key, id) of
+  the previous page's last row, so deep pages cost the same as the first one.
+- Only the Device columns the listing returns are loaded (no clipboard,
+  token or alert-state columns).
+- Server-side filters on status (online/offline by last_seen), installed
+  version and alias prefix, and sorts on last_seen/alias/version. Each sort
+  has a matching (key, id) index, see migration add_device_list_indexes.
+- Total counts are approximate: pg_class.reltuples for large unfiltered
+  listings, otherwise count(*) cached for DEVICE_COUNT_CACHE_TTL_S.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.orm import Query, Session, load_only
+
+from models import Device
+
+DEVICE_COUNT_CACHE_TTL_S = float(os.getenv("DEVICE_COUNT_CACHE_TTL_S", "60"))
+# Below this many rows an exact count(*) is cheap enough
+EXACT_COUNT_MAX_ROWS = 10000
+
+# Columns the listing response reads
+LIST_COLUMNS = (
+    Device.id,
+    Device.alias,
+    Device.app_version,
+    Device.installed_apk_version_code,
+    Device.installed_apk_version_name,
+    Device.last_seen,
+    Device.created_at,
+    Device.last_status,
+    Device.last_ping_sent,
+    Device.last_ping_response,
+    Device.model,
+    Device.manufacturer,
+    Device.android_version,
+    Device.sdk_int,
+    Device.build_id,
+    Device.is_device_owner,
+    Device.monitored_package,
+    Device.monitored_app_name,
+    Device.auto_relaunch_enabled,
+)
+
+_VERSION_KEY = func.coalesce(Device.installed_apk_version_code, -1)
+
+# sort name -> (key expression, descending)
+SORTS = {
+    "last_seen": (Device.last_seen, True),
+    "alias": (Device.alias, False),
+    "version": (_VERSION_KEY, True),
+}
+STATUSES = ("online", "offline")
+
+
+class CursorError(ValueError):
+    """Malformed cursor or one issued for a different sort"""
+
+
+def encode_cursor(sort: str, device: Device) -> str:
+    if sort == "last_seen":
+        value = device.last_seen.isoformat() if device.last_seen else None
+    elif sort == "alias":
+        value = device.alias
+    else:
+        value = device.installed_apk_version_code if device.installed_apk_version_code is not None else -1
+    raw = json.dumps([sort, value, device.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str) -> Tuple[Any, str]:
+    """
+    Returns:
+        (sort key value, device id) of the last row on the previous page
+
+    Raises:
+        CursorError: If the cursor cannot be decoded or belongs to another sort
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, device_id = json.loads(base64.urlsafe_b64decode(padded))
+        if sort == "last_seen":
+            value = datetime.fromisoformat(value)
+        elif sort == "version":
+            value = int(value)
+        elif not isinstance(value, str):
+            raise ValueError("alias cursor value must be a string")
+    except (ValueError, TypeError) as e:
+        raise CursorError(f"Invalid cursor: {e}") from e
+    if cursor_sort != sort or not isinstance(device_id, str):
+        raise CursorError("Cursor does not match the requested sort")
+    return value, device_id
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def filtered_query(
+    db: Session,
+    status: Optional[str],
+    version_code: Optional[int],
+    alias_prefix: Optional[str],
+    offline_after_s: float
+) -> Query:
+    """Device query with the listing's filters applied and only LIST_COLUMNS loaded."""
+    query = db.query(Device).options(load_only(*LIST_COLUMNS))
+    if version_code is not None:
+        query = query.filter(Device.installed_apk_version_code == version_code)
+    if alias_prefix:
+        # Served by the lower(alias) text_pattern_ops index
+        query = query.filter(
+            func.lower(Device.alias).like(_escape_like(alias_prefix.lower()) + "%", escape="\\")
+        )
+    if status:
+        # last_seen is stored as naive UTC
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=offline_after_s)).replace(tzinfo=None)
+        if status == "online":
+            query = query.filter(Device.last_seen >= cutoff)
+        else:
+            query = query.filter(Device.last_seen < cutoff)
+    return query
+
+
+def page_query(query: Query, sort: str, cursor: Optional[Tuple[Any, str]], limit: int) -> Query:
+    """Order by (sort key, id) and continue after cursor; fetches limit + 1 rows to detect a next page."""
+    key, descending = SORTS[sort]
+    if cursor is not None:
+        position = tuple_(key, Device.id)
+        after = tuple_(*cursor)
+        query = query.filter(position < after if descending else position > after)
+    if descending:
+        query = query.order_by(key.desc(), Device.id.desc())
+    else:
+        query = query.order_by(key.asc(), Device.id.asc())
+    return query.limit(limit + 1)
+
+
+class _CountCache:
+    """Listing totals per filter combination, kept for a short TTL"""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[tuple, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        return None
+
+    def set(self, key: tuple, value: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+count_cache = _CountCache(DEVICE_COUNT_CACHE_TTL_S)
+
+
+def approximate_count(db: Session, query: Query, filters: tuple) -> int:
+    """
+    Total rows for a listing.
+
+    Args:
+        db: Database session
+        query: Filtered (unordered, unpaginated) listing query
+        filters: Hashable description of the filters, used as the cache key
+    """
+    cached = count_cache.get(filters)
+    if cached is not None:
+        return cached
+
+    total = None
+    if not any(f is not None for f in filters) and db.get_bind().dialect.name == "postgresql":
+        estimate = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'devices'::regclass")
+        ).scalar()
+        if estimate is not None and estimate >= EXACT_COUNT_MAX_ROWS:
+            total = int(estimate)
+    if total is None:
+        total = query.order_by(None).count()
+
+    count_cache.set(filters, total)
+    return total
@@ -0,0 +1,257 @@
+"""
+Background delivery of Discord webhook notifications.
+
+AlertManager commits alert state first and then hands embeds to
+discord_delivery.enqueue(); nothing on the evaluation path waits on Discord.
+Each webhook URL gets its own lane:
+
+- a token bucket (DISCORD_RATE_PER_SEC, burst DISCORD_RATE_BURST) sized to
+  Discord's per-webhook limits, shared by DISCORD_MAX_IN_FLIGHT senders
+- up to 10 embeds (and at most ~6000 embed characters) packed per message
+- a 429 pauses the lane for the `retry_after` Discord returns and the
+  message is re-sent; other failures are retried up to DISCORD_MAX_ATTEMPTS
+"""
+import asyncio
+import json
+import os
+import random
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from fcm_scheduler import TokenBucket, parse_retry_after
+from observability import structured_logger, metrics
+
+MAX_EMBEDS_PER_MESSAGE = 10
+# Discord rejects messages whose embeds total more than 6000 characters
+MAX_EMBED_CHARS_PER_MESSAGE = 5500
+
+metrics.register_histogram("discord_webhook_batch_size", buckets=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10])
+
+
+class _Lane:
+    """Pending notifications and rate limit for one webhook URL"""
+
+    def __init__(self, url: str, rate_per_sec: float, burst: int):
+        self.url = url
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.bucket = TokenBucket(rate_per_sec, burst)
+        self.wakeup = asyncio.Event()
+        self.workers: List[asyncio.Task] = []
+
+
+class DiscordDeliveryQueue:
+    """
+    Per-webhook queues drained by background senders.
+    """
+
+    def __init__(
+        self,
+        rate_per_sec: float = 0.5,
+        burst: int = 5,
+        max_in_flight: int = 2,
+        max_attempts: int = 5,
+        max_queue: int = 5000,
+        timeout: float = 5.0,
+        backoff_base_s: float = 1.0,
+        backoff_max_s: float = 30.0
+    ):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+        self._lanes: Dict[str, _Lane] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._running = False
+        self._stats = {"enqueued": 0, "sent": 0, "messages": 0, "rate_limited": 0, "dropped": 0}
+
+    def _lane(self, url: str) -> _Lane:
+        lane = self._lanes.get(url)
+        if lane is None:
+            lane = _Lane(url, self.rate_per_sec, self.burst)
+            self._lanes[url] = lane
+            if self._running:
+                self._start_workers(lane)
+        return lane
+
+    def _start_workers(self, lane: _Lane):
+        lane.workers = [asyncio.create_task(self._worker(lane)) for _ in range(self.max_in_flight)]
+
+    def enqueue(self, url: str, embed: Dict[str, Any], event: str, **log_fields) -> bool:
+        """
+        Queue one embed for delivery to a webhook.
+
+        Args:
+            url: Discord webhook URL
+            embed: Embed dict
+            event: structured_logger event name logged once delivered
+            **log_fields: Extra fields for that log event and its metrics
+
+        Returns:
+            False if the lane is full and the notification was dropped
+        """
+        lane = self._lane(url)
+        if len(lane.queue) >= self.max_queue:
+            self._stats["dropped"] += 1
+            metrics.inc_counter("discord_webhooks_failed_total", {"reason": "queue_full"})
+            structured_logger.log_event("discord.queue.full", level="WARN", event_name=event, **log_fields)
+            return False
+
+        lane.queue.append({"embed": embed, "event": event, "fields": log_fields, "attempts": 0})
+        lane.wakeup.set()
+        self._stats["enqueued"] += 1
+        metrics.set_gauge("discord_queue_depth", len(lane.queue))
+        return True
+
+    def _take_batch(self, lane: _Lane) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        chars = 0
+        while lane.queue and len(batch) < MAX_EMBEDS_PER_MESSAGE:
+            size = len(json.dumps(lane.queue[0]["embed"]))
+            if batch and chars + size > MAX_EMBED_CHARS_PER_MESSAGE:
+                break
+            batch.append(lane.queue.popleft())
+            chars += size
+        return batch
+
+    async def _worker(self, lane: _Lane):
+        while self._running or lane.queue:
+            if not lane.queue:
+                lane.wakeup.clear()
+                if not self._running:
+                    return
+                await lane.wakeup.wait()
+                continue
+
+            wait = lane.bucket.try_acquire()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            batch = self._take_batch(lane)
+            if batch:
+                await self._send(lane, batch)
+
+    async def _send(self, lane: _Lane, batch: List[Dict[str, Any]]):
+        """Post one message; requeue or drop its embeds depending on the outcome."""
+        payload = {"embeds": [item["embed"] for item in batch]}
+        start = asyncio.get_running_loop().time()
+        try:
+            response = await self._client.post(lane.url, json=payload)
+        except httpx.HTTPError as e:
+            await self._retry(lane, batch, reason="exception", error=str(e))
+            return
+
+        latency_ms = (asyncio.get_running_loop().time() - start) * 1000
+        if response.status_code in (200, 204):
+            self._stats["messages"] += 1
+            self._stats["sent"] += len(batch)
+            metrics.observe_histogram("discord_webhook_latency_ms", latency_ms)
+            metrics.observe_histogram("discord_webhook_batch_size", len(batch))
+            for item in batch:
+                structured_logger.log_event(item["event"], level="INFO", latency_ms=latency_ms, **item["fields"])
+                labels = {k: str(v) for k, v in item["fields"].items() if k in ("condition", "severity", "type")}
+                metrics.inc_counter("discord_webhooks_sent_total", labels)
+            return
+
+        if response.status_code == 429:
+            retry_after = None
+            try:
+                retry_after = float(response.json().get("retry_after"))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            retry_after = retry_after if retry_after is not None else self.backoff_base_s
+            lane.bucket.pause(retry_after)
+            self._stats["rate_limited"] += 1
+            metrics.inc_counter("discord_webhooks_rate_limited_total")
+            structured_logger.log_event(
+                "discord.webhook.rate_limited",
+                level="WARN",
+                retry_after_s=retry_after,
+                embeds=len(batch)
+            )
+            # Rate limits are not failures; resend first once the pause ends
+            lane.queue.extendleft(reversed(batch))
+            return
+
+        if response.status_code >= 500:
+            await self._retry(lane, batch, reason="http_error", http_code=response.status_code)
+            return
+
+        self._drop(batch, reason="http_error", http_code=response.status_code, response=response.text[:200])
+
+    async def _retry(self, lane: _Lane, batch: List[Dict[str, Any]], reason: str, **details):
+        retry = []
+        for item in batch:
+            item["attempts"] += 1
+            if item["attempts"] < self.max_attempts:
+                retry.append(item)
+        if len(retry) < len(batch):
+            self._drop([item for item in batch if item not in retry], reason=reason, **details)
+        if retry:
+            attempts = max(item["attempts"] for item in retry)
+            delay = min(self.backoff_max_s, self.backoff_base_s * (2 ** (attempts - 1)))
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            lane.queue.extendleft(reversed(retry))
+
+    def _drop(self, batch: List[Dict[str, Any]], reason: str, **details):
+        self._stats["dropped"] += len(batch)
+        metrics.inc_counter("discord_webhooks_failed_total", {"reason": reason}, value=len(batch))
+        for item in batch:
+            structured_logger.log_event(
+                "discord.webhook.failed",
+                level="ERROR",
+                event_name=item["event"],
+                attempts=item["attempts"],
+                **details,
+                **item["fields"]
+            )
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+        for lane in self._lanes.values():
+            self._start_workers(lane)
+
+    async def stop(self, drain_timeout_s: float = 5.0):
+        """Stop accepting work and give queued notifications a short window to go out."""
+        if not self._running:
+            return
+        self._running = False
+        workers = [task for lane in self._lanes.values() for task in lane.workers]
+        for lane in self._lanes.values():
+            lane.wakeup.set()
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=drain_timeout_s)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        for lane in self._lanes.values():
+            lane.workers = []
+        await self._client.aclose()
+        self._client = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "queued": sum(len(lane.queue) for lane in self._lanes.values()),
+            "webhooks": len(self._lanes)
+        }
+
+
+# Global instance
+discord_delivery = DiscordDeliveryQueue(
+    rate_per_sec=float(os.getenv("DISCORD_RATE_PER_SEC", "0.5")),
+    burst=int(os.getenv("DISCORD_RATE_BURST", "5")),
+    max_in_flight=int(os.getenv("DISCORD_MAX_IN_FLIGHT", "2")),
+    max_attempts=int(os.getenv("DISCORD_MAX_ATTEMPTS", "5")),
+    max_queue=int(os.getenv("DISCORD_QUEUE_MAX", "5000"))
+)
@@ -44,6 +44,13 @@ class DiscordSettingsCache:
         
         return enabled
     
+    def peek(self) -> Optional[bool]:
+        """Cached value if still fresh, else None (no database access)."""
+        if self._cache is None or self._cache_timestamp is None:
+            return None
+        age_seconds = (datetime.now(timezone.utc) - self._cache_timestamp).total_seconds()
+        return self._cache if age_seconds < self._cache_ttl_seconds else None
+    
     def invalidate(self):
         """Invalidate the cache (call after updates)."""
         self._cache = None
@@ -6,6 +6,7 @@ from alert_config import alert_config
 from observability import structured_logger, metrics
 from models import SessionLocal
 from discord_settings_cache import discord_settings_cache
+from discord_delivery import discord_delivery
 
 logger = logging.getLogger(__name__)
 
@@ -13,9 +14,13 @@ class DiscordWebhookClient:
     def __init__(self):
         self.webhook_url = alert_config.DISCORD_WEBHOOK_URL
         self.timeout = 5.0
+        self._warned_not_configured = False
     
     def _is_enabled(self) -> bool:
-        """Check if Discord alerts are enabled."""
+        """Check if Discord alerts are enabled (a session is only opened on cache miss)."""
+        cached = discord_settings_cache.peek()
+        if cached is not None:
+            return cached
         db = SessionLocal()
         try:
             return discord_settings_cache.is_enabled(db)
@@ -269,86 +274,7 @@ class DiscordWebhookClient:
             metrics.inc_counter("discord_webhooks_failed_total", {"reason": "exception"})
             return False
     
-    async def send_rollup_alert(
-        self,
-        condition: str,
-        severity: str,
-        total_devices: int,
-        device_list: list[Dict[str, str]]
-    ) -> bool:
-        if not self.webhook_url:
-            return False
-        
-        if not self._is_enabled():
-            structured_logger.log_event(
-                "discord.webhook.disabled",
-                level="INFO",
-                condition=condition,
-                type="rollup"
-            )
-            return False
-        
-        embed = self._build_rollup_embed(
-            condition=condition,
-            severity=severity,
-            total_devices=total_devices,
-            device_list=device_list
-        )
-        
-        payload = {
-            "embeds": [embed]
-        }
-        
-        try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(self.webhook_url, json=payload)
-                
-                if response.status_code in (200, 204):
-                    structured_logger.log_event(
-                        "discord.webhook.rollup_sent",
-                        level="INFO",
-                        condition=condition,
-                        total_devices=total_devices
-                    )
-                    metrics.inc_counter("discord_webhooks_sent_total", {"condition": condition, "type": "rollup"})
-                    return True
-                else:
-                    structured_logger.log_event(
-                        "discord.webhook.rollup_failed",
-                        level="ERROR",
-                        condition=condition,
-                        http_code=response.status_code
-                    )
-                    return False
-        
-        except Exception as e:
-            structured_logger.log_event(
-                "discord.webhook.rollup_error",
-                level="ERROR",
-                condition=condition,
-                error=str(e)
-            )
-            return False
-    
-    async def send_recovery(
-        self,
-        condition: str,
-        device_id: str,
-        alias: str
-    ) -> bool:
-        if not self.webhook_url:
-            return False
-        
-        if not self._is_enabled():
-            structured_logger.log_event(
-                "discord.webhook.disabled",
-                level="INFO",
-                device_id=device_id,
-                condition=condition,
-                type="recovery"
-            )
-            return False
-        
+    def _build_recovery_embed(self, condition: str, device_id: str, alias: str) -> Dict[str, Any]:
         embed = {
             "title": f"✅ Recovered: {condition.replace('_', ' ').title()}",
             "color": 0x00FF00,
@@ -367,25 +293,99 @@ class DiscordWebhookClient:
             "inline": False
         })
         
-        payload = {"embeds": [embed]}
+        return embed
+    
+    def _can_queue(self, **log_fields) -> bool:
+        if not self.webhook_url:
+            # A missing URL is a deployment setting, not a per-alert problem: warn once
+            if not self._warned_not_configured:
+                self._warned_not_configured = True
+                structured_logger.log_event(
+                    "discord.webhook.not_configured",
+                    level="WARN",
+                    **log_fields
+                )
+            return False
         
-        try:
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(self.webhook_url, json=payload)
-                
-                if response.status_code in (200, 204):
-                    structured_logger.log_event(
-                        "discord.webhook.recovery_sent",
-                        level="INFO",
-                        device_id=device_id,
-                        condition=condition
-                    )
-                    metrics.inc_counter("discord_webhooks_sent_total", {"condition": condition, "type": "recovery"})
-                    return True
-                else:
-                    return False
+        if not self._is_enabled():
+            structured_logger.log_event(
+                "discord.webhook.disabled",
+                level="INFO",
+                **log_fields
+            )
+            return False
+        
+        return True
+    
+    def queue_alert(self, condition: str, device_id: str, alias: str, severity: str, **fields) -> bool:
+        """
+        Queue an alert embed for background delivery (see discord_delivery).
+        
+        Args:
+            condition: Alert condition
+            device_id: Device ID
+            alias: Device alias
+            severity: CRIT / WARN / INFO
+            **fields: Optional _build_embed fields (last_seen, battery_pct, ...)
+            
+        Returns:
+            True if queued, False if Discord is not configured, disabled or the queue is full
+        """
+        if not self._can_queue(device_id=device_id, condition=condition):
+            return False
+        
+        embed = self._build_embed(
+            condition=condition,
+            device_id=device_id,
+            alias=alias,
+            severity=severity,
+            last_seen=fields.get("last_seen"),
+            battery_pct=fields.get("battery_pct"),
+            network_type=fields.get("network_type"),
+            unity_running=fields.get("unity_running"),
+            unity_version=fields.get("unity_version"),
+            details=fields.get("details"),
+            monitored_app_name=fields.get("monitored_app_name"),
+            monitored_package=fields.get("monitored_package"),
+            foreground_recent_s=fields.get("foreground_recent_s"),
+            threshold_min=fields.get("threshold_min")
+        )
+        return discord_delivery.enqueue(
+            self.webhook_url, embed, "discord.webhook.sent",
+            device_id=device_id, condition=condition, severity=severity
+        )
+    
+    def queue_rollup(
+        self,
+        condition: str,
+        severity: str,
+        total_devices: int,
+        device_list: list[Dict[str, str]]
+    ) -> bool:
+        """Queue a mass-alert embed for background delivery."""
+        if not self._can_queue(condition=condition, type="rollup"):
+            return False
         
-        except Exception:
+        embed = self._build_rollup_embed(
+            condition=condition,
+            severity=severity,
+            total_devices=total_devices,
+            device_list=device_list
+        )
+        return discord_delivery.enqueue(
+            self.webhook_url, embed, "discord.webhook.rollup_sent",
+            condition=condition, type="rollup", total_devices=total_devices
+        )
+    
+    def queue_recovery(self, condition: str, device_id: str, alias: str) -> bool:
+        """Queue a recovery embed for background delivery."""
+        if not self._can_queue(device_id=device_id, condition=condition, type="recovery"):
             return False
+        
+        embed = self._build_recovery_embed(condition, device_id, alias)
+        return discord_delivery.enqueue(
+            self.webhook_url, embed, "discord.webhook.recovery_sent",
+            device_id=device_id, condition=condition, type="recovery"
+        )
 
 discord_client = DiscordWebhookClient()
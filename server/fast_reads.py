@@ -15,11 +15,38 @@ def get_offline_devices_fast(db: Session, heartbeat_interval_seconds: int) -> Li
     """
     Get offline devices using device_last_status table.
     O(1) index scan vs. full table scan + window function.
+    When the offline detector is running its offline set is used instead,
+    and only aliases are read from the database.
 
     Returns list of: {device_id, alias, last_seen, offline_seconds}
     """
     start_time = time.time()
 
+    from offline_detector import offline_detector
+    if offline_detector.ready and offline_detector.threshold_s == heartbeat_interval_seconds * 3:
+        offline = offline_detector.offline_devices()
+        aliases = {}
+        if offline:
+            rows = db.execute(
+                text("SELECT id, alias FROM devices WHERE id = ANY(:ids)"),
+                {"ids": [device_id for device_id, _ in offline]}
+            )
+            aliases = {row.id: row.alias for row in rows}
+        now = datetime.now(timezone.utc)
+        devices = [
+            {
+                "device_id": device_id,
+                "alias": aliases[device_id],
+                "last_seen": last_seen,
+                "offline_seconds": int((now - last_seen).total_seconds())
+            }
+            for device_id, last_seen in offline
+            if device_id in aliases
+        ]
+        latency_ms = (time.time() - start_time) * 1000
+        metrics.observe_histogram("last_status_read_latency_ms", latency_ms, {"query": "offline_devices"})
+        return devices
+
     cutoff_ts = datetime.now(timezone.utc) - timedelta(seconds=heartbeat_interval_seconds * 3)
 
     query = text("""
@@ -0,0 +1,235 @@
+"""
+Shared FCM client: cached OAuth access token and a long-lived HTTP connection pool.
+
+fcm_v1.get_access_token() parses the service account and performs a blocking
+token refresh on every call, and each dispatch path used to open its own
+httpx.AsyncClient (new TLS handshake per command). FcmClient keeps:
+
+- the parsed service-account credentials (re-parsed only if the env changes)
+- one access token, refreshed in the background REFRESH_MARGIN_SECONDS before
+  expiry; refreshes run in a worker thread so the event loop never blocks
+- one httpx.AsyncClient (HTTP/2 when the `h2` package is installed) that every
+  FCM dispatch path shares via `async with fcm_client.session() as client`
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from datetime import timezone
+from typing import Optional
+
+import httpx
+
+from observability import structured_logger, metrics
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2 support)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class FcmClient:
+    """
+    Process-wide FCM token cache and HTTP client.
+    """
+
+    def __init__(
+        self,
+        refresh_margin_seconds: int = 300,
+        timeout_seconds: float = 10.0,
+        max_connections: int = 100
+    ):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.timeout_seconds = timeout_seconds
+        self.max_connections = max_connections
+
+        self._credentials = None
+        self._credentials_source: Optional[tuple] = None
+        self._project_id: Optional[str] = None
+        self._refresh_lock = threading.Lock()
+
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._running = False
+
+    # -- credentials -------------------------------------------------------
+
+    @staticmethod
+    def _current_source() -> tuple:
+        return (
+            os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON", ""),
+            os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH", "")
+        )
+
+    def _load_credentials(self):
+        """Parse the service account once; re-parse only if the configured secret changes."""
+        from fcm_v1 import _get_service_account_info, SCOPES
+        from google.oauth2 import service_account
+
+        source = self._current_source()
+        if self._credentials is not None and source == self._credentials_source:
+            return self._credentials
+
+        info = _get_service_account_info()
+        project_id = info.get("project_id")
+        if not project_id or project_id.strip() == "":
+            raise ValueError(
+                "Firebase service account data is missing 'project_id' field. "
+                "Please ensure you copied the complete service account JSON from Firebase Console."
+            )
+
+        self._credentials = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+        self._credentials_source = source
+        self._project_id = project_id
+        return self._credentials
+
+    def _token_seconds_left(self) -> float:
+        credentials = self._credentials
+        if credentials is None or not credentials.token or credentials.expiry is None:
+            return 0.0
+        # google-auth expiry is a naive UTC datetime
+        return credentials.expiry.replace(tzinfo=timezone.utc).timestamp() - time.time()
+
+    def _token_is_fresh(self) -> bool:
+        return self._token_seconds_left() > self.refresh_margin_seconds
+
+    def _refresh_token(self, force: bool = False) -> str:
+        """Refresh the token if it is within the refresh margin (blocking; call off the loop)."""
+        import google.auth.transport.requests
+
+        with self._refresh_lock:
+            credentials = self._load_credentials()
+            if not force and self._token_is_fresh():
+                return credentials.token
+
+            refresh_start = time.time()
+            credentials.refresh(google.auth.transport.requests.Request())
+            latency_ms = (time.time() - refresh_start) * 1000
+
+            metrics.inc_counter("fcm_token_refresh_total")
+            metrics.observe_histogram("fcm_token_refresh_latency_ms", latency_ms, {})
+            structured_logger.log_event(
+                "fcm.token.refreshed",
+                latency_ms=int(latency_ms),
+                expires_in_s=int(self._token_seconds_left())
+            )
+            return credentials.token
+
+    def _cached_token(self) -> Optional[str]:
+        """The current token if it is fresh and was issued for the configured secret."""
+        if self._credentials_source != self._current_source() or not self._token_is_fresh():
+            return None
+        return self._credentials.token
+
+    def get_access_token_sync(self) -> str:
+        """Cached access token for sync callers; refreshes inline only when stale."""
+        return self._cached_token() or self._refresh_token()
+
+    async def get_access_token(self) -> str:
+        """Cached access token; a needed refresh runs in a worker thread."""
+        token = self._cached_token()
+        if token:
+            metrics.inc_counter("fcm_token_cache_hits_total")
+            return token
+        return await asyncio.to_thread(self._refresh_token)
+
+    async def force_refresh(self) -> str:
+        """Refresh even if the cached token looks fresh (FCM answered 401)."""
+        return await asyncio.to_thread(self._refresh_token, True)
+
+    def get_project_id(self) -> str:
+        self._load_credentials()
+        return self._project_id
+
+    def get_fcm_url(self) -> str:
+        from fcm_v1 import build_fcm_v1_url
+        return build_fcm_v1_url(self.get_project_id())
+
+    # -- HTTP client -------------------------------------------------------
+
+    def get_http_client(self) -> httpx.AsyncClient:
+        """The shared AsyncClient for the running event loop (created lazily)."""
+        loop = asyncio.get_running_loop()
+        if self._http_client is None or self._http_client.is_closed or self._http_client_loop is not loop:
+            self._http_client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=self.timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+            self._http_client_loop = loop
+        return self._http_client
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        Drop-in for `async with httpx.AsyncClient() as client`: yields the shared
+        client and leaves it open for the next caller.
+        """
+        yield self.get_http_client()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def start(self):
+        """Prefetch the token and keep it refreshed in the background."""
+        if self._running:
+            return
+        self._running = True
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+        structured_logger.log_event(
+            "fcm.client.started",
+            http2=HTTP2_AVAILABLE,
+            refresh_margin_s=self.refresh_margin_seconds
+        )
+
+    async def stop(self):
+        self._running = False
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+
+    async def _refresh_loop(self):
+        while self._running:
+            try:
+                await asyncio.to_thread(self._refresh_token)
+                # Wake up when the token enters the refresh margin
+                delay = max(self._token_seconds_left() - self.refresh_margin_seconds, 30)
+            except Exception as e:
+                # Not configured yet, or Google unreachable: retry later; callers still refresh on demand
+                structured_logger.log_event(
+                    "fcm.token.refresh_failed",
+                    level="WARN",
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
+                metrics.inc_counter("fcm_token_refresh_failures_total")
+                delay = 60
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> dict:
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "token_cached": self._credentials is not None and bool(self._credentials.token),
+            "token_expires_in_s": int(self._token_seconds_left()),
+            "background_refresh": self._running
+        }
+
+
+# Global instance
+fcm_client = FcmClient(
+    refresh_margin_seconds=int(os.getenv("FCM_TOKEN_REFRESH_MARGIN_S", "300")),
+    timeout_seconds=float(os.getenv("FCM_HTTP_TIMEOUT_S", "10")),
+    max_connections=int(os.getenv("FCM_HTTP_MAX_CONNECTIONS", "100"))
+)
@@ -0,0 +1,440 @@
+"""
+Process-wide FCM dispatch scheduler.
+
+Every FCM send goes through fcm_scheduler.post() instead of a per-request
+asyncio.Semaphore, so concurrent admin actions share one budget:
+
+- a global token bucket (FCM_RATE_PER_SEC, burst FCM_RATE_BURST) and a cap on
+  in-flight requests (FCM_MAX_IN_FLIGHT)
+- two priority lanes: interactive sends (ping, ring, stream start, single
+  commands) are granted before bulk sends (deploys, batch remote exec), and
+  FCM_INTERACTIVE_RESERVE in-flight slots are kept free for them
+- retries on 429, 5xx and transport errors with exponential backoff and jitter;
+  Retry-After is honored, and a 429 pauses the whole bucket, not just the caller
+- a 401 triggers one forced access-token refresh and a resend
+
+Retries and end-to-end latency of sends tagged with a request_id are written
+back to fcm_dispatches in batches by a background flusher.
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from observability import structured_logger, metrics
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header (delta-seconds or HTTP-date).
+
+    Returns:
+        Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate` tokens per second up to `burst`.
+    Not thread-safe; only used from the event loop.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def try_acquire(self, now: Optional[float] = None) -> float:
+        """
+        Take one token if available.
+
+        Returns:
+            0.0 if a token was taken, otherwise seconds until one can be
+        """
+        now = time.monotonic() if now is None else now
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def pause(self, seconds: float, now: Optional[float] = None):
+        """Hand out no tokens for `seconds` (FCM asked everyone to back off)."""
+        now = time.monotonic() if now is None else now
+        self._paused_until = max(self._paused_until, now + seconds)
+        # No burst right after the pause ends
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    @property
+    def paused_for(self) -> float:
+        return max(self._paused_until - time.monotonic(), 0.0)
+
+
+class FcmDispatchScheduler:
+    """
+    Global admission control, retry policy and dispatch write-back for FCM sends.
+    """
+
+    def __init__(
+        self,
+        rate_per_sec: float = 50.0,
+        burst: int = 100,
+        max_in_flight: int = 20,
+        interactive_reserve: int = 4,
+        max_retries: int = 3,
+        interactive_max_retries: int = 1,
+        backoff_base_s: float = 0.5,
+        backoff_max_s: float = 30.0,
+        max_retry_after_s: float = 60.0,
+        writeback_interval_s: float = 1.0,
+        writeback_batch_size: int = 500,
+        writeback_max_attempts: int = 5
+    ):
+        self.max_in_flight = max_in_flight
+        self.interactive_reserve = min(interactive_reserve, max(max_in_flight - 1, 0))
+        self.max_retries = {LANE_INTERACTIVE: interactive_max_retries, LANE_BULK: max_retries}
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.max_retry_after_s = max_retry_after_s
+        self.writeback_interval_s = writeback_interval_s
+        self.writeback_batch_size = writeback_batch_size
+        self.writeback_max_attempts = writeback_max_attempts
+
+        self._bucket = TokenBucket(rate_per_sec, burst)
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._in_flight = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        # request_id -> {"request_id", "retries", "latency_ms", "attempts"}
+        self._writeback: Dict[str, Dict[str, Any]] = {}
+        self._flusher_task: Optional[asyncio.Task] = None
+        self._running = False
+        self._stats = {"sent": 0, "retried": 0, "rate_limited": 0, "failed": 0, "written_back": 0}
+
+    # -- admission ---------------------------------------------------------
+
+    def _grant_next(self):
+        """Hand free slots and tokens to waiters, interactive lane first."""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        while True:
+            for waiters in self._waiters.values():
+                while waiters and waiters[0].done():
+                    waiters.popleft()
+
+            if self._waiters[LANE_INTERACTIVE] and self._in_flight < self.max_in_flight:
+                lane = LANE_INTERACTIVE
+            elif self._waiters[LANE_BULK] and self._in_flight < self.max_in_flight - self.interactive_reserve:
+                lane = LANE_BULK
+            else:
+                return
+
+            wait = self._bucket.try_acquire()
+            if wait > 0:
+                self._wakeup = asyncio.get_running_loop().call_later(wait, self._grant_next)
+                return
+
+            self._in_flight += 1
+            self._waiters[lane].popleft().set_result(None)
+            metrics.set_gauge("fcm_scheduler_in_flight", self._in_flight)
+
+    async def _acquire(self, lane: str):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(future)
+        metrics.set_gauge("fcm_scheduler_queue_depth", len(self._waiters[lane]), {"lane": lane})
+        queued_at = time.monotonic()
+        self._grant_next()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancel landed: give the slot back
+                self._release()
+            raise
+        metrics.observe_histogram(
+            "fcm_scheduler_queue_wait_ms", (time.monotonic() - queued_at) * 1000, {"lane": lane}
+        )
+
+    def _release(self):
+        self._in_flight -= 1
+        metrics.set_gauge("fcm_scheduler_in_flight", self._in_flight)
+        self._grant_next()
+
+    # -- sending -----------------------------------------------------------
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    async def post(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        json: dict,
+        headers: dict,
+        lane: str = LANE_BULK,
+        request_id: Optional[str] = None,
+        timeout: float = 10.0
+    ) -> httpx.Response:
+        """
+        Send one FCM request under the global rate limit, retrying transient failures.
+
+        Args:
+            client: HTTP client (normally the shared fcm_client one)
+            url: FCM send URL
+            json: FCM message body
+            headers: Request headers including Authorization
+            lane: LANE_INTERACTIVE or LANE_BULK
+            request_id: FcmDispatch.request_id to write retries/latency back to
+            timeout: Per-attempt timeout in seconds
+
+        Returns:
+            The final response (2xx, non-retryable error, or last retryable error
+            once retries are exhausted)
+
+        Raises:
+            The last transport error if no attempt got a response
+        """
+        from fcm_client import fcm_client
+
+        start = time.monotonic()
+        retries = 0
+        token_refreshed = False
+
+        while True:
+            await self._acquire(lane)
+            error: Optional[Exception] = None
+            response: Optional[httpx.Response] = None
+            try:
+                response = await client.post(url, json=json, headers=headers, timeout=timeout)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                error = e
+            finally:
+                self._release()
+
+            status = response.status_code if response is not None else None
+
+            if status == 401 and not token_refreshed:
+                token_refreshed = True
+                headers = {**headers, "Authorization": f"Bearer {await fcm_client.force_refresh()}"}
+                continue
+
+            retryable = error is not None or status == 429 or status >= 500
+            if not retryable or retries >= self.max_retries[lane]:
+                break
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+            if retry_after is not None and retry_after > self.max_retry_after_s:
+                break
+            delay = retry_after if retry_after is not None else self._backoff(retries)
+
+            if status == 429:
+                self._stats["rate_limited"] += 1
+                metrics.inc_counter("fcm_rate_limited_total")
+                self._bucket.pause(delay)
+
+            retries += 1
+            self._stats["retried"] += 1
+            metrics.inc_counter("fcm_dispatch_retries_total", {"lane": lane})
+            structured_logger.log_event(
+                "fcm.dispatch.retry",
+                level="WARN",
+                request_id=request_id,
+                lane=lane,
+                attempt=retries,
+                fcm_http_code=status,
+                error=str(error) if error else None,
+                delay_ms=int(delay * 1000)
+            )
+            await asyncio.sleep(delay)
+
+        latency_ms = (time.monotonic() - start) * 1000
+        metrics.observe_histogram("fcm_scheduler_send_latency_ms", latency_ms, {"lane": lane})
+        if response is not None and response.status_code < 300:
+            self._stats["sent"] += 1
+        else:
+            self._stats["failed"] += 1
+            metrics.inc_counter("fcm_scheduler_failures_total", {"lane": lane})
+
+        if request_id:
+            self._writeback[request_id] = {
+                "request_id": request_id,
+                "retries": retries,
+                "latency_ms": int(latency_ms),
+                "attempts": 0
+            }
+            if len(self._writeback) >= self.writeback_batch_size and self._running:
+                asyncio.create_task(self.flush_writeback())
+
+        if response is None:
+            raise error
+        return response
+
+    # -- write-back --------------------------------------------------------
+
+    def _write(self, rows: List[Dict[str, Any]]) -> set:
+        """
+        Apply retries/latency for a batch of dispatches in one statement.
+
+        Returns:
+            request_ids that matched an fcm_dispatches row
+        """
+        from sqlalchemy import text
+        from db_utils import _build_values_clause
+        from models import SessionLocal
+
+        values_sql, column_list, params = _build_values_clause(
+            rows,
+            [("request_id", "VARCHAR"), ("retries", "INTEGER"), ("latency_ms", "INTEGER")],
+            "fw"
+        )
+        db = SessionLocal()
+        try:
+            result = db.execute(text(f"""
+                UPDATE fcm_dispatches AS d
+                SET retries = v.retries, latency_ms = v.latency_ms
+                FROM (VALUES {values_sql}) AS v({column_list})
+                WHERE d.request_id = v.request_id
+                RETURNING d.request_id
+            """), params)
+            matched = {row[0] for row in result}
+            db.commit()
+            return matched
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def flush_writeback(self):
+        """
+        Write buffered dispatch stats. Rows whose FcmDispatch record does not
+        exist yet (callers record the dispatch after the send returns) are kept
+        for up to writeback_max_attempts flushes.
+        """
+        if not self._writeback:
+            return
+        rows = list(self._writeback.values())[:self.writeback_batch_size]
+        for row in rows:
+            self._writeback.pop(row["request_id"], None)
+
+        try:
+            matched = await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            structured_logger.log_event(
+                "fcm.writeback.failed",
+                level="ERROR",
+                rows=len(rows),
+                error=str(e),
+                error_type=type(e).__name__
+            )
+            metrics.inc_counter("fcm_writeback_errors_total")
+            matched = set()
+
+        self._stats["written_back"] += len(matched)
+        metrics.inc_counter("fcm_writeback_rows_total", value=len(matched))
+        for row in rows:
+            row["attempts"] += 1
+            if row["request_id"] not in matched and row["attempts"] < self.writeback_max_attempts:
+                self._writeback.setdefault(row["request_id"], row)
+
+    async def _run_flusher(self):
+        while self._running:
+            await asyncio.sleep(self.writeback_interval_s)
+            try:
+                await self.flush_writeback()
+            except Exception as e:
+                structured_logger.log_event(
+                    "fcm.writeback.loop_error",
+                    level="ERROR",
+                    error=str(e)
+                )
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._flusher_task = asyncio.create_task(self._run_flusher())
+        structured_logger.log_event(
+            "fcm.scheduler.started",
+            rate_per_sec=self._bucket.rate,
+            burst=self._bucket.burst,
+            max_in_flight=self.max_in_flight,
+            interactive_reserve=self.interactive_reserve
+        )
+
+    async def stop(self):
+        self._running = False
+        if self._flusher_task:
+            self._flusher_task.cancel()
+            try:
+                await self._flusher_task
+            except asyncio.CancelledError:
+                pass
+            self._flusher_task = None
+        # Final write-back; rows for dispatches that were never recorded are dropped
+        while self._writeback:
+            pending = len(self._writeback)
+            await self.flush_writeback()
+            if len(self._writeback) >= pending:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "in_flight": self._in_flight,
+            "queued": {lane: sum(1 for f in waiters if not f.done()) for lane, waiters in self._waiters.items()},
+            "paused_for_s": round(self._bucket.paused_for, 3),
+            "writeback_pending": len(self._writeback)
+        }
+
+
+# Global instance
+fcm_scheduler = FcmDispatchScheduler(
+    rate_per_sec=float(os.getenv("FCM_RATE_PER_SEC", "50")),
+    burst=int(os.getenv("FCM_RATE_BURST", "100")),
+    max_in_flight=int(os.getenv("FCM_MAX_IN_FLIGHT", "20")),
+    interactive_reserve=int(os.getenv("FCM_INTERACTIVE_RESERVE", "4")),
+    max_retries=int(os.getenv("FCM_MAX_RETRIES", "3")),
+    interactive_max_retries=int(os.getenv("FCM_INTERACTIVE_MAX_RETRIES", "1")),
+    max_retry_after_s=float(os.getenv("FCM_MAX_RETRY_AFTER_S", "60")),
+    writeback_interval_s=float(os.getenv("FCM_WRITEBACK_INTERVAL_S", "1"))
+)
@@ -1,7 +1,5 @@
 import os
 import json
-from google.oauth2 import service_account
-import google.auth.transport.requests
 
 SCOPES = ['https://www.googleapis.com/auth/firebase.messaging']
 
@@ -44,17 +42,9 @@ def _get_service_account_info():
     )
 
 def get_access_token():
-    service_account_info = _get_service_account_info()
-    
-    credentials = service_account.Credentials.from_service_account_info(
-        service_account_info,
-        scopes=SCOPES
-    )
-    
-    request = google.auth.transport.requests.Request()
-    credentials.refresh(request)
-    
-    return credentials.token
+    """Cached access token (see fcm_client); only refreshes when close to expiry"""
+    from fcm_client import fcm_client
+    return fcm_client.get_access_token_sync()
 
 def get_firebase_project_id():
     service_account_info = _get_service_account_info()
@@ -0,0 +1,271 @@
+"""
+Async, batched heartbeat ingest pipeline.
+
+When HEARTBEAT_INGEST_MODE=async, /v1/heartbeat validates the payload, derives
+the status fields it needs for the response and enqueues a write record here
+instead of writing to the database inline. A single writer task drains the
+queue every HB_INGEST_FLUSH_MS milliseconds or HB_INGEST_BATCH_SIZE records
+(whichever comes first) and persists the batch via db_utils.write_heartbeat_batch
+in a worker thread, so the event loop never blocks on the database.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Any, List, Optional
+
+from models import SessionLocal
+from observability import structured_logger, metrics
+
+metrics.register_histogram("hb_ingest_batch_size", buckets=[1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000])
+
+
+class HeartbeatIngestQueue:
+    """
+    Bounded in-process queue with a single batching writer.
+
+    Backpressure: when the queue is full, enqueue() waits up to
+    enqueue_timeout_ms for space before rejecting the heartbeat so the
+    caller can answer 503 + Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval_ms: int = 250,
+        enqueue_timeout_ms: int = 1000,
+        drain_timeout_s: float = 15.0
+    ):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_ms / 1000
+        self.enqueue_timeout_s = enqueue_timeout_ms / 1000
+        self.drain_timeout_s = drain_timeout_s
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._running = False
+        self._writer_task: Optional[asyncio.Task] = None
+        self._stats = {"enqueued": 0, "rejected": 0, "flushed": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def start(self):
+        """Start the writer task."""
+        if self._running:
+            return
+
+        self._running = True
+        self._writer_task = asyncio.create_task(self._run_writer())
+        structured_logger.log_event(
+            "hb_ingest.started",
+            max_size=self.max_size,
+            batch_size=self.batch_size,
+            flush_interval_ms=int(self.flush_interval_s * 1000)
+        )
+
+    async def stop(self):
+        """Stop accepting heartbeats and drain everything already queued."""
+        if not self._running:
+            return
+
+        self._running = False
+        pending = self._queue.qsize()
+
+        if self._writer_task:
+            try:
+                await asyncio.wait_for(self._writer_task, timeout=self.drain_timeout_s)
+            except asyncio.TimeoutError:
+                self._writer_task.cancel()
+                structured_logger.log_event(
+                    "hb_ingest.drain_timeout",
+                    level="ERROR",
+                    remaining=self._queue.qsize()
+                )
+
+        structured_logger.log_event(
+            "hb_ingest.stopped",
+            drained=pending - self._queue.qsize(),
+            remaining=self._queue.qsize()
+        )
+
+    async def enqueue(self, record: Dict[str, Any]) -> bool:
+        """
+        Queue a heartbeat record for the writer.
+
+        Returns:
+            True if queued, False if rejected (pipeline stopped or queue still full
+            after waiting enqueue_timeout_ms)
+        """
+        if not self._running:
+            self._reject("not_running")
+            return False
+
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            metrics.inc_counter("hb_ingest_queue_full_total")
+            wait_start = time.time()
+            try:
+                await asyncio.wait_for(self._queue.put(record), timeout=self.enqueue_timeout_s)
+            except asyncio.TimeoutError:
+                self._reject("queue_full")
+                return False
+            metrics.observe_histogram("hb_ingest_enqueue_wait_ms", (time.time() - wait_start) * 1000, {})
+
+        self._stats["enqueued"] += 1
+        metrics.inc_counter("hb_ingest_enqueued_total")
+        metrics.set_gauge("hb_ingest_queue_depth", self._queue.qsize())
+        return True
+
+    def _reject(self, reason: str):
+        self._stats["rejected"] += 1
+        metrics.inc_counter("hb_ingest_rejected_total", {"reason": reason})
+
+    async def _collect_batch(self) -> List[Dict[str, Any]]:
+        """Wait for the first record, then gather more until batch_size or the flush interval."""
+        batch: List[Dict[str, Any]] = []
+
+        if not self._running:
+            # Draining: take whatever is left without waiting
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            return batch
+
+        try:
+            batch.append(await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval_s))
+        except asyncio.TimeoutError:
+            return batch
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval_s
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not self._running:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run_writer(self):
+        """Writer loop: collect a batch, persist it off the event loop, repeat."""
+        while self._running or not self._queue.empty():
+            try:
+                batch = await self._collect_batch()
+                metrics.set_gauge("hb_ingest_queue_depth", self._queue.qsize())
+                if batch:
+                    await asyncio.to_thread(self._flush_batch, batch)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                structured_logger.log_event(
+                    "hb_ingest.writer_error",
+                    level="ERROR",
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
+                await asyncio.sleep(1)
+
+    def _write(self, batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Write one batch in its own transaction."""
+        from db_utils import write_heartbeat_batch
+
+        db = SessionLocal()
+        try:
+            result = write_heartbeat_batch(db, batch)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _flush_batch(self, batch: List[Dict[str, Any]]):
+        """
+        Persist a batch (runs in a worker thread).
+        If the set-based write fails, retry record by record so one bad
+        heartbeat does not drop the rest of the batch.
+        """
+        from monitoring_helpers import log_service_transition
+
+        flush_start = time.time()
+        results = []
+        try:
+            results.append((batch, self._write(batch)))
+        except Exception as e:
+            self._stats["errors"] += 1
+            metrics.inc_counter("hb_ingest_flush_errors_total")
+            structured_logger.log_event(
+                "hb_ingest.batch_failed",
+                level="ERROR",
+                batch_size=len(batch),
+                error=str(e),
+                error_type=type(e).__name__
+            )
+            if len(batch) > 1:
+                for record in batch:
+                    try:
+                        results.append(([record], self._write([record])))
+                    except Exception as record_error:
+                        self._stats["dropped"] += 1
+                        metrics.inc_counter("hb_ingest_dropped_total")
+                        structured_logger.log_event(
+                            "hb_ingest.record_dropped",
+                            level="ERROR",
+                            device_id=record.get("device_id"),
+                            error=str(record_error)
+                        )
+            else:
+                self._stats["dropped"] += 1
+                metrics.inc_counter("hb_ingest_dropped_total")
+
+        flush_latency_ms = (time.time() - flush_start) * 1000
+        metrics.observe_histogram("hb_ingest_flush_latency_ms", flush_latency_ms, {})
+        metrics.observe_histogram("hb_ingest_batch_size", len(batch), {})
+
+        for records, result in results:
+            self._stats["flushed"] += len(records)
+            self._stats["batches"] += 1
+            metrics.inc_counter("hb_writes_total", value=result["created"])
+            metrics.inc_counter("hb_dedupe_total", value=result["deduped"])
+            metrics.inc_counter("last_status_upserts_total", value=result["last_status_upserts"])
+
+            # Replay service transitions in arrival order
+            service_state = dict(result["prev_service_up"])
+            for record in records:
+                service_up = record["service"]["service_up"]
+                log_service_transition(
+                    record["device_id"],
+                    record["alias"],
+                    record["monitoring"],
+                    service_state.get(record["device_id"]),
+                    service_up,
+                    record["service"]["monitored_foreground_recent_s"]
+                )
+                if service_up is not None:
+                    service_state[record["device_id"]] = service_up
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pipeline statistics."""
+        return {
+            **self._stats,
+            "running": self._running,
+            "queue_depth": self._queue.qsize(),
+            "max_size": self.max_size
+        }
+
+
+# Global instance
+heartbeat_ingest = HeartbeatIngestQueue(
+    max_size=int(os.getenv("HB_INGEST_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("HB_INGEST_BATCH_SIZE", "500")),
+    flush_interval_ms=int(os.getenv("HB_INGEST_FLUSH_MS", "250")),
+    enqueue_timeout_ms=int(os.getenv("HB_INGEST_ENQUEUE_TIMEOUT_MS", "1000"))
+)
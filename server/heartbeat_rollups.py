@@ -0,0 +1,447 @@
+"""
+Downsampled heartbeat history at 1-minute, 1-hour and 1-day resolution.
+
+Raw device_heartbeats are kept for DEFAULT_RETENTION_DAYS only, so anything
+longer-range (battery trend, Unity uptime, network churn) reads these rollup
+tables instead:
+
+    device_heartbeats -> device_heartbeat_rollups_1m -> _1h -> _1d
+
+A background job rolls up closed buckets incrementally. Each level keeps a
+watermark in heartbeat_rollup_state (everything before it is final), so every
+raw row is read once, by the 1m pass, and coarser levels are built from the
+level below. A bucket is closed once it ends ROLLUP_LAG_S in the past;
+heartbeats written later than that for an already rolled-up minute are not
+counted.
+
+Rows store sums and sample counts (not averages) so they merge exactly, and
+net_changes counts transport changes between consecutive heartbeats, using
+the previous bucket's last_network_type across bucket edges.
+
+/v1/devices/{id}/history reads the coarsest table that still gives the
+requested range a useful number of points (see pick_resolution).
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import (
+    SessionLocal, DeviceHeartbeat, HeartbeatRollup1m, HeartbeatRollup1h,
+    HeartbeatRollup1d, HeartbeatRollupState
+)
+from nightly_maintenance import DEFAULT_RETENTION_DAYS
+from observability import structured_logger, metrics
+
+ADVISORY_LOCK_ID = 246813579  # Unique ID for the heartbeat rollup advisory lock
+
+ROLLUP_INTERVAL_S = int(os.getenv("HB_ROLLUP_INTERVAL_S", "60"))
+# How long after a bucket ends before it is rolled up (ingest batching, clock skew)
+ROLLUP_LAG_S = int(os.getenv("HB_ROLLUP_LAG_S", "120"))
+# Upper bound on points returned by /history
+MAX_HISTORY_POINTS = int(os.getenv("HB_HISTORY_MAX_POINTS", "1500"))
+
+RESOLUTIONS = ("1m", "1h", "1d")
+STEPS = {
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+    "1d": timedelta(days=1),
+}
+ROLLUP_MODELS = {
+    "1m": HeartbeatRollup1m,
+    "1h": HeartbeatRollup1h,
+    "1d": HeartbeatRollup1d,
+}
+# How long each level is kept; None = forever
+RETENTION = {
+    "raw": timedelta(days=DEFAULT_RETENTION_DAYS),
+    "1m": timedelta(days=int(os.getenv("HB_ROLLUP_1M_RETENTION_DAYS", "14"))),
+    "1h": timedelta(days=int(os.getenv("HB_ROLLUP_1H_RETENTION_DAYS", "400"))),
+    "1d": None,
+}
+# Largest range rolled up per transaction
+CHUNKS = {
+    "1m": timedelta(hours=1),
+    "1h": timedelta(days=1),
+    "1d": timedelta(days=31),
+}
+
+_DATE_TRUNC_UNITS = {"1m": "minute", "1h": "hour", "1d": "day"}
+
+_ROLLUP_COLUMNS = (
+    "device_id, bucket_ts, samples, battery_min, battery_max, battery_sum, battery_samples, "
+    "unity_running_samples, unity_known_samples, net_wifi, net_cell, net_none, net_changes, "
+    "last_network_type"
+)
+
+_UPSERT = """
+    ON CONFLICT (device_id, bucket_ts) DO UPDATE SET
+        samples = EXCLUDED.samples,
+        battery_min = EXCLUDED.battery_min,
+        battery_max = EXCLUDED.battery_max,
+        battery_sum = EXCLUDED.battery_sum,
+        battery_samples = EXCLUDED.battery_samples,
+        unity_running_samples = EXCLUDED.unity_running_samples,
+        unity_known_samples = EXCLUDED.unity_known_samples,
+        net_wifi = EXCLUDED.net_wifi,
+        net_cell = EXCLUDED.net_cell,
+        net_none = EXCLUDED.net_none,
+        net_changes = EXCLUDED.net_changes,
+        last_network_type = EXCLUDED.last_network_type
+"""
+
+# Raw heartbeats -> 1m. The first heartbeat of each device in the window is
+# compared with the last transport of its previous 1m bucket.
+_ROLLUP_RAW_SQL = f"""
+    WITH w AS (
+        SELECT device_id, ts, battery_pct, unity_running, network_type,
+               lag(network_type) OVER (PARTITION BY device_id ORDER BY ts) AS prev_network,
+               row_number() OVER (PARTITION BY device_id ORDER BY ts) AS rn
+        FROM device_heartbeats
+        WHERE ts >= :start AND ts < :end
+    ),
+    prior AS (
+        SELECT d.device_id, p.last_network_type
+        FROM (SELECT DISTINCT device_id FROM w) d
+        CROSS JOIN LATERAL (
+            SELECT r.last_network_type FROM device_heartbeat_rollups_1m r
+            WHERE r.device_id = d.device_id AND r.bucket_ts < :start
+            ORDER BY r.bucket_ts DESC
+            LIMIT 1
+        ) p
+    ),
+    h AS (
+        SELECT w.*, CASE WHEN w.rn = 1 THEN prior.last_network_type ELSE w.prev_network END AS before_network
+        FROM w LEFT JOIN prior ON prior.device_id = w.device_id
+    )
+    INSERT INTO device_heartbeat_rollups_1m ({_ROLLUP_COLUMNS})
+    SELECT device_id,
+           date_trunc('minute', ts),
+           count(*),
+           min(battery_pct),
+           max(battery_pct),
+           sum(battery_pct),
+           count(battery_pct),
+           count(*) FILTER (WHERE unity_running),
+           count(unity_running),
+           count(*) FILTER (WHERE network_type = 'wifi'),
+           count(*) FILTER (WHERE network_type = 'cell'),
+           count(*) FILTER (WHERE network_type = 'none'),
+           count(*) FILTER (WHERE network_type <> before_network),
+           (array_agg(network_type ORDER BY ts DESC))[1]
+    FROM h
+    GROUP BY device_id, date_trunc('minute', ts)
+    {_UPSERT}
+"""
+
+# Finer rollup -> coarser rollup; net_changes already covers bucket edges
+_ROLLUP_MERGE_SQL = """
+    INSERT INTO {target} ({columns})
+    SELECT device_id,
+           date_trunc('{unit}', bucket_ts),
+           sum(samples),
+           min(battery_min),
+           max(battery_max),
+           sum(battery_sum),
+           sum(battery_samples),
+           sum(unity_running_samples),
+           sum(unity_known_samples),
+           sum(net_wifi),
+           sum(net_cell),
+           sum(net_none),
+           sum(net_changes),
+           (array_agg(last_network_type ORDER BY bucket_ts DESC))[1]
+    FROM {source}
+    WHERE bucket_ts >= :start AND bucket_ts < :end
+    GROUP BY device_id, date_trunc('{unit}', bucket_ts)
+    {upsert}
+"""
+
+
+class HistoryError(ValueError):
+    """Unknown resolution, or a range that is empty or too long for the resolution"""
+
+
+def floor_to(ts: datetime, resolution: str) -> datetime:
+    """Start of the resolution bucket containing ts (naive UTC)."""
+    if resolution == "1d":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == "1h":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+
+def _naive_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def _source(resolution: str) -> Optional[str]:
+    index = RESOLUTIONS.index(resolution)
+    return RESOLUTIONS[index - 1] if index else None
+
+
+def _get_watermark(db: Session, resolution: str) -> Optional[datetime]:
+    state = db.get(HeartbeatRollupState, resolution)
+    return state.rolled_through if state else None
+
+
+def _set_watermark(db: Session, resolution: str, rolled_through: datetime):
+    state = db.get(HeartbeatRollupState, resolution)
+    if state is None:
+        state = HeartbeatRollupState(resolution=resolution, rolled_through=rolled_through)
+        db.add(state)
+    state.rolled_through = rolled_through
+    state.updated_at = datetime.now(timezone.utc)
+
+
+def rollup_windows(start: datetime, upper: datetime, chunk: timedelta) -> List[Tuple[datetime, datetime]]:
+    """Split [start, upper) into consecutive windows of at most chunk."""
+    windows = []
+    while start < upper:
+        end = min(start + chunk, upper)
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+def roll_up(db: Session, resolution: str, now: Optional[datetime] = None) -> int:
+    """
+    Roll up every closed bucket of one resolution since its watermark.
+
+    Args:
+        db: Database session
+        resolution: "1m", "1h" or "1d"
+        now: Current time (naive UTC); defaults to the wall clock
+
+    Returns:
+        Number of rollup rows written
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    source = _source(resolution)
+
+    closed = now - timedelta(seconds=ROLLUP_LAG_S)
+    if source:
+        # A coarse bucket is closed once the level below has rolled past it
+        source_watermark = _get_watermark(db, source)
+        if source_watermark is None:
+            return 0
+        closed = min(closed, source_watermark)
+    upper = floor_to(closed, resolution)
+
+    start = _get_watermark(db, resolution)
+    if start is None:
+        # First run: start from the oldest data the source still holds
+        start = floor_to(now - RETENTION["raw" if source is None else source], resolution)
+
+    written = 0
+    for window_start, window_end in rollup_windows(start, upper, CHUNKS[resolution]):
+        if source is None:
+            sql = _ROLLUP_RAW_SQL
+        else:
+            sql = _ROLLUP_MERGE_SQL.format(
+                target=ROLLUP_MODELS[resolution].__tablename__,
+                source=ROLLUP_MODELS[source].__tablename__,
+                columns=_ROLLUP_COLUMNS,
+                unit=_DATE_TRUNC_UNITS[resolution],
+                upsert=_UPSERT
+            )
+        result = db.execute(text(sql), {"start": window_start, "end": window_end})
+        _set_watermark(db, resolution, window_end)
+        db.commit()
+        written += result.rowcount or 0
+
+    if written:
+        metrics.inc_counter("heartbeat_rollup_rows_total", {"resolution": resolution}, value=written)
+    return written
+
+
+def prune_rollups(db: Session, now: Optional[datetime] = None) -> int:
+    """Delete rollup rows older than their level's retention; returns rows deleted."""
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    deleted = 0
+    for resolution in RESOLUTIONS:
+        retention = RETENTION[resolution]
+        if retention is None:
+            continue
+        table = ROLLUP_MODELS[resolution].__tablename__
+        result = db.execute(
+            text(f"DELETE FROM {table} WHERE bucket_ts < :cutoff"),
+            {"cutoff": now - retention}
+        )
+        deleted += result.rowcount or 0
+    db.commit()
+    return deleted
+
+
+def run_heartbeat_rollups() -> Dict[str, Any]:
+    """
+    Roll up all levels and prune expired rows, under an advisory lock so only
+    one worker process does it.
+    """
+    db = SessionLocal()
+    lock_acquired = False
+    start_time = time.time()
+
+    try:
+        lock_acquired = db.execute(
+            text("SELECT pg_try_advisory_lock(:lock_id)"), {"lock_id": ADVISORY_LOCK_ID}
+        ).scalar()
+        if not lock_acquired:
+            return {"status": "skipped", "reason": "lock_held"}
+
+        written = {resolution: roll_up(db, resolution) for resolution in RESOLUTIONS}
+        pruned = prune_rollups(db)
+
+        elapsed_ms = (time.time() - start_time) * 1000
+        metrics.observe_histogram("heartbeat_rollup_duration_ms", elapsed_ms, {})
+        if any(written.values()) or pruned:
+            structured_logger.log_event(
+                "heartbeat_rollup.completed",
+                written=written,
+                pruned=pruned,
+                elapsed_ms=round(elapsed_ms, 2)
+            )
+        return {"status": "completed", "written": written, "pruned": pruned}
+
+    except Exception as e:
+        db.rollback()
+        structured_logger.log_event(
+            "heartbeat_rollup.failed",
+            level="ERROR",
+            error=str(e),
+            error_type=type(e).__name__
+        )
+        raise
+
+    finally:
+        if lock_acquired:
+            db.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": ADVISORY_LOCK_ID})
+        db.close()
+
+
+def pick_resolution(start: datetime, end: datetime, requested: str = "auto", now: Optional[datetime] = None) -> str:
+    """
+    Choose the table to answer a history query from.
+
+    "auto" picks the finest rollup whose retention still covers start and
+    whose point count for the range stays within MAX_HISTORY_POINTS. "raw"
+    or a rollup resolution can be requested explicitly.
+
+    Raises:
+        HistoryError: If the resolution is unknown, the range is empty, or the
+            requested resolution would return more than MAX_HISTORY_POINTS points
+    """
+    if end <= start:
+        raise HistoryError("'to' must be after 'from'")
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    span = end - start
+
+    if requested == "auto":
+        for resolution in RESOLUTIONS:
+            retention = RETENTION[resolution]
+            if retention is not None and start < now - retention:
+                continue
+            if span / STEPS[resolution] <= MAX_HISTORY_POINTS:
+                return resolution
+        return RESOLUTIONS[-1]
+
+    if requested == "raw":
+        return requested
+    if requested not in STEPS:
+        raise HistoryError(f"resolution must be one of auto, raw, {', '.join(RESOLUTIONS)}")
+    if span / STEPS[requested] > MAX_HISTORY_POINTS:
+        raise HistoryError(
+            f"Range too long for resolution {requested} (max {MAX_HISTORY_POINTS} points); use a coarser one"
+        )
+    return requested
+
+
+def _rollup_point(row) -> Dict[str, Any]:
+    other = row.samples - row.net_wifi - row.net_cell - row.net_none
+    return {
+        "ts": row.bucket_ts.isoformat() + "Z",
+        "samples": row.samples,
+        "battery_min": row.battery_min,
+        "battery_max": row.battery_max,
+        "battery_avg": round(row.battery_sum / row.battery_samples, 1) if row.battery_samples else None,
+        "unity_running_pct": (
+            round(100.0 * row.unity_running_samples / row.unity_known_samples, 1)
+            if row.unity_known_samples else None
+        ),
+        "network": {"wifi": row.net_wifi, "cell": row.net_cell, "none": row.net_none, "other": other},
+        "network_changes": row.net_changes
+    }
+
+
+def _raw_point(row) -> Dict[str, Any]:
+    return {
+        "ts": row.ts.isoformat() + "Z",
+        "battery_pct": row.battery_pct,
+        "unity_running": row.unity_running,
+        "network_type": row.network_type
+    }
+
+
+def load_history(
+    db: Session,
+    device_id: str,
+    start: datetime,
+    end: datetime,
+    resolution: str = "auto"
+) -> Dict[str, Any]:
+    """
+    Heartbeat history for one device over [start, end).
+
+    Args:
+        db: Database session
+        device_id: Device identifier
+        start: Range start (aware or naive UTC)
+        end: Range end (aware or naive UTC)
+        resolution: "auto", "raw", "1m", "1h" or "1d"
+
+    Returns:
+        dict with the resolution used and its points, oldest first
+
+    Raises:
+        HistoryError: See pick_resolution
+    """
+    start, end = _naive_utc(start), _naive_utc(end)
+    resolution = pick_resolution(start, end, resolution)
+
+    query_start = time.time()
+    if resolution == "raw":
+        rows = db.query(
+            DeviceHeartbeat.ts,
+            DeviceHeartbeat.battery_pct,
+            DeviceHeartbeat.unity_running,
+            DeviceHeartbeat.network_type
+        ).filter(
+            DeviceHeartbeat.device_id == device_id,
+            DeviceHeartbeat.ts >= start,
+            DeviceHeartbeat.ts < end
+        ).order_by(DeviceHeartbeat.ts).limit(MAX_HISTORY_POINTS).all()
+        points = [_raw_point(row) for row in rows]
+    else:
+        model = ROLLUP_MODELS[resolution]
+        rows = db.query(model).filter(
+            model.device_id == device_id,
+            model.bucket_ts >= floor_to(start, resolution),
+            model.bucket_ts < end
+        ).order_by(model.bucket_ts).limit(MAX_HISTORY_POINTS).all()
+        points = [_rollup_point(row) for row in rows]
+
+    metrics.observe_histogram(
+        "device_history_query_ms", (time.time() - query_start) * 1000, {"resolution": resolution}
+    )
+    return {
+        "device_id": device_id,
+        "resolution": resolution,
+        "from": start.isoformat() + "Z",
+        "to": end.isoformat() + "Z",
+        "points": points
+    }
@@ -22,7 +22,7 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from sqlalchemy import func, text
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Set, List
+from typing import Optional, List
 from collections import defaultdict
 import json
 import asyncio
@@ -31,7 +31,7 @@ import time
 import hashlib
 import httpx
 
-from models import Device, User, Session as SessionModel, DeviceEvent, ApkVersion, ApkInstallation, BatteryWhitelist, PasswordResetToken, DeviceLastStatus, DeviceSelection, ApkDownloadEvent, MonitoringDefaults, AutoRelaunchDefaults, DiscordSettings, BloatwarePackage, WiFiSettings, DeviceCommand, DeviceMetric, BulkCommand, CommandResult, RemoteExec, RemoteExecResult, ApkDeploymentRun, ApkDeploymentBatch, get_db, init_db, SessionLocal
+from models import Device, User, Session as SessionModel, DeviceEvent, ApkVersion, ApkInstallation, BatteryWhitelist, PasswordResetToken, DeviceLastStatus, DeviceSelection, ApkDownloadEvent, MonitoringDefaults, AutoRelaunchDefaults, DiscordSettings, BloatwarePackage, WiFiSettings, DeviceCommand, DeviceMetric, BulkCommand, CommandResult, RemoteExec, RemoteExecResult, ApkDeploymentRun, ApkDeploymentBatch, get_db, init_db, SessionLocal, ASYNC_DB_ROUTES, uses_jsonb_status, DEVICE_STATUS_COLUMNS, get_route_db, run_in_session, run_in_session_threaded, commit_session
 from schemas import (
     HeartbeatPayload, HeartbeatResponse, DeviceSummary, RegisterResponse,
     UserRegisterRequest, UserLoginRequest, UpdateDeviceAliasRequest, DeployApkRequest,
@@ -41,11 +41,18 @@ from schemas import (
 from auth import (
     verify_device_token, hash_token, verify_token, generate_device_token, verify_admin_key,
     hash_password, verify_password, create_session, get_current_user, get_current_user_optional,
-    compute_token_id, verify_admin_key_header, security
+    compute_token_id, verify_admin_key_header, security, device_token_cache, verify_device_token_async
 )
 from alerts import alert_scheduler, alert_manager
 from background_tasks import background_tasks
-from fcm_v1 import get_access_token, get_firebase_project_id, build_fcm_v1_url
+from fcm_v1 import build_fcm_v1_url
+from fcm_client import fcm_client
+from fcm_scheduler import fcm_scheduler, LANE_INTERACTIVE, LANE_BULK
+from offline_detector import offline_detector
+from discord_delivery import discord_delivery
+from ws_broadcast import broadcast_hub
+from device_deltas import device_deltas
+from stream_relay import streaming_manager
 from apk_manager import save_apk_file, get_apk_download_url
 from object_storage import get_storage_service, ObjectNotFoundError
 from email_service import email_service
@@ -53,19 +60,28 @@ from observability import structured_logger, metrics, request_id_var
 from hmac_utils import compute_hmac_signature, compute_hmac_signature_with_payload
 import uuid
 import fast_reads
+import device_listing
+import heartbeat_rollups
+import columnar_archive
 import bulk_delete
 from purge_jobs import purge_manager
 from rate_limiter import rate_limiter
 from monitoring_defaults_cache import monitoring_defaults_cache
 from discord_settings_cache import discord_settings_cache
-from apk_download_service import download_apk_optimized, get_cache_statistics
+from apk_download_service import download_apk_optimized, get_cache_statistics, prewarm_apk, prewarm_current_builds
+from apk_upload import chunked_upload_store, UploadError
 from config import config
 from response_cache import response_cache, make_cache_key
 from alert_config import alert_config
 from ota_utils import is_device_eligible_for_rollout
+from heartbeat_ingest import heartbeat_ingest
+from metrics_multiproc import metrics_aggregator
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # Feature flags for gradual rollout
 READ_FROM_LAST_STATUS = os.getenv("READ_FROM_LAST_STATUS", "false").lower() == "true"
+# "async": queue heartbeat writes for the batching writer in heartbeat_ingest.py
+HEARTBEAT_INGEST_ASYNC = os.getenv("HEARTBEAT_INGEST_MODE", "sync").lower() == "async"
 
 # Helper function to ensure datetime is timezone-aware (assume UTC for naive datetimes)
 def ensure_utc(dt: Optional[datetime]) -> datetime:
@@ -106,6 +122,18 @@ def get_device_by_token(token: str, db: Session) -> Optional[Device]:
 
     return None
 
+# Hot routes take their session from get_route_db: an AsyncSession when
+# ASYNC_DB_ROUTES=true (see models.py), otherwise the regular sync Session.
+verify_route_device = verify_device_token_async if ASYNC_DB_ROUTES else verify_device_token
+
+def session_compute(db, fn, *args):
+    """Cache producer running fn(session, *args) on whichever session type the route has"""
+    if isinstance(db, AsyncSession):
+        async def compute():
+            return await db.run_sync(fn, *args)
+        return compute
+    return lambda: fn(db, *args)
+
 app = FastAPI(title="NexMDM API")
 
 # Registration queue to prevent connection pool saturation
@@ -316,34 +344,20 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": "Internal server error - backend is still running"}
     )
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Set[WebSocket] = set()
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.add(websocket)
-        print(f"[WS] Client connected. Total: {len(self.active_connections)}")
-
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.discard(websocket)
-        print(f"[WS] Client disconnected. Total: {len(self.active_connections)}")
-
-    async def broadcast(self, message: dict):
-        if not self.active_connections:
-            return
-
-        disconnected = set()
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                disconnected.add(connection)
-
-        for conn in disconnected:
-            self.disconnect(conn)
-
-manager = ConnectionManager()
+# Dashboard /ws clients; see ws_broadcast.py
+manager = broadcast_hub
+
+def _on_device_status_transition(device_id: str, status: str, last_seen: Optional[datetime]):
+    """Push offline_detector transitions to dashboard clients as they happen"""
+    response_cache.invalidate_debounced("/v1/metrics")
+    response_cache.invalidate_debounced("/v1/devices")
+    manager.publish({
+        "type": "device_status",
+        "device_id": device_id,
+        "status": status,
+        "last_seen": last_seen.isoformat() if last_seen else None
+    }, coalesce_key=("device_status", device_id))
+    device_deltas.record(device_id, last_seen, status=status)
 
 async def send_fcm_launch_app(fcm_token: str, package_name: str, device_id: str = "unknown") -> bool:
     """
@@ -353,8 +367,8 @@ async def send_fcm_launch_app(fcm_token: str, package_name: str, device_id: str
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         print(f"[FCM-LAUNCH] Failed to get access token: {e}")
         return False
@@ -387,8 +401,8 @@ async def send_fcm_launch_app(fcm_token: str, package_name: str, device_id: str
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+        async with fcm_client.session() as client:
+            response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_BULK)
             return response.status_code == 200
     except Exception as e:
         print(f"[FCM-LAUNCH] HTTP error: {e}")
@@ -398,7 +412,6 @@ async def dispatch_launch_app_to_device(
     device,
     package_name: str,
     correlation_id: str,
-    semaphore: asyncio.Semaphore,
     client: httpx.AsyncClient,
     fcm_url: str,
     access_token: str,
@@ -408,83 +421,81 @@ async def dispatch_launch_app_to_device(
     Dispatch a launch_app FCM command to a device with tracking support.
     Uses 'action: remote_exec_fcm' format for consistent ACK tracking via /v1/remote-exec/ack endpoint.
     """
-    async with semaphore:
-        try:
-            if not device.fcm_token:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "error",
-                    "error": "No FCM token"
-                }
-                return db_results[device.id]
-            
-            timestamp = datetime.now(timezone.utc).isoformat()
-            # Include critical payload fields in HMAC to prevent tampering
-            payload_fields = {
-                "type": "launch_app",
-                "package_name": package_name
+    try:
+        if not device.fcm_token:
+            db_results[device.id] = {
+                "correlation_id": correlation_id,
+                "alias": device.alias,
+                "status": "error",
+                "error": "No FCM token"
             }
-            hmac_signature = compute_hmac_signature_with_payload(
-                correlation_id, device.id, "remote_exec_fcm", timestamp, payload_fields
-            )
-            
-            message = {
-                "message": {
-                    "token": device.fcm_token,
-                    "data": {
-                        "action": "remote_exec_fcm",
-                        "exec_id": "",
-                        "correlation_id": correlation_id,
-                        "device_id": device.id,
-                        "type": "launch_app",
-                        "package_name": package_name,
-                        "ts": timestamp,
-                        "hmac": hmac_signature
-                    },
-                    "android": {
-                        "priority": "high"
-                    }
+            return db_results[device.id]
+        
+        timestamp = datetime.now(timezone.utc).isoformat()
+        # Include critical payload fields in HMAC to prevent tampering
+        payload_fields = {
+            "type": "launch_app",
+            "package_name": package_name
+        }
+        hmac_signature = compute_hmac_signature_with_payload(
+            correlation_id, device.id, "remote_exec_fcm", timestamp, payload_fields
+        )
+        
+        message = {
+            "message": {
+                "token": device.fcm_token,
+                "data": {
+                    "action": "remote_exec_fcm",
+                    "exec_id": "",
+                    "correlation_id": correlation_id,
+                    "device_id": device.id,
+                    "type": "launch_app",
+                    "package_name": package_name,
+                    "ts": timestamp,
+                    "hmac": hmac_signature
+                },
+                "android": {
+                    "priority": "high"
                 }
             }
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
+        }
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_BULK)
+        
+        if response.status_code == 200:
+            db_results[device.id] = {
+                "correlation_id": correlation_id,
+                "alias": device.alias,
+                "status": "sent"
             }
-            
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
-            
-            if response.status_code == 200:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "sent"
-                }
-            else:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "error",
-                    "error": f"FCM error: {response.status_code}"
-                }
-            
-            return db_results[device.id]
-            
-        except Exception as e:
+        else:
             db_results[device.id] = {
                 "correlation_id": correlation_id,
                 "alias": device.alias,
                 "status": "error",
-                "error": str(e)
+                "error": f"FCM error: {response.status_code}"
             }
-            return db_results[device.id]
+        
+        return db_results[device.id]
+        
+    except Exception as e:
+        db_results[device.id] = {
+            "correlation_id": correlation_id,
+            "alias": device.alias,
+            "status": "error",
+            "error": str(e)
+        }
+        return db_results[device.id]
 
 async def dispatch_force_stop_to_device(
     device,
     package_name: str,
     correlation_id: str,
-    semaphore: asyncio.Semaphore,
     client: httpx.AsyncClient,
     fcm_url: str,
     access_token: str,
@@ -494,143 +505,75 @@ async def dispatch_force_stop_to_device(
     Dispatch a force-stop FCM command to a device with tracking support.
     Uses the correct 'action: remote_exec_shell' format with 'command' field that the agent recognizes.
     """
-    async with semaphore:
-        try:
-            if not device.fcm_token:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "error",
-                    "error": "No FCM token"
-                }
-                return db_results[device.id]
-            
-            force_stop_command = f"am force-stop {package_name}"
-            timestamp = datetime.now(timezone.utc).isoformat()
-            # Include critical payload field (command) in HMAC to prevent tampering
-            payload_fields = {
-                "command": force_stop_command
+    try:
+        if not device.fcm_token:
+            db_results[device.id] = {
+                "correlation_id": correlation_id,
+                "alias": device.alias,
+                "status": "error",
+                "error": "No FCM token"
             }
-            hmac_signature = compute_hmac_signature_with_payload(
-                correlation_id, device.id, "remote_exec_shell", timestamp, payload_fields
-            )
-            
-            message = {
-                "message": {
-                    "token": device.fcm_token,
-                    "data": {
-                        "action": "remote_exec_shell",
-                        "exec_id": "",
-                        "correlation_id": correlation_id,
-                        "device_id": device.id,
-                        "command": force_stop_command,
-                        "ts": timestamp,
-                        "hmac": hmac_signature
-                    },
-                    "android": {
-                        "priority": "high"
-                    }
+            return db_results[device.id]
+        
+        force_stop_command = f"am force-stop {package_name}"
+        timestamp = datetime.now(timezone.utc).isoformat()
+        # Include critical payload field (command) in HMAC to prevent tampering
+        payload_fields = {
+            "command": force_stop_command
+        }
+        hmac_signature = compute_hmac_signature_with_payload(
+            correlation_id, device.id, "remote_exec_shell", timestamp, payload_fields
+        )
+        
+        message = {
+            "message": {
+                "token": device.fcm_token,
+                "data": {
+                    "action": "remote_exec_shell",
+                    "exec_id": "",
+                    "correlation_id": correlation_id,
+                    "device_id": device.id,
+                    "command": force_stop_command,
+                    "ts": timestamp,
+                    "hmac": hmac_signature
+                },
+                "android": {
+                    "priority": "high"
                 }
             }
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
+        }
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_BULK)
+        
+        if response.status_code == 200:
+            db_results[device.id] = {
+                "correlation_id": correlation_id,
+                "alias": device.alias,
+                "status": "sent"
             }
-            
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
-            
-            if response.status_code == 200:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "sent"
-                }
-            else:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "error",
-                    "error": f"FCM error: {response.status_code}"
-                }
-            
-            return db_results[device.id]
-            
-        except Exception as e:
+        else:
             db_results[device.id] = {
                 "correlation_id": correlation_id,
                 "alias": device.alias,
                 "status": "error",
-                "error": str(e)
+                "error": f"FCM error: {response.status_code}"
             }
-            return db_results[device.id]
-
-class StreamingConnectionManager:
-    """Manages screen streaming connections between devices and dashboard clients"""
-    def __init__(self):
-        # device_id -> WebSocket (device streaming source)
-        self.device_streams: dict[str, WebSocket] = {}
-        # device_id -> Set[WebSocket] (dashboard clients watching this device)
-        self.stream_viewers: dict[str, Set[WebSocket]] = {}
-
-    async def connect_device_stream(self, device_id: str, websocket: WebSocket):
-        """Device connects to start streaming its screen"""
-        await websocket.accept()
-        self.device_streams[device_id] = websocket
-        print(f"[STREAM] Device {device_id} started streaming")
-
-    def disconnect_device_stream(self, device_id: str):
-        """Device disconnects from streaming"""
-        if device_id in self.device_streams:
-            del self.device_streams[device_id]
-            print(f"[STREAM] Device {device_id} stopped streaming")
-
-        # Notify all viewers that stream ended
-        if device_id in self.stream_viewers:
-            viewers = self.stream_viewers[device_id].copy()
-            for viewer in viewers:
-                asyncio.create_task(self._send_stream_ended(viewer, device_id))
-            del self.stream_viewers[device_id]
-
-    async def connect_viewer(self, device_id: str, websocket: WebSocket):
-        """Dashboard client connects to view a device stream"""
-        await websocket.accept()
-        if device_id not in self.stream_viewers:
-            self.stream_viewers[device_id] = set()
-        self.stream_viewers[device_id].add(websocket)
-        print(f"[STREAM] Viewer connected to device {device_id}. Total viewers: {len(self.stream_viewers[device_id])}")
-
-    def disconnect_viewer(self, device_id: str, websocket: WebSocket):
-        """Dashboard client disconnects from viewing"""
-        if device_id in self.stream_viewers:
-            self.stream_viewers[device_id].discard(websocket)
-            if not self.stream_viewers[device_id]:
-                del self.stream_viewers[device_id]
-            print(f"[STREAM] Viewer disconnected from device {device_id}")
-
-    async def relay_frame(self, device_id: str, frame_data: bytes):
-        """Relay a screen frame from device to all viewing clients"""
-        if device_id not in self.stream_viewers:
-            return
-
-        disconnected = set()
-        for viewer in self.stream_viewers[device_id]:
-            try:
-                await viewer.send_bytes(frame_data)
-            except:
-                disconnected.add(viewer)
-
-        for viewer in disconnected:
-            self.disconnect_viewer(device_id, viewer)
-
-    async def _send_stream_ended(self, websocket: WebSocket, device_id: str):
-        """Notify viewer that stream has ended"""
-        try:
-            await websocket.send_json({"type": "stream_ended", "device_id": device_id})
-        except:
-            pass
-
-streaming_manager = StreamingConnectionManager()
+        
+        return db_results[device.id]
+        
+    except Exception as e:
+        db_results[device.id] = {
+            "correlation_id": correlation_id,
+            "alias": device.alias,
+            "status": "error",
+            "error": str(e)
+        }
+        return db_results[device.id]
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -805,6 +748,31 @@ async def startup_event():
         # Log but don't crash - background tasks may be optional
         print(f"⚠️  Background tasks failed to start: {e}")
 
+    if HEARTBEAT_INGEST_ASYNC:
+        await heartbeat_ingest.start()
+        print("✅ Async heartbeat ingest pipeline started")
+
+    if os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON") or os.getenv("FIREBASE_SERVICE_ACCOUNT_PATH"):
+        await fcm_client.start()
+        print("✅ FCM client started (token refresh in background)")
+
+    await fcm_scheduler.start()
+
+    offline_detector.add_listener(_on_device_status_transition)
+    await offline_detector.start()
+
+    await discord_delivery.start()
+
+    await device_deltas.start()
+
+    # Promoted builds are served from the disk cache; fill it in the background
+    asyncio.get_running_loop().run_in_executor(None, prewarm_current_builds)
+
+    if metrics_aggregator.enabled:
+        metrics_aggregator.add_pre_publish_hook(sample_pool_metrics)
+        await metrics_aggregator.start()
+        print(f"✅ Multi-worker metrics publishing to {metrics_aggregator.directory}")
+
     print("=" * 60)
     print("✅ NexMDM Backend Server started successfully!")
     print("📡 Server is ready to accept connections on port 8000")
@@ -813,8 +781,18 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Drain queued heartbeats before the rest of the background work stops
+    await heartbeat_ingest.stop()
     await alert_scheduler.stop()
+    # Give queued alert notifications a moment to go out
+    await discord_delivery.stop()
+    await offline_detector.stop()
+    await device_deltas.stop()
     await background_tasks.stop()
+    # Flush pending dispatch write-backs before the HTTP client goes away
+    await fcm_scheduler.stop()
+    await fcm_client.stop()
+    await metrics_aggregator.stop()
 
 def migrate_database():
     """Add missing columns to existing database tables"""
@@ -1055,15 +1033,10 @@ async def readiness_check():
         }
     )
 
-@app.get("/metrics")
-async def prometheus_metrics(x_admin: str = Header(None)):
-    """Prometheus-compatible metrics endpoint (requires admin authentication)"""
-    if not verify_admin_key(x_admin or ""):
-        raise HTTPException(status_code=401, detail="Admin key required")
-
-    structured_logger.log_event("metrics.scrape")
+POOL_GAUGES = ["db_pool_size", "db_pool_checked_in", "db_pool_checked_out", "db_pool_overflow", "db_pool_in_use"]
 
-    # Update connection pool metrics
+def sample_pool_metrics():
+    """Refresh this worker's connection pool gauges"""
     from models import engine
     pool_stats = metrics.get_pool_stats(engine)
     metrics.set_gauge("db_pool_size", pool_stats["size"])
@@ -1072,7 +1045,24 @@ async def prometheus_metrics(x_admin: str = Header(None)):
     metrics.set_gauge("db_pool_overflow", pool_stats["overflow"])
     metrics.set_gauge("db_pool_in_use", pool_stats["checked_out"])  # Alias for alerts
 
-    metrics_text = metrics.get_prometheus_text()
+@app.get("/metrics")
+async def prometheus_metrics(x_admin: str = Header(None)):
+    """
+    Prometheus-compatible metrics endpoint (requires admin authentication).
+    With METRICS_MULTIPROC_DIR set, reports the sum across all workers.
+    """
+    if not verify_admin_key(x_admin or ""):
+        raise HTTPException(status_code=401, detail="Admin key required")
+
+    structured_logger.log_event("metrics.scrape")
+
+    # Update connection pool metrics
+    sample_pool_metrics()
+
+    if metrics_aggregator.enabled:
+        metrics_text = await asyncio.to_thread(metrics_aggregator.get_prometheus_text)
+    else:
+        metrics_text = metrics.get_prometheus_text()
 
     return Response(
         content=metrics_text,
@@ -1174,12 +1164,24 @@ async def get_pool_health(x_admin: str = Header(None)):
         pool_health = check_pool_health()
         pg_health = check_postgres_connection_health()
 
-        return {
+        response = {
             "ok": True,
             "pool": pool_health,
             "postgres": pg_health
         }
 
+        # Per-worker pool usage; "pool" above only describes the answering worker
+        if metrics_aggregator.enabled:
+            sample_pool_metrics()
+            workers = await asyncio.to_thread(metrics_aggregator.get_worker_gauges, POOL_GAUGES)
+            response["workers"] = {
+                "count": len(workers),
+                "pools": {str(pid): stats for pid, stats in sorted(workers.items())},
+                "total_checked_out": sum(stats.get("db_pool_checked_out") or 0 for stats in workers.values())
+            }
+
+        return response
+
     except Exception as e:
         structured_logger.log_event(
             "ops.pool_health.error",
@@ -1229,7 +1231,8 @@ async def websocket_endpoint(
         while True:
             data = await websocket.receive_text()
             if data == "ping":
-                await websocket.send_json({"type": "pong"})
+                # Queued behind broadcasts so only the writer task sends on this socket
+                manager.send_to(websocket, {"type": "pong"})
     except WebSocketDisconnect:
         manager.disconnect(websocket)
         print(f"[WS] User {username} disconnected")
@@ -1279,9 +1282,10 @@ async def viewer_stream_endpoint(
     websocket: WebSocket,
     device_id: str,
     session_token: Optional[str] = Cookie(None, alias="session_token"),
-    token: Optional[str] = None  # Accept session_token as query param too
+    token: Optional[str] = None,  # Accept session_token as query param too
+    max_fps: Optional[float] = Query(None, gt=0)
 ):
-    """WebSocket endpoint for dashboard to view device screen stream"""
+    """WebSocket endpoint for dashboard to view device screen stream (max_fps caps this viewer's frame rate)"""
     # Accept session_token from either cookie or query parameter (for cross-port WebSocket)
     auth_session_id = session_token or token
 
@@ -1319,17 +1323,17 @@ async def viewer_stream_endpoint(
         db.close()  # Close DB session immediately after auth/verification
 
     # Check if this is the first viewer - if so, send FCM to start stream
-    is_first_viewer = len(streaming_manager.stream_viewers.get(device_id, set())) == 0
+    is_first_viewer = streaming_manager.viewer_count(device_id) == 0
 
-    await streaming_manager.connect_viewer(device_id, websocket)
+    await streaming_manager.connect_viewer(device_id, websocket, max_fps=max_fps)
     print(f"[STREAM] User {username} viewing device {device_id}")
 
     # Send FCM command to device to start streaming (only for first viewer)
     if is_first_viewer and device_fcm_token:
         try:
             import httpx
-            access_token = get_access_token()
-            project_id = get_firebase_project_id()
+            access_token = await fcm_client.get_access_token()
+            project_id = fcm_client.get_project_id()
             fcm_url = build_fcm_v1_url(project_id)
 
             message_data = {
@@ -1352,8 +1356,8 @@ async def viewer_stream_endpoint(
                 "Content-Type": "application/json"
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(fcm_url, json=fcm_message, headers=headers)
+            async with fcm_client.session() as client:
+                response = await fcm_scheduler.post(client, fcm_url, json=fcm_message, headers=headers, lane=LANE_INTERACTIVE)
                 if response.status_code == 200:
                     print(f"[STREAM] Sent start_stream FCM to device {device_id}")
                 else:
@@ -1366,7 +1370,8 @@ async def viewer_stream_endpoint(
             # Keep connection alive
             data = await websocket.receive_text()
             if data == "ping":
-                await websocket.send_json({"type": "pong"})
+                # The viewer's writer task owns sends on this socket
+                streaming_manager.send_json(device_id, websocket, {"type": "pong"})
     except WebSocketDisconnect:
         streaming_manager.disconnect_viewer(device_id, websocket)
         print(f"[STREAM] User {username} stopped viewing device {device_id}")
@@ -2353,8 +2358,8 @@ async def register_device(
 async def heartbeat(
     request: Request,
     payload: HeartbeatPayload,
-    device: Device = Depends(verify_device_token),
-    db: Session = Depends(get_db)
+    device: Device = Depends(verify_route_device),
+    db: Session = Depends(get_route_db)
 ):
     # Check if device token has been revoked (device deleted)
     if device.token_revoked_at:
@@ -2390,7 +2395,7 @@ async def heartbeat(
     print(f"[HEARTBEAT] Received from {device.alias}")
 
     # Parse previous status for comparison
-    prev_status = json.loads(device.last_status) if device.last_status else {}
+    prev_status = device.last_status or {}
 
     # PERFORMANCE OPTIMIZATION: Use async event queue instead of synchronous logging
     from background_tasks import background_tasks
@@ -2400,8 +2405,7 @@ async def heartbeat(
     offline_seconds = 0
     if device.last_seen:
         offline_seconds = (datetime.now(timezone.utc) - ensure_utc(device.last_seen)).total_seconds()
-        heartbeat_interval = alert_config.HEARTBEAT_INTERVAL_SECONDS
-        was_offline = offline_seconds > heartbeat_interval * 3
+        was_offline = offline_detector.is_offline(device.id, device.last_seen)
 
     if was_offline:
         # Async event logging - doesn't block the response
@@ -2431,37 +2435,44 @@ async def heartbeat(
             "carrier": payload.network.carrier if new_network == "cellular" else None
         })
 
-    device.last_seen = datetime.now(timezone.utc)
+    # Collect device column updates; applied to the ORM row in sync mode,
+    # handed to the batching writer in async mode
+    heartbeat_ts = datetime.now(timezone.utc)
+    device_updates = {"last_seen": heartbeat_ts}
     # Update device.app_version from heartbeat payload to keep dashboard table in sync
     if payload.app_version:
-        device.app_version = payload.app_version
+        device_updates["app_version"] = payload.app_version
 
     # Track installed Unity APK version for filtering and targeting
     if payload.app_versions:
         unity_app_info = payload.app_versions.get("io.unitynodes.unityapp")
         if unity_app_info and unity_app_info.installed:
-            device.installed_apk_version_code = unity_app_info.version_code
-            device.installed_apk_version_name = unity_app_info.version_name
+            device_updates["installed_apk_version_code"] = unity_app_info.version_code
+            device_updates["installed_apk_version_name"] = unity_app_info.version_name
 
     if payload.fcm_token:
-        device.fcm_token = payload.fcm_token
+        device_updates["fcm_token"] = payload.fcm_token
 
     if payload.system:
-        device.model = payload.system.model
-        device.manufacturer = payload.system.manufacturer
-        device.android_version = payload.system.android_version
-        device.sdk_int = payload.system.sdk_int
-        device.build_id = payload.system.build_id
+        device_updates["model"] = payload.system.model
+        device_updates["manufacturer"] = payload.system.manufacturer
+        device_updates["android_version"] = payload.system.android_version
+        device_updates["sdk_int"] = payload.system.sdk_int
+        device_updates["build_id"] = payload.system.build_id
 
     if hasattr(payload, 'is_device_owner') and payload.is_device_owner is not None:
-        device.is_device_owner = payload.is_device_owner
+        device_updates["is_device_owner"] = payload.is_device_owner
+
+    if not HEARTBEAT_INGEST_ASYNC:
+        for field, value in device_updates.items():
+            setattr(device, field, value)
 
     # PERFORMANCE OPTIMIZATION: Persist heartbeat to partitioned table + dual-write to device_last_status
     from db_utils import record_heartbeat_with_bucketing
     from monitoring_helpers import get_effective_monitoring_settings
     
     # PERF: Get monitoring settings ONCE and reuse throughout (avoid duplicate DB queries)
-    monitoring_settings = get_effective_monitoring_settings(db, device)
+    monitoring_settings = await run_in_session(db, get_effective_monitoring_settings, device)
 
     # Extract Unity app info (ALWAYS from io.unitynodes.unityapp)
     unity_running = None
@@ -2518,29 +2529,36 @@ async def heartbeat(
         'agent_version': payload.app_version
     }
 
-    # Track heartbeat write latency
-    hb_write_start = time.time()
-    hb_result = record_heartbeat_with_bucketing(db, device.id, heartbeat_data, bucket_seconds=10)
-    hb_write_latency_ms = (time.time() - hb_write_start) * 1000
-    metrics.observe_histogram("hb_write_latency_ms", hb_write_latency_ms, {})
+    if not HEARTBEAT_INGEST_ASYNC:
+        # Track heartbeat write latency
+        hb_write_start = time.time()
+        hb_result = await run_in_session(db, record_heartbeat_with_bucketing, device.id, heartbeat_data, 10)
+        hb_write_latency_ms = (time.time() - hb_write_start) * 1000
+        metrics.observe_histogram("hb_write_latency_ms", hb_write_latency_ms, {})
 
-    if hb_result['created']:
-        metrics.inc_counter("hb_writes_total")
-    else:
-        metrics.inc_counter("hb_dedupe_total")
+        if hb_result['created']:
+            metrics.inc_counter("hb_writes_total")
+        else:
+            metrics.inc_counter("hb_dedupe_total")
 
-    if hb_result.get('last_status_updated'):
-        metrics.inc_counter("last_status_upserts_total")
+        if hb_result.get('last_status_updated'):
+            metrics.inc_counter("last_status_upserts_total")
 
+    acked_ping_request_id = None
     if payload.is_ping_response and payload.ping_request_id:
         if device.ping_request_id == payload.ping_request_id and device.last_ping_sent:
-            device.last_ping_response = datetime.now(timezone.utc)
-            latency_ms = int((device.last_ping_response - ensure_utc(device.last_ping_sent)).total_seconds() * 1000)
+            ping_response_at = datetime.now(timezone.utc)
+            latency_ms = int((ping_response_at - ensure_utc(device.last_ping_sent)).total_seconds() * 1000)
             print(f"[FCM-PING] ✓ Response from {device.alias}: {latency_ms}ms latency")
             # Async event logging
             background_tasks.event_queue.enqueue(device.id, "ping_response", {"latency_ms": latency_ms})
-            # Clear ping state after successful response
-            device.ping_request_id = None
+            if HEARTBEAT_INGEST_ASYNC:
+                # Writer clears the ping only if the request id still matches at flush time
+                acked_ping_request_id = payload.ping_request_id
+            else:
+                device.last_ping_response = ping_response_at
+                # Clear ping state after successful response
+                device.ping_request_id = None
 
     # Service monitoring evaluator: Determine if monitored service is up/down
     # NOTE: monitoring_settings already fetched above (PERF optimization - single call)
@@ -2619,59 +2637,48 @@ async def heartbeat(
                     source=monitoring_settings["source"]
                 )
 
-    # PERF: Update DeviceLastStatus with service monitoring data using UPDATE...RETURNING
-    # This avoids a separate SELECT query by returning prev_service_up in the same statement
-    from sqlalchemy import text as sql_text
-    update_result = db.execute(sql_text("""
-        UPDATE device_last_status
-        SET service_up = :service_up,
-            monitored_foreground_recent_s = :fg_recent_s,
-            monitored_package = :monitored_package,
-            monitored_threshold_min = :threshold_min
-        WHERE device_id = :device_id
-        RETURNING (SELECT service_up FROM device_last_status WHERE device_id = :device_id) as prev_service_up
-    """), {
+    service_fields = {
         'service_up': service_up,
-        'fg_recent_s': monitored_foreground_recent_s,
+        'monitored_foreground_recent_s': monitored_foreground_recent_s,
         'monitored_package': monitoring_settings["package"] if monitoring_settings["enabled"] else None,
-        'threshold_min': monitoring_settings["threshold_min"] if monitoring_settings["enabled"] else None,
-        'device_id': device.id
-    })
-    
-    row = update_result.fetchone()
-    if row:
-        prev_service_up = row[0] if row else None
-        
-        # Detect service state transitions for logging
-        if monitoring_settings["enabled"] and prev_service_up is not None and service_up is not None:
-            if prev_service_up and not service_up:
-                # Service went DOWN
-                structured_logger.log_event(
-                    "monitoring.service_down",
-                    device_id=device.id,
-                    alias=device.alias,
-                    monitored_package=monitoring_settings["package"],
-                    monitored_app_name=monitoring_settings["alias"],
-                    foreground_recent_s=monitored_foreground_recent_s,
-                    threshold_min=monitoring_settings["threshold_min"],
-                    source=monitoring_settings["source"]
-                )
-
-            elif not prev_service_up and service_up:
-                # Service RECOVERED
-                structured_logger.log_event(
-                    "monitoring.service_up",
-                    device_id=device.id,
-                    alias=device.alias,
-                    monitored_package=monitoring_settings["package"],
-                    monitored_app_name=monitoring_settings["alias"],
-                    foreground_recent_s=monitored_foreground_recent_s,
-                    source=monitoring_settings["source"]
-                )
+        'monitored_threshold_min': monitoring_settings["threshold_min"] if monitoring_settings["enabled"] else None
+    }
 
-        # Metrics for monitoring
+    if HEARTBEAT_INGEST_ASYNC:
+        # Writer upserts these fields and logs transitions after the batch commits
         if monitoring_settings["enabled"] and service_up is not None:
             metrics.set_gauge("service_up_devices", 1 if service_up else 0, {"device_id": device.id})
+    else:
+        # PERF: Update DeviceLastStatus with service monitoring data using UPDATE...RETURNING
+        # This avoids a separate SELECT query by returning prev_service_up in the same statement
+        from sqlalchemy import text as sql_text
+        from monitoring_helpers import log_service_transition
+        row = await run_in_session(db, lambda s: s.execute(sql_text("""
+            UPDATE device_last_status
+            SET service_up = :service_up,
+                monitored_foreground_recent_s = :fg_recent_s,
+                monitored_package = :monitored_package,
+                monitored_threshold_min = :threshold_min
+            WHERE device_id = :device_id
+            RETURNING (SELECT service_up FROM device_last_status WHERE device_id = :device_id) as prev_service_up
+        """), {
+            'service_up': service_up,
+            'fg_recent_s': monitored_foreground_recent_s,
+            'monitored_package': service_fields['monitored_package'],
+            'threshold_min': service_fields['monitored_threshold_min'],
+            'device_id': device.id
+        }).fetchone())
+
+        if row:
+            prev_service_up = row[0] if row else None
+
+            # Detect service state transitions for logging
+            log_service_transition(device.id, device.alias, monitoring_settings,
+                                   prev_service_up, service_up, monitored_foreground_recent_s)
+
+            # Metrics for monitoring
+            if monitoring_settings["enabled"] and service_up is not None:
+                metrics.set_gauge("service_up_devices", 1 if service_up else 0, {"device_id": device.id})
 
     # Enrich last_status with computed monitoring data for frontend
     # Use exclude_none=False to ensure network.ssid and network.carrier are always present (even when None)
@@ -2723,7 +2730,10 @@ async def heartbeat(
         "version": payload.app_version or "unknown"
     }
 
-    device.last_status = json.dumps(last_status_dict)
+    if HEARTBEAT_INGEST_ASYNC:
+        device_updates["last_status"] = json.dumps(last_status_dict)
+    else:
+        device.last_status = last_status_dict
 
     # Auto-relaunch logic: Check if monitored app is down and auto-relaunch is enabled
     # Use monitoring settings package if available, otherwise use device.monitored_package
@@ -2768,25 +2778,68 @@ async def heartbeat(
             if not is_app_running and device.fcm_token:
                 try:
                     asyncio.create_task(send_fcm_launch_app(device.fcm_token, package_used, device.id))
-                    log_device_event(db, device.id, "auto_relaunch_triggered", {
+                    relaunch_details = {
                         "package": package_used,
                         "used_fallback": used_fallback,
                         "original_package": auto_relaunch_package
-                    })
+                    }
+                    if HEARTBEAT_INGEST_ASYNC:
+                        # No inline commit in async mode
+                        background_tasks.event_queue.enqueue(device.id, "auto_relaunch_triggered", relaunch_details)
+                    else:
+                        await run_in_session(db, log_device_event, device.id, "auto_relaunch_triggered", relaunch_details)
                 except Exception as e:
                     structured_logger.log_event("auto_relaunch.failed", level="ERROR", 
                                                device_id=device.id, error=str(e))
 
-    db.commit()
+    if HEARTBEAT_INGEST_ASYNC:
+        accepted = await heartbeat_ingest.enqueue({
+            "device_id": device.id,
+            "alias": device.alias,
+            "ts": heartbeat_ts,
+            "heartbeat": heartbeat_data,
+            "service": service_fields,
+            "device": device_updates,
+            "ping_request_id": acked_ping_request_id,
+            "monitoring": monitoring_settings
+        })
+        if not accepted:
+            structured_logger.log_event(
+                "heartbeat.rejected",
+                level="WARN",
+                device_id=device.id,
+                reason="ingest_backpressure"
+            )
+            raise HTTPException(
+                status_code=503,
+                detail={"reason": "ingest_backpressure", "message": "Heartbeat queue full, retry later"},
+                headers={"Retry-After": "5"}
+            )
+    else:
+        await commit_session(db)
 
-    # Invalidate cache on device update
-    response_cache.invalidate("/v1/metrics")
-    response_cache.invalidate("/v1/devices")
+    # Re-arm the offline deadline; an offline device comes back online immediately
+    offline_detector.observe(device.id, heartbeat_ts)
 
-    await manager.broadcast({
+    # Invalidate cache on device update (debounced: heartbeats arrive continuously)
+    response_cache.invalidate_debounced("/v1/metrics")
+    response_cache.invalidate_debounced("/v1/devices")
+
+    # Queued per client, never awaits a socket send
+    manager.publish({
         "type": "device_update",
         "device_id": device.id
-    })
+    }, coalesce_key=("device_update", device.id))
+
+    # Sent to dashboards in the next device_deltas message
+    device_deltas.record(
+        device.id,
+        heartbeat_ts,
+        status="online",
+        battery_pct=battery_pct,
+        unity_running=unity_running,
+        service_up=service_up
+    )
 
     return HeartbeatResponse(ok=True, next_heartbeat_seconds=alert_config.HEARTBEAT_INTERVAL_SECONDS)
 
@@ -2794,13 +2847,17 @@ async def heartbeat(
 async def action_result(
     request: Request,
     payload: ActionResultRequest,
-    device: Device = Depends(verify_device_token),
-    db: Session = Depends(get_db)
+    device: Device = Depends(verify_route_device),
+    db: Session = Depends(get_route_db)
 ):
     """
     Receive action result from device after executing FCM command.
     Uses authenticated device.id as the authoritative source (not payload.device_id).
     """
+    return await run_in_session(db, _record_action_result, device, payload)
+
+def _record_action_result(db: Session, device: Device, payload: ActionResultRequest) -> dict:
+    """DB work for /v1/action-result"""
     # Use authenticated device.id - don't trust client-provided device_id
     # Log if there's a mismatch for debugging (but don't reject)
     if payload.device_id and payload.device_id != device.id:
@@ -2888,10 +2945,76 @@ async def get_device_events(
         "details": json.loads(event.details) if event.details else None
     } for event in events]
 
+@app.get("/v1/devices/{device_id}/history")
+async def get_device_history(
+    device_id: str,
+    resolution: str = "auto",
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_route_db)
+):
+    """
+    Battery, Unity and network history for a device over [from, to)
+    (default: the last 24 hours).
+
+    resolution=auto reads the cheapest rollup table that covers the range;
+    raw, 1m, 1h or 1d can be requested explicitly.
+    """
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=24)
+    return await run_in_session_threaded(db, _load_device_history, device_id, start, end, resolution)
+
+def _load_device_history(db: Session, device_id: str, start: datetime, end: datetime, resolution: str) -> dict:
+    """DB work for /v1/devices/{device_id}/history"""
+    device = db.query(Device.id).filter(Device.id == device_id).first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+    try:
+        return heartbeat_rollups.load_history(db, device_id, start, end, resolution)
+    except heartbeat_rollups.HistoryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/v1/devices/{device_id}/history/archive")
+async def get_device_archived_history(
+    device_id: str,
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    limit: int = Query(columnar_archive.MAX_ARCHIVE_ROWS, ge=1, le=columnar_archive.MAX_ARCHIVE_ROWS),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Raw heartbeats for a device over [from, to) read from the Parquet copies
+    of archived partitions (older than the Postgres retention window).
+    """
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if not columnar_archive.available():
+        raise HTTPException(status_code=501, detail="Columnar archives are not enabled on this server")
+
+    start = ensure_utc(start).astimezone(timezone.utc).replace(tzinfo=None)
+    end = ensure_utc(end).astimezone(timezone.utc).replace(tzinfo=None)
+    try:
+        rows = await asyncio.to_thread(columnar_archive.read_device_history, db, device_id, start, end, limit)
+    except columnar_archive.ArchiveError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "device_id": device_id,
+        "from": start.isoformat() + "Z",
+        "to": end.isoformat() + "Z",
+        "points": [
+            {**row, "ts": row["ts"].isoformat() + "Z"}
+            for row in rows
+        ]
+    }
+
 @app.get("/v1/metrics")
 async def get_metrics(
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_route_db)
 ):
     """
     Get device metrics (total, online, offline, low battery counts).
@@ -2900,12 +3023,17 @@ async def get_metrics(
     dashboard endpoint that's heavily cached (60 second TTL). It should never
     be rate limited to ensure dashboard functionality.
     """
-    # Check cache first (60 second TTL)
+    # Cached for 60 seconds; concurrent misses share one computation
     cache_key = make_cache_key("/v1/metrics")
-    cached_result = response_cache.get(cache_key, ttl_seconds=60)
-    if cached_result is not None:
-        return cached_result
+    return await response_cache.get_or_compute(
+        cache_key,
+        ttl_seconds=60,
+        compute=session_compute(db, _compute_device_metrics),
+        path="/v1/metrics"
+    )
 
+def _compute_device_metrics(db: Session) -> dict:
+    """Device counts for /v1/metrics (runs in a worker thread on cache miss)"""
     total_devices = db.query(func.count(Device.id)).scalar()
 
     heartbeat_interval = alert_config.HEARTBEAT_INTERVAL_SECONDS
@@ -2913,14 +3041,18 @@ async def get_metrics(
 
     # Optimized: Use device_last_status table if available for better performance
     if READ_FROM_LAST_STATUS:
-        # Fast path: Use device_last_status table with SQL aggregation
-        # Count online devices using device_last_status
-        online_count_query = text("""
-            SELECT COUNT(*)
-            FROM device_last_status dls
-            WHERE dls.last_ts >= :offline_threshold
-        """)
-        online_count = db.execute(online_count_query, {"offline_threshold": offline_threshold}).scalar() or 0
+        if offline_detector.ready:
+            # Live counter kept by the offline detector's timer wheel
+            online_count = offline_detector.online_count
+        else:
+            # Fast path: Use device_last_status table with SQL aggregation
+            # Count online devices using device_last_status
+            online_count_query = text("""
+                SELECT COUNT(*)
+                FROM device_last_status dls
+                WHERE dls.last_ts >= :offline_threshold
+            """)
+            online_count = db.execute(online_count_query, {"offline_threshold": offline_threshold}).scalar() or 0
 
         offline_count = total_devices - online_count
 
@@ -2939,20 +3071,22 @@ async def get_metrics(
 
         offline_count = total_devices - online_count
 
-        # For low battery, parse JSON from last_status field
-        low_battery_count = 0
-        battery_statuses = db.query(Device.last_status).filter(
-            Device.last_status.isnot(None)
-        ).all()
+        if uses_jsonb_status(db.get_bind().dialect.name):
+            # Indexed column generated from last_status->'battery'->>'pct'
+            low_battery_count = db.query(func.count(Device.id)).filter(
+                DEVICE_STATUS_COLUMNS["battery_pct"] < 15
+            ).scalar() or 0
+        else:
+            # Text storage: last_status has to be parsed per row
+            low_battery_count = 0
+            battery_statuses = db.query(Device.last_status).filter(
+                Device.last_status.isnot(None)
+            ).all()
 
-        for (status_json,) in battery_statuses:
-            try:
-                status = json.loads(status_json)
-                battery = status.get("battery", {}).get("level", 100)
-                if battery < 15:
+            for (status,) in battery_statuses:
+                battery = ((status or {}).get("battery") or {}).get("pct")
+                if battery is not None and battery < 15:
                     low_battery_count += 1
-            except:
-                pass
 
     result = {
         "total": total_devices,
@@ -2961,44 +3095,75 @@ async def get_metrics(
         "low_battery": low_battery_count
     }
 
-    # Cache the result
-    response_cache.set(cache_key, result, ttl_seconds=60, path="/v1/metrics")
-
     return result
 
 @app.get("/v1/devices")
 async def list_devices(
-    page: int = Query(1, ge=1),
+    page: int = Query(1, ge=1, description="Legacy offset paging; ignored when cursor is given"),
     limit: int = Query(25, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="pagination.next_cursor from the previous page"),
+    sort: str = Query("last_seen", description="last_seen (newest first), alias, or version (highest first)"),
+    status: Optional[str] = Query(None, description="Filter by online/offline"),
+    alias: Optional[str] = Query(None, max_length=100, description="Filter by alias prefix (case-insensitive)"),
     version_code: Optional[int] = Query(None, description="Filter by installed APK version code"),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_route_db)
 ):
     """
-    List devices with pagination and optional version filtering.
+    List devices with keyset pagination, filtering and sorting.
+
+    Follow pagination.next_cursor to page through results; page > 1 without
+    a cursor still works but costs an OFFSET scan. total_count is approximate.
 
     NOTE: This endpoint is exempt from rate limiting as it's a read-only
     dashboard endpoint that's cached (5 minute TTL for first page). It should
     never be rate limited to ensure dashboard functionality.
     """
+    if sort not in device_listing.SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {sorted(device_listing.SORTS)}")
+    if status is not None and status not in device_listing.STATUSES:
+        raise HTTPException(status_code=400, detail="status must be 'online' or 'offline'")
+    try:
+        after = device_listing.decode_cursor(sort, cursor) if cursor else None
+    except device_listing.CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    args = (page, limit, after, sort, status, alias, version_code)
+
     # Cache first page only (5 minute TTL) - most common query (no filters)
-    cache_key = None
-    if page == 1 and limit == 25 and version_code is None:
+    if page == 1 and limit == 25 and after is None and sort == "last_seen" and not (status or alias or version_code is not None):
         cache_key = make_cache_key("/v1/devices", {"page": 1, "limit": 25})
-        cached_result = response_cache.get(cache_key, ttl_seconds=300)
-        if cached_result is not None:
-            return cached_result
-
-    query = db.query(Device)
-    
-    # Filter by version code if provided
-    if version_code is not None:
-        query = query.filter(Device.installed_apk_version_code == version_code)
+        return await response_cache.get_or_compute(
+            cache_key,
+            ttl_seconds=300,
+            compute=session_compute(db, _build_device_list, *args),
+            path="/v1/devices"
+        )
 
-    total_count = query.count()
+    return await run_in_session(db, _build_device_list, *args)
+
+def _build_device_list(
+    db: Session,
+    page: int,
+    limit: int,
+    after: Optional[tuple],
+    sort: str,
+    status_filter: Optional[str],
+    alias_prefix: Optional[str],
+    version_code: Optional[int]
+) -> dict:
+    """One page of /v1/devices"""
+    query = device_listing.filtered_query(
+        db, status_filter, version_code, alias_prefix, offline_detector.threshold_s
+    )
+    total_count = device_listing.approximate_count(db, query, (status_filter, version_code, alias_prefix))
 
-    offset = (page - 1) * limit
-    devices = query.order_by(Device.last_seen.desc()).offset(offset).limit(limit).all()
+    page_query = device_listing.page_query(query, sort, after, limit)
+    if after is None and page > 1:
+        page_query = page_query.offset((page - 1) * limit)
+    devices = page_query.all()
+    has_next = len(devices) > limit
+    devices = devices[:limit]
 
     # Batch fetch device statuses if using fast reads
     device_statuses = {}
@@ -3007,7 +3172,6 @@ async def list_devices(
         device_statuses = fast_reads.get_all_device_statuses_fast(db, device_ids)
 
     result = []
-    heartbeat_interval = alert_config.HEARTBEAT_INTERVAL_SECONDS
 
     for device in devices:
         # Determine online/offline status
@@ -3016,17 +3180,14 @@ async def list_devices(
             fast_status = device_statuses[device.id]
             last_seen = fast_status["last_ts"]
             if last_seen:
-                offline_seconds = (datetime.now(timezone.utc) - ensure_utc(last_seen)).total_seconds()
-                status = "offline" if offline_seconds > heartbeat_interval * 3 else "online"
+                status = "offline" if offline_detector.is_offline(device.id, last_seen) else "online"
             else:
                 status = "offline"
         else:
             # Legacy path: use device.last_seen
             status = "online"
-            if device.last_seen:
-                offline_seconds = (datetime.now(timezone.utc) - ensure_utc(device.last_seen)).total_seconds()
-                if offline_seconds > heartbeat_interval * 3:
-                    status = "offline"
+            if device.last_seen and offline_detector.is_offline(device.id, device.last_seen):
+                status = "offline"
 
         ping_status = None
         if device.last_ping_sent:
@@ -3049,17 +3210,6 @@ async def list_devices(
                         "elapsed_seconds": int(time_since_ping)
                     }
 
-        # Handle last_status - it could be a string (JSON) or already a dict
-        last_status_data = None
-        if device.last_status:
-            if isinstance(device.last_status, str):
-                try:
-                    last_status_data = json.loads(device.last_status)
-                except:
-                    last_status_data = None
-            elif isinstance(device.last_status, dict):
-                last_status_data = device.last_status
-
         result.append({
             "id": device.id,
             "alias": device.alias,
@@ -3069,7 +3219,7 @@ async def list_devices(
             "last_seen": device.last_seen.isoformat() + "Z" if device.last_seen else None,
             "created_at": device.created_at.isoformat() + "Z" if device.created_at else None,
             "status": status,
-            "last_status": last_status_data,
+            "last_status": device.last_status,
             "ping_status": ping_status,
             "model": device.model,
             "manufacturer": device.manufacturer,
@@ -3091,15 +3241,12 @@ async def list_devices(
             "limit": limit,
             "total_count": total_count,
             "total_pages": total_pages,
-            "has_next": page < total_pages,
-            "has_prev": page > 1
+            "has_next": has_next,
+            "has_prev": after is not None or page > 1,
+            "next_cursor": device_listing.encode_cursor(sort, devices[-1]) if has_next else None
         }
     }
 
-    # Cache first page result
-    if cache_key:
-        response_cache.set(cache_key, response, ttl_seconds=300, path="/v1/devices")
-
     return response
 
 @app.get("/v1/devices/{device_id}")
@@ -3143,7 +3290,7 @@ async def get_device(
         "app_version": device.app_version,
         "last_seen": device.last_seen.isoformat() + "Z" if device.last_seen else None,
         "created_at": device.created_at.isoformat() + "Z" if device.created_at else None,
-        "last_status": json.loads(device.last_status) if device.last_status else None,
+        "last_status": device.last_status,
         "ping_status": ping_status,
         "is_device_owner": device.is_device_owner,
         "monitored_package": device.monitored_package,
@@ -3202,6 +3349,8 @@ async def delete_device(
     # Delete device
     db.delete(device)
     db.commit()
+    device_token_cache.invalidate_device(device_id)
+    device_deltas.forget(device_id)
 
     # Invalidate cache on device deletion
     response_cache.invalidate("/v1/metrics")
@@ -3230,14 +3379,10 @@ async def get_admin_devices(
 
     devices = query.all()
 
-    heartbeat_interval = alert_config.HEARTBEAT_INTERVAL_SECONDS
-    offline_threshold_seconds = heartbeat_interval * 3
-
     result = []
     for device in devices:
         if device.last_seen:
-            offline_seconds = (datetime.now(timezone.utc) - ensure_utc(device.last_seen)).total_seconds()
-            status = "online" if offline_seconds <= offline_threshold_seconds else "offline"
+            status = "offline" if offline_detector.is_offline(device.id, device.last_seen) else "online"
         else:
             status = "offline"
 
@@ -4063,8 +4208,8 @@ async def push_wifi_to_devices(
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FCM authentication failed: {str(e)}")
 
@@ -4078,7 +4223,7 @@ async def push_wifi_to_devices(
 
     results = []
 
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         for device_id in device_ids:
             device = db.query(Device).filter(Device.id == device_id).first()
             if not device:
@@ -4131,7 +4276,7 @@ async def push_wifi_to_devices(
             fcm_start_time = time.time()
 
             try:
-                response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+                response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_BULK, request_id=request_id)
 
                 latency_ms = (time.time() - fcm_start_time) * 1000
                 fcm_result = response.json() if response.status_code == 200 else None
@@ -4764,8 +4909,8 @@ async def ping_device(
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FCM authentication failed: {str(e)}")
 
@@ -4797,9 +4942,9 @@ async def ping_device(
 
     fcm_start_time = time.time()
 
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         try:
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+            response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_INTERACTIVE)
             latency_ms = (time.time() - fcm_start_time) * 1000
 
             if response.status_code != 200:
@@ -4946,8 +5091,8 @@ async def ring_device(
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FCM authentication failed: {str(e)}")
 
@@ -4976,9 +5121,9 @@ async def ring_device(
         }
     }
 
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         try:
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+            response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_INTERACTIVE)
 
             if response.status_code != 200:
                 command.status = "failed"
@@ -5060,8 +5205,8 @@ async def stop_ringing_device(
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FCM authentication failed: {str(e)}")
 
@@ -5090,9 +5235,9 @@ async def stop_ringing_device(
         }
     }
 
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         try:
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+            response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_INTERACTIVE)
 
             if response.status_code != 200:
                 command.status = "failed"
@@ -5145,9 +5290,13 @@ async def acknowledge_command(
     request: Request,
     device_id: str,
     payload: AckRequest,
-    device: Device = Depends(verify_device_token),
-    db: Session = Depends(get_db)
+    device: Device = Depends(verify_route_device),
+    db: Session = Depends(get_route_db)
 ):
+    return await run_in_session(db, _process_command_ack, device, device_id, payload)
+
+def _process_command_ack(db: Session, device: Device, device_id: str, payload: AckRequest) -> dict:
+    """DB work for /v1/devices/{device_id}/ack"""
     correlation_id = payload.get_correlation_id()
     print(f"[ACK] Received ACK from device_id={device_id}, type={payload.type}, correlation_id={correlation_id}, request_id={payload.request_id}, status={payload.status}, message={payload.message}")
 
@@ -5397,7 +5546,8 @@ async def download_apk_optimized_endpoint(
     Optimized APK download endpoint with caching and telemetry.
 
     Features:
-    - In-memory caching (200MB, 1hr TTL)
+    - Streams from a local disk copy; in-memory caching (200MB, 1hr TTL) as fallback
+    - Range / If-Range (resume) and ETag / If-None-Match on the APK's SHA-256
     - Download telemetry tracking
     - SHA-256 in response headers for client-side caching
     - No rate limiting for deployments
@@ -5425,7 +5575,8 @@ async def download_apk_optimized_endpoint(
         db=db,
         device_id=device_id,
         installation_id=installation_id,
-        use_cache=True
+        use_cache=True,
+        request=request
     )
 
 def build_batch_bloatware_disable_command(package_names: list[str]) -> str:
@@ -5732,95 +5883,93 @@ async def dispatch_apk_fcm_to_device(
     device: Device,
     apk: ApkVersion,
     installation: ApkInstallation,
-    semaphore: asyncio.Semaphore,
     client: "httpx.AsyncClient",
     fcm_url: str,
     access_token: str
 ) -> dict:
     """
-    Dispatch APK installation FCM message to a single device with semaphore-based concurrency control.
+    Dispatch APK installation FCM message to a single device through the global FCM dispatch scheduler.
     Returns result dict with device_id, status, installation_id, and optional error.
     """
-    async with semaphore:
-        try:
-            if not device.fcm_token:
-                return {
-                    "device_id": device.id,
-                    "alias": device.alias,
-                    "installation_id": installation.id,
-                    "status": "error",
-                    "error": "No FCM token"
-                }
-            
-            request_id = str(uuid.uuid4())
-            timestamp = datetime.now(timezone.utc).isoformat()
-            hmac_signature = compute_hmac_signature(request_id, device.id, "install_apk", timestamp)
-            
-            # Generate the download URL for the APK
-            download_url = f"{config.server_url}/v1/apk/download/{apk.id}"
-            
-            fcm_message = {
-                "message": {
-                    "token": device.fcm_token,
-                    "data": {
-                        "action": "install_apk",
-                        "request_id": request_id,
-                        "device_id": device.id,
-                        "ts": timestamp,
-                        "hmac": hmac_signature,
-                        "installation_id": str(installation.id),
-                        "apk_id": str(apk.id),
-                        "version_name": apk.version_name,
-                        "version_code": str(apk.version_code),
-                        "file_size": str(apk.file_size) if apk.file_size else "0",
-                        "package_name": apk.package_name if hasattr(apk, 'package_name') and apk.package_name else "com.nexmdm",
-                        "download_url": download_url
-                    },
-                    "android": {
-                        "priority": "high"
-                    }
-                }
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
+    try:
+        if not device.fcm_token:
+            return {
+                "device_id": device.id,
+                "alias": device.alias,
+                "installation_id": installation.id,
+                "status": "error",
+                "error": "No FCM token"
             }
-            
-            response = await client.post(fcm_url, json=fcm_message, headers=headers, timeout=10.0)
-            
-            if response.status_code == 200:
-                return {
-                    "device_id": device.id,
-                    "alias": device.alias,
-                    "installation_id": installation.id,
-                    "status": "sent"
-                }
-            else:
-                error_msg = f"FCM failed: {response.status_code}"
-                return {
+        
+        request_id = str(uuid.uuid4())
+        timestamp = datetime.now(timezone.utc).isoformat()
+        hmac_signature = compute_hmac_signature(request_id, device.id, "install_apk", timestamp)
+        
+        # Generate the download URL for the APK
+        download_url = f"{config.server_url}/v1/apk/download/{apk.id}"
+        
+        fcm_message = {
+            "message": {
+                "token": device.fcm_token,
+                "data": {
+                    "action": "install_apk",
+                    "request_id": request_id,
                     "device_id": device.id,
-                    "alias": device.alias,
-                    "installation_id": installation.id,
-                    "status": "error",
-                    "error": error_msg
+                    "ts": timestamp,
+                    "hmac": hmac_signature,
+                    "installation_id": str(installation.id),
+                    "apk_id": str(apk.id),
+                    "version_name": apk.version_name,
+                    "version_code": str(apk.version_code),
+                    "file_size": str(apk.file_size) if apk.file_size else "0",
+                    "package_name": apk.package_name if hasattr(apk, 'package_name') and apk.package_name else "com.nexmdm",
+                    "download_url": download_url
+                },
+                "android": {
+                    "priority": "high"
                 }
-        except asyncio.TimeoutError:
+            }
+        }
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        response = await fcm_scheduler.post(client, fcm_url, json=fcm_message, headers=headers, lane=LANE_BULK)
+        
+        if response.status_code == 200:
             return {
                 "device_id": device.id,
                 "alias": device.alias,
                 "installation_id": installation.id,
-                "status": "error",
-                "error": "FCM timeout"
+                "status": "sent"
             }
-        except Exception as e:
+        else:
+            error_msg = f"FCM failed: {response.status_code}"
             return {
                 "device_id": device.id,
                 "alias": device.alias,
                 "installation_id": installation.id,
                 "status": "error",
-                "error": f"FCM error: {str(e)}"
+                "error": error_msg
             }
+    except asyncio.TimeoutError:
+        return {
+            "device_id": device.id,
+            "alias": device.alias,
+            "installation_id": installation.id,
+            "status": "error",
+            "error": "FCM timeout"
+        }
+    except Exception as e:
+        return {
+            "device_id": device.id,
+            "alias": device.alias,
+            "installation_id": installation.id,
+            "status": "error",
+            "error": f"FCM error: {str(e)}"
+        }
 
 @app.post("/v1/apk/deploy")
 async def deploy_apk_v1(
@@ -5844,6 +5993,9 @@ async def deploy_apk_v1(
     if not apk:
         raise HTTPException(status_code=404, detail="APK not found")
 
+    # Pull the build into the disk cache before any device is told to download it
+    await asyncio.to_thread(prewarm_apk, apk)
+
     # Get devices - use all devices if no specific devices provided
     if device_ids:
         devices = db.query(Device).filter(Device.id.in_(device_ids)).all()
@@ -5948,8 +6100,8 @@ async def deploy_apk_v1(
     
     # Get FCM credentials (once, outside the loop)
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
         fcm_url = build_fcm_v1_url(project_id)
     except Exception as e:
         # If FCM setup fails, installations are already created in DB
@@ -5989,11 +6141,8 @@ async def deploy_apk_v1(
             "failed_devices": failed_devices
         }
     
-    # Create semaphore for concurrency control
-    semaphore = asyncio.Semaphore(FCM_DISPATCH_CONCURRENCY)
-    
     # Process devices
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         if use_ack_batching:
             first_batch_devices = devices_with_fcm[:payload.batch_size]
             
@@ -6002,7 +6151,6 @@ async def deploy_apk_v1(
                     device=device,
                     apk=apk,
                     installation=installation_map[device.id],
-                    semaphore=semaphore,
                     client=client,
                     fcm_url=fcm_url,
                     access_token=access_token
@@ -6054,7 +6202,6 @@ async def deploy_apk_v1(
                         device=device,
                         apk=apk,
                         installation=installation_map[device.id],
-                        semaphore=semaphore,
                         client=client,
                         fcm_url=fcm_url,
                         access_token=access_token
@@ -6090,7 +6237,6 @@ async def deploy_apk_v1(
                     device=device,
                     apk=apk,
                     installation=installation_map[device.id],
-                    semaphore=semaphore,
                     client=client,
                     fcm_url=fcm_url,
                     access_token=access_token
@@ -6199,13 +6345,11 @@ async def dispatch_fcm_to_batch(run_id: int, batch_id: int, db: Session):
         devices = db.query(Device).filter(Device.id.in_(device_ids)).all()
         device_map = {d.id: d for d in devices}
         
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
         fcm_url = build_fcm_v1_url(project_id)
         
-        semaphore = asyncio.Semaphore(FCM_DISPATCH_CONCURRENCY)
-        
-        async with httpx.AsyncClient() as client:
+        async with fcm_client.session() as client:
             tasks = []
             for inst in installations:
                 device = device_map.get(inst.device_id)
@@ -6215,7 +6359,6 @@ async def dispatch_fcm_to_batch(run_id: int, batch_id: int, db: Session):
                             device=device,
                             apk=apk,
                             installation=inst,
-                            semaphore=semaphore,
                             client=client,
                             fcm_url=fcm_url,
                             access_token=access_token
@@ -6487,7 +6630,8 @@ async def download_latest_apk(
         db=db,
         device_id=device_id,
         installation_id=installation_id,
-        use_cache=True
+        use_cache=True,
+        request=request
     )
 
 @app.get("/v1/apk/download/{apk_id}")
@@ -6524,7 +6668,8 @@ async def download_apk_by_id(
         db=db,
         device_id=device_id,
         installation_id=installation_id,
-        use_cache=True
+        use_cache=True,
+        request=request
     )
 
 @app.post("/v1/apk/upload-init")
@@ -6591,8 +6736,7 @@ async def init_apk_upload(
     db.commit()
     db.refresh(apk_version)
 
-    chunk_dir = f"/tmp/apk_chunks/{apk_version.id}"
-    os.makedirs(chunk_dir, exist_ok=True)
+    await asyncio.to_thread(chunked_upload_store.init_upload, apk_version.id, file_size, total_chunks)
 
     structured_logger.log_event(
         "apk.upload.init",
@@ -6630,21 +6774,20 @@ async def upload_apk_chunk(
     if not (0 <= chunk_index < total_chunks):
         raise HTTPException(status_code=422, detail="Invalid chunk index or total chunks")
 
-    chunk_dir = f"/tmp/apk_chunks/{apk_id}"
-    os.makedirs(chunk_dir, exist_ok=True)
-
-    chunk_path = f"{chunk_dir}/chunk_{chunk_index:05d}"
-    chunk_content = await file.read()
-    
-    with open(chunk_path, "wb") as f:
-        f.write(chunk_content)
+    try:
+        result = await asyncio.to_thread(
+            chunked_upload_store.write_chunk, apk_id, chunk_index, total_chunks, file.file
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
     structured_logger.log_event(
         "apk.upload.chunk",
         apk_id=apk_id,
         chunk_index=chunk_index,
         total_chunks=total_chunks,
-        chunk_size=len(chunk_content)
+        chunk_size=result["chunk_size"],
+        bytes_hashed=result["bytes_hashed"]
     )
 
     return {
@@ -6655,6 +6798,21 @@ async def upload_apk_chunk(
         "message": f"Chunk {chunk_index + 1}/{total_chunks} uploaded successfully"
     }
 
+@app.get("/v1/apk/upload-status/{apk_id}")
+async def get_apk_upload_status(
+    apk_id: int,
+    x_admin_key: str = Header(..., alias="X-Admin-Key")
+):
+    """Report received and missing chunks so an interrupted upload can resume."""
+    verify_admin_key(x_admin_key)
+
+    try:
+        status = await asyncio.to_thread(chunked_upload_store.get_status, apk_id)
+    except UploadError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return {"ok": True, "apk_id": apk_id, **status}
+
 @app.post("/v1/apk/complete")
 async def complete_apk_upload(
     request: Request,
@@ -6663,51 +6821,35 @@ async def complete_apk_upload(
     db: Session = Depends(get_db),
     x_admin_key: str = Header(..., alias="X-Admin-Key")
 ):
-    """Assemble chunks and finalize APK upload."""
+    """Finalize a chunked APK upload: verify all chunks arrived and stream the file to storage."""
     verify_admin_key(x_admin_key)
 
     apk_version = db.query(ApkVersion).filter(ApkVersion.id == apk_id).first()
     if not apk_version:
         raise HTTPException(status_code=404, detail="APK version not found")
 
-    chunk_dir = f"/tmp/apk_chunks/{apk_id}"
-    
-    existing_chunks = []
-    for i in range(total_chunks):
-        chunk_path = f"{chunk_dir}/chunk_{i:05d}"
-        if not os.path.exists(chunk_path):
-            raise HTTPException(status_code=400, detail=f"Missing chunk {i}")
-        existing_chunks.append(chunk_path)
-
-    assembled_path = f"{chunk_dir}/assembled.apk"
-    sha256_hash = hashlib.sha256()
-    total_size = 0
-
-    with open(assembled_path, "wb") as assembled_file:
-        for chunk_path in existing_chunks:
-            with open(chunk_path, "rb") as chunk_file:
-                chunk_data = chunk_file.read()
-                assembled_file.write(chunk_data)
-                sha256_hash.update(chunk_data)
-                total_size += len(chunk_data)
+    # Chunks were written in place and hashed as they arrived
+    try:
+        upload = await asyncio.to_thread(chunked_upload_store.finalize, apk_id)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     storage_service = get_storage_service()
     object_name = f"apks/{apk_version.version_name}_{apk_version.version_code}.apk"
-    
-    with open(assembled_path, "rb") as f:
-        file_content = f.read()
-        storage_service.upload_file(file_content, object_name)
+    await asyncio.to_thread(storage_service.upload_from_path, upload["path"], object_name)
+
+    total_size = upload["file_size"]
+    sha256_hex = upload["sha256"]
 
     apk_version.file_size = total_size
-    apk_version.sha256 = sha256_hash.hexdigest()
+    apk_version.sha256 = sha256_hex
     apk_version.file_path = object_name
     apk_version.storage_url = object_name
     apk_version.is_active = True
     apk_version.notes = f"Uploaded via chunked upload ({total_chunks} chunks)"
     db.commit()
 
-    import shutil
-    shutil.rmtree(chunk_dir, ignore_errors=True)
+    await asyncio.to_thread(chunked_upload_store.cleanup, apk_id)
 
     structured_logger.log_event(
         "apk.upload.complete",
@@ -6716,7 +6858,7 @@ async def complete_apk_upload(
         version_name=apk_version.version_name,
         version_code=apk_version.version_code,
         file_size=total_size,
-        sha256_hash=sha256_hash.hexdigest()
+        sha256_hash=sha256_hex
     )
 
     return {
@@ -6725,7 +6867,7 @@ async def complete_apk_upload(
         "version_name": apk_version.version_name,
         "version_code": apk_version.version_code,
         "file_size": total_size,
-        "sha256": sha256_hash.hexdigest(),
+        "sha256": sha256_hex,
         "message": "APK uploaded and assembled successfully"
     }
 
@@ -7412,8 +7554,8 @@ async def send_command(
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FCM authentication failed: {str(e)}")
 
@@ -7448,9 +7590,9 @@ async def send_command(
 
     fcm_start_time = time.time()
 
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         try:
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+            response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_INTERACTIVE)
 
             if response.status_code != 200:
                 command.status = "failed"
@@ -7540,8 +7682,8 @@ async def remote_exec(
     import httpx
 
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"FCM authentication failed: {str(e)}")
 
@@ -7571,9 +7713,9 @@ async def remote_exec(
         }
     }
 
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         try:
-            response = await client.post(fcm_url, json=message, headers=headers, timeout=10.0)
+            response = await fcm_scheduler.post(client, fcm_url, json=message, headers=headers, lane=LANE_INTERACTIVE)
 
             if response.status_code != 200:
                 command.status = "failed"
@@ -7700,9 +7842,6 @@ async def get_admin_commands(
 # Rate limiting: 10 batch remote executions per minute per user
 remote_exec_batch_limiter = RateLimiter(max_requests=10, window_seconds=60)
 
-# Concurrency control for FCM dispatch (prevent overwhelming Firebase)
-FCM_DISPATCH_CONCURRENCY = 20  # Max concurrent FCM requests
-
 class RemoteExecRequest(BaseModel):
     mode: str  # "fcm" or "shell"
     payload: Optional[dict] = None  # FCM payload or {"script": "..."} for shell
@@ -7728,7 +7867,6 @@ async def dispatch_fcm_to_device(
     exec_id: str,
     mode: str,
     payload: dict,
-    semaphore: asyncio.Semaphore,
     client: "httpx.AsyncClient",
     fcm_url: str,
     access_token: str,
@@ -7736,139 +7874,138 @@ async def dispatch_fcm_to_device(
     correlation_id: str  # Pre-generated correlation_id to match DB record
 ) -> dict:
     """
-    Dispatch FCM message to a single device with semaphore-based concurrency control.
+    Dispatch FCM message to a single device through the global FCM dispatch scheduler.
     Uses pre-generated correlation_id that matches the RemoteExecResult record in DB.
     Returns result dict with device_id, status, and optional error.
     """
     
-    async with semaphore:
-        try:
-            if not device.fcm_token:
-                return {
-                    "device_id": device.id,
-                    "alias": device.alias,
-                    "correlation_id": correlation_id,
-                    "status": "error",
-                    "error": "No FCM token"
-                }
-            
-            timestamp = datetime.now(timezone.utc).isoformat()
-            action = f"remote_exec_{mode}"
-            
-            if mode == "shell":
-                command = payload.get("script", "")
-                # Include critical payload field (command) in HMAC to prevent tampering
-                payload_fields = {"command": command}
-                hmac_signature = compute_hmac_signature_with_payload(
-                    correlation_id, device.id, action, timestamp, payload_fields
-                )
-                fcm_data = {
-                    "action": "remote_exec_shell",
-                    "exec_id": exec_id,
-                    "correlation_id": correlation_id,
-                    "device_id": device.id,
-                    "command": command,
-                    "ts": timestamp,
-                    "hmac": hmac_signature
-                }
-            else:  # FCM mode
-                # Include critical payload fields in HMAC to prevent tampering
-                # Extract type and other critical fields from payload
-                payload_fields = {}
-                if "type" in payload:
-                    payload_fields["type"] = str(payload["type"])
-                if "package_name" in payload:
-                    payload_fields["package_name"] = str(payload["package_name"])
-                if "enable" in payload:  # For set_dnd
-                    payload_fields["enable"] = str(payload["enable"])
-                if "duration" in payload:  # For ring
-                    payload_fields["duration"] = str(payload["duration"])
-                
-                hmac_signature = compute_hmac_signature_with_payload(
-                    correlation_id, device.id, action, timestamp, payload_fields
-                )
-                fcm_data = {
-                    "action": "remote_exec_fcm",
-                    "exec_id": exec_id,
-                    "correlation_id": correlation_id,
-                    "device_id": device.id,
-                    "ts": timestamp,
-                    "hmac": hmac_signature,
-                    **{k: str(v) for k, v in payload.items()}  # Flatten payload into FCM data
-                }
-            
-            fcm_message = {
-                "message": {
-                    "token": device.fcm_token,
-                    "data": fcm_data,
-                    "android": {
-                        "priority": "high"
-                    }
-                }
+    try:
+        if not device.fcm_token:
+            return {
+                "device_id": device.id,
+                "alias": device.alias,
+                "correlation_id": correlation_id,
+                "status": "error",
+                "error": "No FCM token"
             }
-            
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
+        
+        timestamp = datetime.now(timezone.utc).isoformat()
+        action = f"remote_exec_{mode}"
+        
+        if mode == "shell":
+            command = payload.get("script", "")
+            # Include critical payload field (command) in HMAC to prevent tampering
+            payload_fields = {"command": command}
+            hmac_signature = compute_hmac_signature_with_payload(
+                correlation_id, device.id, action, timestamp, payload_fields
+            )
+            fcm_data = {
+                "action": "remote_exec_shell",
+                "exec_id": exec_id,
+                "correlation_id": correlation_id,
+                "device_id": device.id,
+                "command": command,
+                "ts": timestamp,
+                "hmac": hmac_signature
             }
+        else:  # FCM mode
+            # Include critical payload fields in HMAC to prevent tampering
+            # Extract type and other critical fields from payload
+            payload_fields = {}
+            if "type" in payload:
+                payload_fields["type"] = str(payload["type"])
+            if "package_name" in payload:
+                payload_fields["package_name"] = str(payload["package_name"])
+            if "enable" in payload:  # For set_dnd
+                payload_fields["enable"] = str(payload["enable"])
+            if "duration" in payload:  # For ring
+                payload_fields["duration"] = str(payload["duration"])
             
-            response = await client.post(fcm_url, json=fcm_message, headers=headers, timeout=10.0)
-            
-            if response.status_code == 200:
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "sent"
-                }
-                return {
-                    "device_id": device.id,
-                    "alias": device.alias,
-                    "correlation_id": correlation_id,
-                    "status": "sent"
-                }
-            else:
-                error_msg = f"FCM error: {response.status_code}"
-                db_results[device.id] = {
-                    "correlation_id": correlation_id,
-                    "alias": device.alias,
-                    "status": "error",
-                    "error": error_msg
-                }
-                return {
-                    "device_id": device.id,
-                    "alias": device.alias,
-                    "correlation_id": correlation_id,
-                    "status": "error",
-                    "error": error_msg
+            hmac_signature = compute_hmac_signature_with_payload(
+                correlation_id, device.id, action, timestamp, payload_fields
+            )
+            fcm_data = {
+                "action": "remote_exec_fcm",
+                "exec_id": exec_id,
+                "correlation_id": correlation_id,
+                "device_id": device.id,
+                "ts": timestamp,
+                "hmac": hmac_signature,
+                **{k: str(v) for k, v in payload.items()}  # Flatten payload into FCM data
+            }
+        
+        fcm_message = {
+            "message": {
+                "token": device.fcm_token,
+                "data": fcm_data,
+                "android": {
+                    "priority": "high"
                 }
-        except asyncio.TimeoutError:
+            }
+        }
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        response = await fcm_scheduler.post(client, fcm_url, json=fcm_message, headers=headers, lane=LANE_BULK)
+        
+        if response.status_code == 200:
             db_results[device.id] = {
                 "correlation_id": correlation_id,
                 "alias": device.alias,
-                "status": "error",
-                "error": "FCM timeout"
+                "status": "sent"
             }
             return {
                 "device_id": device.id,
                 "alias": device.alias,
                 "correlation_id": correlation_id,
-                "status": "error",
-                "error": "FCM timeout"
+                "status": "sent"
             }
-        except Exception as e:
+        else:
+            error_msg = f"FCM error: {response.status_code}"
             db_results[device.id] = {
                 "correlation_id": correlation_id,
                 "alias": device.alias,
                 "status": "error",
-                "error": str(e)
+                "error": error_msg
             }
             return {
                 "device_id": device.id,
                 "alias": device.alias,
                 "correlation_id": correlation_id,
                 "status": "error",
-                "error": str(e)
+                "error": error_msg
             }
+    except asyncio.TimeoutError:
+        db_results[device.id] = {
+            "correlation_id": correlation_id,
+            "alias": device.alias,
+            "status": "error",
+            "error": "FCM timeout"
+        }
+        return {
+            "device_id": device.id,
+            "alias": device.alias,
+            "correlation_id": correlation_id,
+            "status": "error",
+            "error": "FCM timeout"
+        }
+    except Exception as e:
+        db_results[device.id] = {
+            "correlation_id": correlation_id,
+            "alias": device.alias,
+            "status": "error",
+            "error": str(e)
+        }
+        return {
+            "device_id": device.id,
+            "alias": device.alias,
+            "correlation_id": correlation_id,
+            "status": "error",
+            "error": str(e)
+        }
 
 @app.get("/v1/remote-exec")
 async def list_remote_executions(
@@ -8024,8 +8161,8 @@ async def create_remote_execution(
     
     # Get FCM credentials
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
         fcm_url = build_fcm_v1_url(project_id)
     except Exception as e:
         exec_record.status = "failed"
@@ -8055,18 +8192,16 @@ async def create_remote_execution(
     # This prevents race condition where ACKs arrive before records exist
     db.commit()
     
-    # Dispatch FCM messages in parallel with bounded concurrency
-    semaphore = asyncio.Semaphore(FCM_DISPATCH_CONCURRENCY)
+    # Dispatch FCM messages in parallel; fcm_scheduler bounds global concurrency and rate
     dispatch_results = {}  # Track dispatch success/failure per device
     
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         tasks = [
             dispatch_fcm_to_device(
                 device=device,
                 exec_id=exec_id,
                 mode=request.mode,
                 payload=effective_payload,
-                semaphore=semaphore,
                 client=client,
                 fcm_url=fcm_url,
                 access_token=access_token,
@@ -8178,13 +8313,17 @@ async def get_remote_execution(
 async def remote_exec_ack(
     request: RemoteExecAckRequest,
     req: Request,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_route_db)
 ):
     """
     Receive ACK from device for remote execution command.
     Called by Android agent after executing the command.
     Updates RemoteExecResult status and parent RemoteExec counters.
     """
+    return await run_in_session(db, _record_remote_exec_ack, request)
+
+def _record_remote_exec_ack(db: Session, request: RemoteExecAckRequest) -> dict:
+    """DB work for /v1/remote-exec/ack"""
     # Find the result record by correlation_id
     result = db.query(RemoteExecResult).filter(
         RemoteExecResult.correlation_id == request.correlation_id,
@@ -8360,8 +8499,8 @@ async def restart_app(
     
     # Get FCM credentials
     try:
-        access_token = get_access_token()
-        project_id = get_firebase_project_id()
+        access_token = await fcm_client.get_access_token()
+        project_id = fcm_client.get_project_id()
         fcm_url = build_fcm_v1_url(project_id)
     except Exception as e:
         force_stop_exec.status = "failed"
@@ -8399,16 +8538,14 @@ async def restart_app(
     db.commit()
     
     # Dispatch force-stop commands using the correct 'action: remote_exec' format
-    semaphore = asyncio.Semaphore(FCM_DISPATCH_CONCURRENCY)
     force_stop_results = {}
     
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         tasks = [
             dispatch_force_stop_to_device(
                 device=device,
                 package_name=request.package_name,
                 correlation_id=force_stop_correlations[device.id],
-                semaphore=semaphore,
                 client=client,
                 fcm_url=fcm_url,
                 access_token=access_token,
@@ -8445,13 +8582,12 @@ async def restart_app(
     # Dispatch launch commands using the correct 'action: launch_app' format
     launch_results = {}
     
-    async with httpx.AsyncClient() as client:
+    async with fcm_client.session() as client:
         tasks = [
             dispatch_launch_app_to_device(
                 device=device,
                 package_name=request.package_name,
                 correlation_id=launch_correlations[device.id],
-                semaphore=semaphore,
                 client=client,
                 fcm_url=fcm_url,
                 access_token=access_token,
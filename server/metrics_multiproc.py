@@ -0,0 +1,303 @@
+"""
+Multi-worker metrics aggregation.
+
+`uvicorn --workers N` gives every worker its own in-memory MetricsCollector,
+so a scrape only sees the worker that happened to answer it. When
+METRICS_MULTIPROC_DIR is set, each worker periodically publishes a snapshot
+of its collector to <dir>/worker_<pid>.json (atomic rename, off the event
+loop). At scrape time the answering worker publishes its own fresh snapshot
+and merges every live worker's file:
+
+- counters and histograms are summed (histograms merge bucket-wise)
+- gauges are combined per metric mode: sum (default), max, min or
+  mostrecent (latest set_gauge across workers wins)
+
+The hot path (inc_counter/observe_histogram/set_gauge) is unchanged.
+Without METRICS_MULTIPROC_DIR everything falls back to the local collector.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from observability import MetricsCollector, Histogram, QuantileSketch, structured_logger, metrics
+
+
+def _series_to_json(data: Dict[tuple, Any]) -> List[Dict[str, Any]]:
+    return [{"labels": [list(item) for item in labels], "value": value} for labels, value in data.items()]
+
+
+def _series_from_json(series: List[Dict[str, Any]]) -> Dict[tuple, Any]:
+    return {tuple(tuple(item) for item in entry["labels"]): entry["value"] for entry in series}
+
+
+def _histogram_to_json(histogram: Histogram) -> Dict[str, Any]:
+    return {
+        "buckets": histogram.buckets,
+        "counts": histogram.counts,
+        "sum": histogram.sum,
+        "count": histogram.count,
+        "sketch": histogram.sketch.to_dict() if histogram.sketch else None
+    }
+
+
+def _histogram_from_json(data: Dict[str, Any]) -> Histogram:
+    histogram = Histogram(data["buckets"])
+    histogram.counts = list(data["counts"])
+    histogram.sum = data["sum"]
+    histogram.count = data["count"]
+    if data.get("sketch"):
+        histogram.sketch = QuantileSketch.from_dict(data["sketch"])
+    return histogram
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MultiprocessMetrics:
+    """
+    Publishes this worker's metrics to a shared directory and aggregates all
+    workers' files for exposition.
+    """
+
+    GAUGE_MODES = ("sum", "max", "min", "mostrecent")
+
+    def __init__(
+        self,
+        collector: MetricsCollector,
+        directory: Optional[str] = None,
+        flush_interval_s: float = 5.0
+    ):
+        self.collector = collector
+        self.directory = directory
+        self.flush_interval_s = flush_interval_s
+        self.pid = os.getpid()
+        self._gauge_modes: Dict[str, str] = {}
+        self._pre_publish_hooks: List[Callable[[], None]] = []
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def set_gauge_mode(self, metric_name: str, mode: str):
+        """Choose how a gauge is combined across workers (sum, max, min, mostrecent)"""
+        if mode not in self.GAUGE_MODES:
+            raise ValueError(f"Unknown gauge mode: {mode}")
+        self._gauge_modes[metric_name] = mode
+
+    def add_pre_publish_hook(self, hook: Callable[[], None]):
+        """Register a callable that refreshes sampled gauges before each publish"""
+        self._pre_publish_hooks.append(hook)
+
+    def _worker_file(self, pid: int) -> str:
+        return os.path.join(self.directory, f"worker_{pid}.json")
+
+    def publish(self):
+        """Write this worker's snapshot (atomic replace)"""
+        if not self.enabled:
+            return
+
+        for hook in self._pre_publish_hooks:
+            try:
+                hook()
+            except Exception as e:
+                structured_logger.log_event("metrics.pre_publish_hook_failed", level="WARN", error=str(e))
+
+        # The pid can change after fork; always publish under the current one
+        self.pid = os.getpid()
+        snapshot = self.collector.snapshot()
+        payload = {
+            "pid": self.pid,
+            "published_at": time.time(),
+            "counters": {name: _series_to_json(data) for name, data in snapshot["counters"].items()},
+            "gauges": {name: _series_to_json(data) for name, data in snapshot["gauges"].items()},
+            "gauge_updated": {name: _series_to_json(data) for name, data in snapshot["gauge_updated"].items()},
+            "histograms": {
+                name: [{"labels": [list(item) for item in labels], "value": _histogram_to_json(hist)}
+                       for labels, hist in data.items()]
+                for name, data in snapshot["histograms"].items()
+            }
+        }
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._worker_file(self.pid)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    def _read_worker_files(self) -> List[Dict[str, Any]]:
+        """Load every live worker's snapshot; files of exited workers are removed"""
+        payloads = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return payloads
+
+        for name in names:
+            if not (name.startswith("worker_") and name.endswith(".json")):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                pid = int(name[len("worker_"):-len(".json")])
+            except ValueError:
+                continue
+
+            if pid != self.pid and not _pid_alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+
+            try:
+                with open(path) as f:
+                    payloads.append(json.load(f))
+            except (OSError, ValueError) as e:
+                structured_logger.log_event("metrics.worker_file_unreadable", level="WARN", path=path, error=str(e))
+
+        return payloads
+
+    def aggregate_snapshot(self) -> Dict[str, Any]:
+        """
+        Merge all workers' snapshots into the MetricsCollector.snapshot() format.
+        Falls back to the local collector when multiprocess mode is off.
+        """
+        if not self.enabled:
+            return self.collector.snapshot()
+
+        self.publish()
+        payloads = self._read_worker_files()
+
+        counters: Dict[str, Dict[tuple, int]] = {}
+        histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        gauge_values: Dict[str, Dict[tuple, List[Tuple[float, float]]]] = {}
+
+        for payload in payloads:
+            for name, series in payload["counters"].items():
+                target = counters.setdefault(name, {})
+                for labels, value in _series_from_json(series).items():
+                    target[labels] = target.get(labels, 0) + value
+
+            for name, series in payload["histograms"].items():
+                target = histograms.setdefault(name, {})
+                for labels, data in _series_from_json(series).items():
+                    histogram = _histogram_from_json(data)
+                    if labels in target:
+                        try:
+                            target[labels].merge(histogram)
+                        except ValueError:
+                            # Bucket layout changed between deploys; keep the first layout seen
+                            continue
+                    else:
+                        target[labels] = histogram
+
+            updated = {name: _series_from_json(series) for name, series in payload.get("gauge_updated", {}).items()}
+            for name, series in payload["gauges"].items():
+                target = gauge_values.setdefault(name, {})
+                for labels, value in _series_from_json(series).items():
+                    ts = updated.get(name, {}).get(labels, payload["published_at"])
+                    target.setdefault(labels, []).append((ts, value))
+
+        gauges: Dict[str, Dict[tuple, float]] = {}
+        for name, series in gauge_values.items():
+            mode = self._gauge_modes.get(name, "sum")
+            gauges[name] = {}
+            for labels, samples in series.items():
+                values = [value for _, value in samples]
+                if mode == "max":
+                    gauges[name][labels] = max(values)
+                elif mode == "min":
+                    gauges[name][labels] = min(values)
+                elif mode == "mostrecent":
+                    gauges[name][labels] = max(samples)[1]
+                else:
+                    gauges[name][labels] = sum(values)
+
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def get_prometheus_text(self) -> str:
+        """Prometheus exposition for the whole server (all workers)"""
+        return self.collector.format_prometheus_text(self.aggregate_snapshot())
+
+    def get_worker_gauges(self, metric_names: List[str]) -> Dict[int, Dict[str, float]]:
+        """
+        Unlabelled gauge values per worker pid (e.g. each worker's pool stats).
+        Only the local worker is reported when multiprocess mode is off.
+        """
+        if not self.enabled:
+            snapshot = self.collector.snapshot()
+            return {self.pid: {name: snapshot["gauges"].get(name, {}).get(()) for name in metric_names}}
+
+        self.publish()
+        result = {}
+        for payload in self._read_worker_files():
+            gauges = {name: _series_from_json(series) for name, series in payload["gauges"].items()}
+            result[payload["pid"]] = {name: gauges.get(name, {}).get(()) for name in metric_names}
+        return result
+
+    async def start(self):
+        """Start the periodic publisher"""
+        if not self.enabled or self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._publish_loop())
+        structured_logger.log_event(
+            "metrics.multiproc.started",
+            directory=self.directory,
+            pid=os.getpid(),
+            flush_interval_s=self.flush_interval_s
+        )
+
+    async def stop(self):
+        """Stop publishing and remove this worker's file"""
+        if not self._running:
+            return
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            os.remove(self._worker_file(os.getpid()))
+        except OSError:
+            pass
+
+    async def _publish_loop(self):
+        while self._running:
+            try:
+                await asyncio.to_thread(self.publish)
+            except Exception as e:
+                structured_logger.log_event(
+                    "metrics.multiproc.publish_failed",
+                    level="ERROR",
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
+            await asyncio.sleep(self.flush_interval_s)
+
+
+# Global instance
+metrics_aggregator = MultiprocessMetrics(
+    metrics,
+    directory=os.getenv("METRICS_MULTIPROC_DIR") or None,
+    flush_interval_s=float(os.getenv("METRICS_FLUSH_INTERVAL_S", "5"))
+)
+metrics_aggregator.set_gauge_mode("db_pool_utilization_pct", "max")
+metrics_aggregator.set_gauge_mode("service_up_devices", "mostrecent")
+# Every worker's offline detector tracks the whole fleet
+metrics_aggregator.set_gauge_mode("devices_online", "max")
+metrics_aggregator.set_gauge_mode("devices_offline", "max")
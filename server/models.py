@@ -1,14 +1,91 @@
 from datetime import datetime, timezone
-from sqlalchemy import String, DateTime, Text, create_engine, Integer, Index, Boolean, ForeignKey, UniqueConstraint, BigInteger, func, Computed
+from sqlalchemy import String, DateTime, Text, create_engine, text, inspect as sa_inspect, Integer, Index, Boolean, ForeignKey, UniqueConstraint, BigInteger, func, Computed, literal_column
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
-from typing import Optional
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from typing import Optional, Callable, Any
+import asyncio
+import json
 import os
 import uuid
 
 class Base(DeclarativeBase):
     pass
 
+# devices.last_status storage: JSONB plus generated filter columns once the
+# last_status_jsonb migration has run (or for a database created by init_db),
+# JSON text otherwise. Decided from the schema by init_db(), not configured.
+LAST_STATUS_JSONB = False
+
+# (column, type, expression) generated from devices.last_status for SQL-side filters
+LAST_STATUS_GENERATED_COLUMNS = [
+    ('last_battery_pct', 'INTEGER', "(last_status->'battery'->>'pct')::numeric::integer"),
+    ('last_unity_status', 'VARCHAR', "last_status->'unity'->>'status'"),
+    ('last_service_up', 'BOOLEAN', "(last_status->>'service_up')::boolean"),
+    ('last_ssid', 'VARCHAR', "last_status->'network'->>'ssid'"),
+]
+
+def last_status_generated_ddl() -> list:
+    """Idempotent DDL adding the generated last_* columns and their indexes"""
+    statements = [
+        f"ALTER TABLE devices ADD COLUMN IF NOT EXISTS {name} {sql_type} GENERATED ALWAYS AS ({expression}) STORED"
+        for name, sql_type, expression in LAST_STATUS_GENERATED_COLUMNS
+    ]
+    statements += [
+        "CREATE INDEX IF NOT EXISTS idx_device_last_battery_pct ON devices (last_battery_pct) WHERE last_battery_pct IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_device_last_unity_status ON devices (last_unity_status)",
+        "CREATE INDEX IF NOT EXISTS idx_device_last_service_up ON devices (last_service_up) WHERE last_service_up IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_device_last_ssid ON devices (last_ssid) WHERE last_ssid IS NOT NULL",
+    ]
+    return statements
+
+def jsonb_status_schema(columns: list) -> bool:
+    """
+    Whether reflected devices columns (Inspector.get_columns) hold last_status
+    as JSONB together with every generated last_* column.
+    """
+    names = {c['name']: c for c in columns}
+    last_status = names.get('last_status')
+    return (
+        last_status is not None
+        and isinstance(last_status['type'], JSONB)
+        and all(name in names for name, _, _ in LAST_STATUS_GENERATED_COLUMNS)
+    )
+
+def uses_jsonb_status(dialect_name: str) -> bool:
+    """Whether last_status is JSONB, with its generated columns, on this database"""
+    return LAST_STATUS_JSONB and dialect_name == "postgresql"
+
+class StatusJSON(TypeDecorator):
+    """
+    JSON document column: JSONB when the schema stores it that way
+    (LAST_STATUS_JSONB, see init_db), JSON text otherwise. Either way callers assign and read dicts.
+    """
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if uses_jsonb_status(dialect.name):
+            return dialect.type_descriptor(JSONB())
+        return dialect.type_descriptor(Text())
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            value = json.loads(value)
+        if value is None or uses_jsonb_status(dialect.name):
+            return value
+        return json.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError:
+                return None
+        return value
+
 class User(Base):
     __tablename__ = "users"
     
@@ -39,7 +116,7 @@ class Device(Base):
     token_revoked_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, index=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
     last_seen: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
-    last_status: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    last_status: Mapped[Optional[dict]] = mapped_column(StatusJSON, nullable=True)
     last_alert_state: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     fcm_token: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     last_ping_sent: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -67,8 +144,23 @@ class Device(Base):
         Index('idx_device_status_query', 'last_seen'),
         Index('idx_device_token_lookup', 'token_id'),
         Index('idx_device_monitoring', 'monitor_enabled', 'monitored_package'),
+        # /v1/devices keyset pagination: one (sort key, id) index per sort.
+        # The lower(alias) text_pattern_ops index for alias prefix filters is
+        # PostgreSQL-only and created in the add_device_list_indexes migration.
+        Index('idx_device_list_last_seen', 'last_seen', 'id'),
+        Index('idx_device_list_alias', 'alias', 'id'),
+        Index('idx_device_list_version', func.coalesce(installed_apk_version_code, -1), 'id'),
     )
 
+# Generated from devices.last_status (LAST_STATUS_GENERATED_COLUMNS);
+# only present when uses_jsonb_status() holds
+DEVICE_STATUS_COLUMNS = {
+    "battery_pct": literal_column("devices.last_battery_pct"),
+    "unity_status": literal_column("devices.last_unity_status"),
+    "service_up": literal_column("devices.last_service_up"),
+    "ssid": literal_column("devices.last_ssid"),
+}
+
 class DeviceEvent(Base):
     __tablename__ = "device_events"
     
@@ -284,6 +376,12 @@ class ApkDeploymentStats(Base):
         Index('idx_deployment_stats_updated', 'last_updated'),
     )
 
+def _heartbeat_bucket(context) -> datetime:
+    """Default bucket_ts: start of the 10-second dedup bucket containing ts"""
+    from db_utils import compute_heartbeat_bucket
+    ts = context.get_current_parameters().get("ts") or datetime.now(timezone.utc)
+    return compute_heartbeat_bucket(ts)
+
 class DeviceHeartbeat(Base):
     __tablename__ = "device_heartbeats"
     
@@ -308,6 +406,10 @@ class DeviceHeartbeat(Base):
     unity_running: Mapped[Optional[bool]] = mapped_column(Boolean, nullable=True)
     agent_version: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     
+    # Dedup key: every daily partition has a unique (device_id, bucket_ts)
+    # index (created with the partition, see db_utils.create_heartbeat_partition)
+    bucket_ts: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True, default=_heartbeat_bucket)
+    
     __table_args__ = (
         Index('idx_heartbeat_device_ts', 'device_id', 'ts'),
     )
@@ -339,6 +441,62 @@ class DeviceLastStatus(Base):
         Index('idx_last_status_service_down', 'service_up', 'last_ts'),
     )
 
+class _HeartbeatRollupColumns:
+    """
+    Per-device heartbeat aggregates for one time bucket (see heartbeat_rollups).
+    Sums and sample counts are stored instead of averages so buckets can be
+    merged into coarser ones.
+    """
+    
+    device_id: Mapped[str] = mapped_column(String, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    bucket_ts: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    samples: Mapped[int] = mapped_column(Integer, nullable=False)
+    
+    battery_min: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    battery_max: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    battery_sum: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    battery_samples: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    
+    unity_running_samples: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    unity_known_samples: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    
+    # Samples per network transport ("wifi", "cell", "none"; the rest is other)
+    net_wifi: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    net_cell: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    net_none: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Transport changes between consecutive heartbeats, including across bucket edges
+    net_changes: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_network_type: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+class HeartbeatRollup1m(_HeartbeatRollupColumns, Base):
+    __tablename__ = "device_heartbeat_rollups_1m"
+    
+    __table_args__ = (
+        Index('idx_hb_rollup_1m_bucket', 'bucket_ts'),
+    )
+
+class HeartbeatRollup1h(_HeartbeatRollupColumns, Base):
+    __tablename__ = "device_heartbeat_rollups_1h"
+    
+    __table_args__ = (
+        Index('idx_hb_rollup_1h_bucket', 'bucket_ts'),
+    )
+
+class HeartbeatRollup1d(_HeartbeatRollupColumns, Base):
+    __tablename__ = "device_heartbeat_rollups_1d"
+    
+    __table_args__ = (
+        Index('idx_hb_rollup_1d_bucket', 'bucket_ts'),
+    )
+
+class HeartbeatRollupState(Base):
+    __tablename__ = "heartbeat_rollup_state"
+    
+    # "1m", "1h" or "1d"; every bucket before rolled_through is final
+    resolution: Mapped[str] = mapped_column(String, primary_key=True)
+    rolled_through: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
 class HeartbeatPartition(Base):
     __tablename__ = "hb_partitions"
     
@@ -351,6 +509,9 @@ class HeartbeatPartition(Base):
     bytes_size: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     checksum_sha256: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     archive_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    # Queryable Parquet copy (columnar_archive); kept after the partition is dropped
+    parquet_url: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    parquet_checksum_sha256: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     
     created_at: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     archived_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -683,8 +844,58 @@ else:
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async session layer (asyncpg) for hot routes, behind ASYNC_DB_ROUTES so latency can be A/B tested.
+# Requires PostgreSQL; with SQLite the flag is ignored and routes keep the sync session.
+ASYNC_DB_ROUTES = os.getenv("ASYNC_DB_ROUTES", "false").lower() == "true" and "sqlite" not in DATABASE_URL
+
+def _async_database_url(url: str):
+    """Map DATABASE_URL to the asyncpg driver; asyncpg takes sslmode as the `ssl` connect arg"""
+    parsed = make_url(url)
+    query = dict(parsed.query)
+    sslmode = query.pop("sslmode", None)
+    connect_args = {"ssl": sslmode} if sslmode and sslmode != "disable" else {}
+    return parsed.set(drivername="postgresql+asyncpg", query=query), connect_args
+
+async_engine = None
+AsyncSessionLocal = None
+
+if ASYNC_DB_ROUTES:
+    _async_url, _async_connect_args = _async_database_url(DATABASE_URL)
+    # Separate, smaller pool: only the ported routes use it
+    async_engine = create_async_engine(
+        _async_url,
+        connect_args=_async_connect_args,
+        pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", "25")),
+        max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "25")),
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        pool_timeout=10
+    )
+    # expire_on_commit=False: attribute access after commit must not trigger lazy IO outside a greenlet
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 def init_db():
+    """
+    Create missing tables and pick the devices.last_status storage mode.
+
+    The mode is read from the schema before create_all compiles any DDL: an
+    existing devices table is JSONB mode only if the last_status_jsonb
+    migration has run; a new PostgreSQL database is created in JSONB mode,
+    generated columns included.
+    """
+    global LAST_STATUS_JSONB
+    if engine.dialect.name != "postgresql":
+        Base.metadata.create_all(bind=engine)
+        return
+
+    inspector = sa_inspect(engine)
+    fresh = not inspector.has_table("devices")
+    LAST_STATUS_JSONB = fresh or jsonb_status_schema(inspector.get_columns("devices"))
     Base.metadata.create_all(bind=engine)
+    if fresh:
+        with engine.begin() as conn:
+            for statement in last_status_generated_ddl():
+                conn.execute(text(statement))
 
 def get_db():
     db = SessionLocal()
@@ -692,3 +903,39 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Session dependency for the ported hot routes
+get_route_db = get_async_db if ASYNC_DB_ROUTES else get_db
+
+async def run_in_session(db, fn: Callable[..., Any], *args) -> Any:
+    """
+    Run sync ORM code fn(session, *args) against either session type.
+
+    With an AsyncSession the function runs through run_sync(): the ORM code is
+    unchanged but every query is awaited on asyncpg, so the event loop is free
+    while Postgres works. With a sync Session it is called directly.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return fn(db, *args)
+
+async def run_in_session_threaded(db, fn: Callable[..., Any], *args) -> Any:
+    """
+    Like run_in_session, but a sync Session's work runs in a worker thread.
+    For long reads that must not hold up the event loop whichever session type
+    the route gets.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await asyncio.to_thread(fn, db, *args)
+
+async def commit_session(db):
+    """Commit either session type"""
+    if isinstance(db, AsyncSession):
+        await db.commit()
+    else:
+        db.commit()
@@ -2,7 +2,7 @@
 Helper functions for monitoring configuration.
 Handles fallback to global defaults for devices without per-device overrides.
 """
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from sqlalchemy.orm import Session
 from models import Device
 from monitoring_defaults_cache import monitoring_defaults_cache
@@ -93,3 +93,43 @@ def get_effective_monitoring_settings(db: Session, device: Device) -> Dict[str,
             "threshold_min": threshold_min,
             "source": source
         }
+
+
+def log_service_transition(
+    device_id: str,
+    alias: str,
+    monitoring_settings: Dict[str, Any],
+    prev_service_up: Optional[bool],
+    service_up: Optional[bool],
+    foreground_recent_s: Optional[int]
+) -> None:
+    """
+    Log a monitored service state transition (up -> down or down -> up).
+    No-op when monitoring is disabled or either state is unknown.
+    """
+    if not monitoring_settings["enabled"] or prev_service_up is None or service_up is None:
+        return
+    
+    if prev_service_up and not service_up:
+        # Service went DOWN
+        structured_logger.log_event(
+            "monitoring.service_down",
+            device_id=device_id,
+            alias=alias,
+            monitored_package=monitoring_settings["package"],
+            monitored_app_name=monitoring_settings["alias"],
+            foreground_recent_s=foreground_recent_s,
+            threshold_min=monitoring_settings["threshold_min"],
+            source=monitoring_settings["source"]
+        )
+    elif not prev_service_up and service_up:
+        # Service RECOVERED
+        structured_logger.log_event(
+            "monitoring.service_up",
+            device_id=device_id,
+            alias=alias,
+            monitored_package=monitoring_settings["package"],
+            monitored_app_name=monitoring_settings["alias"],
+            foreground_recent_s=foreground_recent_s,
+            source=monitoring_settings["source"]
+        )
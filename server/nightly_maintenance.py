@@ -4,8 +4,10 @@ Nightly maintenance job for partition lifecycle management.
 
 Responsibilities:
 1. Create future partitions (3 days ahead)
-2. Archive old partitions (CSV export + SHA-256 + object storage)
-3. Drop archived partitions (2+ days old, only if archived successfully)
+2. Archive old partitions (streamed compressed CSV + SHA-256 + object storage);
+   partitions whose archive failed are re-queued and archived again
+3. Drop archived partitions (2+ days old, only once the archive re-reads with a matching checksum
+   and, with ARCHIVE_PARQUET on, once the Parquet copy that serves archived history exists)
 4. Update partition metadata (row counts, sizes, states)
 5. VACUUM ANALYZE hot partitions for optimal query planning
 
@@ -16,15 +18,13 @@ Usage:
 import sys
 import os
 import argparse
-import hashlib
-import csv
-import gzip
 from datetime import datetime, timezone, timedelta
-from io import StringIO
 from sqlalchemy import text
 from models import SessionLocal, HeartbeatPartition
 from observability import structured_logger, metrics
 from db_utils import create_heartbeat_partition
+from partition_archiver import archive_partition, verify_archive, ArchiveError
+import columnar_archive
 
 ADVISORY_LOCK_ID = 987654321  # Unique ID for nightly maintenance advisory lock
 DEFAULT_RETENTION_DAYS = 2
@@ -125,12 +125,60 @@ def update_partition_stats(db, dry_run: bool = False):
     print(f"   ✓ Updated stats for {updated_count} partitions")
     return updated_count
 
+def requeue_failed_archives(db, dry_run: bool = False):
+    """
+    Put archive_failed partitions back in the archive queue.
+    Their table still holds the rows (nothing is dropped without a verified
+    archive), so they are reset to active with the failed archive's URL and
+    checksums cleared, and archive_old_partitions exports them again. This
+    includes archives recorded before uploads existed (s3://...csv.gz stubs),
+    which can never verify. A partition that keeps failing is retried once a night.
+    """
+    print(f"\n🔁 Re-queueing failed archives...")
+    
+    failed = db.query(HeartbeatPartition).filter(
+        HeartbeatPartition.state == 'archive_failed'
+    ).all()
+    
+    if not failed:
+        print("   No failed archives")
+        return 0
+    
+    requeued_count = 0
+    
+    for partition in failed:
+        if dry_run:
+            print(f"   [DRY RUN] Would re-queue {partition.partition_name}")
+            continue
+        
+        stale_url = partition.archive_url
+        partition.state = 'active'
+        partition.archive_url = None
+        partition.checksum_sha256 = None
+        partition.archived_at = None
+        partition.parquet_url = None
+        partition.parquet_checksum_sha256 = None
+        db.commit()
+        
+        requeued_count += 1
+        
+        print(f"   ✓ Re-queued: {partition.partition_name}")
+        
+        structured_logger.log_event(
+            "archive.requeued",
+            partition_name=partition.partition_name,
+            stale_archive_url=stale_url
+        )
+        metrics.inc_counter("archive_requeued_total", {})
+    
+    return requeued_count
+
 def archive_old_partitions(db, retention_days: int, dry_run: bool = False):
     """
     Archive partitions older than retention_days.
-    Exports to CSV, computes SHA-256 checksum, marks as archived.
-    
-    Note: Actual upload to object storage is stubbed (would use S3/GCS in production)
+    Streams each partition through COPY into a compressed archive in the
+    archive store (see partition_archiver), records its SHA-256 checksum and
+    marks it as archived.
     """
     print(f"\n📦 Archiving partitions older than {retention_days} days...")
     
@@ -162,41 +210,15 @@ def archive_old_partitions(db, retention_days: int, dry_run: bool = False):
             )
             metrics.inc_counter("archive_attempts_total", {})
             
-            # Export partition data to CSV
-            export_query = text(f"""
-                SELECT device_id, ts, battery_pct, network_type, unity_running,
-                       signal_dbm, agent_version, ip, status
-                FROM {partition.partition_name}
-                ORDER BY ts
-            """)
-            
-            result = db.execute(export_query)
-            
-            # Write to CSV string buffer
-            csv_buffer = StringIO()
-            csv_writer = csv.writer(csv_buffer)
-            
-            # Write header
-            csv_writer.writerow(['device_id', 'ts', 'battery_pct', 'network_type', 'unity_running',
-                                'signal_dbm', 'agent_version', 'ip', 'status'])
-            
-            row_count = 0
-            for row in result:
-                csv_writer.writerow(row)
-                row_count += 1
+            # Stream export -> compress -> hash -> upload, constant memory
+            archive = archive_partition(db, partition.partition_name)
+            db.commit()  # End the export's read transaction
+            checksum = archive.checksum_sha256
+            archive_url = archive.url
+            row_count = archive.row_count
             
-            csv_content = csv_buffer.getvalue()
-            csv_buffer.close()
-            
-            # Compute SHA-256 checksum
-            checksum = hashlib.sha256(csv_content.encode('utf-8')).hexdigest()
-            
-            # In production, upload to object storage (S3/GCS)
-            # For now, we'll just log that we would upload
-            archive_url = f"s3://nexmdm-archives/{partition.partition_name}.csv.gz"
-            
-            print(f"      Exported {row_count} rows, SHA-256: {checksum[:16]}...")
-            print(f"      [STUB] Would upload to: {archive_url}")
+            print(f"      Exported {row_count} rows ({archive.raw_bytes} -> {archive.compressed_bytes} bytes), SHA-256: {checksum[:16]}...")
+            print(f"      Uploaded to: {archive_url}")
             
             # Update metadata to mark as archived
             partition.state = 'archived'
@@ -219,8 +241,11 @@ def archive_old_partitions(db, retention_days: int, dry_run: bool = False):
             
             print(f"   ✓ Archived: {partition.partition_name}")
             
+            export_partition_columnar(db, partition)
+            
         except Exception as e:
             # Mark archive as failed, do NOT drop partition
+            db.rollback()
             partition.state = 'archive_failed'
             db.commit()
             
@@ -236,10 +261,53 @@ def archive_old_partitions(db, retention_days: int, dry_run: bool = False):
     
     return archived_count
 
+def export_partition_columnar(db, partition):
+    """
+    Write the queryable Parquet copy of an archived partition.
+    A failure here is logged and does not fail archiving (the CSV archive is
+    the record of truth); drop_archived_partitions retries the export and
+    keeps the partition until the copy exists.
+    """
+    if not (columnar_archive.ARCHIVE_PARQUET and columnar_archive.available()):
+        return
+    
+    try:
+        result = columnar_archive.export_partition_parquet(db, partition.partition_name)
+        db.commit()  # End the export's read transaction
+        partition.parquet_url = result.url
+        partition.parquet_checksum_sha256 = result.checksum_sha256
+        db.commit()
+        
+        print(f"      Parquet copy: {result.url} ({result.compressed_bytes} bytes)")
+        
+        structured_logger.log_event(
+            "archive.parquet.end",
+            partition_name=partition.partition_name,
+            row_count=result.row_count,
+            parquet_url=result.url
+        )
+    except Exception as e:
+        db.rollback()
+        print(f"      ✗ Parquet copy FAILED for {partition.partition_name}: {e}")
+        
+        structured_logger.log_event(
+            "archive.parquet.failed",
+            level="ERROR",
+            partition_name=partition.partition_name,
+            error=str(e),
+            error_type=type(e).__name__
+        )
+        metrics.inc_counter("archive_parquet_failures_total", {})
+
 def drop_archived_partitions(db, dry_run: bool = False):
     """
     Drop partitions that have been successfully archived.
-    Uses advisory lock for safety. Only drops if archive_url and checksum exist.
+    Uses advisory lock for safety. Only drops if archive_url and checksum exist
+    and the stored archive re-reads with the recorded checksum and row count;
+    a partition whose archive fails verification is marked archive_failed and kept.
+    With ARCHIVE_PARQUET on, a missing Parquet copy is back-filled first and the
+    partition is kept (retried next night) until it exists, so its history
+    stays queryable.
     """
     print(f"\n🗑️  Dropping archived partitions...")
     
@@ -263,6 +331,39 @@ def drop_archived_partitions(db, dry_run: bool = False):
             print(f"   [DRY RUN] Would drop {partition.partition_name}")
             continue
         
+        try:
+            verify_archive(partition.archive_url, partition.checksum_sha256, partition.row_count)
+        except ArchiveError as e:
+            partition.state = 'archive_failed'
+            db.commit()
+            
+            print(f"   ✗ Archive verification FAILED for {partition.partition_name}, not dropping: {e}")
+            
+            structured_logger.log_event(
+                "archive.verify_failed",
+                level="ERROR",
+                partition_name=partition.partition_name,
+                archive_url=partition.archive_url,
+                error=str(e)
+            )
+            metrics.inc_counter("archive_verify_failures_total", {})
+            continue
+        
+        if columnar_archive.ARCHIVE_PARQUET and not partition.parquet_url:
+            export_partition_columnar(db, partition)
+            if not partition.parquet_url:
+                reason = "parquet_failed" if columnar_archive.available() else "pyarrow_missing"
+                print(f"   ⏭️  No Parquet copy for {partition.partition_name} ({reason}), not dropping")
+                
+                structured_logger.log_event(
+                    "partition.drop_deferred",
+                    level="WARN",
+                    partition_name=partition.partition_name,
+                    reason=reason
+                )
+                metrics.inc_counter("partition_drop_deferred_total", {"reason": reason})
+                continue
+        
         try:
             # Drop the partition table
             drop_query = text(f"DROP TABLE IF EXISTS {partition.partition_name}")
@@ -379,7 +480,8 @@ def run_nightly_maintenance(retention_days: int = DEFAULT_RETENTION_DAYS, dry_ru
         # Task 2: Update partition statistics
         updated = update_partition_stats(db, dry_run=dry_run)
         
-        # Task 3: Archive old partitions
+        # Task 3: Archive old partitions (failed archives first go back in the queue)
+        requeued = requeue_failed_archives(db, dry_run=dry_run)
         archived = archive_old_partitions(db, retention_days=retention_days, dry_run=dry_run)
         
         # Task 4: Drop archived partitions
@@ -394,6 +496,7 @@ def run_nightly_maintenance(retention_days: int = DEFAULT_RETENTION_DAYS, dry_ru
         print(f"✅ MAINTENANCE COMPLETE ({round(elapsed_ms / 1000, 2)}s)")
         print(f"   Created: {created} partitions")
         print(f"   Updated: {updated} statistics")
+        print(f"   Re-queued: {requeued} failed archives")
         print(f"   Archived: {archived} partitions")
         print(f"   Dropped: {dropped} partitions")
         print(f"   Vacuumed: {vacuumed} partitions")
@@ -403,6 +506,7 @@ def run_nightly_maintenance(retention_days: int = DEFAULT_RETENTION_DAYS, dry_ru
             "nightly_maintenance.completed",
             created=created,
             updated=updated,
+            requeued=requeued,
             archived=archived,
             dropped=dropped,
             vacuumed=vacuumed,
@@ -415,6 +519,7 @@ def run_nightly_maintenance(retention_days: int = DEFAULT_RETENTION_DAYS, dry_ru
             "status": "completed",
             "created": created,
             "updated": updated,
+            "requeued": requeued,
             "archived": archived,
             "dropped": dropped,
             "vacuumed": vacuumed,
@@ -99,7 +99,7 @@ class AppStorageService:
         if file_size == 0:
             raise ValueError("File is empty")
     
-    def upload_file(self, file_data: bytes, storage_key: str, content_type: str = "application/vnd.android.package-archive") -> str:
+    def upload_file(self, file_data: bytes, storage_key: str, content_type: str = "application/vnd.android.package-archive", validate_apk: bool = True) -> str:
         """
         Upload a file to Replit Object Storage.
         
@@ -107,6 +107,7 @@ class AppStorageService:
             file_data: Binary file data
             storage_key: The storage key/path to use (e.g., "apks/1.0.0_100.apk")
             content_type: MIME type
+            validate_apk: Apply the APK name/size checks (off for non-APK objects such as archives)
             
         Returns:
             The storage key that was used
@@ -116,7 +117,8 @@ class AppStorageService:
             StorageUnavailableError: If storage service is unavailable
         """
         file_size = len(file_data)
-        self._validate_apk_file(storage_key, file_size)
+        if validate_apk:
+            self._validate_apk_file(storage_key, file_size)
         
         self._log_event(
             "storage.upload.start",
@@ -153,6 +155,60 @@ class AppStorageService:
             )
             raise
     
+    def upload_from_path(self, file_path: str, storage_key: str, validate_apk: bool = True) -> str:
+        """
+        Upload a local file to Replit Object Storage without reading it into memory.
+
+        Args:
+            file_path: Local file to upload
+            storage_key: The storage key/path to use (e.g., "apks/1.0.0_100.apk")
+            validate_apk: Apply the APK name/size checks (off for non-APK objects such as archives)
+
+        Returns:
+            The storage key that was used
+
+        Raises:
+            ValueError: If file validation fails
+            StorageUnavailableError: If storage service is unavailable
+        """
+        file_size = os.path.getsize(file_path)
+        if validate_apk:
+            self._validate_apk_file(storage_key, file_size)
+
+        self._log_event(
+            "storage.upload.start",
+            key=storage_key,
+            file_size=file_size,
+            source="file"
+        )
+
+        try:
+            self._retry_on_error(
+                self.client.upload_from_filename,
+                storage_key,
+                file_path
+            )
+
+            if not self.client.exists(storage_key):
+                raise StorageUnavailableError(f"Upload verification failed: {storage_key}")
+
+            self._log_event(
+                "storage.upload.success",
+                key=storage_key,
+                file_size=file_size
+            )
+
+            return storage_key
+
+        except Exception as e:
+            self._log_event(
+                "storage.upload.error",
+                key=storage_key,
+                error=str(e),
+                error_type=type(e).__name__
+            )
+            raise
+
     def download_file(self, storage_path: str, use_cache: bool = True) -> Tuple[bytes, str, int]:
         """
         Download a file from Replit Object Storage.
@@ -245,6 +301,69 @@ class AppStorageService:
             )
             raise
     
+    def download_to_path(self, storage_path: str, dest_path: str) -> int:
+        """
+        Download a file from Replit Object Storage straight to disk.
+
+        The object is written to a temporary file next to dest_path and renamed
+        into place, so readers never see a partial file and the worker never
+        holds the whole object in memory.
+
+        Args:
+            storage_path: Path in format storage://apk/debug/{uuid}_{filename}
+                         or just apk/debug/{uuid}_{filename}
+            dest_path: Local file path to write
+
+        Returns:
+            Size of the downloaded file in bytes
+
+        Raises:
+            ObjectNotFoundError: If file doesn't exist
+            StorageUnavailableError: If storage service is unavailable
+        """
+        storage_key = storage_path.replace("storage://", "")
+        tmp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+
+        self._log_event(
+            "storage.download_to_path.start",
+            key=storage_key
+        )
+
+        try:
+            if not self.client.exists(storage_key):
+                raise ObjectNotFoundError(f"Object not found: {storage_path}")
+
+            self._retry_on_error(
+                self.client.download_to_filename,
+                storage_key,
+                tmp_path
+            )
+            file_size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, dest_path)
+
+            self._log_event(
+                "storage.download_to_path.success",
+                key=storage_key,
+                file_size=file_size
+            )
+
+            return file_size
+
+        except ReplitObjectNotFoundError:
+            raise ObjectNotFoundError(f"Object not found: {storage_path}")
+        except Exception as e:
+            if not isinstance(e, ObjectNotFoundError):
+                self._log_event(
+                    "storage.download_to_path.error",
+                    key=storage_key,
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
+            raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     def delete_file(self, storage_path: str) -> bool:
         """
         Delete a file from Replit Object Storage.
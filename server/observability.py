@@ -1,8 +1,11 @@
 import json
 import logging
+import math
+import os
 import time
+from bisect import bisect_left
 from datetime import datetime, timezone
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Iterable
 from contextvars import ContextVar
 from collections import defaultdict
 from threading import Lock
@@ -101,19 +104,195 @@ class StructuredLogger:
             self.logger.info(log_line)
 
 
+class QuantileSketch:
+    """
+    Streaming quantile sketch with bounded relative error (DDSketch-style).
+
+    Positive values are counted in logarithmic bins, so any quantile is
+    reported within relative_accuracy of the true value, memory stays at
+    most max_bins bins, and two sketches merge by adding bin counts.
+    When the bin limit is hit the lowest bins are collapsed, which only
+    degrades accuracy for the smallest values.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._bins: Dict[int, int] = {}
+        self._zero_count = 0
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        self.count += count
+        if value <= 0:
+            self._zero_count += count
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self._bins[key] = self._bins.get(key, 0) + count
+        if len(self._bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self._bins)
+        overflow = len(keys) - self.max_bins
+        merged = sum(self._bins.pop(k) for k in keys[:overflow + 1])
+        self._bins[keys[overflow]] = merged
+
+    def merge(self, other: "QuantileSketch"):
+        """Add another sketch's observations (must share relative_accuracy)"""
+        self.count += other.count
+        self._zero_count += other._zero_count
+        for key, count in other._bins.items():
+            self._bins[key] = self._bins.get(key, 0) + count
+        while len(self._bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-quantile (0 <= q <= 1); None when empty"""
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self._zero_count
+        if rank < seen:
+            return 0.0
+
+        for key in sorted(self._bins):
+            seen += self._bins[key]
+            if rank < seen:
+                return 2 * self._gamma ** key / (self._gamma + 1)
+
+        return 2 * self._gamma ** max(self._bins) / (self._gamma + 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self._zero_count,
+            "count": self.count,
+            "bins": {str(k): v for k, v in self._bins.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], max_bins: int = 2048) -> "QuantileSketch":
+        sketch = cls(relative_accuracy=data["relative_accuracy"], max_bins=max_bins)
+        sketch._zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch._bins = {int(k): v for k, v in data["bins"].items()}
+        return sketch
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram: per-bucket counts plus sum and count.
+    Observing is a binary search over the bucket bounds and memory does not
+    grow with the number of observations. Histograms with the same bounds
+    merge by adding counts.
+    """
+
+    def __init__(self, buckets: Iterable[float], quantiles: bool = False):
+        self.buckets: List[float] = sorted(buckets)
+        # One slot per bucket bound plus the +Inf overflow slot (non-cumulative)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.sketch: Optional[QuantileSketch] = QuantileSketch() if quantiles else None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    def cumulative_counts(self) -> List[int]:
+        """Cumulative counts for each bucket bound, ending with +Inf"""
+        result = []
+        running = 0
+        for count in self.counts:
+            running += count
+            result.append(running)
+        return result
+
+    def merge(self, other: "Histogram"):
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different bucket layouts")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = QuantileSketch(relative_accuracy=other.sketch.relative_accuracy)
+            self.sketch.merge(other.sketch)
+
+    def copy(self) -> "Histogram":
+        clone = Histogram(self.buckets)
+        clone.merge(self)
+        return clone
+
+
+def _format_labels(label_items: Iterable) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in label_items)
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
 class MetricsCollector:
     """
     Lightweight in-memory metrics collector for Prometheus-compatible exposition.
-    Tracks counters and histogram buckets with minimal overhead.
+    Tracks counters and fixed-bucket histograms with minimal overhead.
+
+    Histograms use latency_buckets unless a per-metric layout is registered via
+    register_histogram(); that call can also enable a streaming quantile sketch
+    which is exposed as <metric>_quantile gauges (p50/p95/p99).
     """
     
+    QUANTILES = (0.5, 0.95, 0.99)
+    
     def __init__(self):
         self._lock = Lock()
         self._counters: Dict[str, Dict[tuple, int]] = defaultdict(lambda: defaultdict(int))
-        self._histograms: Dict[str, Dict[tuple, list]] = defaultdict(lambda: defaultdict(list))
+        self._histograms: Dict[str, Dict[tuple, Histogram]] = defaultdict(dict)
         self._gauges: Dict[str, Dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        self._gauge_updated: Dict[str, Dict[tuple, float]] = defaultdict(dict)
         
         self.latency_buckets = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+        self._bucket_layouts: Dict[str, List[float]] = {}
+        self._quantile_metrics = set(
+            name.strip()
+            for name in os.getenv(
+                "METRICS_QUANTILE_HISTOGRAMS",
+                "http_request_latency_ms,hb_write_latency_ms,device_auth_latency_ms"
+            ).split(",")
+            if name.strip()
+        )
+    
+    def register_histogram(
+        self,
+        metric_name: str,
+        buckets: Optional[Iterable[float]] = None,
+        quantiles: Optional[bool] = None
+    ):
+        """
+        Configure the bucket layout and/or quantile sketch for a histogram.
+        Applies to label sets first observed after registration.
+        
+        Args:
+            metric_name: Histogram name
+            buckets: Upper bounds (le) for this metric; defaults to latency_buckets
+            quantiles: Track a streaming quantile sketch for p50/p95/p99
+        """
+        with self._lock:
+            if buckets is not None:
+                self._bucket_layouts[metric_name] = sorted(buckets)
+            if quantiles is True:
+                self._quantile_metrics.add(metric_name)
+            elif quantiles is False:
+                self._quantile_metrics.discard(metric_name)
     
     def inc_counter(self, metric_name: str, labels: Optional[Dict[str, str]] = None, value: int = 1):
         """Increment a counter metric"""
@@ -125,65 +304,115 @@ class MetricsCollector:
         """Record a histogram observation"""
         label_tuple = tuple(sorted((labels or {}).items()))
         with self._lock:
-            self._histograms[metric_name][label_tuple].append(value)
+            series = self._histograms[metric_name]
+            histogram = series.get(label_tuple)
+            if histogram is None:
+                histogram = Histogram(
+                    self._bucket_layouts.get(metric_name, self.latency_buckets),
+                    quantiles=metric_name in self._quantile_metrics
+                )
+                series[label_tuple] = histogram
+            histogram.observe(value)
     
     def set_gauge(self, metric_name: str, value: float, labels: Optional[Dict[str, str]] = None):
         """Set a gauge metric to a specific value"""
         label_tuple = tuple(sorted((labels or {}).items()))
         with self._lock:
             self._gauges[metric_name][label_tuple] = value
+            self._gauge_updated[metric_name][label_tuple] = time.time()
+    
+    def get_quantiles(self, metric_name: str, labels: Optional[Dict[str, str]] = None) -> Dict[str, Optional[float]]:
+        """
+        p50/p95/p99 for a histogram with a quantile sketch.
+        
+        Returns:
+            {"p50": ..., "p95": ..., "p99": ...}; values are None when there is no data
+        """
+        label_tuple = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            histogram = self._histograms.get(metric_name, {}).get(label_tuple)
+            sketch = histogram.sketch if histogram else None
+            return {
+                f"p{int(q * 100)}": sketch.quantile(q) if sketch else None
+                for q in self.QUANTILES
+            }
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Copy all metric state under the lock so exposition can run without it.
+        Histograms are copied (O(buckets) each), never re-scanned.
+        """
+        with self._lock:
+            return {
+                "counters": {name: dict(data) for name, data in self._counters.items()},
+                "gauges": {name: dict(data) for name, data in self._gauges.items()},
+                "gauge_updated": {name: dict(data) for name, data in self._gauge_updated.items()},
+                "histograms": {
+                    name: {labels: hist.copy() for labels, hist in data.items()}
+                    for name, data in self._histograms.items()
+                }
+            }
     
     def get_prometheus_text(self) -> str:
         """
         Generate Prometheus-compatible text format exposition.
         Returns metrics in plain text format.
         """
+        return self.format_prometheus_text(self.snapshot())
+    
+    def format_prometheus_text(self, snapshot: Dict[str, Any]) -> str:
+        """Render a snapshot() in Prometheus text format"""
         lines = []
         
-        with self._lock:
-            for metric_name, label_data in sorted(self._counters.items()):
-                lines.append(f"# TYPE {metric_name} counter")
-                for label_tuple, count in sorted(label_data.items()):
-                    if label_tuple:
-                        label_str = ",".join(f'{k}="{v}"' for k, v in label_tuple)
-                        lines.append(f"{metric_name}{{{label_str}}} {count}")
-                    else:
-                        lines.append(f"{metric_name} {count}")
-            
-            for metric_name, label_data in sorted(self._histograms.items()):
-                lines.append(f"# TYPE {metric_name}_bucket histogram")
-                for label_tuple, observations in sorted(label_data.items()):
-                    label_dict = dict(label_tuple) if label_tuple else {}
-                    
-                    for bucket in self.latency_buckets:
-                        count = sum(1 for obs in observations if obs <= bucket)
-                        bucket_labels = {**label_dict, "le": str(bucket)}
-                        label_str = ",".join(f'{k}="{v}"' for k, v in sorted(bucket_labels.items()))
-                        lines.append(f"{metric_name}_bucket{{{label_str}}} {count}")
-                    
-                    inf_labels = {**label_dict, "le": "+Inf"}
-                    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(inf_labels.items()))
-                    lines.append(f"{metric_name}_bucket{{{label_str}}} {len(observations)}")
-                    
-                    label_str_base = ",".join(f'{k}="{v}"' for k, v in sorted(label_dict.items())) if label_dict else ""
-                    if label_str_base:
-                        lines.append(f"{metric_name}_count{{{label_str_base}}} {len(observations)}")
-                        if observations:
-                            lines.append(f"{metric_name}_sum{{{label_str_base}}} {sum(observations)}")
-                    else:
-                        lines.append(f"{metric_name}_count {len(observations)}")
-                        if observations:
-                            lines.append(f"{metric_name}_sum {sum(observations)}")
-            
-            # Gauges
-            for metric_name, label_data in sorted(self._gauges.items()):
-                lines.append(f"# TYPE {metric_name} gauge")
-                for label_tuple, value in sorted(label_data.items()):
-                    if label_tuple:
-                        label_str = ",".join(f'{k}="{v}"' for k, v in label_tuple)
-                        lines.append(f"{metric_name}{{{label_str}}} {value}")
-                    else:
-                        lines.append(f"{metric_name} {value}")
+        for metric_name, label_data in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE {metric_name} counter")
+            for label_tuple, count in sorted(label_data.items()):
+                if label_tuple:
+                    lines.append(f"{metric_name}{{{_format_labels(label_tuple)}}} {count}")
+                else:
+                    lines.append(f"{metric_name} {count}")
+        
+        quantile_lines = []
+        for metric_name, label_data in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE {metric_name} histogram")
+            for label_tuple, histogram in sorted(label_data.items()):
+                label_dict = dict(label_tuple)
+                cumulative = histogram.cumulative_counts()
+                bounds = [_format_value(b) for b in histogram.buckets] + ["+Inf"]
+                
+                for le, count in zip(bounds, cumulative):
+                    bucket_labels = sorted({**label_dict, "le": le}.items())
+                    lines.append(f"{metric_name}_bucket{{{_format_labels(bucket_labels)}}} {count}")
+                
+                label_str_base = _format_labels(sorted(label_dict.items()))
+                suffix = f"{{{label_str_base}}}" if label_str_base else ""
+                lines.append(f"{metric_name}_count{suffix} {histogram.count}")
+                if histogram.count:
+                    lines.append(f"{metric_name}_sum{suffix} {histogram.sum}")
+                
+                if histogram.sketch is not None and histogram.sketch.count:
+                    for q in self.QUANTILES:
+                        q_labels = sorted({**label_dict, "quantile": str(q)}.items())
+                        quantile_lines.append(
+                            (metric_name, f"{metric_name}_quantile{{{_format_labels(q_labels)}}} {histogram.sketch.quantile(q)}")
+                        )
+        
+        # Quantile estimates from sketches (gauges, one family per histogram)
+        current = None
+        for metric_name, line in quantile_lines:
+            if metric_name != current:
+                lines.append(f"# TYPE {metric_name}_quantile gauge")
+                current = metric_name
+            lines.append(line)
+        
+        # Gauges
+        for metric_name, label_data in sorted(snapshot["gauges"].items()):
+            lines.append(f"# TYPE {metric_name} gauge")
+            for label_tuple, value in sorted(label_data.items()):
+                if label_tuple:
+                    lines.append(f"{metric_name}{{{_format_labels(label_tuple)}}} {value}")
+                else:
+                    lines.append(f"{metric_name} {value}")
         
         return "\n".join(lines) + "\n"
     
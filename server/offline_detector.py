@@ -0,0 +1,315 @@
+"""
+Offline detection driven by heartbeat deadlines instead of last_seen scans.
+
+Each heartbeat re-arms its device's deadline (last heartbeat + 3 heartbeat
+intervals) in a hashed timer wheel. The wheel advances once per tick and fires
+online->offline transitions as deadlines pass; a newer heartbeat for an
+offline device fires offline->online. Live online/offline counters are kept
+as transitions happen, so readers never recompute them; the devices_online /
+devices_offline gauges are set on every transition.
+
+Heartbeats reach the detector two ways: directly from the heartbeat route in
+this worker (observe), and from a device_last_status change feed polled every
+few seconds, which covers heartbeats handled by other workers. A periodic
+resync rebuilds the state from device_last_status (drops deleted devices).
+
+Listeners registered with add_listener are called with
+(device_id, status, last_seen) on every transition, on the event loop thread.
+"""
+import asyncio
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from alert_config import alert_config
+from observability import structured_logger, metrics
+
+STATUS_ONLINE = "online"
+STATUS_OFFLINE = "offline"
+
+
+def _epoch(ts: datetime) -> float:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: one slot per tick, O(1) arm/cancel.
+
+    Keys whose deadline is more than len(slots) ticks away share a slot with
+    nearer keys and are skipped until their round comes up.
+    """
+
+    def __init__(self, tick_s: float = 1.0, slots: int = 4096, now: Optional[float] = None):
+        self.tick_s = tick_s
+        self._slots: List[Set[str]] = [set() for _ in range(slots)]
+        self._slot_ticks: Dict[str, int] = {}
+        self._current_tick = int((time.time() if now is None else now) // tick_s)
+
+    def __len__(self) -> int:
+        return len(self._slot_ticks)
+
+    def arm(self, key: str, deadline: float):
+        """(Re-)arm key to fire at deadline (epoch seconds); past deadlines fire on the next advance."""
+        self.cancel(key)
+        tick = max(math.ceil(deadline / self.tick_s), self._current_tick + 1)
+        self._slots[tick % len(self._slots)].add(key)
+        self._slot_ticks[key] = tick
+
+    def cancel(self, key: str):
+        tick = self._slot_ticks.pop(key, None)
+        if tick is not None:
+            self._slots[tick % len(self._slots)].discard(key)
+
+    def advance(self, now: float) -> List[str]:
+        """Move the wheel to now and return the keys whose deadline has passed."""
+        target = int(now // self.tick_s)
+        expired: List[str] = []
+        if target <= self._current_tick:
+            return expired
+
+        # After a long stall every slot is visited once
+        span = min(target - self._current_tick, len(self._slots))
+        for tick in range(target - span + 1, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            due = [key for key in slot if self._slot_ticks[key] <= target]
+            for key in due:
+                slot.discard(key)
+                del self._slot_ticks[key]
+            expired.extend(due)
+
+        self._current_tick = target
+        return expired
+
+
+class OfflineDetector:
+    """
+    Tracks online/offline state for every device with a device_last_status row.
+    """
+
+    def __init__(
+        self,
+        threshold_s: float,
+        tick_s: float = 1.0,
+        poll_interval_s: float = 5.0,
+        resync_interval_s: float = 600.0,
+        overlap_s: float = 120.0
+    ):
+        self.threshold_s = threshold_s
+        self.tick_s = tick_s
+        self.poll_interval_s = poll_interval_s
+        self.resync_interval_s = resync_interval_s
+        self.overlap_s = overlap_s
+
+        self._wheel = TimerWheel(tick_s)
+        self._last_seen: Dict[str, float] = {}
+        self._offline: Set[str] = set()
+        self._listeners: List[Callable[[str, str, datetime], None]] = []
+        self._watermark: Optional[float] = None
+        self._last_poll = 0.0
+        self._last_resync = 0.0
+
+        self.ready = False
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def online_count(self) -> int:
+        return len(self._last_seen) - len(self._offline)
+
+    @property
+    def offline_count(self) -> int:
+        return len(self._offline)
+
+    def add_listener(self, listener: Callable[[str, str, datetime], None]):
+        self._listeners.append(listener)
+
+    def last_seen(self, device_id: str) -> Optional[datetime]:
+        ts = self._last_seen.get(device_id)
+        return datetime.fromtimestamp(ts, timezone.utc) if ts is not None else None
+
+    def is_offline(self, device_id: str, last_seen: Optional[datetime] = None) -> bool:
+        """
+        Offline status for one device.
+
+        Uses the tracked state when it is at least as fresh as last_seen;
+        otherwise (detector not running yet, device unknown, or the caller
+        holds a newer heartbeat) falls back to comparing last_seen against
+        the threshold.
+        """
+        tracked = self._last_seen.get(device_id)
+        if self.ready and tracked is not None and (last_seen is None or tracked >= _epoch(last_seen)):
+            return device_id in self._offline
+        if last_seen is None:
+            return True
+        return time.time() - _epoch(last_seen) > self.threshold_s
+
+    def offline_devices(self) -> List[Tuple[str, datetime]]:
+        """(device_id, last_seen) for every offline device, longest offline first."""
+        return sorted(
+            ((device_id, datetime.fromtimestamp(self._last_seen[device_id], timezone.utc))
+             for device_id in self._offline),
+            key=lambda item: item[1]
+        )
+
+    def observe(self, device_id: str, last_seen: datetime, now: Optional[float] = None, notify: bool = True):
+        """
+        Record a heartbeat. Older or duplicate timestamps are ignored.
+
+        Args:
+            device_id: Device that sent the heartbeat
+            last_seen: Heartbeat timestamp
+            now: Current time (epoch seconds), for tests
+            notify: Whether a resulting transition is sent to listeners
+        """
+        ts = _epoch(last_seen)
+        previous = self._last_seen.get(device_id)
+        if previous is not None and ts <= previous:
+            return
+        self._last_seen[device_id] = ts
+        if previous is None:
+            self._publish_gauges()
+        if self._watermark is None or ts > self._watermark:
+            self._watermark = ts
+
+        now = time.time() if now is None else now
+        deadline = ts + self.threshold_s
+        if deadline <= now:
+            self._wheel.cancel(device_id)
+            self._set_offline(device_id, notify)
+            return
+
+        self._wheel.arm(device_id, deadline)
+        if device_id in self._offline:
+            self._offline.discard(device_id)
+            self._publish_gauges()
+            if notify:
+                self._emit(device_id, STATUS_ONLINE)
+
+    def forget(self, device_id: str):
+        self._wheel.cancel(device_id)
+        if self._last_seen.pop(device_id, None) is not None:
+            self._offline.discard(device_id)
+            self._publish_gauges()
+
+    def advance(self, now: Optional[float] = None):
+        """Fire online->offline transitions for deadlines that have passed."""
+        now = time.time() if now is None else now
+        for device_id in self._wheel.advance(now):
+            if device_id in self._last_seen:
+                self._set_offline(device_id, notify=True)
+
+    def _set_offline(self, device_id: str, notify: bool):
+        if device_id in self._offline:
+            return
+        self._offline.add(device_id)
+        self._publish_gauges()
+        if notify:
+            self._emit(device_id, STATUS_OFFLINE)
+
+    def _publish_gauges(self):
+        metrics.set_gauge("devices_online", self.online_count)
+        metrics.set_gauge("devices_offline", self.offline_count)
+
+    def _emit(self, device_id: str, status: str):
+        last_seen = self.last_seen(device_id)
+        metrics.inc_counter("device_status_transitions_total", {"to": status})
+        structured_logger.log_event(
+            "device.status.transition",
+            device_id=device_id,
+            status=status,
+            last_seen=last_seen.isoformat() if last_seen else None
+        )
+        for listener in self._listeners:
+            try:
+                listener(device_id, status, last_seen)
+            except Exception as e:
+                structured_logger.log_event(
+                    "offline_detector.listener_error",
+                    level="ERROR",
+                    device_id=device_id,
+                    error=str(e)
+                )
+
+    def _load_rows(self, since: Optional[float]) -> List[Tuple[str, datetime]]:
+        """device_last_status (device_id, last_ts) rows, optionally only those newer than since."""
+        from models import SessionLocal, DeviceLastStatus
+
+        db = SessionLocal()
+        try:
+            query = db.query(DeviceLastStatus.device_id, DeviceLastStatus.last_ts)
+            if since is not None:
+                query = query.filter(
+                    DeviceLastStatus.last_ts > datetime.fromtimestamp(since, timezone.utc)
+                )
+            return query.all()
+        finally:
+            db.close()
+
+    def apply_snapshot(self, rows: List[Tuple[str, datetime]], now: Optional[float] = None):
+        """Replace the tracked device set with a full device_last_status snapshot."""
+        present = {device_id for device_id, _ in rows}
+        for device_id in [d for d in self._last_seen if d not in present]:
+            self.forget(device_id)
+        for device_id, last_ts in rows:
+            self.observe(device_id, last_ts, now=now, notify=self.ready)
+        self.ready = True
+        self._publish_gauges()
+
+    async def _run(self):
+        while self._running:
+            try:
+                now = time.time()
+                if now - self._last_resync >= self.resync_interval_s:
+                    rows = await asyncio.to_thread(self._load_rows, None)
+                    self.apply_snapshot(rows)
+                    self._last_resync = self._last_poll = now
+                elif now - self._last_poll >= self.poll_interval_s:
+                    since = self._watermark - self.overlap_s if self._watermark is not None else None
+                    for device_id, last_ts in await asyncio.to_thread(self._load_rows, since):
+                        self.observe(device_id, last_ts)
+                    self._last_poll = now
+                self.advance()
+            except Exception as e:
+                structured_logger.log_event(
+                    "offline_detector.error",
+                    level="ERROR",
+                    error=str(e),
+                    error_type=type(e).__name__
+                )
+            await asyncio.sleep(self.tick_s)
+
+    async def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+        structured_logger.log_event(
+            "offline_detector.started",
+            threshold_s=self.threshold_s,
+            poll_interval_s=self.poll_interval_s
+        )
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Global instance
+offline_detector = OfflineDetector(
+    threshold_s=alert_config.HEARTBEAT_INTERVAL_SECONDS * 3,
+    tick_s=float(os.getenv("OFFLINE_DETECTOR_TICK_S", "1")),
+    poll_interval_s=float(os.getenv("OFFLINE_DETECTOR_POLL_S", "5")),
+    resync_interval_s=float(os.getenv("OFFLINE_DETECTOR_RESYNC_S", "600")),
+    overlap_s=float(os.getenv("OFFLINE_DETECTOR_OVERLAP_S", "120"))
+)
@@ -0,0 +1,424 @@
+"""
+Streaming archiver for device_heartbeats partitions.
+
+A partition is exported with COPY ... TO STDOUT and compressed (gzip, or
+zstd when the zstandard package is installed). The compressed stream is
+hashed (SHA-256) and uploaded as it is produced. Memory stays bounded by the
+copy buffer whatever the partition size. The checksum covers the stored
+(compressed) bytes, so verify_archive() can re-read the object and compare
+before the partition is dropped.
+
+Stores:
+- ObjectArchiveStore: App Storage (object_storage.AppStorageService). The SDK
+  has no multipart upload, so the stream is cut into ARCHIVE_PART_BYTES parts
+  (<key>.part00000, ...), each spooled to a temp file and uploaded. A JSON
+  manifest at <key> lists the parts. Parts are byte ranges of one compressed
+  stream; concatenated they form the archive.
+- LocalArchiveStore: a directory (ARCHIVE_LOCAL_DIR), for development and tests.
+
+ARCHIVE_BACKEND selects the store ("storage" or "local").
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional
+
+from observability import structured_logger, metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_BACKEND = os.getenv("ARCHIVE_BACKEND", "storage")
+ARCHIVE_LOCAL_DIR = os.getenv("ARCHIVE_LOCAL_DIR", "./data/archives")
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archives/heartbeats/")
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "gzip")
+ARCHIVE_PART_BYTES = int(os.getenv("ARCHIVE_PART_BYTES", str(64 * 1024 * 1024)))
+
+# COPY emits one write per row; rows are buffered up to this size before compressing
+WRITE_BUFFER_BYTES = 256 * 1024
+READ_CHUNK_BYTES = 1024 * 1024
+
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# Exported columns, in archive order
+ARCHIVE_COLUMNS = (
+    "hb_id", "device_id", "ts", "ip", "status", "battery_pct", "plugged", "temp_c",
+    "network_type", "signal_dbm", "uptime_s", "ram_used_mb", "unity_pkg_version",
+    "unity_running", "agent_version", "bucket_ts"
+)
+
+
+class ArchiveError(Exception):
+    """Archive could not be written, read or verified"""
+
+
+@dataclass
+class ArchiveResult:
+    url: str
+    checksum_sha256: str
+    row_count: int
+    raw_bytes: int
+    compressed_bytes: int
+
+
+def resolve_compression(name: str) -> str:
+    """zstd needs the optional zstandard package; fall back to gzip without it."""
+    if name == "zstd" and zstandard is None:
+        structured_logger.log_event(
+            "archive.compression.fallback",
+            level="WARN",
+            requested="zstd",
+            used="gzip",
+            reason="zstandard not installed"
+        )
+        return "gzip"
+    if name not in EXTENSIONS:
+        raise ArchiveError(f"Unsupported archive compression: {name}")
+    return name
+
+
+def _compressor(compression: str):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compressobj()
+    # wbits=31: gzip container, readable with gunzip
+    return zlib.compressobj(6, zlib.DEFLATED, 31)
+
+
+def _decompressor(compression: str):
+    if compression == "zstd":
+        if zstandard is None:
+            raise ArchiveError("zstandard is required to read .zst archives")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def compression_for_url(url: str) -> str:
+    for name, extension in EXTENSIONS.items():
+        if url.endswith(extension):
+            return name
+    raise ArchiveError(f"Unknown archive compression: {url}")
+
+
+# ---------------------------------------------------------------------------
+# Stores
+# ---------------------------------------------------------------------------
+
+class _LocalUpload:
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp_path = f"{path}.part"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(self._tmp_path, "wb")
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def commit(self) -> str:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        return "file://" + os.path.abspath(self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class LocalArchiveStore:
+    """Archives as files under a local directory"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def open(self, key: str) -> _LocalUpload:
+        return _LocalUpload(os.path.join(self.root, key))
+
+    def iter_chunks(self, url: str) -> Iterator[bytes]:
+        path = url[len("file://"):]
+        if not os.path.exists(path):
+            raise ArchiveError(f"Archive not found: {url}")
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+
+
+class _PartUpload:
+    """Cuts the stream into parts; each part is spooled to disk, uploaded, then discarded."""
+
+    def __init__(self, storage, key: str, part_bytes: int):
+        self.storage = storage
+        self.key = key
+        self.part_bytes = part_bytes
+        self.parts: List[dict] = []
+        self._file = tempfile.NamedTemporaryFile(prefix="archive-part-", delete=False)
+        self._size = 0
+        self._hash = hashlib.sha256()
+
+    def write(self, data: bytes):
+        while data:
+            room = self.part_bytes - self._size
+            head, data = data[:room], data[room:]
+            self._file.write(head)
+            self._hash.update(head)
+            self._size += len(head)
+            if self._size >= self.part_bytes:
+                self._upload_part()
+
+    def _upload_part(self):
+        if not self._size:
+            return
+        self._file.flush()
+        part_key = f"{self.key}.part{len(self.parts):05d}"
+        self.storage.upload_from_path(self._file.name, part_key, validate_apk=False)
+        self.parts.append({"key": part_key, "size": self._size, "sha256": self._hash.hexdigest()})
+        self._file.seek(0)
+        self._file.truncate()
+        self._size = 0
+        self._hash = hashlib.sha256()
+
+    def commit(self) -> str:
+        self._upload_part()
+        self._close()
+        manifest = json.dumps({"parts": self.parts}).encode()
+        self.storage.upload_file(manifest, self.key, content_type="application/json", validate_apk=False)
+        return f"storage://{self.key}"
+
+    def abort(self):
+        self._close()
+        for part in self.parts:
+            self.storage.delete_file(part["key"])
+
+    def _close(self):
+        self._file.close()
+        if os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+
+class ObjectArchiveStore:
+    """Archives in App Storage, uploaded as fixed-size parts plus a manifest"""
+
+    def __init__(self, storage=None, part_bytes: int = ARCHIVE_PART_BYTES):
+        self._storage = storage
+        self.part_bytes = part_bytes
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            from object_storage import get_storage_service
+            self._storage = get_storage_service()
+        return self._storage
+
+    def open(self, key: str) -> _PartUpload:
+        return _PartUpload(self.storage, key, self.part_bytes)
+
+    def iter_chunks(self, url: str) -> Iterator[bytes]:
+        key = url[len("storage://"):]
+        manifest_data, _, _ = self.storage.download_file(key, use_cache=False)
+        manifest = json.loads(manifest_data)
+
+        tmp_dir = tempfile.mkdtemp(prefix="archive-verify-")
+        try:
+            for part in manifest["parts"]:
+                path = os.path.join(tmp_dir, "part")
+                self.storage.download_to_path(part["key"], path)
+                part_hash = hashlib.sha256()
+                with open(path, "rb") as f:
+                    while True:
+                        chunk = f.read(READ_CHUNK_BYTES)
+                        if not chunk:
+                            break
+                        part_hash.update(chunk)
+                        yield chunk
+                os.remove(path)
+                if part_hash.hexdigest() != part["sha256"]:
+                    raise ArchiveError(f"Checksum mismatch in archive part {part['key']}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def get_archive_store(backend: str = ARCHIVE_BACKEND):
+    if backend == "local":
+        return LocalArchiveStore(ARCHIVE_LOCAL_DIR)
+    if backend == "storage":
+        return ObjectArchiveStore()
+    raise ArchiveError(f"Unknown ARCHIVE_BACKEND: {backend}")
+
+
+def store_for_url(url: str):
+    """Store that can read back an archive_url written by archive_partition()."""
+    if url.startswith("file://"):
+        return LocalArchiveStore(ARCHIVE_LOCAL_DIR)
+    if url.startswith("storage://"):
+        return ObjectArchiveStore()
+    raise ArchiveError(f"Archive location cannot be read back: {url}")
+
+
+# ---------------------------------------------------------------------------
+# Writing and verifying
+# ---------------------------------------------------------------------------
+
+class ArchiveWriter:
+    """
+    File-like COPY target: buffers rows, compresses, hashes and hands the
+    compressed bytes to an upload as they are produced.
+    """
+
+    def __init__(self, upload, compression: str):
+        self.upload = upload
+        self._compressor = _compressor(compression)
+        self._buffer = bytearray()
+        self._hash = hashlib.sha256()
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.lines = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._buffer += data
+        self.raw_bytes += len(data)
+        self.lines += data.count(b"\n")
+        if len(self._buffer) >= WRITE_BUFFER_BYTES:
+            self._emit(self._compressor.compress(bytes(self._buffer)))
+            self._buffer.clear()
+
+    def _emit(self, compressed: bytes):
+        if compressed:
+            self._hash.update(compressed)
+            self.compressed_bytes += len(compressed)
+            self.upload.write(compressed)
+
+    def finish(self) -> str:
+        """Flush the compressor; returns the SHA-256 of the compressed stream."""
+        if self._buffer:
+            self._emit(self._compressor.compress(bytes(self._buffer)))
+            self._buffer.clear()
+        self._emit(self._compressor.flush())
+        return self._hash.hexdigest()
+
+
+def write_archive(
+    store,
+    key: str,
+    produce: Callable[[ArchiveWriter], int],
+    compression: str = ARCHIVE_COMPRESSION
+) -> ArchiveResult:
+    """
+    Stream an archive into a store.
+
+    Args:
+        store: LocalArchiveStore or ObjectArchiveStore
+        key: Object key without the compression extension
+        produce: Writes the uncompressed content to the writer; returns its row count
+        compression: "gzip" or "zstd"
+
+    Returns:
+        ArchiveResult for the committed archive
+
+    Raises:
+        ArchiveError: If the archive could not be written; nothing is left behind
+    """
+    compression = resolve_compression(compression)
+    upload = store.open(key + EXTENSIONS[compression])
+    try:
+        writer = ArchiveWriter(upload, compression)
+        row_count = produce(writer)
+        checksum = writer.finish()
+        url = upload.commit()
+    except Exception as e:
+        upload.abort()
+        if isinstance(e, ArchiveError):
+            raise
+        raise ArchiveError(f"Failed to write archive {key}: {e}") from e
+
+    return ArchiveResult(
+        url=url,
+        checksum_sha256=checksum,
+        row_count=row_count,
+        raw_bytes=writer.raw_bytes,
+        compressed_bytes=writer.compressed_bytes
+    )
+
+
+def archive_partition(db, partition_name: str, store=None, compression: str = ARCHIVE_COMPRESSION) -> ArchiveResult:
+    """
+    Export one heartbeat partition as compressed CSV (with header), streamed
+    through COPY TO STDOUT.
+
+    Args:
+        db: Database session (psycopg2)
+        partition_name: e.g. device_heartbeats_20260101
+        store: Destination; defaults to get_archive_store()
+        compression: "gzip" or "zstd"
+
+    Raises:
+        ArchiveError: If the export or upload fails
+    """
+    store = store or get_archive_store()
+    start = time.time()
+
+    def produce(writer: ArchiveWriter) -> int:
+        cursor = db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY (SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {partition_name} ORDER BY ts) "
+                "TO STDOUT WITH (FORMAT csv, HEADER)",
+                writer
+            )
+            # rowcount comes from the COPY command tag; the header line is not a row
+            return cursor.rowcount if cursor.rowcount >= 0 else writer.lines - 1
+        finally:
+            cursor.close()
+
+    result = write_archive(store, ARCHIVE_PREFIX + partition_name + ".csv", produce, compression)
+
+    elapsed_ms = (time.time() - start) * 1000
+    metrics.observe_histogram("archive_duration_ms", elapsed_ms, {})
+    metrics.inc_counter("archive_bytes_total", {"kind": "raw"}, value=result.raw_bytes)
+    metrics.inc_counter("archive_bytes_total", {"kind": "compressed"}, value=result.compressed_bytes)
+    return result
+
+
+def verify_archive(url: str, checksum_sha256: str, row_count: Optional[int] = None, store=None) -> None:
+    """
+    Re-read a stored archive and check it before its source data is dropped.
+
+    The SHA-256 of the stored bytes must match, and the stream must
+    decompress completely. When row_count is given, the CSV must have that
+    many rows plus the header line.
+
+    Raises:
+        ArchiveError: If the archive is missing, corrupt or does not match
+    """
+    store = store or store_for_url(url)
+    decompressor = _decompressor(compression_for_url(url))
+    digest = hashlib.sha256()
+    lines = 0
+
+    try:
+        for chunk in store.iter_chunks(url):
+            digest.update(chunk)
+            lines += decompressor.decompress(chunk).count(b"\n")
+    except ArchiveError:
+        raise
+    except Exception as e:
+        raise ArchiveError(f"Archive unreadable: {url}: {e}") from e
+
+    if digest.hexdigest() != checksum_sha256:
+        raise ArchiveError(f"Checksum mismatch for {url}")
+    if hasattr(decompressor, "eof") and not decompressor.eof:
+        raise ArchiveError(f"Archive truncated: {url}")
+    if row_count is not None and lines != row_count + 1:
+        raise ArchiveError(f"Row count mismatch for {url}: expected {row_count}, found {lines - 1}")
@@ -108,6 +108,14 @@ class PurgeJobManager:
             # SQLAlchemy Result.rowcount is an int attribute
             deleted_counts["device_heartbeats"] = getattr(hb_result, 'rowcount', 0)
             
+            # Delete from heartbeat history rollups
+            for table in ("device_heartbeat_rollups_1m", "device_heartbeat_rollups_1h", "device_heartbeat_rollups_1d"):
+                rollup_result = db.execute(
+                    text(f"DELETE FROM {table} WHERE device_id = :device_id"),
+                    {"device_id": device_id}
+                )
+                deleted_counts[table] = getattr(rollup_result, 'rowcount', 0)
+            
             # Delete from fcm_dispatches
             fcm_result = db.execute(
                 text("DELETE FROM fcm_dispatches WHERE device_id = :device_id"),
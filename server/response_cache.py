@@ -1,120 +1,396 @@
 """
-Simple in-memory response cache with TTL for frequently accessed endpoints.
+In-memory response cache with TTL, LRU bound and tag-based invalidation
+for frequently accessed endpoints.
+
+Invalidation is O(1): every entry is tagged with the segment prefixes of its
+path ("/v1", "/v1/devices", ...) and remembers the generation of each tag when
+it was computed. invalidate("/v1/devices") just bumps that tag's generation;
+entries with an older generation are treated as misses and dropped lazily.
+
+Optional pieces:
+- get_or_compute(): single-flight, concurrent misses for a key share one computation
+- invalidate_debounced(): for hot writers (heartbeats), applies at most once per window;
+  the folded invalidation is applied by a timer when the window ends
+- RESPONSE_CACHE_SHARED_DIR: invalidations are also published as per-tag counter files
+  in a directory shared by all workers, so one worker's invalidation reaches the others
+  within shared_poll_seconds
 """
-from typing import Any, Optional, Dict
-from datetime import datetime, timezone, timedelta
+from typing import Any, Optional, Dict, List, Callable, Set, Tuple
+from collections import OrderedDict, defaultdict
+import asyncio
+import fcntl
+import os
 import threading
+import time
 import hashlib
 import json
 
+from observability import structured_logger, metrics
+
+# Tag bumped by invalidate(None); part of every entry's tag set
+ALL_TAG = "__all__"
+# Tag for entries stored without a path; bumped by every invalidate() call
+UNTAGGED = "__untagged__"
+
+
+def path_tags(path: Optional[str]) -> List[str]:
+    """
+    Tags for a request path: one per segment prefix.
+    "/v1/devices/abc" -> ["/v1", "/v1/devices", "/v1/devices/abc"]
+    """
+    if not path:
+        return [UNTAGGED]
+    parts = [p for p in path.strip("/").split("/") if p]
+    return ["/" + "/".join(parts[:i + 1]) for i in range(len(parts))] or ["/"]
+
+
 class ResponseCache:
     """
-    Thread-safe in-memory cache with TTL support.
+    Thread-safe in-memory cache with TTL, LRU eviction and tag invalidation.
     """
-    
-    def __init__(self):
-        self._cache: Dict[str, Dict[str, Any]] = {}
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        debounce_seconds: float = 5.0,
+        shared_dir: Optional[str] = None,
+        shared_poll_seconds: float = 0.25
+    ):
+        self.max_entries = max_entries
+        self.debounce_seconds = debounce_seconds
+        self.shared_dir = shared_dir
+        self.shared_poll_seconds = shared_poll_seconds
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = defaultdict(int)
+        self._last_debounced: Dict[str, float] = {}
+        self._pending_invalidations: Dict[str, float] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._debounce_timer: Optional[threading.Timer] = None
+        # tag -> (shared counter, monotonic time it was read); guarded by the GIL only,
+        # so file reads never happen under self._lock
+        self._shared_seen: Dict[str, Tuple[int, float]] = {}
+        # Tags bumped locally whose shared counter file still has to be bumped
+        self._unpublished: Set[str] = set()
         self._lock = threading.Lock()
-    
+
+        if self.shared_dir:
+            os.makedirs(self.shared_dir, exist_ok=True)
+
+    def _shared_path(self, tag: str) -> str:
+        return os.path.join(self.shared_dir, hashlib.md5(tag.encode()).hexdigest())
+
+    def _read_shared(self, tag: str) -> int:
+        try:
+            with open(self._shared_path(tag), "rb") as f:
+                # Shared lock: never observe a writer's truncate-then-write midway
+                fcntl.flock(f, fcntl.LOCK_SH)
+                return int(f.read() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _shared_generations(self, tags: List[str]) -> Dict[str, int]:
+        """
+        Shared (cross-worker) counter per tag, re-read at most once per
+        shared_poll_seconds. Must be called without holding self._lock.
+        """
+        if not self.shared_dir:
+            return {}
+        now = time.monotonic()
+        result = {}
+        for tag in tags:
+            seen = self._shared_seen.get(tag)
+            if seen is None or now - seen[1] >= self.shared_poll_seconds:
+                seen = (self._read_shared(tag), now)
+                self._shared_seen[tag] = seen
+            result[tag] = seen[0]
+        return result
+
+    def _tag_state(self, tags: List[str], shared: Optional[Dict[str, int]] = None) -> tuple:
+        """
+        Local generation plus the shared generation of each tag (caller holds the lock).
+
+        shared comes from _shared_generations(); when omitted the last value read
+        for each tag is used, so no file I/O happens here.
+        """
+        if shared is None:
+            shared = {tag: self._shared_seen.get(tag, (0, 0.0))[0] for tag in tags} if self.shared_dir else {}
+        return tuple((self._generations[tag], shared.get(tag, 0)) for tag in tags)
+
+    def _bump(self, tag: str):
+        """Bump a tag's local generation (caller holds the lock); shared bumps are queued"""
+        self._generations[tag] += 1
+        if self.shared_dir:
+            self._unpublished.add(tag)
+
+    def _flush_shared(self):
+        """
+        Publish queued shared bumps. Called after releasing self._lock; on the
+        event loop the file writes (which may wait on another worker's flock)
+        go to a worker thread.
+        """
+        if not self._unpublished:
+            return
+        with self._lock:
+            tags, self._unpublished = self._unpublished, set()
+        if not tags:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._publish_shared(tags)
+        else:
+            loop.run_in_executor(None, self._publish_shared, tags)
+
+    def _publish_shared(self, tags):
+        for tag in tags:
+            try:
+                fd = os.open(self._shared_path(tag), os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    raw = os.read(fd, 32)
+                    counter = int(raw or 0) + 1
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.ftruncate(fd, 0)
+                    os.write(fd, str(counter).encode())
+                finally:
+                    os.close(fd)
+            except (OSError, ValueError) as e:
+                structured_logger.log_event(
+                    "response_cache.shared_invalidate_failed",
+                    level="WARN",
+                    tag=tag,
+                    error=str(e)
+                )
+
+    def _apply_due_invalidations(self, now: float):
+        """Apply debounced invalidations whose window has elapsed (caller holds the lock)"""
+        for pattern, due_at in list(self._pending_invalidations.items()):
+            if now >= due_at:
+                del self._pending_invalidations[pattern]
+                self._last_debounced[pattern] = now
+                self._invalidate_locked(pattern)
+
+    def _schedule_debounce_timer_locked(self, now: float):
+        """Arm a timer for the earliest pending invalidation (caller holds the lock)"""
+        if self._debounce_timer is not None or not self._pending_invalidations:
+            return
+        delay = max(0.0, min(self._pending_invalidations.values()) - now)
+        self._debounce_timer = threading.Timer(delay, self._on_debounce_timer)
+        self._debounce_timer.daemon = True
+        self._debounce_timer.start()
+
+    def _on_debounce_timer(self):
+        now = time.monotonic()
+        with self._lock:
+            self._debounce_timer = None
+            self._apply_due_invalidations(now)
+            self._schedule_debounce_timer_locked(now)
+        self._flush_shared()
+
     def get(self, key: str, ttl_seconds: int) -> Optional[Any]:
         """
-        Get cached value if it exists and hasn't expired.
-        
+        Get cached value if it exists and hasn't expired or been invalidated.
+
         Args:
             key: Cache key
-            ttl_seconds: Time-to-live in seconds
-            
+            ttl_seconds: Time-to-live in seconds (the TTL given to set() applies)
+
         Returns:
             Cached value or None if not found/expired
         """
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        shared = self._shared_generations(entry['tags']) if entry is not None else None
         with self._lock:
-            if key not in self._cache:
+            entry = self._cache.get(key)
+            if entry is None:
                 return None
-            
-            entry = self._cache[key]
-            expires_at = entry['expires_at']
-            
-            if datetime.now(timezone.utc) > expires_at:
-                # Expired, remove it
+
+            if now > entry['expires_at'] or entry['tag_state'] != self._tag_state(entry['tags'], shared):
+                # Expired or invalidated, remove it
                 del self._cache[key]
                 return None
-            
+
+            self._cache.move_to_end(key)
             return entry['value']
-    
+
     def set(self, key: str, value: Any, ttl_seconds: int, path: Optional[str] = None):
         """
         Store value in cache with TTL.
-        
+
         Args:
             key: Cache key
             value: Value to cache
             ttl_seconds: Time-to-live in seconds
-            path: Request path for pattern-based invalidation (e.g., "/v1/devices")
+            path: Request path for tag-based invalidation (e.g., "/v1/devices")
         """
+        tags = [ALL_TAG] + path_tags(path)
+        shared = self._shared_generations(tags)
         with self._lock:
-            expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
-            self._cache[key] = {
-                'value': value,
-                'expires_at': expires_at,
-                'path': path  # Store path for pattern-based invalidation
-            }
-    
+            self._store_locked(key, value, ttl_seconds, path, tags, self._tag_state(tags, shared))
+
+    def _store_locked(self, key: str, value: Any, ttl_seconds: int, path: Optional[str], tags: List[str], tag_state: tuple):
+        self._cache[key] = {
+            'value': value,
+            'expires_at': time.monotonic() + ttl_seconds,
+            'path': path,
+            'tags': tags,
+            'tag_state': tag_state
+        }
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+            metrics.inc_counter("response_cache_evictions_total")
+
+    async def get_or_compute(
+        self,
+        key: str,
+        ttl_seconds: int,
+        compute: Callable[[], Any],
+        path: Optional[str] = None
+    ) -> Any:
+        """
+        Return the cached value or compute it once for all concurrent callers.
+
+        compute is a sync callable (run in a worker thread) or a coroutine function.
+        An invalidation that lands while compute is running makes the result
+        stale on arrival instead of caching outdated data.
+
+        Args:
+            key: Cache key
+            ttl_seconds: Time-to-live in seconds
+            compute: Producer for the value on a miss
+            path: Request path for tag-based invalidation
+
+        Returns:
+            Cached or freshly computed value
+        """
+        labels = {"path": path or "unknown"}
+        value = self.get(key, ttl_seconds)
+        if value is not None:
+            metrics.inc_counter("response_cache_hits_total", labels)
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            metrics.inc_counter("response_cache_coalesced_total", labels)
+            return await asyncio.shield(inflight)
+
+        metrics.inc_counter("response_cache_misses_total", labels)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+
+        tags = [ALL_TAG] + path_tags(path)
+        shared = self._shared_generations(tags)
+        with self._lock:
+            tag_state = self._tag_state(tags, shared)
+
+        try:
+            if asyncio.iscoroutinefunction(compute):
+                value = await compute()
+            else:
+                value = await asyncio.to_thread(compute)
+
+            with self._lock:
+                self._store_locked(key, value, ttl_seconds, path, tags, tag_state)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved so an exception nobody waited on is not reported
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _invalidate_locked(self, pattern: Optional[str]):
+        if pattern is None:
+            self._bump(ALL_TAG)
+            self._cache.clear()
+        else:
+            self._bump(path_tags(pattern)[-1])
+            # Entries created without path metadata can't be matched by tag;
+            # invalidate them on every call to avoid serving stale data
+            self._bump(UNTAGGED)
+
     def invalidate(self, pattern: Optional[str] = None):
         """
         Invalidate cache entries.
-        
+
         Args:
-            pattern: If provided, invalidate entries matching the path pattern.
-                     Matches entries where stored path starts with pattern.
-                     Also invalidates entries without path metadata (legacy entries).
-                     If None, invalidate all entries.
+            pattern: If provided, invalidate entries whose path is this path or
+                     lies under it (segment-wise, e.g. "/v1/devices" also covers
+                     "/v1/devices/abc"). Also invalidates entries without path
+                     metadata. If None, invalidate all entries.
         """
         with self._lock:
-            if pattern is None:
-                self._cache.clear()
-            else:
-                # Match by stored path metadata instead of key prefix
-                # This works with MD5-hashed keys
-                # Also invalidate entries without path metadata (legacy entries created before path was added)
-                # to avoid serving stale data from entries that can't be matched by pattern
-                keys_to_remove = [
-                    k for k, entry in self._cache.items()
-                    if not entry.get('path') or entry['path'].startswith(pattern)
-                ]
-                for key in keys_to_remove:
-                    del self._cache[key]
-    
+            self._pending_invalidations.pop(pattern, None)
+            self._invalidate_locked(pattern)
+        self._flush_shared()
+
+    def invalidate_debounced(self, pattern: str):
+        """
+        Invalidate at most once per debounce window for this pattern.
+
+        The first call in a window invalidates immediately; later calls in the
+        same window are folded into one invalidation applied when the window
+        ends, so readers see data at most debounce_seconds old.
+        """
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_debounced.get(pattern)
+            if last is None or now - last >= self.debounce_seconds:
+                self._last_debounced[pattern] = now
+                self._pending_invalidations.pop(pattern, None)
+                self._invalidate_locked(pattern)
+            elif pattern not in self._pending_invalidations:
+                self._pending_invalidations[pattern] = last + self.debounce_seconds
+                metrics.inc_counter("response_cache_invalidations_debounced_total")
+                self._schedule_debounce_timer_locked(now)
+        self._flush_shared()
+
     def cleanup_expired(self):
-        """Remove all expired entries from cache."""
-        now = datetime.now(timezone.utc)
+        """Remove all expired or invalidated entries from cache."""
+        now = time.monotonic()
         with self._lock:
-            expired_keys = [
-                key for key, entry in self._cache.items()
-                if now > entry['expires_at']
-            ]
-            for key in expired_keys:
-                del self._cache[key]
-    
+            self._cleanup_locked(now)
+
+    def _cleanup_locked(self, now: float):
+        expired_keys = [
+            key for key, entry in self._cache.items()
+            if now > entry['expires_at'] or entry['tag_state'] != self._tag_state(entry['tags'])
+        ]
+        for key in expired_keys:
+            del self._cache[key]
+
     def get_stats(self) -> Dict[str, Any]:
         """Get cache statistics."""
         with self._lock:
-            self.cleanup_expired()
+            self._cleanup_locked(time.monotonic())
             return {
                 'size': len(self._cache),
+                'max_entries': self.max_entries,
+                'inflight': len(self._inflight),
+                'pending_invalidations': len(self._pending_invalidations),
                 'keys': list(self._cache.keys())
             }
 
 # Global cache instance
-response_cache = ResponseCache()
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")),
+    debounce_seconds=float(os.getenv("RESPONSE_CACHE_INVALIDATION_DEBOUNCE_S", "5")),
+    shared_dir=os.getenv("RESPONSE_CACHE_SHARED_DIR") or None,
+    shared_poll_seconds=float(os.getenv("RESPONSE_CACHE_SHARED_POLL_S", "0.25"))
+)
 
 def make_cache_key(path: str, query_params: Optional[Dict[str, Any]] = None) -> str:
     """
     Generate a cache key from path and query parameters.
-    
+
     Args:
         path: Request path
         query_params: Query parameters dict
-        
+
     Returns:
         Cache key string
     """
@@ -125,7 +401,6 @@ def make_cache_key(path: str, query_params: Optional[Dict[str, Any]] = None) ->
         key_str = f"{path}?{params_str}"
     else:
         key_str = path
-    
+
     # Hash for shorter keys
     return hashlib.md5(key_str.encode()).hexdigest()
-
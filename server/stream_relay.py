@@ -0,0 +1,196 @@
+"""
+Screen-stream relay from a streaming device to dashboard viewers.
+
+Frames are relayed latest-frame-wins: each viewer has a one-slot mailbox
+drained by its own writer task. relay_frame() only fills mailboxes, so the
+device's receive loop never waits on a viewer socket; a frame that has not
+been sent by the time the next one arrives is replaced (counted as a drop)
+rather than queued behind it.
+
+A viewer can be capped at a frame rate (STREAM_VIEWER_MAX_FPS, or a lower
+per-connection max_fps); frames arriving faster than the cap are skipped the
+same way, which bounds bandwidth when several admins watch one device.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from fastapi import WebSocket
+
+from observability import structured_logger, metrics
+
+# How often a viewer's frame rate is sampled into stream_viewer_fps
+FPS_WINDOW_S = 5.0
+
+metrics.register_histogram("stream_viewer_fps", buckets=[1, 2, 5, 10, 15, 20, 30, 60])
+
+
+class _Viewer:
+    """One dashboard viewer: latest-frame mailbox, control messages and counters"""
+
+    def __init__(self, websocket: WebSocket, max_fps: float):
+        self.websocket = websocket
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.frame: Optional[bytes] = None
+        self.control: Deque[Dict[str, Any]] = deque()
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+        self.connected_at = time.monotonic()
+        self.last_sent_at = 0.0
+        self.sent = 0
+        self.dropped = 0
+        self._window_start = self.connected_at
+        self._window_sent = 0
+
+    def record_sent(self, now: float):
+        self.sent += 1
+        self.last_sent_at = now
+        self._window_sent += 1
+        elapsed = now - self._window_start
+        if elapsed >= FPS_WINDOW_S:
+            metrics.observe_histogram("stream_viewer_fps", self._window_sent / elapsed, {})
+            self._window_start = now
+            self._window_sent = 0
+
+    def stats(self) -> Dict[str, Any]:
+        duration = time.monotonic() - self.connected_at
+        return {
+            "frames_sent": self.sent,
+            "frames_dropped": self.dropped,
+            "avg_fps": round(self.sent / duration, 2) if duration > 0 else 0.0,
+            "max_fps": round(1.0 / self.min_interval, 2) if self.min_interval else None
+        }
+
+
+class StreamingConnectionManager:
+    """Manages screen streaming connections between devices and dashboard clients"""
+
+    def __init__(self, max_fps: float = 0.0):
+        # Server-wide per-viewer frame rate cap; 0 = uncapped
+        self.max_fps = max_fps
+        # device_id -> WebSocket (device streaming source)
+        self.device_streams: Dict[str, WebSocket] = {}
+        # device_id -> {WebSocket: _Viewer} (dashboard clients watching this device)
+        self.stream_viewers: Dict[str, Dict[WebSocket, _Viewer]] = {}
+
+    async def connect_device_stream(self, device_id: str, websocket: WebSocket):
+        """Device connects to start streaming its screen"""
+        await websocket.accept()
+        self.device_streams[device_id] = websocket
+        print(f"[STREAM] Device {device_id} started streaming")
+
+    def disconnect_device_stream(self, device_id: str):
+        """Device disconnects from streaming"""
+        if device_id in self.device_streams:
+            del self.device_streams[device_id]
+            print(f"[STREAM] Device {device_id} stopped streaming")
+
+        # Notify all viewers that stream ended
+        for websocket in list(self.stream_viewers.get(device_id, {})):
+            self.disconnect_viewer(device_id, websocket)
+            asyncio.create_task(self._send_stream_ended(websocket, device_id))
+
+    def _effective_max_fps(self, requested: Optional[float]) -> float:
+        caps = [fps for fps in (self.max_fps, requested or 0.0) if fps > 0]
+        return min(caps) if caps else 0.0
+
+    async def connect_viewer(self, device_id: str, websocket: WebSocket, max_fps: Optional[float] = None):
+        """
+        Dashboard client connects to view a device stream.
+
+        Args:
+            device_id: Device being watched
+            websocket: Viewer socket
+            max_fps: Optional frame rate cap for this viewer; cannot exceed the server-wide cap
+        """
+        await websocket.accept()
+        viewer = _Viewer(websocket, self._effective_max_fps(max_fps))
+        viewer.task = asyncio.create_task(self._writer(device_id, viewer))
+        self.stream_viewers.setdefault(device_id, {})[websocket] = viewer
+        metrics.set_gauge("stream_viewers", self.viewer_count())
+        print(f"[STREAM] Viewer connected to device {device_id}. Total viewers: {len(self.stream_viewers[device_id])}")
+
+    def disconnect_viewer(self, device_id: str, websocket: WebSocket):
+        """Dashboard client disconnects from viewing"""
+        viewers = self.stream_viewers.get(device_id)
+        if not viewers or websocket not in viewers:
+            return
+        viewer = viewers.pop(websocket)
+        if not viewers:
+            del self.stream_viewers[device_id]
+        if viewer.task and viewer.task is not asyncio.current_task():
+            viewer.task.cancel()
+
+        metrics.set_gauge("stream_viewers", self.viewer_count())
+        structured_logger.log_event("stream.viewer.disconnected", device_id=device_id, **viewer.stats())
+        print(f"[STREAM] Viewer disconnected from device {device_id}")
+
+    def viewer_count(self, device_id: Optional[str] = None) -> int:
+        if device_id is not None:
+            return len(self.stream_viewers.get(device_id, {}))
+        return sum(len(viewers) for viewers in self.stream_viewers.values())
+
+    async def relay_frame(self, device_id: str, frame_data: bytes):
+        """Hand a screen frame to every viewer's mailbox; never waits on a viewer socket."""
+        viewers = self.stream_viewers.get(device_id)
+        if not viewers:
+            return
+
+        metrics.inc_counter("stream_frames_received_total")
+        for viewer in viewers.values():
+            if viewer.frame is not None:
+                # Previous frame never went out; the newer one replaces it
+                viewer.dropped += 1
+                metrics.inc_counter("stream_frames_dropped_total")
+            viewer.frame = frame_data
+            viewer.ready.set()
+
+    def send_json(self, device_id: str, websocket: WebSocket, message: Dict[str, Any]):
+        """Queue a control message (e.g. a pong) ahead of the viewer's next frame."""
+        viewer = self.stream_viewers.get(device_id, {}).get(websocket)
+        if viewer:
+            viewer.control.append(message)
+            viewer.ready.set()
+
+    async def _writer(self, device_id: str, viewer: _Viewer):
+        websocket = viewer.websocket
+        try:
+            while True:
+                if viewer.control:
+                    await websocket.send_json(viewer.control.popleft())
+                    continue
+                if viewer.frame is None:
+                    viewer.ready.clear()
+                    await viewer.ready.wait()
+                    continue
+
+                wait = viewer.last_sent_at + viewer.min_interval - time.monotonic()
+                if wait > 0:
+                    # Frames arriving meanwhile replace the pending one
+                    await asyncio.sleep(wait)
+                    continue
+
+                frame, viewer.frame = viewer.frame, None
+                await websocket.send_bytes(frame)
+                viewer.record_sent(time.monotonic())
+                metrics.inc_counter("stream_frames_sent_total")
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.disconnect_viewer(device_id, websocket)
+
+    async def _send_stream_ended(self, websocket: WebSocket, device_id: str):
+        """Notify viewer that stream has ended"""
+        try:
+            await websocket.send_json({"type": "stream_ended", "device_id": device_id})
+        except:
+            pass
+
+
+# Global instance
+streaming_manager = StreamingConnectionManager(
+    max_fps=float(os.getenv("STREAM_VIEWER_MAX_FPS", "0"))
+)
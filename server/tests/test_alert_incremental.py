@@ -0,0 +1,101 @@
+"""
+Tests for incremental alert evaluation (AlertEvaluator.evaluate_changed_devices).
+The change feed, device lookup and per-device evaluation are stubbed, so these
+cover only which devices get re-evaluated on each tick.
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from alert_evaluator import AlertEvaluator
+
+
+class StubEvaluator(AlertEvaluator):
+    """Feeds device_last_status rows from a dict and records evaluated ids."""
+
+    def __init__(self):
+        super().__init__()
+        self.config = SimpleNamespace(
+            HEARTBEAT_INTERVAL_SECONDS=60,
+            ALERT_LOW_BATTERY_PCT=15,
+            UNITY_DOWN_REQUIRE_CONSECUTIVE=False,
+            ALERT_FULL_RESYNC_MINUTES=60,
+            ALERT_CHANGE_FEED_OVERLAP_S=0,
+        )
+        self.rows = {}
+        self.evaluated = []
+        self.alerts_for = set()
+
+    def set_row(self, device_id, last_ts, battery_pct=80, unity_running=True, service_up=True):
+        self.rows[device_id] = (device_id, last_ts, battery_pct, unity_running, service_up)
+
+    def _load_status_changes(self, db, since):
+        return [row for row in self.rows.values() if since is None or row[1] > since]
+
+    def _load_devices(self, db, device_ids):
+        return [SimpleNamespace(id=device_id) for device_id in device_ids]
+
+    def _evaluate_devices(self, db, devices, mode):
+        ids = sorted(device.id for device in devices)
+        self.evaluated.append(ids)
+        return [{"device_id": i, "condition": "test"} for i in ids if i in self.alerts_for]
+
+    def evaluate_all_devices(self, db):
+        return self._evaluate_devices(db, self._load_devices(db, list(self.rows)), mode="full")
+
+
+@pytest.fixture
+def evaluator():
+    evaluator = StubEvaluator()
+    now = datetime.now(timezone.utc)
+    for device_id in ("dev-1", "dev-2", "dev-3"):
+        evaluator.set_row(device_id, now - timedelta(seconds=10))
+    evaluator.evaluate_changed_devices(None)
+    evaluator.evaluated.clear()
+    return evaluator
+
+
+class TestIncrementalEvaluation:
+    """Dirty-set selection between full sweeps"""
+
+    def test_first_tick_is_full_sweep(self):
+        evaluator = StubEvaluator()
+        evaluator.set_row("dev-1", datetime.now(timezone.utc))
+        evaluator.evaluate_changed_devices(None)
+        assert evaluator.evaluated == [["dev-1"]]
+
+    def test_idle_tick_evaluates_nothing(self, evaluator):
+        assert evaluator.evaluate_changed_devices(None) == []
+        assert evaluator.evaluated == []
+
+    def test_heartbeat_without_verdict_change_is_skipped(self, evaluator):
+        evaluator.set_row("dev-1", datetime.now(timezone.utc), battery_pct=70)
+        evaluator.evaluate_changed_devices(None)
+        assert evaluator.evaluated == []
+
+    def test_verdict_change_is_evaluated(self, evaluator):
+        now = datetime.now(timezone.utc)
+        evaluator.set_row("dev-1", now, battery_pct=5)
+        evaluator.set_row("dev-2", now, service_up=False)
+        evaluator.evaluate_changed_devices(None)
+        assert evaluator.evaluated == [["dev-1", "dev-2"]]
+
+    def test_offline_transition_is_evaluated(self, evaluator):
+        """Online/offline transitions from offline_detector mark the device dirty once"""
+        evaluator._on_status_transition("dev-3", "offline", None)
+        evaluator.evaluate_changed_devices(None)
+        evaluator.evaluate_changed_devices(None)
+        assert evaluator.evaluated == [["dev-3"]]
+
+    def test_unrecorded_alert_is_retried(self, evaluator):
+        evaluator.alerts_for = {"dev-1"}
+        evaluator.set_row("dev-1", datetime.now(timezone.utc), battery_pct=5)
+        evaluator.evaluate_changed_devices(None)
+        evaluator.evaluate_changed_devices(None)
+        assert evaluator.evaluated == [["dev-1"], ["dev-1"]]
+
+        evaluator.alerts_for = set()
+        evaluator.evaluate_changed_devices(None)
+        evaluator.evaluate_changed_devices(None)
+        assert evaluator.evaluated == [["dev-1"], ["dev-1"], ["dev-1"]]
@@ -0,0 +1,99 @@
+"""
+Tests for the APK cache tiers (apk_cache.py): the content-addressed disk cache
+and the in-memory LRU.
+"""
+import hashlib
+import os
+
+import pytest
+
+from apk_cache import ApkCache, DiskApkCache
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def writer(data: bytes, calls: list):
+    def fetch(dest_path):
+        calls.append(dest_path)
+        with open(dest_path, "wb") as f:
+            f.write(data)
+    return fetch
+
+
+class TestDiskApkCache:
+    """Content-addressed disk tier"""
+
+    def test_fill_once_then_hit(self, tmp_path):
+        cache = DiskApkCache(str(tmp_path))
+        data = b"apk-bytes" * 100
+        calls = []
+
+        path, hit = cache.fill(digest(data), writer(data, calls))
+        assert not hit
+        assert path == cache.path_for(digest(data))
+        with open(path, "rb") as f:
+            assert f.read() == data
+
+        _, hit = cache.fill(digest(data), writer(data, calls))
+        assert hit
+        assert len(calls) == 1
+
+    def test_hash_mismatch_rejected(self, tmp_path):
+        cache = DiskApkCache(str(tmp_path))
+
+        with pytest.raises(ValueError):
+            cache.fill(digest(b"expected"), writer(b"corrupted", []))
+
+        assert cache.get_path(digest(b"expected")) is None
+        assert cache.get_stats()["entries"] == 0
+        # No temp files left behind
+        assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+    def test_lru_eviction(self, tmp_path):
+        cache = DiskApkCache(str(tmp_path), max_size_mb=1)
+        blobs = [bytes([i]) * (400 * 1024) for i in range(3)]
+
+        cache.fill(digest(blobs[0]), writer(blobs[0], []))
+        cache.fill(digest(blobs[1]), writer(blobs[1], []))
+        # Make blob 0 the oldest, then touch it so blob 1 becomes least recently used
+        for offset, blob in enumerate(blobs[:2]):
+            os.utime(cache.path_for(digest(blob)), (1000 + offset, 1000 + offset))
+        assert cache.get_path(digest(blobs[0])) is not None
+
+        cache.fill(digest(blobs[2]), writer(blobs[2], []))
+
+        assert cache.get_path(digest(blobs[0])) is not None
+        assert cache.get_path(digest(blobs[1])) is None
+        assert cache.get_path(digest(blobs[2])) is not None
+        assert cache.evictions == 1
+
+    def test_open_mmap(self, tmp_path):
+        cache = DiskApkCache(str(tmp_path))
+        data = os.urandom(10000)
+        cache.fill(digest(data), writer(data, []))
+
+        mapped = cache.open_mmap(digest(data))
+        assert mapped[100:200] == data[100:200]
+        assert len(mapped) == len(data)
+        mapped.close()
+
+        assert cache.open_mmap(digest(b"missing")) is None
+
+
+class TestApkCacheLru:
+    """In-memory tier eviction order"""
+
+    def test_evicts_least_recently_used(self):
+        cache = ApkCache(max_size_mb=1)
+        size = 400 * 1024
+        cache.put("a", b"a" * size, "application/octet-stream", size)
+        cache.put("b", b"b" * size, "application/octet-stream", size)
+        assert cache.get("a") is not None
+
+        cache.put("c", b"c" * size, "application/octet-stream", size)
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.get("c") is not None
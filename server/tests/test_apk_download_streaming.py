@@ -0,0 +1,139 @@
+"""
+Tests for streaming APK downloads (apk_download_service.py): Range parsing,
+ETag handling and the disk-backed FileResponse path. Object storage is stubbed.
+"""
+import hashlib
+import mmap
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.testclient import TestClient
+
+import apk_cache
+import apk_download_service
+from apk_cache import DiskApkCache
+from apk_download_service import _iter_bytes, download_apk_optimized, etag_matches, parse_range_header
+
+APK_BYTES = bytes(range(256)) * 1024
+APK_SHA256 = hashlib.sha256(APK_BYTES).hexdigest()
+
+
+class StubStorage:
+    def __init__(self):
+        self.downloads = 0
+
+    def download_to_path(self, storage_path, dest_path):
+        self.downloads += 1
+        with open(dest_path, "wb") as f:
+            f.write(APK_BYTES)
+        return len(APK_BYTES)
+
+
+class StubQuery:
+    def __init__(self, apk):
+        self.apk = apk
+
+    def filter(self, *args):
+        return self
+
+    def first(self):
+        return self.apk
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    storage = StubStorage()
+    monkeypatch.setattr(apk_cache, "_disk_apk_cache", DiskApkCache(str(tmp_path)))
+    monkeypatch.setattr(apk_download_service, "get_storage_service", lambda: storage)
+
+    apk = SimpleNamespace(
+        id=1, sha256=APK_SHA256, file_path="storage://apk/test.apk",
+        package_name="com.example", version_code=7
+    )
+    db = SimpleNamespace(query=lambda model: StubQuery(apk))
+
+    app = FastAPI()
+
+    @app.get("/apk")
+    async def download(request: Request):
+        return await download_apk_optimized(apk_id=1, db=db, request=request)
+
+    test_client = TestClient(app)
+    test_client.storage = storage
+    return test_client
+
+
+class TestRangeParsing:
+    """parse_range_header / etag_matches"""
+
+    def test_open_and_suffix_ranges(self):
+        assert parse_range_header("bytes=100-", 1000) == (100, 999)
+        assert parse_range_header("bytes=100-199", 1000) == (100, 199)
+        assert parse_range_header("bytes=-100", 1000) == (900, 999)
+        assert parse_range_header("bytes=900-5000", 1000) == (900, 999)
+
+    def test_full_file_for_missing_or_multi_range(self):
+        assert parse_range_header(None, 1000) is None
+        assert parse_range_header("bytes=0-1,5-6", 1000) is None
+        assert parse_range_header("items=0-1", 1000) is None
+
+    def test_unsatisfiable(self):
+        with pytest.raises(HTTPException) as exc:
+            parse_range_header("bytes=1000-", 1000)
+        assert exc.value.status_code == 416
+
+    def test_etag_matches(self):
+        assert etag_matches('"abc"', '"abc"')
+        assert etag_matches('W/"abc", "def"', '"abc"')
+        assert etag_matches("*", '"abc"')
+        assert not etag_matches('"def"', '"abc"')
+
+
+class TestStreamingDownload:
+    """End-to-end download responses"""
+
+    def test_full_download_cached_on_disk(self, client):
+        response = client.get("/apk")
+        assert response.status_code == 200
+        assert response.content == APK_BYTES
+        assert response.headers["etag"] == f'"{APK_SHA256}"'
+        assert response.headers["accept-ranges"] == "bytes"
+
+        client.get("/apk")
+        assert client.storage.downloads == 1
+
+    def test_resume_with_range(self, client):
+        response = client.get("/apk", headers={"Range": "bytes=1000-"})
+        assert response.status_code == 206
+        assert response.content == APK_BYTES[1000:]
+        assert response.headers["content-range"] == f"bytes 1000-{len(APK_BYTES) - 1}/{len(APK_BYTES)}"
+
+    def test_if_range_mismatch_sends_full_file(self, client):
+        response = client.get("/apk", headers={"Range": "bytes=1000-", "If-Range": '"other-build"'})
+        assert response.status_code == 200
+        assert len(response.content) == len(APK_BYTES)
+
+    def test_if_none_match(self, client):
+        response = client.get("/apk", headers={"If-None-Match": f'"{APK_SHA256}"'})
+        assert response.status_code == 304
+        assert client.storage.downloads == 0
+
+    def test_mmap_source_closed_after_streaming(self, tmp_path):
+        cache = DiskApkCache(str(tmp_path))
+        cache.fill(APK_SHA256, lambda dest: StubStorage().download_to_path(None, dest))
+        mapped = cache.open_mmap(APK_SHA256)
+
+        assert b"".join(_iter_bytes(mapped, 0, len(APK_BYTES) - 1)) == APK_BYTES
+        assert mapped.closed
+
+    def test_mmap_source_closed_when_client_disconnects(self, tmp_path):
+        with open(tmp_path / "build.apk", "wb") as f:
+            f.write(APK_BYTES)
+        with open(tmp_path / "build.apk", "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        chunks = _iter_bytes(mapped, 0, len(APK_BYTES) - 1)
+        next(chunks)
+        chunks.close()
+        assert mapped.closed
@@ -0,0 +1,56 @@
+"""
+Tests for the async session helpers in models.py.
+The asyncpg path needs PostgreSQL; these cover URL mapping and the sync fallback.
+"""
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import _async_database_url, run_in_session, run_in_session_threaded, commit_session
+
+
+class TestAsyncDatabaseUrl:
+    """DATABASE_URL -> asyncpg URL mapping"""
+
+    def test_driver_is_asyncpg(self):
+        url, connect_args = _async_database_url("postgresql://u:p@db.example:5432/mdm")
+
+        assert url.drivername == "postgresql+asyncpg"
+        assert url.database == "mdm"
+        assert connect_args == {}
+
+    def test_sslmode_becomes_ssl_connect_arg(self):
+        url, connect_args = _async_database_url("postgresql://u:p@db.example/mdm?sslmode=require")
+
+        assert "sslmode" not in url.query
+        assert connect_args == {"ssl": "require"}
+
+
+class TestRunInSession:
+    """run_in_session with a regular sync Session"""
+
+    async def test_calls_function_directly(self):
+        db = sessionmaker(bind=create_engine("sqlite:///:memory:"))()
+        try:
+            result = await run_in_session(db, lambda s, x: s.execute(text("SELECT :x"), {"x": x}).scalar(), 7)
+            await commit_session(db)
+        finally:
+            db.close()
+
+        assert result == 7
+
+    async def test_threaded_variant_leaves_the_loop_thread(self):
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        db = sessionmaker(bind=engine)()
+        loop_thread = threading.get_ident()
+        try:
+            result, thread = await run_in_session_threaded(
+                db, lambda s: (s.execute(text("SELECT 7")).scalar(), threading.get_ident())
+            )
+        finally:
+            db.close()
+
+        assert result == 7
+        assert thread != loop_thread
@@ -0,0 +1,32 @@
+"""
+Tests for the chunked `= ANY(:ids)` lookup helper (db_utils.iter_bulk_lookup).
+The session is stubbed; only statement reuse and chunking are checked.
+"""
+from db_utils import chunked, iter_bulk_lookup
+
+
+class RecordingSession:
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, statement, params):
+        self.calls.append((statement, params))
+        return [(device_id,) for device_id in params["ids"]]
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+
+def test_one_statement_per_chunk_with_shared_text():
+    db = RecordingSession()
+    ids = [f"dev-{i}" for i in range(7)]
+
+    rows = list(iter_bulk_lookup(db, "SELECT id FROM devices WHERE id = ANY(:ids) AND x > :x", ids,
+                                 {"x": 1}, chunk_size=3))
+
+    assert [row[0] for row in rows] == ids
+    assert [params["ids"] for _, params in db.calls] == [ids[0:3], ids[3:6], ids[6:7]]
+    assert all(params["x"] == 1 for _, params in db.calls)
+    assert len({id(statement) for statement, _ in db.calls}) == 1
@@ -0,0 +1,119 @@
+"""
+Tests for Parquet archive copies (columnar_archive.py): sorted row groups with
+statistics, row-group skipping on device/time predicates, and reads across
+archived partitions. Skipped when pyarrow is not installed.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import columnar_archive
+from models import HeartbeatPartition
+from partition_archiver import ARCHIVE_COLUMNS, ArchiveError, LocalArchiveStore, ObjectArchiveStore
+from tests.test_partition_archiver import FakeStorage
+
+DAY = datetime(2026, 1, 1)
+DEVICES = [f"dev-{i:02d}" for i in range(10)]
+
+
+def heartbeat(device_id, ts, hb_id):
+    values = {
+        "hb_id": hb_id, "device_id": device_id, "ts": ts, "status": "ok",
+        "battery_pct": hb_id % 100, "network_type": "wifi", "unity_running": True,
+        "bucket_ts": ts.replace(second=ts.second // 10 * 10)
+    }
+    return tuple(values.get(name) for name in ARCHIVE_COLUMNS)
+
+
+def day_rows(day):
+    """One heartbeat per device every 10 minutes for the day, sorted like the export query."""
+    rows = []
+    for device_id in DEVICES:
+        for minute in range(0, 24 * 60, 10):
+            rows.append(heartbeat(device_id, day + timedelta(minutes=minute), len(rows)))
+    return rows
+
+
+def batches(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+@pytest.fixture
+def parquet_path(tmp_path):
+    path = str(tmp_path / "device_heartbeats_20260101.parquet")
+    assert columnar_archive.write_parquet(batches(day_rows(DAY), 144), path) == 1440
+    return path
+
+
+def test_row_groups_follow_batches_and_carry_statistics(parquet_path):
+    metadata = pq.ParquetFile(parquet_path).metadata
+    assert metadata.num_row_groups == 10
+    first = metadata.row_group(0).column(ARCHIVE_COLUMNS.index("device_id")).statistics
+    assert first.has_min_max and first.min == first.max == "dev-00"
+
+
+def test_read_only_touches_matching_row_groups(parquet_path, monkeypatch):
+    read_groups = []
+    original = pq.ParquetFile.read_row_group
+
+    def counting_read(self, i, *args, **kwargs):
+        read_groups.append(i)
+        return original(self, i, *args, **kwargs)
+
+    monkeypatch.setattr(pq.ParquetFile, "read_row_group", counting_read)
+
+    rows = columnar_archive.read_parquet_history(
+        parquet_path, "dev-03", DAY + timedelta(hours=1), DAY + timedelta(hours=2)
+    )
+
+    assert read_groups == [3]
+    assert [r["ts"] for r in rows] == [DAY + timedelta(hours=1, minutes=m) for m in range(0, 60, 10)]
+    assert set(rows[0]) == set(columnar_archive.READ_COLUMNS)
+
+
+def test_read_device_history_spans_partitions(tmp_path):
+    engine = create_engine("sqlite://")
+    HeartbeatPartition.__table__.create(engine)
+    db = sessionmaker(bind=engine)()
+
+    store = LocalArchiveStore(str(tmp_path))
+    for day in (DAY, DAY + timedelta(days=1)):
+        name = f"device_heartbeats_{day:%Y%m%d}"
+        path = str(tmp_path / f"{name}.tmp")
+        count = columnar_archive.write_parquet(batches(day_rows(day), 144), path)
+        result = columnar_archive.upload_file(store, path, f"{name}.parquet", count)
+        db.add(HeartbeatPartition(
+            partition_name=name, range_start=day, range_end=day + timedelta(days=1),
+            state="dropped", parquet_url=result.url, parquet_checksum_sha256=result.checksum_sha256
+        ))
+    db.commit()
+
+    rows = columnar_archive.read_device_history(
+        db, "dev-07", DAY + timedelta(hours=23), DAY + timedelta(days=1, hours=1)
+    )
+    assert [r["ts"] for r in rows] == [DAY + timedelta(hours=23, minutes=m) for m in range(0, 120, 10)]
+
+    limited = columnar_archive.read_device_history(db, "dev-07", DAY, DAY + timedelta(days=2), limit=5)
+    assert len(limited) == 5
+    db.close()
+
+
+def test_object_store_archives_are_cached_and_checksummed(tmp_path, monkeypatch, parquet_path):
+    monkeypatch.setattr(columnar_archive, "ARCHIVE_CACHE_DIR", str(tmp_path / "cache"))
+    store = ObjectArchiveStore(FakeStorage(), part_bytes=4096)
+    monkeypatch.setattr(columnar_archive, "store_for_url", lambda url: store)
+
+    result = columnar_archive.upload_file(store, parquet_path, "archives/p.parquet", 1440)
+    local = columnar_archive._local_path(result.url, result.checksum_sha256)
+    assert open(local, "rb").read() == open(parquet_path, "rb").read()
+    # Second read is served from the cache
+    assert columnar_archive._local_path(result.url, result.checksum_sha256) == local
+
+    with pytest.raises(ArchiveError, match="Checksum"):
+        columnar_archive._local_path(result.url, "0" * 64)
@@ -0,0 +1,70 @@
+"""
+Tests for coalesced dashboard device deltas (device_deltas.py). Published
+messages are collected in a list instead of going to the broadcast hub.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from device_deltas import DeviceDeltaCoalescer
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def published():
+    return []
+
+
+@pytest.fixture
+def coalescer(published):
+    return DeviceDeltaCoalescer(published.append, max_devices_per_message=2)
+
+
+class TestDeviceDeltaCoalescer:
+    """Per-window diffs"""
+
+    def test_first_delta_carries_all_fields(self, coalescer, published):
+        coalescer.record("dev-1", T0, status="online", battery_pct=80, unity_running=True, service_up=True)
+        assert coalescer.flush() == 1
+        assert published == [{"type": "device_deltas", "devices": [{
+            "id": "dev-1", "last_seen": T0.isoformat(), "status": "online",
+            "battery_pct": 80, "unity_running": True, "service_up": True
+        }]}]
+
+    def test_heartbeats_in_one_window_coalesce(self, coalescer, published):
+        for i in range(10):
+            coalescer.record("dev-1", T0 + timedelta(seconds=i), battery_pct=80 - i)
+        coalescer.flush()
+        assert published[0]["devices"] == [
+            {"id": "dev-1", "last_seen": (T0 + timedelta(seconds=9)).isoformat(), "battery_pct": 71}
+        ]
+
+    def test_only_changed_fields_are_sent(self, coalescer, published):
+        coalescer.record("dev-1", T0, status="online", battery_pct=80, service_up=True)
+        coalescer.flush()
+        coalescer.record("dev-1", T0 + timedelta(seconds=60), status="online", battery_pct=79, service_up=True)
+        coalescer.flush()
+        assert published[1]["devices"] == [
+            {"id": "dev-1", "last_seen": (T0 + timedelta(seconds=60)).isoformat(), "battery_pct": 79}
+        ]
+
+    def test_forget_drops_pending_and_sent_state(self, coalescer, published):
+        coalescer.record("dev-1", T0, status="online", battery_pct=80)
+        coalescer.flush()
+        coalescer.record("dev-1", T0 + timedelta(seconds=60), battery_pct=79)
+        coalescer.forget("dev-1")
+
+        assert coalescer.flush() == 0
+        assert coalescer._sent == {}
+
+    def test_unknown_fields_ignored_and_idle_flush_publishes_nothing(self, coalescer, published):
+        coalescer.record("dev-1", None, alias="ignored")
+        assert coalescer.flush() == 0
+        assert published == []
+
+    def test_large_flush_split_into_messages(self, coalescer, published):
+        for device_id in ("dev-1", "dev-2", "dev-3"):
+            coalescer.record(device_id, T0, status="online")
+        assert coalescer.flush() == 3
+        assert [len(message["devices"]) for message in published] == [2, 1]
@@ -0,0 +1,85 @@
+"""
+Tests for /v1/devices query building (device_listing.py): keyset pagination,
+filters and cursors, against an in-memory SQLite devices table.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import device_listing
+from models import Device
+
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Device.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    for i in range(7):
+        session.add(Device(
+            id=f"dev-{i}",
+            alias=f"Lab_{i % 3}",
+            token_hash="x",
+            # Repeated last_seen values exercise the id tie-breaker
+            last_seen=T0 + timedelta(minutes=i % 4),
+            installed_apk_version_code=i if i % 2 else None
+        ))
+    session.commit()
+    device_listing.count_cache.clear()
+    yield session
+    session.close()
+
+
+def walk(db, sort, limit=2, **filters):
+    """Follow cursors through every page and return the ids in order."""
+    ids, after = [], None
+    while True:
+        query = device_listing.filtered_query(
+            db, filters.get("status"), filters.get("version_code"), filters.get("alias"), 180
+        )
+        rows = device_listing.page_query(query, sort, after, limit).all()
+        ids.extend(row.id for row in rows[:limit])
+        if len(rows) <= limit:
+            return ids
+        after = device_listing.decode_cursor(sort, device_listing.encode_cursor(sort, rows[limit - 1]))
+
+
+class TestKeysetPagination:
+    """Cursor paging covers every row once, in sort order"""
+
+    def test_last_seen_newest_first(self, db):
+        assert walk(db, "last_seen") == ["dev-3", "dev-6", "dev-2", "dev-5", "dev-1", "dev-4", "dev-0"]
+
+    def test_alias_ascending(self, db):
+        assert walk(db, "alias", limit=3) == ["dev-0", "dev-3", "dev-6", "dev-1", "dev-4", "dev-2", "dev-5"]
+
+    def test_version_highest_first_nulls_last(self, db):
+        assert walk(db, "version") == ["dev-5", "dev-3", "dev-1", "dev-6", "dev-4", "dev-2", "dev-0"]
+
+    def test_filters(self, db):
+        assert walk(db, "last_seen", alias="LAB_1") == ["dev-1", "dev-4"]
+        assert walk(db, "last_seen", alias="Lab%") == []
+        assert walk(db, "last_seen", version_code=3) == ["dev-3"]
+        assert walk(db, "last_seen", status="online") == []
+
+    def test_count_is_cached(self, db):
+        query = device_listing.filtered_query(db, None, None, "lab_1", 180)
+        assert device_listing.approximate_count(db, query, (None, None, "lab_1")) == 2
+        db.query(Device).filter(Device.id == "dev-1").delete()
+        db.commit()
+        assert device_listing.approximate_count(db, query, (None, None, "lab_1")) == 2
+
+
+class TestCursor:
+    def test_rejects_cursor_for_other_sort(self, db):
+        cursor = device_listing.encode_cursor("alias", db.get(Device, "dev-1"))
+        with pytest.raises(device_listing.CursorError):
+            device_listing.decode_cursor("last_seen", cursor)
+
+    def test_rejects_garbage(self):
+        with pytest.raises(device_listing.CursorError):
+            device_listing.decode_cursor("last_seen", "not-a-cursor")
@@ -0,0 +1,55 @@
+"""
+Tests for the verified device-token cache (auth.DeviceTokenCache).
+"""
+import time
+
+from auth import DeviceTokenCache
+
+
+class TestDeviceTokenCache:
+    """TTL, LRU and revocation behaviour of DeviceTokenCache"""
+
+    def test_hit_after_put(self):
+        cache = DeviceTokenCache(max_size=10, ttl_seconds=60)
+        cache.put("tok-1", "dev-1", "hash-1", cache.generation("dev-1"))
+
+        assert cache.get("tok-1") == ("dev-1", "hash-1")
+        assert cache.get("tok-2") is None
+
+    def test_entry_expires_after_ttl(self):
+        cache = DeviceTokenCache(max_size=10, ttl_seconds=0)
+        cache.put("tok-1", "dev-1", "hash-1", 0)
+        time.sleep(0.01)
+
+        assert cache.get("tok-1") is None
+        assert cache.get_stats()["size"] == 0
+
+    def test_lru_eviction(self):
+        cache = DeviceTokenCache(max_size=2, ttl_seconds=60)
+        cache.put("tok-1", "dev-1", "hash-1", 0)
+        cache.put("tok-2", "dev-2", "hash-2", 0)
+        cache.get("tok-1")  # tok-2 is now least recently used
+        cache.put("tok-3", "dev-3", "hash-3", 0)
+
+        assert cache.get("tok-1") is not None
+        assert cache.get("tok-2") is None
+        assert cache.get("tok-3") is not None
+
+    def test_invalidate_device_revokes_entries(self):
+        cache = DeviceTokenCache(max_size=10, ttl_seconds=60)
+        cache.put("tok-1", "dev-1", "hash-1", cache.generation("dev-1"))
+        cache.put("tok-2", "dev-2", "hash-2", cache.generation("dev-2"))
+
+        cache.invalidate_device("dev-1")
+
+        assert cache.get("tok-1") is None
+        assert cache.get("tok-2") == ("dev-2", "hash-2")
+
+    def test_put_after_revocation_is_ignored(self):
+        """A verification that started before the device was revoked is not cached"""
+        cache = DeviceTokenCache(max_size=10, ttl_seconds=60)
+        generation = cache.generation("dev-1")
+        cache.invalidate_device("dev-1")
+        cache.put("tok-1", "dev-1", "hash-1", generation)
+
+        assert cache.get("tok-1") is None
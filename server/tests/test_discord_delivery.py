@@ -0,0 +1,90 @@
+"""
+Tests for the background Discord delivery queue (discord_delivery.py):
+embed batching, 429 retry_after handling and retries. HTTP is stubbed.
+"""
+import asyncio
+
+import httpx
+
+from discord_delivery import DiscordDeliveryQueue, MAX_EMBEDS_PER_MESSAGE
+
+URL = "https://discord.test/webhook"
+
+
+class StubClient:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = []
+
+    async def post(self, url, json=None):
+        self.posts.append(len(json["embeds"]))
+        outcome = self.outcomes.pop(0) if self.outcomes else httpx.Response(204)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def aclose(self):
+        pass
+
+
+async def run_queue(queue: DiscordDeliveryQueue, client: StubClient, embeds: int):
+    await queue.start()
+    await queue._client.aclose()
+    queue._client = client
+    for i in range(embeds):
+        queue.enqueue(URL, {"title": f"alert {i}"}, "discord.webhook.sent", device_id=f"dev-{i}")
+    for _ in range(200):
+        if not queue.get_stats()["queued"] and sum(client.posts) >= embeds:
+            break
+        await asyncio.sleep(0.01)
+    await queue.stop()
+
+
+def make_queue(**kwargs) -> DiscordDeliveryQueue:
+    options = dict(rate_per_sec=1000, burst=1000, max_in_flight=1, backoff_base_s=0.001, backoff_max_s=0.01)
+    options.update(kwargs)
+    return DiscordDeliveryQueue(**options)
+
+
+class TestDiscordDeliveryQueue:
+    """Batching, rate limiting and retries"""
+
+    async def test_packs_embeds_per_message(self):
+        queue = make_queue()
+        client = StubClient()
+        await run_queue(queue, client, 25)
+        assert client.posts == [MAX_EMBEDS_PER_MESSAGE, MAX_EMBEDS_PER_MESSAGE, 5]
+        assert queue.get_stats()["sent"] == 25
+
+    async def test_429_pauses_and_resends(self):
+        queue = make_queue()
+        client = StubClient(httpx.Response(429, json={"retry_after": 0.05, "global": False}))
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await run_queue(queue, client, 3)
+
+        assert client.posts == [3, 3]
+        assert loop.time() - started >= 0.05
+        stats = queue.get_stats()
+        assert stats["rate_limited"] == 1
+        assert stats["sent"] == 3
+
+    async def test_server_errors_retried_then_dropped(self):
+        queue = make_queue(max_attempts=2)
+        client = StubClient(httpx.Response(502), httpx.ConnectError("down"))
+        await run_queue(queue, client, 1)
+        assert client.posts == [1, 1]
+        assert queue.get_stats()["dropped"] == 1
+
+    async def test_client_error_not_retried(self):
+        queue = make_queue()
+        client = StubClient(httpx.Response(400, text="bad embed"))
+        await run_queue(queue, client, 1)
+        assert client.posts == [1]
+        assert queue.get_stats()["dropped"] == 1
+
+    def test_full_queue_rejects(self):
+        queue = make_queue(max_queue=1)
+        assert queue.enqueue(URL, {}, "discord.webhook.sent")
+        assert not queue.enqueue(URL, {}, "discord.webhook.sent")
@@ -0,0 +1,73 @@
+"""
+Tests for the shared FCM client (fcm_client.py): token caching and the shared HTTP client.
+Google's token endpoint is not called; credentials are stubbed.
+"""
+from datetime import datetime, timedelta
+
+from fcm_client import FcmClient
+
+
+class StubCredentials:
+    def __init__(self, lifetime_s: int):
+        self.lifetime_s = lifetime_s
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f"token-{self.refreshes}"
+        self.expiry = datetime.utcnow() + timedelta(seconds=self.lifetime_s)
+
+
+def make_client(lifetime_s: int = 3600, margin_s: int = 300) -> tuple:
+    client = FcmClient(refresh_margin_seconds=margin_s)
+    credentials = StubCredentials(lifetime_s)
+    client._credentials = credentials
+    client._credentials_source = client._current_source()
+    client._project_id = "demo-project"
+    return client, credentials
+
+
+class TestFcmTokenCache:
+    """Access token reuse and refresh"""
+
+    async def test_token_is_reused_until_margin(self):
+        client, credentials = make_client(lifetime_s=3600)
+
+        first = await client.get_access_token()
+        second = await client.get_access_token()
+
+        assert first == second == "token-1"
+        assert credentials.refreshes == 1
+
+    async def test_token_refreshed_inside_margin(self):
+        client, credentials = make_client(lifetime_s=100, margin_s=300)
+
+        await client.get_access_token()
+        await client.get_access_token()
+
+        assert credentials.refreshes == 2
+
+    def test_sync_accessor_shares_cache(self):
+        client, credentials = make_client()
+
+        assert client.get_access_token_sync() == client.get_access_token_sync()
+        assert credentials.refreshes == 1
+
+
+class TestSharedHttpClient:
+    """One AsyncClient reused across dispatch paths"""
+
+    async def test_session_reuses_client(self):
+        client, _ = make_client()
+
+        async with client.session() as first:
+            pass
+        async with client.session() as second:
+            pass
+
+        assert first is second
+        assert not first.is_closed
+        await client.stop()
+        assert first.is_closed
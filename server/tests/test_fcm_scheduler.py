@@ -0,0 +1,181 @@
+"""
+Tests for the global FCM dispatch scheduler (fcm_scheduler.py).
+Covers the token bucket, lane priority, retry/Retry-After handling and the
+batched dispatch write-back; FCM and the database are stubbed.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from fcm_scheduler import (
+    FcmDispatchScheduler,
+    TokenBucket,
+    parse_retry_after,
+    LANE_INTERACTIVE,
+    LANE_BULK,
+)
+
+
+class StubClient:
+    """Returns queued responses (or raises queued exceptions) in order."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def post(self, url, json=None, headers=None, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_scheduler(**kwargs) -> FcmDispatchScheduler:
+    options = dict(rate_per_sec=1000, burst=1000, backoff_base_s=0.001, backoff_max_s=0.01)
+    options.update(kwargs)
+    return FcmDispatchScheduler(**options)
+
+
+class TestRetryAfter:
+    """Retry-After header parsing"""
+
+    def test_delta_seconds(self):
+        assert parse_retry_after("7") == 7.0
+
+    def test_http_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        assert 25 <= parse_retry_after(format_datetime(retry_at, usegmt=True)) <= 30
+
+    def test_missing_or_malformed(self):
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("soon") is None
+
+
+class TestTokenBucket:
+    """Token bucket refill and pause"""
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket._updated
+        assert bucket.try_acquire(now) == 0
+        assert bucket.try_acquire(now) == 0
+        assert bucket.try_acquire(now) == pytest.approx(0.1)
+        assert bucket.try_acquire(now + 0.11) == 0
+
+    def test_pause_blocks_all_tokens(self):
+        bucket = TokenBucket(rate=10, burst=5)
+        now = bucket._updated
+        bucket.pause(2, now)
+        assert bucket.try_acquire(now + 1) == pytest.approx(1)
+        assert bucket.try_acquire(now + 2.2) == 0
+
+
+class TestFcmDispatchScheduler:
+    """Admission, retries and write-back"""
+
+    async def test_interactive_lane_granted_first(self):
+        """With one slot busy, a later interactive send overtakes queued bulk sends"""
+        scheduler = make_scheduler(max_in_flight=1, interactive_reserve=0)
+        order = []
+
+        await scheduler._acquire(LANE_BULK)
+
+        async def send(lane, name):
+            await scheduler._acquire(lane)
+            order.append(name)
+            scheduler._release()
+
+        bulk = asyncio.create_task(send(LANE_BULK, "bulk"))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(send(LANE_INTERACTIVE, "interactive"))
+        await asyncio.sleep(0)
+
+        scheduler._release()
+        await asyncio.gather(bulk, interactive)
+        assert order == ["interactive", "bulk"]
+
+    async def test_interactive_reserve(self):
+        """Bulk sends cannot take the slots reserved for interactive sends"""
+        scheduler = make_scheduler(max_in_flight=2, interactive_reserve=1)
+        await scheduler._acquire(LANE_BULK)
+
+        blocked = asyncio.create_task(scheduler._acquire(LANE_BULK))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        await asyncio.wait_for(scheduler._acquire(LANE_INTERACTIVE), timeout=1)
+        blocked.cancel()
+
+    async def test_retries_429_and_honors_retry_after(self):
+        """A 429 is retried after Retry-After and the bucket pauses for everyone"""
+        scheduler = make_scheduler()
+        client = StubClient(
+            httpx.Response(429, headers={"Retry-After": "0.05"}),
+            httpx.Response(200, json={"name": "msg-1"})
+        )
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        response = await scheduler.post(client, "https://fcm", json={}, headers={}, request_id="req-1")
+
+        assert response.status_code == 200
+        assert client.calls == 2
+        assert loop.time() - started >= 0.05
+        assert scheduler.get_stats()["rate_limited"] == 1
+        assert scheduler._writeback["req-1"]["retries"] == 1
+
+    async def test_non_retryable_error_returned(self):
+        """4xx other than 401/429 is returned without retrying"""
+        scheduler = make_scheduler()
+        client = StubClient(httpx.Response(404))
+
+        response = await scheduler.post(client, "https://fcm", json={}, headers={})
+        assert response.status_code == 404
+        assert client.calls == 1
+
+    async def test_lane_retry_budget(self):
+        """Interactive sends give up sooner than bulk sends"""
+        scheduler = make_scheduler(max_retries=3, interactive_max_retries=1)
+
+        client = StubClient(*[httpx.Response(503) for _ in range(2)])
+        response = await scheduler.post(client, "https://fcm", json={}, headers={}, lane=LANE_INTERACTIVE)
+        assert response.status_code == 503
+        assert client.calls == 2
+
+        client = StubClient(*[httpx.Response(503) for _ in range(4)])
+        await scheduler.post(client, "https://fcm", json={}, headers={}, lane=LANE_BULK)
+        assert client.calls == 4
+
+    async def test_transport_error_raised_after_retries(self):
+        """If no attempt gets a response the last transport error propagates"""
+        scheduler = make_scheduler(max_retries=1)
+        client = StubClient(httpx.ConnectTimeout("t1"), httpx.ConnectTimeout("t2"))
+
+        with pytest.raises(httpx.ConnectTimeout):
+            await scheduler.post(client, "https://fcm", json={}, headers={})
+        assert scheduler.get_stats()["in_flight"] == 0
+
+    async def test_writeback_keeps_unrecorded_dispatches(self):
+        """Rows without an fcm_dispatches record yet are retried on later flushes"""
+        scheduler = make_scheduler(writeback_max_attempts=2)
+        written = []
+
+        def fake_write(rows):
+            written.append(sorted(row["request_id"] for row in rows))
+            return {row["request_id"] for row in rows} & {"req-1"}
+
+        scheduler._write = fake_write
+        for request_id in ("req-1", "req-2"):
+            await scheduler.post(StubClient(httpx.Response(200)), "https://fcm", json={}, headers={}, request_id=request_id)
+
+        await scheduler.flush_writeback()
+        assert list(scheduler._writeback) == ["req-2"]
+
+        await scheduler.flush_writeback()
+        assert written == [["req-1", "req-2"], ["req-2"]]
+        assert scheduler._writeback == {}
+        assert scheduler.get_stats()["written_back"] == 1
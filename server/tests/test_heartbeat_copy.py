@@ -0,0 +1,48 @@
+"""
+Tests for the COPY encoding used by the batched heartbeat writer
+(db_utils.build_copy_buffer) and partition naming.
+"""
+from datetime import date, datetime, timezone, timedelta
+
+from db_utils import HEARTBEAT_BATCH_COLUMNS, _build_values_clause, build_copy_buffer, heartbeat_partition_name, _utc_date
+
+COLUMNS = [("device_id", "VARCHAR"), ("ts", "TIMESTAMP"), ("plugged", "BOOLEAN"),
+           ("battery_pct", "INTEGER"), ("agent_version", "VARCHAR")]
+
+
+class TestCopyBuffer:
+    def test_row_encoding(self):
+        rows = [{
+            "device_id": "dev-1",
+            "ts": datetime(2026, 1, 1, 12, 0, 5, tzinfo=timezone.utc),
+            "plugged": False,
+            "battery_pct": 42,
+            "agent_version": None
+        }]
+        assert build_copy_buffer(rows, COLUMNS).read() == "dev-1\t2026-01-01T12:00:05\tf\t42\t\\N\n"
+
+    def test_special_characters_escaped(self):
+        rows = [{"device_id": "a\tb", "agent_version": "1.0\\beta\nx"}]
+        line = build_copy_buffer(rows, COLUMNS).read()
+        assert line == "a\\tb\t\\N\t\\N\t\\N\t1.0\\\\beta\\nx\n"
+        assert line.count("\t") == len(COLUMNS) - 1
+
+    def test_timestamps_converted_to_utc(self):
+        ts = datetime(2026, 1, 2, 1, 30, tzinfo=timezone(timedelta(hours=2)))
+        assert build_copy_buffer([{"ts": ts}], [("ts", "TIMESTAMP")]).read() == "2026-01-01T23:30:00\n"
+
+    def test_every_batch_column_is_written(self):
+        line = build_copy_buffer([{}], HEARTBEAT_BATCH_COLUMNS).read()
+        assert line.rstrip("\n").split("\t") == ["\\N"] * len(HEARTBEAT_BATCH_COLUMNS)
+
+
+def test_partition_for_utc_date():
+    ts = datetime(2026, 1, 2, 1, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert heartbeat_partition_name(_utc_date(ts)) == "device_heartbeats_20260101"
+    assert heartbeat_partition_name(date(2026, 3, 9)) == "device_heartbeats_20260309"
+
+
+def test_values_clause_binds_naive_utc():
+    ts = datetime(2026, 1, 2, 1, 30, tzinfo=timezone(timedelta(hours=2)))
+    _, _, params = _build_values_clause([{"ts": ts}], [("ts", "TIMESTAMP")], "hb")
+    assert params == {"hb_ts_0": datetime(2026, 1, 1, 23, 30)}
@@ -0,0 +1,118 @@
+"""
+Tests for the async heartbeat ingest pipeline (heartbeat_ingest.py).
+Covers batching, backpressure and drain-on-shutdown; the SQL writer is stubbed.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+from heartbeat_ingest import HeartbeatIngestQueue
+
+
+def make_record(device_id: str) -> dict:
+    return {
+        "device_id": device_id,
+        "alias": device_id,
+        "ts": datetime.now(timezone.utc),
+        "heartbeat": {"battery_pct": 80},
+        "service": {"service_up": None, "monitored_foreground_recent_s": None},
+        "device": {"last_seen": datetime.now(timezone.utc)},
+        "ping_request_id": None,
+        "monitoring": {"enabled": False},
+    }
+
+
+def stub_writer(queue: HeartbeatIngestQueue, fail: bool = False) -> list:
+    """Replace the DB write with an in-memory recorder; returns the list of written batches."""
+    batches = []
+
+    def fake_write(batch):
+        if fail:
+            raise RuntimeError("db down")
+        batches.append([r["device_id"] for r in batch])
+        return {"created": len(batch), "deduped": 0, "last_status_upserts": len(batch),
+                "devices_updated": len(batch), "prev_service_up": {}}
+
+    queue._write = fake_write
+    return batches
+
+
+class TestHeartbeatIngestQueue:
+    """Queue mechanics of HeartbeatIngestQueue"""
+
+    async def test_flushes_by_batch_size(self):
+        """A full batch is written without waiting for the flush interval"""
+        queue = HeartbeatIngestQueue(max_size=100, batch_size=5, flush_interval_ms=5000)
+        batches = stub_writer(queue)
+        await queue.start()
+
+        for i in range(5):
+            assert await queue.enqueue(make_record(f"dev-{i}"))
+
+        for _ in range(50):
+            if batches:
+                break
+            await asyncio.sleep(0.02)
+
+        assert batches == [[f"dev-{i}" for i in range(5)]]
+        await queue.stop()
+
+    async def test_flushes_by_interval(self):
+        """A partial batch is written once the flush interval elapses"""
+        queue = HeartbeatIngestQueue(max_size=100, batch_size=500, flush_interval_ms=50)
+        batches = stub_writer(queue)
+        await queue.start()
+
+        await queue.enqueue(make_record("dev-1"))
+        await queue.enqueue(make_record("dev-2"))
+        await asyncio.sleep(0.3)
+
+        assert batches == [["dev-1", "dev-2"]]
+        await queue.stop()
+
+    async def test_rejects_when_full(self):
+        """Backpressure: enqueue gives up after enqueue_timeout_ms when the queue stays full"""
+        queue = HeartbeatIngestQueue(max_size=2, batch_size=10, flush_interval_ms=5000, enqueue_timeout_ms=20)
+        stub_writer(queue)
+        queue._running = True  # accept records without a writer draining them
+
+        assert await queue.enqueue(make_record("dev-1"))
+        assert await queue.enqueue(make_record("dev-2"))
+        assert not await queue.enqueue(make_record("dev-3"))
+
+        stats = queue.get_stats()
+        assert stats["enqueued"] == 2
+        assert stats["rejected"] == 1
+        assert stats["queue_depth"] == 2
+
+    async def test_rejects_when_not_running(self):
+        """Heartbeats are not accepted before start() or after stop()"""
+        queue = HeartbeatIngestQueue()
+        assert not await queue.enqueue(make_record("dev-1"))
+
+    async def test_stop_drains_queue(self):
+        """stop() writes every queued record before returning"""
+        queue = HeartbeatIngestQueue(max_size=100, batch_size=3, flush_interval_ms=5000)
+        batches = stub_writer(queue)
+        await queue.start()
+
+        for i in range(7):
+            await queue.enqueue(make_record(f"dev-{i}"))
+        await queue.stop()
+
+        written = [device_id for batch in batches for device_id in batch]
+        assert written == [f"dev-{i}" for i in range(7)]
+        assert queue.get_stats()["queue_depth"] == 0
+
+    async def test_failed_batch_retried_per_record(self):
+        """A failing batch falls back to per-record writes and counts drops"""
+        queue = HeartbeatIngestQueue(max_size=100, batch_size=2, flush_interval_ms=50)
+        stub_writer(queue, fail=True)
+        await queue.start()
+
+        await queue.enqueue(make_record("dev-1"))
+        await queue.enqueue(make_record("dev-2"))
+        await queue.stop()
+
+        stats = queue.get_stats()
+        assert stats["errors"] == 1
+        assert stats["dropped"] == 2
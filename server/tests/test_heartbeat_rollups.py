@@ -0,0 +1,102 @@
+"""
+Tests for heartbeat history (heartbeat_rollups.py): resolution selection,
+rollup windows and reads from the rollup tables, against in-memory SQLite.
+The rollup SQL itself is Postgres-only.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import heartbeat_rollups
+from heartbeat_rollups import HistoryError, floor_to, pick_resolution, rollup_windows
+from models import HeartbeatRollup1m, HeartbeatRollup1h, HeartbeatRollup1d
+
+NOW = datetime(2026, 3, 10, 12, 34, 56)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    for model in (HeartbeatRollup1m, HeartbeatRollup1h, HeartbeatRollup1d):
+        model.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_floor_to():
+    assert floor_to(NOW, "1m") == datetime(2026, 3, 10, 12, 34)
+    assert floor_to(NOW, "1h") == datetime(2026, 3, 10, 12)
+    assert floor_to(NOW, "1d") == datetime(2026, 3, 10)
+
+
+def test_rollup_windows_are_contiguous_and_bounded():
+    start = datetime(2026, 3, 10, 9)
+    windows = rollup_windows(start, datetime(2026, 3, 10, 11, 30), timedelta(hours=1))
+    assert windows == [
+        (datetime(2026, 3, 10, 9), datetime(2026, 3, 10, 10)),
+        (datetime(2026, 3, 10, 10), datetime(2026, 3, 10, 11)),
+        (datetime(2026, 3, 10, 11), datetime(2026, 3, 10, 11, 30)),
+    ]
+    assert rollup_windows(start, start, timedelta(hours=1)) == []
+
+
+def test_auto_resolution_picks_coarser_tables_for_longer_ranges():
+    assert pick_resolution(NOW - timedelta(hours=6), NOW, now=NOW) == "1m"
+    assert pick_resolution(NOW - timedelta(days=7), NOW, now=NOW) == "1h"
+    assert pick_resolution(NOW - timedelta(days=365), NOW, now=NOW) == "1d"
+
+
+def test_auto_resolution_skips_levels_past_retention():
+    # A short range older than the 1m retention can only come from 1h
+    start = NOW - heartbeat_rollups.RETENTION["1m"] - timedelta(days=1)
+    assert pick_resolution(start, start + timedelta(hours=2), now=NOW) == "1h"
+
+
+def test_explicit_resolution_is_validated():
+    assert pick_resolution(NOW - timedelta(hours=1), NOW, "raw", now=NOW) == "raw"
+    assert pick_resolution(NOW - timedelta(days=30), NOW, "1h", now=NOW) == "1h"
+    with pytest.raises(HistoryError):
+        pick_resolution(NOW - timedelta(days=30), NOW, "1m", now=NOW)
+    with pytest.raises(HistoryError):
+        pick_resolution(NOW - timedelta(hours=1), NOW, "5m", now=NOW)
+    with pytest.raises(HistoryError):
+        pick_resolution(NOW, NOW - timedelta(hours=1), now=NOW)
+
+
+def test_load_history_reads_rollup_points(db):
+    hour = datetime(2026, 3, 10, 10)
+    db.add_all([
+        HeartbeatRollup1h(
+            device_id="dev-1", bucket_ts=hour, samples=60,
+            battery_min=40, battery_max=50, battery_sum=2700, battery_samples=60,
+            unity_running_samples=45, unity_known_samples=60,
+            net_wifi=50, net_cell=8, net_none=1, net_changes=3, last_network_type="wifi"
+        ),
+        HeartbeatRollup1h(
+            device_id="dev-1", bucket_ts=hour + timedelta(hours=1), samples=10,
+            battery_samples=0, unity_known_samples=0
+        ),
+        HeartbeatRollup1h(device_id="dev-2", bucket_ts=hour, samples=60),
+    ])
+    db.commit()
+
+    history = heartbeat_rollups.load_history(
+        db, "dev-1",
+        datetime(2026, 3, 10, 10, 30, tzinfo=timezone.utc),
+        datetime(2026, 3, 10, 12, tzinfo=timezone.utc),
+        "1h"
+    )
+
+    assert history["resolution"] == "1h"
+    points = history["points"]
+    # The bucket containing 'from' is included
+    assert [p["ts"] for p in points] == ["2026-03-10T10:00:00Z", "2026-03-10T11:00:00Z"]
+    assert points[0]["battery_avg"] == 45.0
+    assert points[0]["unity_running_pct"] == 75.0
+    assert points[0]["network"] == {"wifi": 50, "cell": 8, "none": 1, "other": 1}
+    assert points[0]["network_changes"] == 3
+    assert points[1]["battery_avg"] is None
+    assert points[1]["unity_running_pct"] is None
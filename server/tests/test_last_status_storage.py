@@ -0,0 +1,74 @@
+"""
+Tests for devices.last_status storage (models.StatusJSON): callers assign
+and read dicts in both text and JSONB modes.
+"""
+import json
+
+import pytest
+from sqlalchemy import String, Text, create_engine, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
+
+import db_utils
+import models
+from models import Device, StatusJSON
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Device.__table__.create(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_device(db, last_status):
+    db.add(Device(id="dev-1", alias="Lab", token_hash="x", last_status=last_status))
+    db.commit()
+    db.expire_all()
+    return db.get(Device, "dev-1")
+
+
+class TestStatusJSON:
+    def test_dict_round_trip_stored_as_text(self, db):
+        status = {"battery": {"pct": 12}, "unity": {"status": "running"}}
+        assert add_device(db, status).last_status == status
+        stored = db.execute(text("SELECT last_status FROM devices")).scalar()
+        assert json.loads(stored) == status
+
+    def test_legacy_json_text_is_accepted(self, db):
+        assert add_device(db, '{"service_up": true}').last_status == {"service_up": True}
+
+    def test_unparseable_row_reads_as_none(self, db):
+        add_device(db, None)
+        db.execute(text("UPDATE devices SET last_status = 'not json'"))
+        db.commit()
+        db.expire_all()
+        assert db.get(Device, "dev-1").last_status is None
+
+    def test_jsonb_mode_binds_dicts(self, monkeypatch):
+        monkeypatch.setattr(models, "LAST_STATUS_JSONB", True)
+        column_type = StatusJSON()
+        pg = postgresql.dialect()
+        assert isinstance(column_type.load_dialect_impl(pg), postgresql.JSONB)
+        assert column_type.process_bind_param('{"a": 1}', pg) == {"a": 1}
+        # JSONB mode only applies to PostgreSQL
+        assert column_type.process_bind_param({"a": 1}, sqlite.dialect()) == '{"a": 1}'
+
+    def test_jsonb_mode_follows_the_schema(self):
+        generated = [{"name": name, "type": String()} for name, _, _ in models.LAST_STATUS_GENERATED_COLUMNS]
+        migrated = [{"name": "last_status", "type": postgresql.JSONB()}] + generated
+        assert models.jsonb_status_schema(migrated)
+        # Unmigrated text column, or JSONB without the generated columns
+        assert not models.jsonb_status_schema([{"name": "last_status", "type": Text()}] + generated)
+        assert not models.jsonb_status_schema(migrated[:2])
+
+    def test_default_mode_is_text(self):
+        assert not models.LAST_STATUS_JSONB
+
+    def test_batch_update_types_last_status_like_the_column(self, monkeypatch):
+        monkeypatch.setattr(models, "LAST_STATUS_JSONB", True)
+        assert ("last_status", "JSONB") in db_utils._device_batch_columns()
+        monkeypatch.setattr(models, "LAST_STATUS_JSONB", False)
+        assert ("last_status", "TEXT") in db_utils._device_batch_columns()
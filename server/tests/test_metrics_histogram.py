@@ -0,0 +1,79 @@
+"""
+Tests for the fixed-bucket histograms and quantile sketch in observability.py.
+"""
+import random
+
+from observability import MetricsCollector, QuantileSketch
+
+
+class TestHistogramExposition:
+    """Prometheus exposition of fixed-bucket histograms"""
+
+    def test_cumulative_buckets_sum_and_count(self):
+        collector = MetricsCollector()
+        collector.register_histogram("req_ms", buckets=[10, 100])
+        for value in (5, 10, 50, 500):
+            collector.observe_histogram("req_ms", value, {"route": "/x"})
+
+        text = collector.get_prometheus_text()
+
+        assert "# TYPE req_ms histogram" in text
+        assert 'req_ms_bucket{le="10",route="/x"} 2' in text
+        assert 'req_ms_bucket{le="100",route="/x"} 3' in text
+        assert 'req_ms_bucket{le="+Inf",route="/x"} 4' in text
+        assert 'req_ms_count{route="/x"} 4' in text
+        assert 'req_ms_sum{route="/x"} 565' in text
+
+    def test_default_layout_is_latency_buckets(self):
+        collector = MetricsCollector()
+        collector.observe_histogram("other_ms", 7)
+
+        text = collector.get_prometheus_text()
+
+        for bucket in collector.latency_buckets:
+            assert f'other_ms_bucket{{le="{bucket}"}}' in text
+
+    def test_memory_does_not_grow_with_observations(self):
+        collector = MetricsCollector()
+        for i in range(10000):
+            collector.observe_histogram("busy_ms", i % 300)
+
+        histogram = collector.snapshot()["histograms"]["busy_ms"][()]
+        assert histogram.count == 10000
+        assert len(histogram.counts) == len(collector.latency_buckets) + 1
+
+
+class TestQuantileSketch:
+    """Relative-error quantile sketch"""
+
+    def test_quantiles_within_relative_accuracy(self):
+        values = [random.uniform(1, 5000) for _ in range(20000)]
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        ordered = sorted(values)
+        for q in (0.5, 0.95, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            assert abs(sketch.quantile(q) - exact) <= exact * 0.02
+
+    def test_merge_matches_single_sketch(self):
+        left, right, combined = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for i in range(1, 1001):
+            (left if i % 2 else right).add(i)
+            combined.add(i)
+
+        left.merge(right)
+
+        assert left.count == combined.count
+        assert left.quantile(0.95) == combined.quantile(0.95)
+
+    def test_collector_exposes_quantiles(self):
+        collector = MetricsCollector()
+        collector.register_histogram("sketched_ms", quantiles=True)
+        for i in range(1, 101):
+            collector.observe_histogram("sketched_ms", i)
+
+        p95 = collector.get_quantiles("sketched_ms")["p95"]
+        assert 93 <= p95 <= 97
+        assert 'sketched_ms_quantile{quantile="0.95"}' in collector.get_prometheus_text()
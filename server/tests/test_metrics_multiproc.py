@@ -0,0 +1,72 @@
+"""
+Tests for cross-worker metrics aggregation (metrics_multiproc.py).
+A second worker is simulated by publishing a collector under the parent pid.
+"""
+import os
+
+from observability import MetricsCollector
+from metrics_multiproc import MultiprocessMetrics
+
+
+def publish_as_other_worker(directory, collector: MetricsCollector):
+    other = MultiprocessMetrics(collector, directory=str(directory))
+    other.publish()
+    os.replace(
+        os.path.join(directory, f"worker_{os.getpid()}.json"),
+        os.path.join(directory, f"worker_{os.getppid()}.json")
+    )
+
+
+class TestMultiprocessMetrics:
+    """Aggregation of counters, histograms and gauges across worker files"""
+
+    def test_counters_and_histograms_are_summed(self, tmp_path):
+        other = MetricsCollector()
+        other.inc_counter("hb_total", value=3)
+        other.observe_histogram("req_ms", 7)
+        publish_as_other_worker(tmp_path, other)
+
+        local = MetricsCollector()
+        local.inc_counter("hb_total", value=2)
+        local.observe_histogram("req_ms", 700)
+        aggregator = MultiprocessMetrics(local, directory=str(tmp_path))
+
+        text = aggregator.get_prometheus_text()
+
+        assert "hb_total 5" in text
+        assert 'req_ms_bucket{le="10"} 1' in text
+        assert "req_ms_count 2" in text
+
+    def test_gauge_modes(self, tmp_path):
+        other = MetricsCollector()
+        other.set_gauge("db_pool_checked_out", 4)
+        other.set_gauge("db_pool_utilization_pct", 90)
+        publish_as_other_worker(tmp_path, other)
+
+        local = MetricsCollector()
+        local.set_gauge("db_pool_checked_out", 1)
+        local.set_gauge("db_pool_utilization_pct", 10)
+        aggregator = MultiprocessMetrics(local, directory=str(tmp_path))
+        aggregator.set_gauge_mode("db_pool_utilization_pct", "max")
+
+        gauges = aggregator.aggregate_snapshot()["gauges"]
+
+        assert gauges["db_pool_checked_out"][()] == 5
+        assert gauges["db_pool_utilization_pct"][()] == 90
+
+    def test_dead_worker_files_are_removed(self, tmp_path):
+        stale = tmp_path / "worker_999999999.json"
+        stale.write_text("{}")
+
+        aggregator = MultiprocessMetrics(MetricsCollector(), directory=str(tmp_path))
+        aggregator.aggregate_snapshot()
+
+        assert not stale.exists()
+
+    def test_disabled_without_directory(self):
+        local = MetricsCollector()
+        local.inc_counter("only_local")
+        aggregator = MultiprocessMetrics(local, directory=None)
+
+        assert not aggregator.enabled
+        assert "only_local 1" in aggregator.get_prometheus_text()
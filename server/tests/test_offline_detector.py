@@ -0,0 +1,116 @@
+"""
+Tests for the timer-wheel offline detector (offline_detector.py).
+Time is passed in explicitly; the device_last_status feed is not used.
+"""
+from datetime import datetime, timezone
+
+from observability import metrics
+from offline_detector import OfflineDetector, TimerWheel, STATUS_OFFLINE, STATUS_ONLINE
+
+T0 = 1_700_000_000.0
+
+
+def at(seconds: float) -> datetime:
+    return datetime.fromtimestamp(T0 + seconds, timezone.utc)
+
+
+def make_detector() -> OfflineDetector:
+    detector = OfflineDetector(threshold_s=30)
+    detector._wheel = TimerWheel(tick_s=1.0, slots=16, now=T0)
+    detector.ready = True
+    detector.transitions = []
+    detector.add_listener(lambda device_id, status, last_seen: detector.transitions.append((device_id, status)))
+    return detector
+
+
+class TestTimerWheel:
+    """Arm, re-arm and advance"""
+
+    def test_fires_at_deadline(self):
+        wheel = TimerWheel(tick_s=1.0, slots=16, now=T0)
+        wheel.arm("a", T0 + 5)
+        assert wheel.advance(T0 + 4) == []
+        assert wheel.advance(T0 + 5) == ["a"]
+        assert len(wheel) == 0
+
+    def test_rearm_moves_deadline(self):
+        wheel = TimerWheel(tick_s=1.0, slots=16, now=T0)
+        wheel.arm("a", T0 + 5)
+        wheel.arm("a", T0 + 10)
+        assert wheel.advance(T0 + 9) == []
+        assert wheel.advance(T0 + 10) == ["a"]
+
+    def test_deadline_beyond_one_rotation(self):
+        wheel = TimerWheel(tick_s=1.0, slots=16, now=T0)
+        wheel.arm("far", T0 + 40)
+        wheel.arm("near", T0 + 8)
+        assert wheel.advance(T0 + 20) == ["near"]
+        assert wheel.advance(T0 + 39) == []
+        assert wheel.advance(T0 + 40) == ["far"]
+
+    def test_long_stall(self):
+        wheel = TimerWheel(tick_s=1.0, slots=16, now=T0)
+        wheel.arm("a", T0 + 3)
+        wheel.arm("b", T0 + 100)
+        assert wheel.advance(T0 + 50) == ["a"]
+        assert wheel.advance(T0 + 100) == ["b"]
+
+
+class TestOfflineDetector:
+    """Transitions and counters"""
+
+    def test_goes_offline_at_deadline_and_back_online(self):
+        detector = make_detector()
+        detector.observe("dev-1", at(0), now=T0)
+        detector.observe("dev-2", at(0), now=T0)
+        assert (detector.online_count, detector.offline_count) == (2, 0)
+
+        detector.observe("dev-2", at(20), now=T0 + 20)
+        detector.advance(T0 + 30)
+        assert detector.transitions == [("dev-1", STATUS_OFFLINE)]
+        assert (detector.online_count, detector.offline_count) == (1, 1)
+        assert detector.is_offline("dev-1")
+        assert not detector.is_offline("dev-2")
+
+        detector.observe("dev-1", at(35), now=T0 + 35)
+        assert detector.transitions[-1] == ("dev-1", STATUS_ONLINE)
+        assert detector.offline_count == 0
+
+    def test_gauges_follow_transitions_between_resyncs(self):
+        detector = make_detector()
+
+        def gauges():
+            snapshot = metrics.snapshot()["gauges"]
+            return snapshot["devices_online"][()], snapshot["devices_offline"][()]
+
+        detector.observe("dev-1", at(0), now=T0)
+        detector.observe("dev-2", at(0), now=T0)
+        assert gauges() == (2, 0)
+
+        detector.advance(T0 + 30)
+        assert gauges() == (0, 2)
+
+        detector.observe("dev-1", at(35), now=T0 + 35)
+        detector.forget("dev-2")
+        assert gauges() == (1, 0)
+
+    def test_stale_heartbeat_ignored(self):
+        detector = make_detector()
+        detector.observe("dev-1", at(10), now=T0 + 10)
+        detector.observe("dev-1", at(0), now=T0 + 10)
+        assert detector.last_seen("dev-1") == at(10)
+
+    def test_snapshot_seeds_without_notifying_and_drops_deleted(self):
+        detector = make_detector()
+        detector.ready = False
+        detector.apply_snapshot([("dev-1", at(0)), ("dev-2", at(-100))], now=T0)
+        assert detector.transitions == []
+        assert detector.offline_devices() == [("dev-2", at(-100))]
+
+        detector.apply_snapshot([("dev-1", at(0))], now=T0)
+        assert (detector.online_count, detector.offline_count) == (1, 0)
+
+    def test_is_offline_falls_back_to_last_seen(self):
+        detector = make_detector()
+        assert detector.is_offline("unknown", datetime.now(timezone.utc)) is False
+        assert detector.is_offline("unknown", None) is True
@@ -0,0 +1,228 @@
+"""
+Tests for the streaming partition archiver (partition_archiver.py): compressed
+archives round-trip through the local and part-based object stores, and
+verification catches corrupt, truncated or mismatched archives.
+"""
+import gzip
+import os
+import shutil
+
+import pytest
+
+import partition_archiver
+from partition_archiver import (
+    ArchiveError,
+    LocalArchiveStore,
+    ObjectArchiveStore,
+    verify_archive,
+    write_archive,
+)
+
+HEADER = b"hb_id,device_id,ts,battery_pct\n"
+
+
+class FakeStorage:
+    """In-memory stand-in for AppStorageService"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_from_path(self, file_path, storage_key, validate_apk=True):
+        with open(file_path, "rb") as f:
+            self.objects[storage_key] = f.read()
+        return storage_key
+
+    def upload_file(self, file_data, storage_key, content_type=None, validate_apk=True):
+        self.objects[storage_key] = file_data
+        return storage_key
+
+    def download_file(self, storage_path, use_cache=True):
+        data = self.objects[storage_path]
+        return data, "application/octet-stream", len(data)
+
+    def download_to_path(self, storage_path, dest_path):
+        with open(dest_path, "wb") as f:
+            f.write(self.objects[storage_path])
+        return len(self.objects[storage_path])
+
+    def delete_file(self, storage_path):
+        return self.objects.pop(storage_path, None) is not None
+
+
+def produce_rows(count):
+    def produce(writer):
+        # COPY writes one row per call
+        writer.write(HEADER)
+        for i in range(count):
+            writer.write(f"{i},dev-{i % 7},2026-01-01 00:00:{i % 60:02d},{i % 100}\n")
+        return count
+    return produce
+
+
+def expected_csv(count):
+    return HEADER + b"".join(
+        f"{i},dev-{i % 7},2026-01-01 00:00:{i % 60:02d},{i % 100}\n".encode() for i in range(count)
+    )
+
+
+def test_local_archive_round_trip(tmp_path):
+    store = LocalArchiveStore(str(tmp_path))
+    result = write_archive(store, "hb/device_heartbeats_20260101.csv", produce_rows(5000), "gzip")
+
+    assert result.url.startswith("file://") and result.url.endswith(".csv.gz")
+    path = result.url[len("file://"):]
+    with gzip.open(path, "rb") as f:
+        assert f.read() == expected_csv(5000)
+    assert result.row_count == 5000
+    assert result.raw_bytes == len(expected_csv(5000))
+    assert result.compressed_bytes == os.path.getsize(path) < result.raw_bytes
+    # No partial file left behind
+    assert not os.path.exists(path + ".part")
+
+    verify_archive(result.url, result.checksum_sha256, 5000, store)
+
+
+def test_object_store_uploads_in_parts(tmp_path, monkeypatch):
+    monkeypatch.setattr(partition_archiver, "WRITE_BUFFER_BYTES", 1024)
+    storage = FakeStorage()
+    store = ObjectArchiveStore(storage, part_bytes=4096)
+
+    result = write_archive(store, "archives/p.csv", produce_rows(20000), "gzip")
+
+    assert result.url == "storage://archives/p.csv.gz"
+    parts = sorted(k for k in storage.objects if ".part" in k)
+    assert len(parts) > 1
+    assert all(len(storage.objects[k]) <= 4096 for k in parts)
+    assert gzip.decompress(b"".join(storage.objects[k] for k in parts)) == expected_csv(20000)
+
+    verify_archive(result.url, result.checksum_sha256, 20000, store)
+
+
+def test_failed_write_leaves_nothing_behind(tmp_path):
+    storage = FakeStorage()
+    store = ObjectArchiveStore(storage, part_bytes=512)
+
+    def produce(writer):
+        writer.write(os.urandom(64 * 1024))
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(ArchiveError):
+        write_archive(store, "archives/broken.csv", produce, "gzip")
+    assert storage.objects == {}
+
+
+def test_verify_detects_corruption(tmp_path):
+    store = LocalArchiveStore(str(tmp_path))
+    result = write_archive(store, "p.csv", produce_rows(1000), "gzip")
+    path = result.url[len("file://"):]
+
+    with pytest.raises(ArchiveError, match="Row count"):
+        verify_archive(result.url, result.checksum_sha256, 999, store)
+    with pytest.raises(ArchiveError, match="Checksum"):
+        verify_archive(result.url, "0" * 64, None, store)
+
+    # Truncated upload
+    shutil.copy(path, path + ".orig")
+    with open(path + ".orig", "rb") as src, open(path, "wb") as dst:
+        dst.write(src.read()[:-20])
+    with pytest.raises(ArchiveError):
+        verify_archive(result.url, result.checksum_sha256, 1000, store)
+
+    os.remove(path)
+    with pytest.raises(ArchiveError, match="not found"):
+        verify_archive(result.url, result.checksum_sha256, 1000, store)
+
+
+def test_unreadable_archive_locations_are_rejected():
+    # Archives recorded before uploads existed cannot be verified, so are never dropped
+    with pytest.raises(ArchiveError):
+        verify_archive("s3://nexmdm-archives/device_heartbeats_20250815.csv.gz", "0" * 64)
+
+
+class StubMaintenanceDb:
+    """Just enough Session for drop_archived_partitions"""
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.executed = []
+
+    def query(self, model):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def all(self):
+        return self.partitions
+
+    def execute(self, statement, params=None):
+        self.executed.append(str(statement))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_drop_waits_for_parquet_copy(monkeypatch):
+    from types import SimpleNamespace
+
+    import columnar_archive
+    import nightly_maintenance
+
+    partition = SimpleNamespace(
+        partition_name="device_heartbeats_20260101", state="archived", archive_url="file:///a.csv.gz",
+        checksum_sha256="x", row_count=1, parquet_url=None, parquet_checksum_sha256=None
+    )
+    db = StubMaintenanceDb([partition])
+    monkeypatch.setattr(nightly_maintenance, "verify_archive", lambda *args: None)
+    monkeypatch.setattr(columnar_archive, "ARCHIVE_PARQUET", True)
+    monkeypatch.setattr(columnar_archive, "available", lambda: True)
+
+    def failing_export(db, name):
+        raise RuntimeError("upload failed")
+
+    monkeypatch.setattr(columnar_archive, "export_partition_parquet", failing_export)
+    assert nightly_maintenance.drop_archived_partitions(db) == 0
+    assert partition.state == "archived"
+    assert db.executed == []
+
+    # The next run back-fills the copy and then drops
+    monkeypatch.setattr(
+        columnar_archive, "export_partition_parquet",
+        lambda db, name: SimpleNamespace(url="file:///a.parquet", checksum_sha256="y", row_count=1, compressed_bytes=10)
+    )
+    assert nightly_maintenance.drop_archived_partitions(db) == 1
+    assert partition.parquet_url == "file:///a.parquet"
+    assert partition.state == "dropped"
+
+
+def test_failed_archives_are_requeued_and_archived_again(monkeypatch):
+    from datetime import datetime
+    from types import SimpleNamespace
+
+    import columnar_archive
+    import nightly_maintenance
+
+    # Recorded before uploads existed: can never verify, so must be re-archived
+    partition = SimpleNamespace(
+        partition_name="device_heartbeats_20250815", state="archive_failed",
+        archive_url="s3://nexmdm-archives/device_heartbeats_20250815.csv.gz", checksum_sha256="0" * 64,
+        archived_at=datetime(2025, 8, 16), row_count=3, parquet_url=None, parquet_checksum_sha256=None
+    )
+    db = StubMaintenanceDb([partition])
+    assert nightly_maintenance.requeue_failed_archives(db) == 1
+    assert partition.state == "active"
+    assert partition.archive_url is None and partition.checksum_sha256 is None
+
+    monkeypatch.setattr(columnar_archive, "ARCHIVE_PARQUET", False)
+    monkeypatch.setattr(
+        nightly_maintenance, "archive_partition",
+        lambda db, name: SimpleNamespace(
+            url="file:///p.csv.gz", checksum_sha256="a" * 64, row_count=3, raw_bytes=90, compressed_bytes=40
+        )
+    )
+    assert nightly_maintenance.archive_old_partitions(db, retention_days=2) == 1
+    assert partition.state == "archived"
+    assert partition.archive_url == "file:///p.csv.gz"
@@ -0,0 +1,138 @@
+"""
+Tests for ResponseCache: LRU bound, tag invalidation, debouncing and single-flight.
+"""
+import asyncio
+import threading
+import time
+
+from response_cache import ResponseCache
+
+
+class TestResponseCache:
+    """Eviction and invalidation"""
+
+    def test_lru_bound(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", 1, ttl_seconds=60, path="/v1/a")
+        cache.set("b", 2, ttl_seconds=60, path="/v1/b")
+        cache.get("a", 60)
+        cache.set("c", 3, ttl_seconds=60, path="/v1/c")
+
+        assert cache.get("a", 60) == 1
+        assert cache.get("b", 60) is None
+        assert cache.get("c", 60) == 3
+
+    def test_tag_invalidation_is_scoped(self):
+        cache = ResponseCache()
+        cache.set("devices", [1], ttl_seconds=60, path="/v1/devices")
+        cache.set("device", {"id": 1}, ttl_seconds=60, path="/v1/devices/abc")
+        cache.set("metrics", {"total": 1}, ttl_seconds=60, path="/v1/metrics")
+
+        cache.invalidate("/v1/devices")
+
+        assert cache.get("devices", 60) is None
+        assert cache.get("device", 60) is None
+        assert cache.get("metrics", 60) == {"total": 1}
+
+    def test_invalidate_all(self):
+        cache = ResponseCache()
+        cache.set("metrics", 1, ttl_seconds=60, path="/v1/metrics")
+        cache.invalidate()
+
+        assert cache.get("metrics", 60) is None
+
+    def test_debounced_invalidation(self):
+        cache = ResponseCache(debounce_seconds=0.05)
+        cache.set("metrics", 1, ttl_seconds=60, path="/v1/metrics")
+        cache.invalidate_debounced("/v1/metrics")
+        assert cache.get("metrics", 60) is None
+
+        # Within the window: the entry survives until the window ends
+        cache.set("metrics", 2, ttl_seconds=60, path="/v1/metrics")
+        cache.invalidate_debounced("/v1/metrics")
+        cache.invalidate_debounced("/v1/metrics")
+        assert cache.get("metrics", 60) == 2
+
+        # The folded invalidation is applied by a timer, not by the next read
+        time.sleep(0.1)
+        assert cache.get_stats()["pending_invalidations"] == 0
+        assert cache.get("metrics", 60) is None
+
+    def test_shared_dir_invalidation_reaches_other_instances(self, tmp_path):
+        worker_a = ResponseCache(shared_dir=str(tmp_path), shared_poll_seconds=0)
+        worker_b = ResponseCache(shared_dir=str(tmp_path), shared_poll_seconds=0)
+        worker_b.set("metrics", 1, ttl_seconds=60, path="/v1/metrics")
+
+        worker_a.invalidate("/v1/metrics")
+
+        assert worker_b.get("metrics", 60) is None
+
+    def test_shared_dir_back_to_back_invalidations(self, tmp_path):
+        worker_a = ResponseCache(shared_dir=str(tmp_path), shared_poll_seconds=0)
+        worker_b = ResponseCache(shared_dir=str(tmp_path), shared_poll_seconds=0)
+
+        # No sleeps: the shared counter must change on every bump even when
+        # the file's mtime would not
+        worker_a.invalidate("/v1/metrics")
+        worker_b.set("metrics", 1, ttl_seconds=60, path="/v1/metrics")
+        worker_a.invalidate("/v1/metrics")
+
+        assert worker_b.get("metrics", 60) is None
+
+
+    async def test_shared_write_leaves_the_event_loop(self, tmp_path, monkeypatch):
+        worker_a = ResponseCache(shared_dir=str(tmp_path), shared_poll_seconds=0)
+        worker_b = ResponseCache(shared_dir=str(tmp_path), shared_poll_seconds=0)
+        worker_b.set("metrics", 1, ttl_seconds=60, path="/v1/metrics")
+
+        loop_thread = threading.get_ident()
+        writers = []
+        publish = worker_a._publish_shared
+        monkeypatch.setattr(worker_a, "_publish_shared", lambda tags: (writers.append(threading.get_ident()), publish(tags)))
+
+        worker_a.invalidate_debounced("/v1/metrics")
+        for _ in range(100):
+            if worker_b.get("metrics", 60) is None:
+                break
+            await asyncio.sleep(0.01)
+
+        assert worker_b.get("metrics", 60) is None
+        assert writers and loop_thread not in writers
+
+
+class TestSingleFlight:
+    """get_or_compute coalescing"""
+
+    async def test_concurrent_misses_compute_once(self):
+        cache = ResponseCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"total": 5}
+
+        results = await asyncio.gather(*[
+            cache.get_or_compute("metrics", 60, compute, path="/v1/metrics") for _ in range(10)
+        ])
+
+        assert len(calls) == 1
+        assert all(r == {"total": 5} for r in results)
+        assert cache.get("metrics", 60) == {"total": 5}
+
+    async def test_invalidation_during_compute_is_not_cached(self):
+        cache = ResponseCache()
+
+        async def compute():
+            cache.invalidate("/v1/metrics")
+            return "stale"
+
+        assert await cache.get_or_compute("metrics", 60, compute, path="/v1/metrics") == "stale"
+        assert cache.get("metrics", 60) is None
+
+    async def test_sync_compute_runs_in_thread(self):
+        cache = ResponseCache()
+        value = await cache.get_or_compute("k", 60, lambda: 42, path="/v1/x")
+
+        assert value == 42
+        assert cache.get("k", 60) == 42
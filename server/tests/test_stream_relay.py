@@ -0,0 +1,95 @@
+"""
+Tests for the latest-frame-wins screen-stream relay (stream_relay.py).
+Viewer sockets are stubs whose sends can be held open.
+"""
+import asyncio
+
+import pytest
+
+from stream_relay import StreamingConnectionManager
+
+
+class StubViewer:
+    def __init__(self, stalled=False):
+        self.frames = []
+        self.json = []
+        self.flowing = asyncio.Event()
+        if not stalled:
+            self.flowing.set()
+
+    async def accept(self):
+        pass
+
+    async def send_bytes(self, data):
+        await self.flowing.wait()
+        self.frames.append(data)
+
+    async def send_json(self, message):
+        self.json.append(message)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def relay():
+    relay = StreamingConnectionManager()
+    yield relay
+    for device_id in list(relay.stream_viewers):
+        for websocket in list(relay.stream_viewers[device_id]):
+            relay.disconnect_viewer(device_id, websocket)
+
+
+class TestLatestFrameRelay:
+    """Mailbox relay and frame-rate cap"""
+
+    async def test_slow_viewer_gets_latest_frame_only(self, relay):
+        slow, fast = StubViewer(stalled=True), StubViewer()
+        await relay.connect_viewer("dev-1", slow)
+        await relay.connect_viewer("dev-1", fast)
+
+        await relay.relay_frame("dev-1", b"f1")
+        await settle()  # slow viewer is now stuck sending f1
+        for frame in (b"f2", b"f3", b"f4"):
+            await relay.relay_frame("dev-1", frame)
+            await settle()
+
+        assert fast.frames == [b"f1", b"f2", b"f3", b"f4"]
+        slow.flowing.set()
+        await settle()
+        assert slow.frames == [b"f1", b"f4"]
+        assert relay.stream_viewers["dev-1"][slow].dropped == 2
+
+    async def test_fps_cap_skips_frames(self, relay):
+        viewer = StubViewer()
+        await relay.connect_viewer("dev-1", viewer, max_fps=10)
+
+        await relay.relay_frame("dev-1", b"f1")
+        await settle()
+        await relay.relay_frame("dev-1", b"f2")
+        await relay.relay_frame("dev-1", b"f3")
+        await settle()
+        assert viewer.frames == [b"f1"]
+
+        await asyncio.sleep(0.15)
+        assert viewer.frames == [b"f1", b"f3"]
+
+    async def test_server_cap_bounds_requested_fps(self):
+        relay = StreamingConnectionManager(max_fps=5)
+        assert relay._effective_max_fps(None) == 5
+        assert relay._effective_max_fps(30) == 5
+        assert relay._effective_max_fps(2) == 2
+
+    async def test_control_messages_and_stream_end(self, relay):
+        viewer = StubViewer()
+        await relay.connect_viewer("dev-1", viewer)
+        relay.send_json("dev-1", viewer, {"type": "pong"})
+        await settle()
+        assert viewer.json == [{"type": "pong"}]
+
+        relay.disconnect_device_stream("dev-1")
+        await settle()
+        assert relay.viewer_count("dev-1") == 0
+        assert viewer.json[-1] == {"type": "stream_ended", "device_id": "dev-1"}
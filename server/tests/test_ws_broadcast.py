@@ -0,0 +1,116 @@
+"""
+Tests for the dashboard WebSocket broadcast hub (ws_broadcast.py): per-client
+queues, coalescing, drops and slow-consumer eviction. Sockets are stubs.
+"""
+import asyncio
+import json
+
+import pytest
+
+from ws_broadcast import BroadcastHub, SLOW_CONSUMER_CLOSE_CODE
+
+
+class StubWebSocket:
+    """Records sent text; send_text blocks while `stalled` is cleared."""
+
+    def __init__(self, stalled=False):
+        self.sent = []
+        self.closed_code = None
+        self.flowing = asyncio.Event()
+        if not stalled:
+            self.flowing.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.flowing.wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self, code=1000, reason=None):
+        self.closed_code = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def hub():
+    hub = BroadcastHub(max_queue=3, max_drops=2)
+    yield hub
+    for websocket in list(hub.active_connections):
+        hub.disconnect(websocket)
+
+
+class TestBroadcastHub:
+    """Fan-out through per-client writer tasks"""
+
+    async def test_publish_reaches_every_client(self, hub):
+        clients = [StubWebSocket(), StubWebSocket()]
+        for ws in clients:
+            await hub.connect(ws)
+
+        hub.publish({"type": "device_update", "device_id": "dev-1"})
+        await settle()
+
+        for ws in clients:
+            assert ws.sent == [{"type": "device_update", "device_id": "dev-1"}]
+
+    async def test_slow_client_does_not_block_others(self, hub):
+        slow, fast = StubWebSocket(stalled=True), StubWebSocket()
+        await hub.connect(slow)
+        await hub.connect(fast)
+
+        hub.publish({"n": 1})
+        hub.publish({"n": 2})
+        await settle()
+
+        assert fast.sent == [{"n": 1}, {"n": 2}]
+        assert slow.sent == []
+
+        slow.flowing.set()
+        await settle()
+        assert slow.sent == [{"n": 1}, {"n": 2}]
+
+    async def test_coalesced_messages_keep_latest(self, hub):
+        ws = StubWebSocket(stalled=True)
+        await hub.connect(ws)
+
+        hub.publish({"n": 0})
+        await settle()  # writer picks up n=0 and blocks in send_text
+        for n in range(1, 4):
+            hub.publish({"device_id": "dev-1", "n": n}, coalesce_key="dev-1")
+        hub.publish({"device_id": "dev-2"}, coalesce_key="dev-2")
+
+        ws.flowing.set()
+        await settle()
+        assert ws.sent == [{"n": 0}, {"device_id": "dev-1", "n": 3}, {"device_id": "dev-2"}]
+
+    async def test_full_queue_drops_then_evicts(self, hub):
+        ws = StubWebSocket(stalled=True)
+        await hub.connect(ws)
+        hub.publish({"n": 0})
+        await settle()
+
+        for n in range(1, 4):
+            hub.publish({"n": n})
+        hub.publish({"n": 4})
+        hub.publish({"n": 5})
+        assert ws in hub.active_connections
+
+        hub.publish({"n": 6})
+        await settle()
+        assert ws not in hub.active_connections
+        assert ws.closed_code == SLOW_CONSUMER_CLOSE_CODE
+
+    async def test_send_to_targets_one_client(self, hub):
+        a, b = StubWebSocket(), StubWebSocket()
+        await hub.connect(a)
+        await hub.connect(b)
+
+        hub.send_to(a, {"type": "pong"})
+        await settle()
+        assert a.sent == [{"type": "pong"}]
+        assert b.sent == []
@@ -0,0 +1,160 @@
+"""
+Dashboard WebSocket broadcast hub.
+
+publish() serializes a message once and drops the text into every client's
+bounded send queue; a writer task per client does the actual network send.
+Publishing never awaits a socket, so a slow browser tab cannot add latency
+to the request that produced the message (e.g. a heartbeat).
+
+Slow consumers:
+- a message published with a coalesce_key replaces the queued message with
+  the same key instead of taking another slot
+- when a client's queue is full, new messages for it are dropped
+- a client that has dropped more than max_drops messages is disconnected
+"""
+import asyncio
+import itertools
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from fastapi import WebSocket
+
+from observability import structured_logger, metrics
+
+# Close code for "try again later": the client may reconnect and refetch
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+def serialize_message(message: Dict[str, Any]) -> str:
+    """Same encoding as WebSocket.send_json"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class _Client:
+    """One dashboard socket and its pending messages"""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.ready = asyncio.Event()
+        self.drops = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+class BroadcastHub:
+    """
+    Fan-out of dashboard messages with a bounded queue per client.
+    """
+
+    def __init__(self, max_queue: int = 256, max_drops: int = 500):
+        self.max_queue = max_queue
+        self.max_drops = max_drops
+        self._clients: Dict[WebSocket, _Client] = {}
+        self._sequence = itertools.count()
+
+    @property
+    def active_connections(self):
+        return set(self._clients)
+
+    async def connect(self, websocket: WebSocket):
+        await websocket.accept()
+        client = _Client(websocket)
+        client.task = asyncio.create_task(self._writer(client))
+        self._clients[websocket] = client
+        metrics.set_gauge("ws_clients", len(self._clients))
+        print(f"[WS] Client connected. Total: {len(self._clients)}")
+
+    def disconnect(self, websocket: WebSocket):
+        client = self._clients.pop(websocket, None)
+        if client is None:
+            return
+        if client.task and client.task is not asyncio.current_task():
+            client.task.cancel()
+        metrics.set_gauge("ws_clients", len(self._clients))
+        print(f"[WS] Client disconnected. Total: {len(self._clients)}")
+
+    def publish(self, message: Dict[str, Any], coalesce_key: Optional[Hashable] = None):
+        """
+        Queue a message for every connected client without awaiting any send.
+
+        Args:
+            message: JSON-serializable message
+            coalesce_key: Messages with the same key replace each other while queued
+        """
+        if not self._clients:
+            return
+        self._offer_all(serialize_message(message), coalesce_key)
+
+    async def broadcast(self, message: Dict[str, Any], coalesce_key: Optional[Hashable] = None):
+        """Awaitable alias of publish() for existing callers; it does not wait for delivery."""
+        self.publish(message, coalesce_key)
+
+    def send_to(self, websocket: WebSocket, message: Dict[str, Any]):
+        """Queue a message for a single client (e.g. a pong) behind its pending broadcasts."""
+        client = self._clients.get(websocket)
+        if client:
+            self._offer(client, next(self._sequence), serialize_message(message))
+
+    def _offer_all(self, text: str, coalesce_key: Optional[Hashable]):
+        key = coalesce_key if coalesce_key is not None else next(self._sequence)
+        for client in list(self._clients.values()):
+            self._offer(client, key, text)
+
+    def _offer(self, client: _Client, key: Hashable, text: str):
+        if key in client.queue:
+            # Keep the queue position, send the newest content
+            client.queue[key] = text
+            metrics.inc_counter("ws_messages_coalesced_total")
+            return
+
+        if len(client.queue) >= self.max_queue:
+            client.drops += 1
+            metrics.inc_counter("ws_messages_dropped_total")
+            if client.drops > self.max_drops:
+                self._evict(client)
+            return
+
+        client.queue[key] = text
+        client.ready.set()
+
+    def _evict(self, client: _Client):
+        """Disconnect a client that cannot keep up."""
+        structured_logger.log_event(
+            "ws.slow_consumer.disconnected",
+            level="WARN",
+            drops=client.drops,
+            queued=len(client.queue)
+        )
+        metrics.inc_counter("ws_slow_clients_disconnected_total")
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Too slow, reconnect")
+        except Exception:
+            pass
+
+    async def _writer(self, client: _Client):
+        try:
+            while True:
+                if not client.queue:
+                    client.ready.clear()
+                    await client.ready.wait()
+                    continue
+                _, text = client.queue.popitem(last=False)
+                await client.websocket.send_text(text)
+                metrics.inc_counter("ws_messages_sent_total")
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.disconnect(client.websocket)
+
+
+# Global instance
+broadcast_hub = BroadcastHub(
+    max_queue=int(os.getenv("WS_CLIENT_QUEUE_MAX", "256")),
+    max_drops=int(os.getenv("WS_MAX_DROPS", "500"))
+)
@@ -14,6 +14,19 @@ cd server
 echo "Starting backend server..."
 echo "Working directory: $(pwd)"
 
+# Shared directory for per-worker metrics snapshots (aggregated by /metrics)
+export METRICS_MULTIPROC_DIR="${METRICS_MULTIPROC_DIR:-/tmp/nexmdm-metrics}"
+rm -rf "$METRICS_MULTIPROC_DIR"
+mkdir -p "$METRICS_MULTIPROC_DIR"
+
+# Shared directory so response cache invalidations reach every worker
+export RESPONSE_CACHE_SHARED_DIR="${RESPONSE_CACHE_SHARED_DIR:-/tmp/nexmdm-cache-tags}"
+mkdir -p "$RESPONSE_CACHE_SHARED_DIR"
+
+# Content-addressed APK cache shared by all workers; kept across restarts
+export APK_DISK_CACHE_DIR="${APK_DISK_CACHE_DIR:-/tmp/nexmdm-apk-cache}"
+mkdir -p "$APK_DISK_CACHE_DIR"
+
 # Start uvicorn and redirect stderr to stdout so we can see errors
 uvicorn main:app --host 0.0.0.0 --port 8000 --workers 2 2>&1 &
 BACKEND_PID=$!